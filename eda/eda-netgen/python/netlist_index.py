@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+netlist_index.py
+Dependency index for checking whether a netlist is out of date relative to
+the layouts (.mag) or schematics (.sch) it was generated from.
+
+For each netlist the index records the subcircuits it defines and the
+schematic files named by xschem "sch_path" comments, keyed on the size
+and modification time of the netlist, so that a netlist is read again
+only after it has changed.  For each source file that has been found to
+be older than the current version of a netlist, the index records its
+modification time and a hash of its contents.  A source file that is
+later saved again without changes is newer than the netlist but has the
+same contents, and does not make the netlist out of date.  Only source
+files with a new modification time are ever read.
+
+The index is kept in the project's .config directory as the file
+"netlist_index.json".  If the project has no .config directory, the index
+is kept in memory only.
+
+This file is shared by CACE (cace_gensim.py) and the LVS manager
+(lvs_manager.py), and a copy is kept with each.
+"""
+
+import os
+import re
+import json
+import hashlib
+
+subrex = re.compile(r'^[^\*]*[ \t]*.subckt[ \t]+([^ \t]+).*$', re.IGNORECASE)
+schrex = re.compile(r'\*\*[ \t]*sch_path:[ \t]*([^ \t\n]+)', re.IGNORECASE)
+
+def hash_file(filepath):
+    hasher = hashlib.sha256()
+    with open(filepath, 'rb') as ifile:
+        for block in iter(lambda: ifile.read(1 << 20), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+class NetlistIndex(object):
+    def __init__(self, projectpath=None):
+        self.indexfile = None
+        self.netlists = {}
+        self.changed = False
+        if projectpath and os.path.isdir(projectpath + '/.config'):
+            self.indexfile = projectpath + '/.config/netlist_index.json'
+            try:
+                with open(self.indexfile, 'r') as ifile:
+                    self.netlists = json.load(ifile)['netlists']
+            except (OSError, ValueError, KeyError):
+                self.netlists = {}
+
+    def save(self):
+        """Write the index back to the project, if anything has changed."""
+        if not self.indexfile or not self.changed:
+            return
+        tmpfile = self.indexfile + '.tmp'
+        try:
+            with open(tmpfile, 'w') as ofile:
+                json.dump({'netlists': self.netlists}, ofile, indent=1)
+            os.replace(tmpfile, self.indexfile)
+        except OSError:
+            pass
+        self.changed = False
+
+    def entry(self, spicepath):
+        # Return the index entry for netlist "spicepath", reading the netlist
+        # only if it is new or has changed since it was indexed.
+        key = os.path.realpath(spicepath)
+        statbuf = os.stat(key)
+        entry = self.netlists.get(key)
+        if entry and entry['mtime'] == statbuf.st_mtime and entry['size'] == statbuf.st_size:
+            return entry
+
+        subcircuits = []
+        schematics = []
+        with open(key, 'r') as ifile:
+            duttext = ifile.read()
+        dutlines = duttext.replace('\n+', ' ').splitlines()
+        for line in dutlines:
+            lmatch = subrex.match(line)
+            if lmatch:
+                subcircuits.append(lmatch.group(1))
+            # xschem helpfully adds a "sch_path" comment line for every subcircuit
+            # coming from a separate schematic file.
+            lmatch = schrex.match(line)
+            if lmatch:
+                schematics.append(lmatch.group(1))
+
+        entry = {'mtime': statbuf.st_mtime, 'size': statbuf.st_size,
+		'subcircuits': subcircuits, 'schematics': schematics, 'sources': {}}
+        self.netlists[key] = entry
+        self.changed = True
+        return entry
+
+    def subcircuits(self, spicepath):
+        """Return the names of the subcircuits defined in netlist "spicepath"."""
+        return self.entry(spicepath)['subcircuits']
+
+    def schematics(self, spicepath):
+        """Return the schematic files named by sch_path comments in "spicepath"."""
+        return self.entry(spicepath)['schematics']
+
+    def stale_source(self, spicepath, sources):
+        """
+        Return the first file in "sources" that is newer than netlist
+        "spicepath" and differs from the version the netlist was last
+        found to be current with, or None if the netlist is up to date.
+        Files that do not exist are ignored.
+        """
+        entry = self.entry(spicepath)
+        spitime = entry['mtime']
+        known = entry['sources']
+        for source in sources:
+            try:
+                srctime = os.stat(source).st_mtime
+            except OSError:
+                continue
+            srckey = os.path.abspath(source)
+            record = known.get(srckey)
+            if record and record['mtime'] == srctime:
+                continue
+            if srctime > spitime and not record:
+                return source
+            try:
+                srchash = hash_file(source)
+            except OSError:
+                continue
+            if srctime > spitime and srchash != record['hash']:
+                return source
+            # Older than the netlist, or touched but not changed since
+            known[srckey] = {'mtime': srctime, 'hash': srchash}
+            self.changed = True
+        return None
+
+    def layout_out_of_date(self, spicepath, layoutpath):
+        """
+        Check if netlist "spicepath" is out of date relative to the top-level
+        layout "layoutpath" or to the layouts of any of its subcircuits in
+        the same directory, and return the first layout that is newer, or
+        None.  Subcircuits with no layout in that directory are assumed to be
+        library components and never out of date.
+        """
+        layoutdir = os.path.split(layoutpath)[0]
+        sources = [layoutpath]
+        for subname in self.subcircuits(spicepath):
+            sources.append(layoutdir + '/' + subname + '.mag')
+        return self.stale_source(spicepath, sources)
+
+    def schematic_out_of_date(self, spicepath, schempath):
+        """
+        Check if netlist "spicepath" is out of date relative to the top-level
+        schematic "schempath" or to any subcircuit schematic named in the
+        netlist, and return the first schematic that is newer, or None.
+        """
+        sources = [schempath] + self.schematics(spicepath)
+        return self.stale_source(spicepath, sources)
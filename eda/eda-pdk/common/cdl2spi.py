@@ -8,12 +8,26 @@ usage: cdl2spi.py <inCDLfile> [<outSPCfile>] [options...]
 Writes to .spi to outSPCfile, or stdout if no output argument given. Sets exit
 status if there were non-zero errors.  Most errors/warnings are annotated in-line
 in the stdout each before the relevant line.
+
+usage: cdl2spi.py <inCDLdir> <outSPCdir> [-jobs=<number>] [options...]
+Converts every .cdl file in inCDLdir to a .spice file of the same name in
+outSPCdir, up to <number> files at a time (default is the number of processors).
 """
 
 import sys, getopt
 import os
+import io
 import re
 import textwrap
+import contextlib
+import concurrent.futures
+
+# Supported primitive devices (FET, diode, resistor, capacitor, bipolar)
+primch  = 'mdrcq'
+primch2 = 'mdrcqx'
+
+# Characters that textwrap changes in a line (other than spaces)
+wrapchars = re.compile('[\t\n\x0b\x0c\r]')
 
 # Convert linear scale to area scale suffix 
 # (e.g., if linear scale is 1e-6 ('u') then area scales as 1e-12 ('p'))
@@ -32,10 +46,10 @@ def getAreaScale(dscale):
 # If not used yet, mark it used, and return as-is.
 # Else generate a unique suffixed version, and mark it used, return it.
 # If 1M suffixes don't generate a unique name, throw exception.
-#   hasInm : global hash, key of hash is (subckt, iname)
+#   hasInm : hash of the names in the file being converted, key of hash
+#            is (subckt, iname)
 
-hasInm = {}
-def uniqInm(sub, nm):
+def uniqInm(sub, nm, hasInm):
     subl=sub.lower()
     nml=nm.lower()
     if not (subl, nml) in hasInm:
@@ -59,9 +73,9 @@ inmBadChars='/'
 inmRplChars='|'
 inmBadCharREX=re.compile( "["+ inmBadChars+"]" )
 
-def mapInm(sub, nm):
+def mapInm(sub, nm, hasInm):
     nm2 = inmBadCharREX.sub(inmRplChars, nm)
-    return uniqInm(sub, nm2)
+    return uniqInm(sub, nm2, hasInm)
 
 # Process subckt line (array of tokens). Return new array of tokens.
 # There might be a ' /' in the line that needs to be deleted. It may be standalone ' / ', or
@@ -324,6 +338,9 @@ def mapLookup(tok, nm, edit):
     val=""
     nmeq = nm.lower() + "="
     nmeqlen = len(nmeq)
+    # (Most lookups find nothing, which is quicker to find out all at once)
+    if " " + nmeq not in " ".join(tok).lower():
+        return [ val, tok ]
     for i in range(len(tok)-1, 0, -1):
         if not tok[i].lower().startswith(nmeq):
             continue
@@ -596,16 +613,17 @@ def cdl2spice(fnmIn, fnmOut, options):
         print('cdl2spi.py: failed to open ' + fnmIn + ' for reading.', file=sys.stderr)
         return 1
 
+    # Each line is split into tokens once, for both passes below
+    tokens = [ i.split() for i in lines ]
+    hasInm = {}
+
     # Loop over original CDL:
     #   record existing instanceNames (in subckt-context), for efficient membership
     #   tests later.  Track the subckt-context, instanceNames only need to be unique
     #   within current subckt.
 
     sub = ""
-    for i in lines:
-        if i == "":
-            continue
-        tok = i.split()
+    for tok in tokens:
         tlen = len(tok)
         if tlen == 0:
             continue
@@ -637,8 +655,8 @@ def cdl2spice(fnmIn, fnmOut, options):
 
     sub = ""
     tmp = []
-    for i in lines:
-        tok = i.split()
+    for i, tok in zip(lines, tokens):
+        # (The tokens of the line are modified in place below)
         tlen = len(tok)
         # AS-IS: empty line or all (preserved) whitespace
         if tlen == 0:
@@ -687,7 +705,7 @@ def cdl2spice(fnmIn, fnmOut, options):
                 msg = "*cdl2spi.py: ERROR: Missing subckt instance name:"
                 tmp += [ msg, i ]
                 continue
-            inm = mapInm(sub, nm)
+            inm = mapInm(sub, nm, hasInm)
             tok[0] = T0[0] + inm
             tok = mapSubcktInst(tok)
             tmp += [ " ".join(tok) ]
@@ -709,7 +727,7 @@ def cdl2spice(fnmIn, fnmOut, options):
                 tmp += [ msg, i ]
                 continue
             nm = T0
-            nm = mapInm(sub, nm)
+            nm = mapInm(sub, nm, hasInm)
             tok[0] = nm
             tok = mapMfactor(tok, options)
             tok = mapCDLparam(tok)
@@ -877,10 +895,14 @@ def cdl2spice(fnmIn, fnmOut, options):
         # tmp += [ "*cdl2spi.py: WARNING: unrecognized line:", i ]
         # warn+=1
 
-    # Re-wrap continuation lines at 80 characters
+    # Re-wrap continuation lines at 80 characters.  Most lines are short and
+    # would be returned unchanged by textwrap, so are not passed to it.
     lines = []
     for line in tmp:
-        lines.append('\n+ '.join(textwrap.wrap(line, 80)))
+        if len(line) <= 80 and not line.endswith(' ') and not wrapchars.search(line):
+            lines.append(line)
+        else:
+            lines.append('\n+ '.join(textwrap.wrap(line, 80)))
 
     # Write output
 
@@ -900,6 +922,55 @@ def cdl2spice(fnmIn, fnmOut, options):
     print( "*cdl2spi.py: %d errors, %d warnings" % (err, warn))
     return err
 
+#------------------------------------------------------------------------
+# Convert one file in a worker process for cdl2spice_batch().  Returns
+# the result of cdl2spice() and the output it printed, so that the output
+# of files converted at the same time is not mixed together.
+#------------------------------------------------------------------------
+
+def cdl2spice_worker(fnmIn, fnmOut, options):
+    output = io.StringIO()
+    errors = io.StringIO()
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(errors):
+        result = cdl2spice(fnmIn, fnmOut, options)
+    return result, output.getvalue(), errors.getvalue()
+
+#------------------------------------------------------------------------
+# Convert a list of (CDL file, SPICE file) pairs with the same options,
+# up to "jobs" files at once in separate processes (default is the number
+# of processors).  The output of each file is printed in order.  Returns
+# the list of results of cdl2spice() (the number of errors in each file).
+#------------------------------------------------------------------------
+
+def cdl2spice_batch(filepairs, options, jobs=None):
+    jobs = max(1, jobs or os.cpu_count() or 1)
+    if jobs == 1 or len(filepairs) < 2:
+        return [ cdl2spice(fnmIn, fnmOut, options) for fnmIn, fnmOut in filepairs ]
+
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [ pool.submit(cdl2spice_worker, fnmIn, fnmOut, options)
+		for fnmIn, fnmOut in filepairs ]
+        for future in futures:
+            result, output, errors = future.result()
+            sys.stdout.write(output)
+            sys.stderr.write(errors)
+            results.append(result)
+    return results
+
+#------------------------------------------------------------------------
+# Convert every .cdl file in directory "dirIn" to a .spice file of the same
+# name in directory "dirOut" (see cdl2spice_batch()).
+#------------------------------------------------------------------------
+
+def cdl2spice_dir(dirIn, dirOut, options, jobs=None):
+    cdlfiles = sorted(item for item in os.listdir(dirIn)
+		if os.path.splitext(item)[1].lower() == '.cdl')
+    os.makedirs(dirOut, exist_ok=True)
+    filepairs = [ (dirIn + '/' + cdlfile, dirOut + '/' + os.path.splitext(cdlfile)[0] + '.spice')
+		for cdlfile in cdlfiles ]
+    return cdl2spice_batch(filepairs, options, jobs)
+
 if __name__ == '__main__':
 
     options = {}
@@ -910,6 +981,7 @@ if __name__ == '__main__':
     options['dscale'] = ''
     options['addinm'] = []
     options['ignore'] = []
+    options['jobs'] = ''
 
     arguments = []
     for item in sys.argv[1:]:
@@ -930,10 +1002,6 @@ if __name__ == '__main__':
         else:
             arguments.append(item)
 
-    # Supported primitive devices (FET, diode, resistor, capacitor, bipolar)
-    primch  = 'mdrcq'
-    primch2 = 'mdrcqx'
-
     if len(arguments) > 0:
         fnmIn = arguments[0]
 
@@ -959,14 +1027,28 @@ if __name__ == '__main__':
 
     elif len(arguments) > 2 or len(arguments) < 1 :
         print('Usage: cdl2spi.py <cdlFileName> [<spiFileName>]')
+        print('       cdl2spi.py <cdlDirectory> <spiDirectory>')
         print('   Options:' )
         print('       -debug              run debug tests')
         print('       -dscale=<suffix>    rescale lengths with <suffix>')
         print('       -addinm=<param>     add multiplier parameter <param>')
         print('       -ignore=<param>     ignore parameter <param>')
         print('       -subckt             convert primitive devices to subcircuits')
+        print('       -jobs=<number>      convert <number> files at once (directories only)')
         sys.exit(1)
 
+    elif os.path.isdir(fnmIn):
+        if fnmOut == sys.stdout:
+            print('cdl2spi.py: an output directory is required to convert directory ' + fnmIn)
+            sys.exit(1)
+        try:
+            jobs = int(options['jobs']) if options['jobs'] != '' else None
+        except ValueError:
+            print('cdl2spi.py: bad value for option -jobs: ' + options['jobs'])
+            sys.exit(1)
+        results = cdl2spice_dir(fnmIn, fnmOut, options, jobs)
+        sys.exit(1 if any(results) else 0)
+
     else:
         if options['debug'] == True:
             print('Diagnostic:  options = ' + str(options))
@@ -9,17 +9,30 @@
 # for the "-gds" install.
 #
 # Because GDS files are large, this script supports reading gzipped GDS files.
-# The file (de-)compression is handled in Magic;  it is only necessary in this
-# script to accept ".gds.gz" as a valid filename extension for GDS files.
+#
+# The library is made by copying the structures (cells) of each file, record
+# by record, into the library file (see gds_stream.py).  A structure with the
+# same name as one already copied is skipped;  if its contents are different,
+# a warning is printed and the first one is kept.  If the files do not all
+# use the same database units, the coordinates of the files with the coarser
+# units are scaled to the finest units.  Option "-magic" makes the library
+# by reading all the files into magic and writing them out again instead,
+# which was the only method in earlier versions of this script.
 #----------------------------------------------------------------------------
 
 import os
 import sys
 import glob
 import gzip
+import struct
 import fnmatch
+import shutil
+import hashlib
+import tempfile
+import contextlib
 import subprocess
 import natural_sort
+import gds_stream
 
 #----------------------------------------------------------------------------
 
@@ -27,7 +40,7 @@ def usage():
     print('')
     print('Usage:')
     print('    create_gds_library <destlibdir> <destlib> <startup_script> ')
-    print('             [-compile-only] [-excludelist="file1,file2,..."] [-keep]')
+    print('             [-compile-only] [-excludelist="file1,file2,..."] [-keep] [-magic]')
     print('')
     print('Create a single GDS library from a set of individual GDS files.')
     print('')
@@ -38,11 +51,12 @@ def usage():
     print('    -compile-only     removes the indidual files if specified')
     print('    -excludelist=     is a comma-separated list of files to ignore')
     print('    -keep             keep the Tcl script used to generate the library')
+    print('    -magic            generate the library with magic')
     print('')
 
 #----------------------------------------------------------------------------
 
-def create_gds_library(destlibdir, destlib, startup_script, do_compile_only=False, excludelist=[], keep=False):
+def create_gds_library(destlibdir, destlib, startup_script, do_compile_only=False, excludelist=[], keep=False, use_magic=False):
 
     # destlib should not have a file extension
     destlibroot = os.path.splitext(destlib)[0]
@@ -85,73 +99,297 @@ def create_gds_library(destlibdir, destlib, startup_script, do_compile_only=Fals
     if len(glist) > 1:
         print('New file is:  ' + alllibname)
 
-        if os.path.isfile(startup_script):
-            # If the symbolic link exists, remove it.
-            if os.path.isfile(destlibdir + '/.magicrc'):
-                os.remove(destlibdir + '/.magicrc')
-            os.symlink(startup_script, destlibdir + '/.magicrc')
-
-        # A GDS library is binary and requires handling in Magic
-        print('Creating magic generation script to generate GDS library.') 
-        with open(destlibdir + '/generate_magic.tcl', 'w') as ofile:
-            print('#!/usr/bin/env wish', file=ofile)
-            print('#--------------------------------------------', file=ofile)
-            print('# Script to generate .gds library from files   ', file=ofile)
-            print('#--------------------------------------------', file=ofile)
-            print('drc off', file=ofile)
-            print('locking off', file=ofile)
-            print('gds readonly true', file=ofile)
-            # print('gds flatten true', file=ofile)
-            print('gds polygon subcell true', file=ofile)
-            print('gds rescale false', file=ofile)
-            print('tech unlock *', file=ofile)
+        merged = False
+        if not use_magic:
+            merged = merge_gds_library(alllibname, destlibroot, glist)
+            if not merged:
+                print('Using magic to create GDS library instead.')
+        if not merged:
+            magic_gds_library(destlibdir, destlibroot, glist, startup_script, keep)
+
+        if do_compile_only == True:
+            print('Compile-only:  Removing individual GDS files')
+            for gfile in glist:
+                if os.path.isfile(gfile):
+                    os.remove(gfile)
+    else:
+        print('Only one file (' + str(glist) + ');  ignoring "compile" option.')
+
+#----------------------------------------------------------------------------
+# Records whose coordinates are scaled when the database units change
+#----------------------------------------------------------------------------
+
+WIDTH = 15
+XY = 16
+BGNEXTN = 48
+ENDEXTN = 49
+
+scaled_records = [WIDTH, XY, BGNEXTN, ENDEXTN]
+
+#----------------------------------------------------------------------------
+# Convert an 8-byte GDS real (excess-64, base 16 exponent) to a float
+#----------------------------------------------------------------------------
+
+def gds_real(data):
+    value = int.from_bytes(data[1:8], 'big') / float(1 << 56)
+    value *= 16.0 ** ((data[0] & 0x7f) - 64)
+    return -value if data[0] & 0x80 else value
+
+#----------------------------------------------------------------------------
+# Open a GDS file for reading, uncompressing it if it is gzipped.  Yields
+# an object that can be indexed and sliced like bytes.  A gzipped file is
+# uncompressed a block at a time into a temporary file, which is memory-
+# mapped like an uncompressed file, so it is never all read into memory.
+#----------------------------------------------------------------------------
+
+@contextlib.contextmanager
+def open_gds_file(gdsfile):
+    if os.path.splitext(gdsfile)[1] == '.gz':
+        with gzip.open(gdsfile, 'rb') as ifile, \
+			tempfile.NamedTemporaryFile(suffix='.gds') as tmpfile:
+            shutil.copyfileobj(ifile, tmpfile, gds_stream.COPY_BLOCK)
+            tmpfile.flush()
+            with gds_stream.open_gds(tmpfile.name) as data:
+                yield data
+    else:
+        with gds_stream.open_gds(gdsfile) as data:
+            yield data
+
+#----------------------------------------------------------------------------
+# Return the UNITS record of GDS data "data" as a tuple (user units per
+# database unit, meters per database unit, raw record), or None.
+#----------------------------------------------------------------------------
+
+def gds_units(data):
+    for offset, reclen, rectype, datatype in gds_stream.records(data):
+        if rectype == gds_stream.UNITS and reclen == 20:
+            record = bytes(data[offset:offset + reclen])
+            return (gds_real(record[4:12]), gds_real(record[12:20]), record)
+        elif rectype == gds_stream.BGNSTR:
+            break
+    return None
+
+#----------------------------------------------------------------------------
+# Write the structure at data[start:end] to "ofile", multiplying all
+# coordinates and widths by "scale".
+#----------------------------------------------------------------------------
+
+def write_scaled(data, start, end, scale, ofile):
+    for offset, reclen, rectype, datatype in gds_stream.records(data, start, end):
+        if rectype in scaled_records and datatype == gds_stream.INT4:
+            count = (reclen - 4) // 4
+            values = struct.unpack_from('>' + str(count) + 'i', data, offset + 4)
+            values = [value * scale for value in values]
+            if any(value < -(1 << 31) or value >= (1 << 31) for value in values):
+                raise OverflowError('Coordinate out of range after scaling')
+            ofile.write(gds_stream.make_record(rectype, datatype,
+			struct.pack('>' + str(count) + 'i', *values)))
+        else:
+            gds_stream.copy_data(data, offset, offset + reclen, ofile)
+
+#----------------------------------------------------------------------------
+# File-like object that only keeps the hash of the data written to it
+#----------------------------------------------------------------------------
+
+class DigestFile(object):
+    def __init__(self):
+        self.hash = hashlib.sha1()
+
+    def write(self, data):
+        self.hash.update(data)
+
+    def digest(self):
+        return self.hash.digest()
+
+#----------------------------------------------------------------------------
+# Create the GDS library "alllibname" from the files in "glist" by copying
+# the structures in each file into it.  Returns True if the library was
+# written, or False if the files cannot be merged this way.
+#----------------------------------------------------------------------------
+
+def merge_gds_library(alllibname, destlibroot, glist):
+
+    # Use the finest database units of all the files.  Files with coarser
+    # units are scaled, if their units are a whole multiple.
+    fileunits = {}
+    libunits = None
+    header = None
+    bgnlib = None
+    for gdsfile in glist:
+        if not os.path.isfile(gdsfile):
+            print('Error:  GDS file ' + gdsfile + ' not found (skipping).')
+            continue
+        with open_gds_file(gdsfile) as data:
+            units = gds_units(data)
+            if header is None:
+                for offset, reclen, rectype, datatype in gds_stream.records(data):
+                    if rectype == gds_stream.HEADER:
+                        header = bytes(data[offset:offset + reclen])
+                    elif rectype == gds_stream.BGNLIB:
+                        bgnlib = bytes(data[offset:offset + reclen])
+                        break
+        if not units:
+            print('Error:  GDS file ' + gdsfile + ' has no UNITS record.')
+            return False
+        fileunits[gdsfile] = units
+        if not libunits or units[1] < libunits[1]:
+            libunits = units
+
+    if not libunits or not header or not bgnlib:
+        return False
+
+    scales = {}
+    for gdsfile, units in fileunits.items():
+        ratio = units[1] / libunits[1]
+        scale = int(round(ratio))
+        if abs(ratio - scale) > 1e-6 * ratio:
+            print('Error:  Database units of ' + gdsfile + ' (' + str(units[1])
+			+ 'm) are not a multiple of ' + str(libunits[1]) + 'm.')
+            return False
+        if scale != 1:
+            print('Scaling ' + gdsfile + ' by ' + str(scale) + ' to database units of '
+			+ str(libunits[1]) + 'm.')
+        scales[gdsfile] = scale
+
+    # Structure names already written, with the hash of their contents and
+    # the file they came from.
+    written = {}
+    duplicates = 0
+    try:
+        with gds_stream.output_file(alllibname) as ofile:
+            ofile.write(header)
+            ofile.write(bgnlib)
+            libname = destlibroot.encode('ascii')
+            if len(libname) % 2:
+                libname += b'\0'
+            ofile.write(gds_stream.make_record(gds_stream.LIBNAME, gds_stream.ASCII, libname))
+            ofile.write(libunits[2])
 
             for gdsfile in glist:
-                print('gds read ' + gdsfile, file=ofile)
-
-            # Remove any cell named "(UNNAMED)"
-            print('cellname delete \(UNNAMED\)', file=ofile)
-
-            # Get list of cell names, which may be different than the
-            # file names.
-            print('set glist [cellname list top]', file=ofile)
-
-            print('puts stdout "Creating cell ' + destlibroot + '"', file=ofile)
-            print('load ' + destlibroot, file=ofile)
-            print('puts stdout "Adding cells to library"', file=ofile)
-            print('box values 0 0 0 0', file=ofile)
-
-            # for gdsfile in glist:
-            #     gdsroot = os.path.split(gdsfile)[1]
-            #     gdsname = os.path.splitext(gdsroot)[0]
-            #     print('getcell ' + gdsname, file=ofile)
-            #     # Could properly make space for the cell here. . . 
-            #     print('box move e 200', file=ofile)
-
-            print('foreach gcell $glist {', file=ofile)
-            print('    getcell $gcell', file=ofile)
-            print('    box move e 200', file=ofile)
-            print('}', file=ofile)
-                                
-            print('puts stdout "Writing GDS library ' + destlibroot + '"', file=ofile)
-            print('gds library true', file=ofile)
-            print('gds write ' + destlibroot, file=ofile)
-            print('puts stdout "Done."', file=ofile)
-            print('quit -noprompt', file=ofile)
-
-        # Run magic to read in the individual GDS files and
-        # write out the consolidated GDS library
-
-        print('Running magic to create GDS library.')
-        sys.stdout.flush()
+                if gdsfile not in scales:
+                    continue
+                scale = scales[gdsfile]
+                with open_gds_file(gdsfile) as data, memoryview(data) as view:
+                    start = None
+                    for offset, reclen, rectype, datatype in gds_stream.records(data):
+                        if rectype == gds_stream.BGNSTR:
+                            start = offset
+                            contents = offset + reclen
+                        elif rectype == gds_stream.STRNAME and start is not None:
+                            name = gds_stream.record_string(data, offset, reclen)
+                        elif rectype == gds_stream.ENDSTR and start is not None:
+                            end = offset + reclen
+                            start, bgnstr = None, start
+                            # The contents do not include the dates in BGNSTR,
+                            # and are compared as they are after scaling
+                            if scale == 1:
+                                digest = hashlib.sha1(view[contents:end]).digest()
+                            else:
+                                hashfile = DigestFile()
+                                write_scaled(data, contents, end, scale, hashfile)
+                                digest = hashfile.digest()
+                            # magic deletes this cell when making the library
+                            if name == b'(UNNAMED)':
+                                continue
+                            if name in written:
+                                if written[name][0] != digest:
+                                    print('Warning:  Cell ' + name.decode('ascii', 'replace')
+					+ ' in ' + gdsfile + ' differs from the one in '
+					+ written[name][1] + ';  keeping the first one.')
+                                duplicates += 1
+                                continue
+                            written[name] = (digest, gdsfile)
+                            if scale == 1:
+                                gds_stream.copy_data(data, bgnstr, end, ofile)
+                            else:
+                                write_scaled(data, bgnstr, end, scale, ofile)
+
+            ofile.write(gds_stream.make_record(gds_stream.ENDLIB, gds_stream.NODATA, b''))
+    except (OSError, OverflowError) as error:
+        print('Error:  Failed to write GDS library ' + alllibname + ':  ' + str(error))
+        return False
+
+    print('Wrote ' + str(len(written)) + ' cells to GDS library ' + alllibname
+		+ ' (' + str(duplicates) + ' duplicates skipped).')
+    return True
+
+#----------------------------------------------------------------------------
+# Create the GDS library "destlibroot" in "destlibdir" from the files in
+# "glist" by reading them into magic and writing them out as one library.
+#----------------------------------------------------------------------------
 
+def magic_gds_library(destlibdir, destlibroot, glist, startup_script, keep=False):
+
+    if os.path.isfile(startup_script):
+        # If the symbolic link exists, remove it.
+        if os.path.isfile(destlibdir + '/.magicrc'):
+            os.remove(destlibdir + '/.magicrc')
+        os.symlink(startup_script, destlibdir + '/.magicrc')
+
+    # A GDS library is binary and requires handling in Magic
+    print('Creating magic generation script to generate GDS library.') 
+    with open(destlibdir + '/generate_magic.tcl', 'w') as ofile:
+        print('#!/usr/bin/env wish', file=ofile)
+        print('#--------------------------------------------', file=ofile)
+        print('# Script to generate .gds library from files   ', file=ofile)
+        print('#--------------------------------------------', file=ofile)
+        print('drc off', file=ofile)
+        print('locking off', file=ofile)
+        print('gds readonly true', file=ofile)
+        # print('gds flatten true', file=ofile)
+        print('gds polygon subcell true', file=ofile)
+        print('gds rescale false', file=ofile)
+        print('tech unlock *', file=ofile)
+
+        for gdsfile in glist:
+            print('gds read ' + gdsfile, file=ofile)
+
+        # Remove any cell named "(UNNAMED)"
+        print('cellname delete \(UNNAMED\)', file=ofile)
+
+        # Get list of cell names, which may be different than the
+        # file names.
+        print('set glist [cellname list top]', file=ofile)
+
+        print('puts stdout "Creating cell ' + destlibroot + '"', file=ofile)
+        print('load ' + destlibroot, file=ofile)
+        print('puts stdout "Adding cells to library"', file=ofile)
+        print('box values 0 0 0 0', file=ofile)
+
+        # for gdsfile in glist:
+        #     gdsroot = os.path.split(gdsfile)[1]
+        #     gdsname = os.path.splitext(gdsroot)[0]
+        #     print('getcell ' + gdsname, file=ofile)
+        #     # Could properly make space for the cell here. . . 
+        #     print('box move e 200', file=ofile)
+
+        print('foreach gcell $glist {', file=ofile)
+        print('    getcell $gcell', file=ofile)
+        print('    box move e 200', file=ofile)
+        print('}', file=ofile)
+                            
+        print('puts stdout "Writing GDS library ' + destlibroot + '"', file=ofile)
+        print('gds library true', file=ofile)
+        print('gds write ' + destlibroot, file=ofile)
+        print('puts stdout "Done."', file=ofile)
+        print('quit -noprompt', file=ofile)
+
+    # Run magic to read in the individual GDS files and
+    # write out the consolidated GDS library
+
+    print('Running magic to create GDS library.')
+    sys.stdout.flush()
+
+    try:
         mproc = subprocess.run(['magic', '-dnull', '-noconsole',
 			destlibdir + '/generate_magic.tcl'],
 			stdin = subprocess.DEVNULL,
 			stdout = subprocess.PIPE,
 			stderr = subprocess.PIPE, cwd = destlibdir,
 			universal_newlines = True)
-
+    except FileNotFoundError:
+        print('ERROR:  Failed to find executable for magic in standard search path.')
+    else:
         if mproc.stdout:
             for line in mproc.stdout.splitlines():
                 print(line)
@@ -161,15 +399,8 @@ def create_gds_library(destlibdir, destlib, startup_script, do_compile_only=Fals
                 print(line)
         if mproc.returncode != 0:
             print('ERROR:  Magic exited with status ' + str(mproc.returncode))
-        if do_compile_only == True:
-            print('Compile-only:  Removing individual GDS files')
-            for gfile in glist:
-                if os.path.isfile(gfile):
-                    os.remove(gfile)
-        if not keep:
-            os.remove(destlibdir + '/generate_magic.tcl')
-    else:
-        print('Only one file (' + str(glist) + ');  ignoring "compile" option.')
+    if not keep:
+        os.remove(destlibdir + '/generate_magic.tcl')
 
 #----------------------------------------------------------------------------
 
@@ -184,6 +415,7 @@ if __name__ == '__main__':
     # Defaults
     do_compile_only = False
     keep = False
+    use_magic = False
     excludelist = []
 
     # Break arguments into groups where the first word begins with "-".
@@ -200,6 +432,8 @@ if __name__ == '__main__':
                         do_compile_only = True
                 else:
                     do_compile_only = True
+            elif keyval[0] == 'magic':
+                use_magic = True
             elif keyval[1] == 'exclude' or key == 'excludelist':
                 if len(keyval) > 0:
                     excludelist = keyval[1].trim('"').split(',')
@@ -233,9 +467,10 @@ if __name__ == '__main__':
         for file in excludelist:
             print(file)
     print('Keep generating script: ' + 'Yes' if keep else 'No')
+    print('Use magic: ' + ('Yes' if use_magic else 'No'))
     print('')
 
-    create_gds_library(destlibdir, destlib, startup_script, do_compile_only, excludelist, keep)
+    create_gds_library(destlibdir, destlib, startup_script, do_compile_only, excludelist, keep, use_magic)
     print('Done.')
     sys.exit(0)
 
@@ -15,6 +15,7 @@ import re
 import glob
 import fnmatch
 import natural_sort
+from library_blocks import LibraryBlocks, subckt_begin, subckt_end
 
 #----------------------------------------------------------------------------
 
@@ -98,14 +99,14 @@ def create_spice_library(destlibdir, destlib, spiext, do_compile_only=False, do_
 
     if len(slist) > 1:
         with open(outputname, 'w') as ofile:
-            allsubckts = []
+            allsubckts = set()
             for sfile in slist:
                 with open(sfile, 'r') as ifile:
                     # print('Adding ' + sfile + ' to library.')
                     stext = ifile.read()
                     subckts = re.findall(r'\.subckt[ \t]+([^ \t\n]+)', stext, flags=re.IGNORECASE)
-                    sseen = list(item for item in subckts if item in allsubckts)
-                    allsubckts.extend(list(item for item in subckts if item not in allsubckts))
+                    sseen = set(item for item in subckts if item in allsubckts)
+                    allsubckts.update(subckts)
                     sfilter = remove_redundant_subckts(stext, subckts, sseen)
                     if do_stub:
                         sfilter = create_blackboxes(sfilter)
@@ -134,34 +135,24 @@ def create_blackboxes(ntext):
 
 #----------------------------------------------------------------------------
 # Remove redundant subcircuit entries from a SPICE or CDL netlist file.  "sseen"
-# is a list of subcircuit names gleaned from all previously read files using
-# re.findall(). "slist" is a list of subcircuits including those in "ntext".
+# is a list (or set) of subcircuit names gleaned from all previously read files
+# using re.findall(). "slist" is a list of subcircuits including those in "ntext".
 # If a subcircuit is defined outside of "ntext", then remove all occurrences in
 # "ntext".  Otherwise, if a subcircuit is defined more than once in "ntext",
 # remove all but one copy.  The reason for doing this is that some netlists will
 # include primitive device definitions used by all the standard cell subcircuits.
 #
+# The subcircuits in "ntext" are found in a single pass (see library_blocks.py)
+# instead of searching the whole text once for each name in "slist".
+#
 # It may be necessary to remove redundant .include statements and redundant .model
 # and/or .option statements as well.
 #----------------------------------------------------------------------------
 
 def remove_redundant_subckts(ntext, slist, sseen):
-    updated = ntext
-    for subckt in slist:
-        if subckt in sseen:
-            # Remove all occurrences of subckt
-            updated = re.sub(r'\n\.subckt[ \t]+' + subckt + '[ \t\n]+.*?\n\.ends[ \t\n]+', '\n', updated, flags=re.IGNORECASE | re.DOTALL)
-
-        else:
-            # Determine the number of times the subcircuit appears in the text
-            n = len(re.findall(r'\n\.subckt[ \t]+' + subckt + '[ \t\n]+.*?\n\.ends[ \t\n]+', updated, flags=re.IGNORECASE | re.DOTALL))
-            # Optimization:  Just keep original text if n < 2
-            if n < 2:
-                continue
-
-            # Remove all but one
-            updated = re.sub(r'\n\.subckt[ \t]+' + subckt + '[ \t\n]+.*?\n\.ends[ \t\n]+', '\n', updated, n - 1, flags=re.IGNORECASE | re.DOTALL)
-    return updated
+    blocks = LibraryBlocks(ntext, subckt_begin, subckt_end, nocase=True, strip_after=True)
+    blocks.remove_redundant(slist, sseen)
+    return blocks.result()
 
 #----------------------------------------------------------------------------
 
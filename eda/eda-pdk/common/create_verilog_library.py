@@ -15,6 +15,7 @@ import re
 import glob
 import fnmatch
 import natural_sort
+from library_blocks import LibraryBlocks, module_begin, module_end
 
 #----------------------------------------------------------------------------
 
@@ -86,7 +87,7 @@ def create_verilog_library(destlibdir, destlib, do_compile_only=False, do_stub=F
         if do_stub:
             sfile = open(allstubname, 'w')
         with open(alllibname, 'w') as ofile:
-            allmodules = []
+            allmodules = set()
             for vfile in vlist:
                 if not os.path.exists(vfile):
                     print('Error: File ' + vfile + ' not found (skipping).')
@@ -95,8 +96,8 @@ def create_verilog_library(destlibdir, destlib, do_compile_only=False, do_stub=F
                     # print('Adding ' + vfile + ' to library.')
                     vtext = ifile.read()
                     modules = re.findall(r'[ \t\n]module[ \t]+([^ \t\n\(]+)', vtext)
-                    mseen = list(item for item in modules if item in allmodules)
-                    allmodules.extend(list(item for item in modules if item not in allmodules))
+                    mseen = set(item for item in modules if item in allmodules)
+                    allmodules.update(modules)
                     # NOTE:  "remove_redundant_modules" is disabled because it is
                     # not checking if duplicate modules might exist within separate
                     # blocks of an "ifdef".
@@ -194,11 +195,13 @@ def create_blackboxes(ntext):
     return '\n'.join(updated)
 
 #----------------------------------------------------------------------------
-# Remove redundant module entries from a verilog file.  "m2list" is a list of
-# module names gleaned from all previously read files using re.findall().
+# Remove redundant module entries from a verilog file.  "m2list" is a list (or
+# set) of module names gleaned from all previously read files using re.findall().
 # "mlist" is a list of all module names including those in "ntext".
 # The reason for doing this is that some verilog files may includes modules used
 # by all the files, and if included more than once, then iverilog complains.
+# The modules are found in a single pass (see library_blocks.py), and each
+# module removed is replaced by a newline along with the whitespace before it.
 #
 # Important note:  This module has been disabled.  It needs to check if
 # duplicate modules are inside mutually exclusive conditions of an ifdef
@@ -206,24 +209,9 @@ def create_blackboxes(ntext):
 #----------------------------------------------------------------------------
 
 def remove_redundant_modules(ntext, mlist, m2list):
-    updated = ntext
-    for module in mlist:
-        # Determine the number of times the module appears in the text
-        if module in m2list:
-            # This module seen before outside of ntext, so remove all occurrances in ntext
-            new = re.sub(r'[ \t\n]+module[ \t]+' + module + '[ \t\n\(]+.*?[ \t\n]endmodule', '\n', updated, flags=re.DOTALL)
-            updated = new
-
-        else:
-            n = len(re.findall(r'[ \t\n]module[ \t]+' + module + '[ \t\n\(]+.*?[ \t\n]endmodule', updated, flags=re.DOTALL))
-            # This module defined more than once inside ntext, so remove all but one
-            # Optimization:  Just keep original text if n < 2
-            if n < 2:
-                continue
-
-            # Remove all but one
-            updated = re.sub(r'[ \t\n]+module[ \t]+' + module + '[ \t\n]+.*?[ \t\n]endmodule', '\n', updated, n - 1, flags=re.IGNORECASE | re.DOTALL)
-    return updated
+    blocks = LibraryBlocks(ntext, module_begin, module_end)
+    blocks.remove_redundant(mlist, m2list)
+    return blocks.result()
 
 #----------------------------------------------------------------------------
 
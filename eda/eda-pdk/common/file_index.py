@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+#
+# file_index.py
+#
+#----------------------------------------------------------------------------
+# Index of file contents used by staging_install.py to find the files in an
+# installed PDK that are identical to a file elsewhere (in the vendor
+# sources, or in another installed PDK), so that they can be replaced by a
+# symbolic link to that one copy.
+#
+# Files are compared by the SHA-256 hash of their contents.  Pairs of files
+# with different sizes are rejected without reading either file, and the
+# remaining files are hashed in parallel threads (hashing spends its time
+# reading the disk and in hashlib, which releases the interpreter lock).
+#
+# Hashes can be kept in a cache file between runs.  Each hash is stored with
+# the device, inode, size, and modification time of the file it was made
+# from, and is only used again while all of those are the same.  The files
+# of the vendor sources or of the PDK being linked to are the same from one
+# install to the next, so only the newly installed files need to be read.
+#----------------------------------------------------------------------------
+
+import os
+import json
+import hashlib
+import concurrent.futures
+
+#----------------------------------------------------------------------------
+
+class FileIndex(object):
+    def __init__(self, cachefile=None, jobs=None):
+        self.cachefile = cachefile
+        self.jobs = max(1, jobs or os.cpu_count() or 1)
+        self.oldhashes = {}
+        self.hashes = {}
+        self.linked = 0
+        self.reclaimed = 0
+
+        if cachefile:
+            try:
+                with open(cachefile, 'r') as ifile:
+                    self.oldhashes = json.load(ifile)
+            except (OSError, ValueError):
+                pass
+            if not isinstance(self.oldhashes, dict):
+                self.oldhashes = {}
+
+    def save(self):
+        """Write the hashes of all files seen into the cache file, if any."""
+        if not self.cachefile:
+            return
+        os.makedirs(os.path.split(self.cachefile)[0], exist_ok=True)
+        tmpfile = self.cachefile + '.tmp'
+        with open(tmpfile, 'w') as ofile:
+            json.dump(self.hashes, ofile, indent=1, sort_keys=True)
+        os.replace(tmpfile, self.cachefile)
+
+    # Return the SHA-256 hash of the contents of "filepath", or None if the
+    # file cannot be read.
+
+    def digest(self, filepath):
+        filepath = os.path.abspath(filepath)
+        try:
+            statbuf = os.stat(filepath)
+        except OSError:
+            return None
+        stamp = [statbuf.st_dev, statbuf.st_ino, statbuf.st_size, statbuf.st_mtime_ns]
+        known = self.hashes.get(filepath) or self.oldhashes.get(filepath)
+        if known and known[0:4] == stamp:
+            self.hashes[filepath] = known
+            return known[4]
+        hasher = hashlib.sha256()
+        try:
+            with open(filepath, 'rb') as ifile:
+                for block in iter(lambda: ifile.read(1 << 20), b''):
+                    hasher.update(block)
+        except OSError:
+            return None
+        self.hashes[filepath] = stamp + [hasher.hexdigest()]
+        return hasher.hexdigest()
+
+    def identical(self, pairs):
+        """
+        For each pair of file paths in "pairs", return True if the two files
+        have the same contents.  Files that are missing or are not regular
+        files are never identical to anything.
+        """
+        sizes = {}
+        def size(filepath):
+            if filepath not in sizes:
+                sizes[filepath] = os.path.getsize(filepath) if os.path.isfile(filepath) else None
+            return sizes[filepath]
+
+        # Only files with a partner of the same size need to be read
+        candidates = [size(first) is not None and size(first) == size(second)
+			for first, second in pairs]
+        tohash = set()
+        for (first, second), candidate in zip(pairs, candidates):
+            if candidate:
+                tohash.add(first)
+                tohash.add(second)
+
+        tohash = sorted(tohash)
+        if self.jobs > 1 and len(tohash) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                digests = dict(zip(tohash, pool.map(self.digest, tohash)))
+        else:
+            digests = dict((filepath, self.digest(filepath)) for filepath in tohash)
+
+        result = []
+        for (first, second), candidate in zip(pairs, candidates):
+            result.append(candidate and digests[first] is not None
+			and digests[first] == digests[second])
+        return result
+
+    def replace_with_links(self, links):
+        """
+        "links" is a list of (filepath, linkpath, checkpath), where
+        "checkpath" is the file to compare "filepath" against and "linkpath"
+        is where that file will be found once installed.  Each file that is
+        identical to its "checkpath" is replaced by a symbolic link to
+        "linkpath".  Returns the number of files replaced.
+        """
+        same = self.identical([(filepath, checkpath) for filepath, linkpath, checkpath in links])
+        total = 0
+        for (filepath, linkpath, checkpath), identical in zip(links, same):
+            if not identical:
+                continue
+            # (Replacing a link to the same contents saves nothing)
+            filesize = 0 if os.path.islink(filepath) else os.path.getsize(filepath)
+            os.remove(filepath)
+            os.symlink(linkpath, filepath)
+            total += 1
+            self.reclaimed += filesize
+        self.linked += total
+        return total
+
+    def report(self):
+        """Print the number of files replaced by links and the space saved."""
+        if self.linked == 0:
+            return
+        filestr = 'files' if self.linked > 1 else 'file'
+        print('Replaced ' + str(self.linked) + ' ' + filestr + ' with symbolic links, '
+		+ 'reclaiming ' + format_size(self.reclaimed) + '.')
+
+# Return a number of bytes as a readable string
+
+def format_size(nbytes):
+    for unit in ['bytes', 'kB', 'MB', 'GB']:
+        if nbytes < 1024 or unit == 'GB':
+            break
+        nbytes /= 1024.0
+    if unit == 'bytes':
+        return str(nbytes) + ' bytes'
+    return '{:.1f} '.format(nbytes) + unit
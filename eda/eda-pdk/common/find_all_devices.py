@@ -6,11 +6,22 @@
 # these devices.  Then find all paths from the directory models/
 # that will read the subcircuit definition through a hierarchical
 # series of includes.
+#
+# The subcircuits and includes found in each file are kept in an
+# index file in the PDK directory (see find_everything()), so that
+# only files that have changed are read again.
 #-----------------------------------------------------------
 
 import re
 import os 
 import sys
+import json
+
+# Name of the index file kept in the top level PDK directory
+index_filename = '.device_index.json'
+
+# Version of the index contents;  an index of any other version is ignored
+index_version = 1
 
 #-----------------------------------------------------------
 # Find all models in the model directory path, recursively
@@ -132,12 +143,14 @@ def preferred_order(subfiles, feol):
 # Find the appropriate file to include to handle this device
 #-----------------------------------------------------------
 
-def check_device(subfiles, includedict, modfilesdict, feol, beol, notop, debug):
+def check_device(subfiles, includedict, modfilesdict, feol, beol, notop, debug, memo=None):
     # subfiles = list of files that define this subcircuit.
     # includedict  = files that include the dictionary keyword file
     # modfilesdict = files that are included by the dictionary keyword file
     # feol = FEOL corner (fs, tt, ss, etc.) for transistors, diodes
     # beol = BEOL corner (hl, tt, ll, etc.) for capacitors, resistors, inductors
+    # memo = dictionary of top level include files already found, by the
+    #        name of the file they were found from (for the same corners)
 
     ordfiles = preferred_order(subfiles, feol)
     if debug:
@@ -159,6 +172,12 @@ def check_device(subfiles, includedict, modfilesdict, feol, beol, notop, debug):
         ordname = os.path.split(ordfile)[1]
         if debug:
             print('   (1) Search for "' + ordname  + '"')
+        if memo is not None and ordname in memo:
+            if memo[ordname] is None:
+                continue
+            if debug:
+                print('Final top level include file is: "' + memo[ordname] + '"')
+            return memo[ordname]
         try:
             inclist = includedict[ordname][1:]
         except:
@@ -168,6 +187,8 @@ def check_device(subfiles, includedict, modfilesdict, feol, beol, notop, debug):
                 for key in includedict:
                     print('      ' + key + ': "' + str(includedict[key][1:]) + '"')
                     break
+            if memo is not None:
+                memo[ordname] = None
             continue
         else:
             if debug:
@@ -175,11 +196,20 @@ def check_device(subfiles, includedict, modfilesdict, feol, beol, notop, debug):
                 for item in inclist:
                     print('      ' + item)
 
+        # Files are only known by name, so files of the same name in
+        # different directories can make the includes appear to loop.
+        # Stop climbing at the first file name seen before.
+        visited = set([ordname])
         while True:
             incfile = choose_preferred(inclist, feol, beol, notop, debug)
             incname = os.path.split(incfile)[1]
             if debug:
                 print('   (2) Search for "' + incname  + '"')
+            if incname in visited:
+                if debug:
+                    print('   Include of "' + incname + '" loops back;  stopping here.')
+                break
+            visited.add(incname)
             try:
                 inclist = includedict[incname][1:]
             except:
@@ -192,11 +222,85 @@ def check_device(subfiles, includedict, modfilesdict, feol, beol, notop, debug):
 
         if debug:
             print('Final top level include file is: "' + incfile + '"')
+        if memo is not None:
+            memo[ordname] = incfile
         return incfile
 
     # Should only happen if subfiles is empty list
     return None
 
+#-----------------------------------------------------------
+# Index of the subcircuits defined and the files included by
+# each SPICE file under the PDK directory.  Each entry is kept
+# with the size and modification time of the file, and the file
+# is only read again when either has changed.
+#-----------------------------------------------------------
+
+class DeviceIndex(object):
+    def __init__(self, pathtop):
+        self.pathtop = pathtop
+        self.indexfile = pathtop + '/' + index_filename
+        self.oldfiles = {}
+        self.files = {}
+        self.changed = False
+        self.subcktrex = re.compile(r'\.subckt[ \t]+([^ \t]+)[ \t]+', re.IGNORECASE)
+        self.includerex = re.compile(r'\.include[ \t]+([^ \t]+)', re.IGNORECASE)
+        try:
+            with open(self.indexfile, 'r') as ifile:
+                index = json.load(ifile)
+            if index['version'] == index_version:
+                self.oldfiles = index['files']
+        except (OSError, ValueError, KeyError, TypeError):
+            self.oldfiles = {}
+
+    def save(self):
+        """Write the index into the PDK directory, if anything has changed."""
+        if not self.changed and len(self.files) == len(self.oldfiles):
+            return
+        tmpfile = self.indexfile + '.tmp'
+        try:
+            with open(tmpfile, 'w') as ofile:
+                json.dump({'version': index_version, 'files': self.files}, ofile)
+            os.replace(tmpfile, self.indexfile)
+        except OSError:
+            # The PDK directory may not be writable;  the index is then
+            # only kept for this run.
+            pass
+
+    def entry(self, file):
+        # Return [size, mtime, subcircuits, includes] for "file", reading
+        # the file only if it has not been indexed or has changed.
+        key = os.path.relpath(file, self.pathtop)
+        entry = self.files.get(key)
+        if entry:
+            return entry
+        statbuf = os.stat(file)
+        entry = self.oldfiles.get(key)
+        if not entry or entry[0:2] != [statbuf.st_size, statbuf.st_mtime_ns]:
+            subckts = []
+            includes = []
+            with open(file, 'r') as ifile:
+                spicelines = ifile.read().splitlines()
+                for line in spicelines:
+                    smatch = self.subcktrex.match(line)
+                    if smatch:
+                        subckts.append(smatch.group(1))
+                    imatch = self.includerex.match(line)
+                    if imatch:
+                        includes.append(imatch.group(1))
+            entry = [statbuf.st_size, statbuf.st_mtime_ns, subckts, includes]
+            self.changed = True
+        self.files[key] = entry
+        return entry
+
+    def subcircuits(self, file):
+        """Return the names of the subcircuits defined in "file"."""
+        return self.entry(file)[2]
+
+    def includes(self, file):
+        """Return the names of the files included by "file"."""
+        return self.entry(file)[3]
+
 #-----------------------------------------------------------
 # Find all cells and all models
 #-----------------------------------------------------------
@@ -206,9 +310,7 @@ def find_everything(pathtop):
     modelspath = pathtop + '/models'
 
     allcells = os.listdir(cellspath)
-
-    subcktrex = re.compile(r'\.subckt[ \t]+([^ \t]+)[ \t]+', re.IGNORECASE)
-    includerex = re.compile(r'\.include[ \t]+([^ \t]+)', re.IGNORECASE)
+    index = DeviceIndex(pathtop)
 
     filesdict  = {}
     subcktdict  = {}
@@ -225,21 +327,16 @@ def find_everything(pathtop):
                 files_to_parse.append(cellpath + '/' + cellfmt)
 
         for file in files_to_parse:
-            with open(file, 'r') as ifile:
-                spicelines = ifile.read().splitlines()
-                for line in spicelines:
-                    smatch = subcktrex.match(line)
-                    if smatch:
-                        subname = smatch.group(1)
-                        try:
-                            subcktdict[subname].append(file)
-                        except:
-                            subcktdict[subname] = [file]
-                        filetail = os.path.split(file)[1]
-                        try:
-                            filesdict[filetail].append(subname)
-                        except:
-                            filesdict[filetail] = [subname]
+            for subname in index.subcircuits(file):
+                try:
+                    subcktdict[subname].append(file)
+                except:
+                    subcktdict[subname] = [file]
+                filetail = os.path.split(file)[1]
+                try:
+                    filesdict[filetail].append(subname)
+                except:
+                    filesdict[filetail] = [subname]
 
     files_to_parse = addmodels(modelspath)
     files_to_parse.extend(addmodels(cellspath))
@@ -248,34 +345,33 @@ def find_everything(pathtop):
         # NOTE:  Avoid problems with sonos directories using
         # "tt.spice", which causes the include chain recursive
         # loop to fail to exit.  This is a one-off exception
-        # (hack alert)
+        # (hack alert).  check_device() now stops on a loop, but
+        # these files are still left out so that they are not
+        # chosen as includes for other devices.
         if '_of_life' in file:
             continue
 
-        with open(file, 'r') as ifile:
-            spicelines = ifile.read().splitlines()
-            for line in spicelines:
-                imatch = includerex.match(line)
-                if imatch:
-                    incname = imatch.group(1).strip('"')
-                    inckey = os.path.split(incname)[1]
-
-                    try:
-                        inclist = includedict[inckey]
-                    except:
-                        includedict[inckey] = [incname, file]
-                    else:
-                        if file not in inclist[1:]:
-                            includedict[inckey].append(file)
-                    filetail = os.path.split(file)[1]
-                    try:
-                        modlist = modfilesdict[filetail]
-                    except:
-                        modfilesdict[filetail] = [incname]
-                    else:
-                        if incname not in modlist:
-                            modfilesdict[filetail].append(incname)
+        for incname in index.includes(file):
+            incname = incname.strip('"')
+            inckey = os.path.split(incname)[1]
 
+            try:
+                inclist = includedict[inckey]
+            except:
+                includedict[inckey] = [incname, file]
+            else:
+                if file not in inclist[1:]:
+                    includedict[inckey].append(file)
+            filetail = os.path.split(file)[1]
+            try:
+                modlist = modfilesdict[filetail]
+            except:
+                modfilesdict[filetail] = [incname]
+            else:
+                if incname not in modlist:
+                    modfilesdict[filetail].append(incname)
+
+    index.save()
     return filesdict, subcktdict, includedict, modfilesdict
 
 #-----------------------------------------------------------
@@ -286,6 +382,10 @@ def do_find_all_devices(pathtop, sourcefile, cellname=None, feol='tt', beol='tt'
 
     (filesdict, subcktdict, includedict, modfilesdict) = find_everything(pathtop)
 
+    # Top level include files found by check_device(), which are the same
+    # for every device found through the same file.
+    memo = {}
+
     if sourcefile:
         # Parse the source file and find all 'X' records, and collect a list
         # of all primitive devices used in the file by cross-checking against
@@ -316,7 +416,7 @@ def do_find_all_devices(pathtop, sourcefile, cellname=None, feol='tt', beol='tt'
                 except:
                     pass
                 else:
-                    incfile = check_device(subfiles, includedict, modfilesdict, feol, beol, notop, debug)
+                    incfile = check_device(subfiles, includedict, modfilesdict, feol, beol, notop, debug, memo)
                     if not incfile:
                         incfile = preferred_order(subfiles, feol)[0]
 
@@ -342,7 +442,7 @@ def do_find_all_devices(pathtop, sourcefile, cellname=None, feol='tt', beol='tt'
                 except:
                     pass
                 else:
-                    incfile = check_device(subfiles, includedict, modfilesdict, feol, beol, notop, debug)
+                    incfile = check_device(subfiles, includedict, modfilesdict, feol, beol, notop, debug, memo)
                     if not incfile:
                         incfile = preferred_order(subfiles, feol)[0]
 
@@ -367,7 +467,7 @@ def do_find_all_devices(pathtop, sourcefile, cellname=None, feol='tt', beol='tt'
             print('No cell "' + cellname + '" was found in the PDK files.')
             sys.exit(1)
 
-        incfile = check_device(subfiles, includedict, modfilesdict, feol, beol, notop, debug)
+        incfile = check_device(subfiles, includedict, modfilesdict, feol, beol, notop, debug, memo)
         if debug:
             print('')
             print('Report:')
@@ -401,7 +501,7 @@ def do_find_all_devices(pathtop, sourcefile, cellname=None, feol='tt', beol='tt'
                 print('No cell "' + cellname + '" was found in the PDK files.')
                 continue
 
-            incfile = check_device(subfiles, includedict, modfilesdict, feol, beol, notop, debug)
+            incfile = check_device(subfiles, includedict, modfilesdict, feol, beol, notop, debug, memo)
             print('Cell = "' + cellname + '"')
             bestfilepath = preferred_order(subfiles, feol)[0]
             if bestfilepath.startswith(pathtop):
@@ -11,6 +11,8 @@
 #    -clean		Clear out and remove target directory before starting
 #    -source <path>	Path to source data top level directory
 #    -target <path>	Path to target (staging) top level directory
+#    -jobs=<number>	Number of installation steps to run in parallel
+#    -force		Install all libraries, even those that are up to date
 #
 # All other options represent paths to vendor files.  They may all be
 # wildcarded with "*", or with specific escapes like "%l" for library
@@ -187,6 +189,12 @@
 # However, it is more likely that it will be called several times for the
 # same PDK, once to install I/O cells, once to install digital, and so
 # forth, as made possible by the wild-carding.
+#
+# NOTE:  A manifest of what has been installed is kept in the target
+# directory (see install_manifest.py).  When the script is run again, the
+# formats of each library whose source files, scripts, and options have
+# not changed since the last run are not installed again.  Use "-force"
+# to install everything regardless.
 
 import re
 import os
@@ -199,6 +207,8 @@ import subprocess
 
 # Import local routines
 import natural_sort
+from install_scheduler import InstallScheduler
+from install_manifest import InstallManifest
 from create_gds_library import create_gds_library
 from create_spice_library import create_spice_library
 from create_lef_library import create_lef_library
@@ -212,6 +222,8 @@ def usage():
     print("")
     print("   -source <path>    Path to top of source directory tree")
     print("   -target <path>    Path to top of target directory tree")
+    print("   -jobs=<number>    Run up to <number> installation steps in parallel")
+    print("   -force            Install all libraries, even those that are up to date")
     print("")
     print("   -techlef <path>   Path to technology LEF file")
     print("   -doc <path>       Path to technology documentation")
@@ -499,6 +511,1353 @@ def tfilter(targetroot, filterscript, outfile=[]):
                 print('   Filtering file ' + tfile + ' with ' + filterroot)
                 subprocess_run('filter', [filterscript, tfile, tfile])
 
+#----------------------------------------------------------------------------
+# Install the vendor files of one option (e.g., "-gds") for one library into
+# the staging area, and compile them into a library file if requested.
+# "settings" holds the paths of the installation and the keywords given
+# with the option.  Returns the name of a vendor LEF file that was kept for
+# annotation and is to be removed after layout has been generated, or None.
+#----------------------------------------------------------------------------
+
+def install_library_files(option, library, settings):
+    sourcedir = settings['sourcedir']
+    targetdir = settings['targetdir']
+    scriptdir = settings['scriptdir']
+    mag_current = settings['mag_current']
+    pdkname = settings['pdkname']
+    have_lefanno = settings['have_lefanno']
+    removelist = settings['removelist']
+    hier_up = settings['hier_up']
+    filter_scripts = settings['filter_scripts']
+    do_collate = settings['do_collate']
+    do_stub = settings['do_stub']
+    do_compile = settings['do_compile']
+    do_compile_only = settings['do_compile_only']
+    do_remove_spec = settings['do_remove_spec']
+    do_remove = settings['do_remove']
+    excludelist = settings['excludelist']
+    nocopylist = settings['nocopylist']
+    includelist = settings['includelist']
+    headerfile = settings['headerfile']
+    newname = settings['newname']
+    sortscript = settings['sortscript']
+
+    lef_savelibname = None
+    liblistnames = []
+    destpath = ''
+    targname = None
+
+    if len(library) == 3:
+        destlib = library[2]
+    else:
+        destlib = library[1]
+
+    destdir = targetdir + '/libs.ref/' + destlib + '/' + option[0]
+    destlibdir = destdir
+
+    os.makedirs(destlibdir, exist_ok=True)
+
+    # Populate the library subdirectory
+    # Parse the option and replace each '/*/' with the library name,
+    # and check if it is a valid directory name.  Then glob the
+    # resulting option name.  Warning:  This assumes that all
+    # occurences of the text '/*/' match a library name.  It should
+    # be possible to wild-card the directory name in such a way that
+    # this is always true.
+
+    testpath = substitute(sourcedir + '/' + option[1], library[1])
+    liblist = glob.glob(testpath)
+    liblist = natural_sort.natural_sort(liblist)
+
+    if do_collate:
+        # Rework liblist so that file parts are put into a list and
+        # associated with the final filename.  Replace the file parts
+        # in liblist with the collated filename.  Assume that the
+        # parts are named with an additional extension such as ".part1"
+        # ".part2" etc., and that these extensions are in natural sort
+        # order.  Note that it is not necessary for all files in the
+        # list to be split into parts.
+
+        # Regular expression catches filename "a.b.c", handling any
+        # leading dots (such as "../") and returns string "a.b"
+        basenamerex = re.compile(r'(\.?\.?[^.]+\..+)\.+')
+        baseliblist = []
+        splitfiles = {}
+        for libfile in liblist:
+            bmatch = basenamerex.match(libfile)
+            if bmatch:
+                basename = bmatch.group(1)
+                if basename not in baseliblist:
+                    baseliblist.append(basename)
+                    splitfiles[basename] = [libfile]
+                else:
+                    splitfiles[basename].append(libfile)
+            else:
+                baseliblist.append(libfile)   ;# not a split file
+        liblist = baseliblist
+
+    # Create a file "sources.txt" (or append to it if it exists)
+    # and add the source directory name so that the staging install
+    # script can know where the files came from.
+
+    with open(destlibdir + '/sources.txt', 'a') as ofile:
+        print(testpath, file=ofile)
+
+    # Create exclude list with glob-style matching using fnmatch
+    if len(liblist) > 0:
+        liblistnames = list(os.path.split(item)[1] for item in liblist)
+        notliblist = []
+        for exclude in excludelist:
+            if '/' in exclude:
+                # Names come from files in a path that is not the source
+                excludefiles = os.listdir(os.path.split(exclude)[0])
+                pattern = os.path.split(exclude)[1]
+                notliblist.extend(fnmatch.filter(excludefiles, pattern))
+            else:
+                notliblist.extend(fnmatch.filter(liblistnames, exclude))
+
+        # Apply exclude list
+        if len(notliblist) > 0:
+            for file in liblist[:]:
+                if os.path.split(file)[1] in notliblist:
+                    liblist.remove(file)
+
+        if len(excludelist) > 0 and len(notliblist) == 0:
+            print('Warning:  Nothing from the exclude list found in sources.')
+            print('excludelist = ' + str(excludelist))
+            print('destlibdir = ' + destlibdir)
+
+    # Create a list of cell names not to be copied from "nocopylist"
+    nocopynames = []
+    for nocopy in nocopylist:
+        if '/' in nocopy:
+            # Names come from files in a path that is not the source
+            nocopyfiles = os.listdir(os.path.split(nocopy)[0])
+            pattern = os.path.split(nocopy)[1]
+            nocopynames.extend(fnmatch.filter(nocopyfiles, pattern))
+        else:
+            nocopynames.extend(fnmatch.filter(liblistnames, nocopy))
+
+    # Diagnostic
+    print('Collecting files from ' + testpath)
+    print('Files to install:')
+    if len(liblist) < 10:
+        for item in liblist:
+            print('   ' + item)
+    else:
+        for item in liblist[0:4]:
+            print('   ' + item)
+        print('   .')
+        print('   .')
+        print('   .')
+        for item in liblist[-6:-1]:
+            print('   ' + item)
+        print('(' + str(len(liblist)) + ' files total)')
+
+    destfilelist = []
+
+    for libname in liblist:
+
+        # Note that there may be a hierarchy to the files in option[1],
+        # say for liberty timing files under different conditions, so
+        # make sure directories have been created as needed.
+
+        libfile = os.path.split(libname)[1]
+        libfilepath = os.path.split(libname)[0]
+        destpathcomp = []
+        for i in range(hier_up):
+            destpathcomp.append('/' + os.path.split(libfilepath)[1])
+            libfilepath = os.path.split(libfilepath)[0]
+        destpathcomp.reverse()
+        destpath = ''.join(destpathcomp)
+
+        dontcopy = True if libfile in nocopynames else False
+
+        if option[0] == 'verilog':
+            fileext = '.v'
+        elif option[0] == 'liberty' or option[0] == 'lib':
+            fileext = '.lib'
+        elif option[0] == 'spice' or option[0] == 'spi':
+            fileext = '.spice'
+        elif option[0] == 'techlef':
+            fileext = '.lef'
+        else:
+            fileext = '.' + option[0]
+
+        if newname:
+            if os.path.splitext(newname)[1] == '':
+                newname = newname + fileext
+
+            if len(liblist) == 1:
+                destfile = newname
+            elif newname.startswith('*.'):
+                destfile = os.path.splitext(libfile)[0] + newname[1:]
+            elif newname.startswith('.'):
+                destfile = os.path.splitext(libfile)[0] + newname
+            else:
+                if not do_compile and not do_compile_only:
+                    print('Error:  rename specified but more than one file found!')
+                destfile = libfile
+        else:
+            destfile = libfile
+
+        targname = destlibdir + destpath + '/' + destfile
+
+        # NOTE:  When using "up" with link_from, could just make
+        # destpath itself a symbolic link;  this way is more flexible
+        # but adds one symbolic link per file.
+
+        if destpath != '':
+            if not os.path.isdir(destlibdir + destpath):
+                os.makedirs(destlibdir + destpath, exist_ok=True)
+
+        # Remove any existing file
+        if os.path.isfile(targname):
+            if not dontcopy:
+                os.remove(targname)
+        elif os.path.isdir(targname):
+            if not dontcopy:
+                shutil.rmtree(targname)
+
+        # Stage items for later removal if requested
+        if do_remove:
+            removelist.append(targname)
+
+        # NOTE:  Diagnostic, probably much too much output.
+        print('   Install:' + libname + ' to ' + targname)
+        if not os.path.isdir(libname):
+            if not dontcopy:
+                if do_collate:
+                    if libname not in splitfiles:
+                        shutil.copy(libname, targname)
+                    else:
+                        allparts = splitfiles[libname]
+                        with open(targname, 'wb') as afd:
+                            for filepart in allparts:
+                                with open(filepart, 'rb') as fd:
+                                    shutil.copyfileobj(fd, afd)
+                else:
+                    shutil.copy(libname, targname)
+        else:
+            if not dontcopy:
+                shutil.copytree(libname, targname)
+
+        # File filtering options:  Two options 'stub' and 'nospec' are
+        # handled by scripts in ../common/.  Custom filters can also be
+        # specified.
+
+        local_filter_scripts = filter_scripts[:]
+
+        if option[0] == 'verilog':
+            # Internally handle syntactical issues with verilog and iverilog
+            vfilter(targname)
+
+            if do_remove_spec:
+                local_filter_scripts.append(scriptdir + '/remove_specify.py')
+
+        elif option[0] == 'cdl' or option[0] == 'spi' or option[0] == 'spice':
+            if do_stub:
+                local_filter_scripts.append(scriptdir + '/makestub.py')
+
+        for filter_script in local_filter_scripts:
+            # Apply filter script to all files in the target directory
+            tfilter(targname, filter_script)
+
+        destfilelist.append(os.path.split(targname)[1])
+
+    # If headerfile is non-null, then copy this file, too.  Do not add
+    # it to "destfilelist", as it is handled separately.  Recast
+    # headerfile as the name of the file without the path.
+
+    if headerfile:
+        headerpath = substitute(sourcedir + '/' + headerfile, library[1])
+        headerlist = glob.glob(headerpath)
+        if len(headerlist) == 1:
+            libname = headerlist[0]
+            destfile = os.path.split(libname)[1]
+            targname = destlibdir + destpath + '/' + destfile
+            shutil.copy(libname, targname)
+            headerfile = destfile
+
+    # Add names from "include" list to destfilelist before writing
+    # filelist.txt for library file compiling.
+
+    for incname in includelist:
+        if '/' in incname:
+            # Names come from files in a path that is not the source
+            incfiles = os.listdir(os.path.split(incname)[0])
+            pattern = os.path.split(incname)[1]
+            destfilelist.extend(fnmatch.filter(incfiles, pattern))
+        else:
+            destfilelist.extend(fnmatch.filter(liblistnames, incname))
+
+    if sortscript:
+        with open(destlibdir + '/filelist.txt', 'w') as ofile:
+            for destfile in destfilelist:
+                print(destfile, file=ofile)
+        if os.path.isfile(sortscript):
+            print('Diagnostic:  Sorting files with ' + sortscript)
+            subprocess.run(
+                [sortscript, destlibdir],
+                stdout = subprocess.DEVNULL,
+                stderr = subprocess.DEVNULL,
+                check = True,
+            )
+
+    if do_compile == True or do_compile_only == True:
+        # NOTE:  The purpose of "rename" is to put a destlib-named
+        # library elsewhere so that it can be merged with another
+        # library into a compiled <destlib>.<ext> on another pass.
+
+        compname = destlib
+
+        # To do:  Make this compatible with linking from another PDK.
+
+        if option[0] == 'verilog':
+            # If there is not a single file with all verilog cells in it,
+            # then compile one, because one does not want to have to have
+            # an include line for every single cell used in a design.
+
+            create_verilog_library(destlibdir, compname, do_compile_only, do_stub, excludelist)
+
+        elif option[0] == 'gds':
+            # If there is not a single file with all GDS cells in it,
+            # then compile one.  (This does not need magic unless the
+            # files cannot be merged directly;  see create_gds_library.py)
+
+            # Link to the PDK magic startup file from the target directory
+            startup_script = targetdir + mag_current + pdkname + '-F.magicrc'
+            if not os.path.isfile(startup_script):
+                startup_script = targetdir + mag_current + pdkname + '.magicrc'
+            create_gds_library(destlibdir, compname, startup_script, do_compile_only, excludelist)
+
+        elif option[0] == 'liberty' or option[0] == 'lib':
+            # If there is not a single file with all liberty cells in it,
+            # then compile one, because one does not want to have to have
+            # an include line for every single cell used in a design.
+
+            create_lib_library(destlibdir, compname, do_compile_only, excludelist, headerfile)
+
+        elif option[0] == 'spice' or option[0] == 'spi':
+            # If there is not a single file with all SPICE subcircuits in it,
+            # then compile one, because one does not want to have to have
+            # an include line for every single cell used in a design.
+
+            spiext = '.spice'
+            create_spice_library(destlibdir, compname, spiext, do_compile_only, do_stub, excludelist)
+
+        elif option[0] == 'cdl':
+            # If there is not a single file with all CDL subcircuits in it,
+            # then compile one, because one does not want to have to have
+            # an include line for every single cell used in a design.
+
+            create_spice_library(destlibdir, compname, '.cdl', do_compile_only, do_stub, excludelist)
+
+        elif option[0] == 'lef':
+            # If there is not a single file with all LEF cells in it,
+            # then compile one, because one does not want to have to have
+            # an include line for every single cell used in a design.
+
+            if not have_lefanno:
+                create_lef_library(destlibdir, compname, do_compile_only, excludelist)
+
+            if do_compile_only == True:
+                if newname and targname:
+                    if os.path.isfile(targname):
+                        if have_lefanno:
+                            # If the original source is a single file
+                            # but is used for annotation, then save the
+                            # file name and delete it just before writing
+                            # the LEF library
+                            lef_savelibname = targname
+                        else:
+                            os.remove(targname)
+
+        # "rename" with "compile" or "compile-only":  Change the name
+        # of the compiled file.
+
+        if newname:
+            print('   Renaming ' + compname + fileext + ' to ' + newname)
+            origname = destlibdir + '/' + compname + fileext
+            targrename = destlibdir + destpath + '/' + newname
+            if os.path.isfile(origname):
+                os.rename(origname, targrename)
+
+    # If "filelist.txt" was created, remove it
+    if sortscript:
+        if os.path.isfile(destlibdir + '/filelist.txt'):
+            os.remove(destlibdir + '/filelist.txt')
+
+    return lef_savelibname
+
+#----------------------------------------------------------------------------
+# Move the installed files of one option for one library from libs.ref to
+# libs.priv (see option "priv").
+#----------------------------------------------------------------------------
+
+def move_to_privileged(option, library, targetdir):
+    if len(library) == 3:
+        destlib = library[2]
+    else:
+        destlib = library[1]
+
+    srclibdir = targetdir + '/libs.ref/' + destlib + '/' + option[0]
+    destlibdir = targetdir + '/libs.priv/' + destlib + '/' + option[0]
+
+    if not os.path.exists(destlibdir):
+        os.makedirs(destlibdir)
+
+    print('Moving files in ' + srclibdir + ' to privileged space.')
+    filelist = os.listdir(srclibdir)
+    for file in filelist:
+        srcfile = srclibdir + '/' + file
+        destfile = destlibdir + '/' + file
+        if os.path.isfile(destfile):
+            os.remove(destfile)
+        elif os.path.isdir(destfile):
+            shutil.rmtree(destfile)
+
+        if os.path.isfile(srcfile):
+            shutil.copy(srcfile, destfile)
+            os.remove(srcfile)
+        else:
+            shutil.copytree(srcfile, destfile)
+            shutil.rmtree(srcfile)
+
+#----------------------------------------------------------------------------
+# Generate magic databases (mag/) from the GDS of one library, and generate
+# LEF views from the layout if the library has no LEF files or if they are
+# used only for annotation.  "settings" holds the paths and options of the
+# installation.
+#----------------------------------------------------------------------------
+
+def migrate_gds_library(library, settings):
+    targetdir = settings['targetdir']
+    gds_reflib = settings['gds_reflib']
+    cdl_reflib = settings['cdl_reflib']
+    lef_reflib = settings['lef_reflib']
+    mag_current = settings['mag_current']
+    pdkname = settings['pdkname']
+    have_mag_8_2 = settings['have_mag_8_2']
+    have_mag_8_3_261 = settings['have_mag_8_3_261']
+    do_timestamp = settings['do_timestamp']
+    timestamp_value = settings['timestamp_value']
+    tclscript = settings['tclscript']
+    tcllines = settings['tcllines']
+    pdklibrary = settings['pdklibrary']
+    fixedlist = settings['fixedlist']
+    have_lef = settings['have_lef']
+    have_lefanno = settings['have_lefanno']
+    have_cdl = settings['have_cdl']
+    have_spice = settings['have_spice']
+    have_verilog = settings['have_verilog']
+    gds_exclude = settings['gds_exclude']
+    lef_exclude = settings['lef_exclude']
+    verilog_exclude = settings['verilog_exclude']
+    cdl_exclude = settings['cdl_exclude']
+    spice_exclude = settings['spice_exclude']
+    lefopts = settings['lefopts']
+
+    if len(library) == 3:
+        destlib = library[2]
+    else:
+        destlib = library[1]
+
+    destdir = targetdir + gds_reflib + destlib + '/mag'
+    srcdir = targetdir + gds_reflib + destlib + '/gds'
+    vdir = targetdir + '/libs.ref/' + destlib + '/verilog'
+    cdir = targetdir + cdl_reflib + destlib + '/cdl'
+    sdir = targetdir + cdl_reflib + destlib + '/spice'
+    destlibdir = destdir
+    srclibdir = srcdir
+    vlibdir = vdir
+    clibdir = cdir
+    slibdir = sdir
+
+    os.makedirs(destlibdir, exist_ok=True)
+
+    # Link to the PDK magic startup file from the target directory
+    # If there is no -F version then look for one without -F (open source PDK)
+    startup_script = targetdir + mag_current + pdkname + '-F.magicrc'
+    if not os.path.isfile(startup_script):
+        startup_script = targetdir + mag_current + pdkname + '.magicrc'
+
+    if have_mag_8_2 and os.path.isfile(startup_script):
+        # If the symbolic link exists, remove it.
+        if os.path.isfile(destlibdir + '/.magicrc'):
+            os.remove(destlibdir + '/.magicrc')
+        os.symlink(startup_script, destlibdir + '/.magicrc')
+
+        # Find GDS file names in the source
+        print('Getting GDS file list from ' + srclibdir + '.')
+        gdsfilesraw = os.listdir(srclibdir)
+        gdsfiles = []
+        for gdsfile in gdsfilesraw:
+            gdsext = os.path.splitext(gdsfile)[1].lower()
+            if gdsext == '.gds' or gdsext == '.gdsii' or gdsext == '.gds2':
+                gdsfiles.append(gdsfile)
+
+        # Create exclude list with glob-style matching using fnmatch
+        if len(gdsfiles) > 0:
+            gdsnames = list(os.path.split(item)[1] for item in gdsfiles)
+            notgdsnames = []
+            for exclude in gds_exclude:
+                notgdsnames.extend(fnmatch.filter(gdsnames, exclude))
+
+            # Apply exclude list
+            if len(notgdsnames) > 0:
+                for file in gdsfiles[:]:
+                    if os.path.split(file)[1] in notgdsnames:
+                        gdsfiles.remove(file)
+
+        # Generate a script called "generate_magic.tcl" and leave it in
+        # the target directory.  Use it as input to magic to create the
+        # .mag files from the database.
+
+        print('Creating magic generation script to generate magic database files.') 
+        with open(destlibdir + '/generate_magic.tcl', 'w') as ofile:
+            print('#!/usr/bin/env wish', file=ofile)
+            print('#--------------------------------------------', file=ofile)
+            print('# Script to generate .mag files from .gds    ', file=ofile)
+            print('#--------------------------------------------', file=ofile)
+            print('crashbackups stop', file=ofile)
+            print('drc off', file=ofile)
+            print('locking off', file=ofile)
+            if do_timestamp and have_mag_8_3_261:
+                print('gds datestamp ' + str(timestamp_value), file=ofile)
+            print('gds readonly true', file=ofile)
+            print('gds drccheck false', file=ofile)
+            print('gds flatten true', file=ofile)
+            print('gds rescale false', file=ofile)
+            print('tech unlock *', file=ofile)
+
+            # Add custom Tcl script lines before "gds read".
+            if tclscript:
+                for line in tcllines:
+                    print(line, file=ofile)
+
+            for gdsfile in gdsfiles:
+                # Note:  DO NOT use a relative path here.
+                print('gds read ' + srclibdir + '/' + gdsfile, file=ofile)
+
+            # Make sure properties include the Tcl generated cell
+            # information from the PDK script
+
+            if pdklibrary:
+                tclfixedlist = '{' + ' '.join(fixedlist) + '}'
+                print('set devlist ' + tclfixedlist, file=ofile)
+                print('set topcell [lindex [cellname list top] 0]',
+			    file=ofile)
+
+                print('foreach cellname $devlist {', file=ofile)
+                print('    load $cellname', file=ofile)
+                print('    property gencell $cellname', file=ofile)
+                print('    property parameter m=1', file=ofile)
+                print('    property library ' + pdklibrary, file=ofile)
+                print('}', file=ofile)
+                print('load $topcell', file=ofile)
+
+            else:
+                # Use LEF files to set the port properties
+                if have_lefanno or have_lef:
+                    lefdirname = 'lef'
+
+                    # Find LEF file names in the source
+                    lefsrcdir = targetdir + lef_reflib + destlib + '/' + lefdirname
+                    lefsrclibdir = lefsrcdir
+
+                    leffiles = os.listdir(lefsrclibdir)
+                    leffiles = list(item for item in leffiles if os.path.splitext(item)[1] == '.lef')
+                    if len(leffiles) > 0:
+                        lefnames = list(os.path.split(item)[1] for item in leffiles)
+                        notlefnames = []
+                        for exclude in lef_exclude:
+                            notlefnames.extend(fnmatch.filter(lefnames, exclude))
+
+                        # Apply exclude list
+                        if len(notlefnames) > 0:
+                            for file in leffiles[:]:
+                                if os.path.split(file)[1] in notlefnames:
+                                    leffiles.remove(file)
+
+                    if len(leffiles) > 0:
+                        print('puts stdout "Annotating cells from LEF"', file=ofile)
+                    for leffile in leffiles:
+                        print('lef read ' + lefsrclibdir + '/' + leffile, file=ofile)
+
+                # Use CDL or SPICE netlists to set the port order
+                if have_cdl or have_spice:
+                    if have_cdl:
+                        netdir = clibdir
+                    else:
+                        netdir = slibdir
+
+                    # Find CDL/SPICE file names in the source
+                    # Ignore "sources.txt" if it is in the list.
+                    netfiles = os.listdir(netdir)
+                    print('puts stdout "Annotating cells from CDL/SPICE"',
+				file=ofile)
+                    for netfile in netfiles:
+                        if os.path.split(netfile)[1] != 'sources.txt':
+                            print('catch {readspice ' + netdir + '/' + netfile
+					+ '}', file=ofile)
+
+            # print(r'cellname delete \(UNNAMED\)', file=ofile)
+            print('puts stdout "Writing all magic database files"', file=ofile)
+            print('writeall force', file=ofile)
+
+            leffiles = []
+            lefmacros = []
+            if have_lefanno:
+                # Find LEF file names in the source
+                lefsrcdir = targetdir + lef_reflib + destlib + '/lef'
+                lefsrclibdir = lefsrcdir
+
+                leffiles = os.listdir(lefsrclibdir)
+                leffiles = list(item for item in leffiles if os.path.splitext(item)[1] == '.lef')
+                # Create exclude list with glob-style matching using fnmatch
+                if len(leffiles) > 0:
+                    lefnames = list(os.path.split(item)[1] for item in leffiles)
+                    notlefnames = []
+                    for exclude in lef_exclude:
+                        notlefnames.extend(fnmatch.filter(lefnames, exclude))
+
+                    # Apply exclude list
+                    if len(notlefnames) > 0:
+                        for file in leffiles[:]:
+                            if os.path.split(file)[1] in notlefnames:
+                                leffiles.remove(file)
+
+                # Get list of abstract views to make from LEF macros
+                # (Note:  exclude list can only contain the file being
+                # read, not individual macro names in the file;  might
+                # need some additional feature to accommodate this.)
+                for leffile in leffiles:
+                    with open(lefsrclibdir + '/' + leffile, 'r') as ifile:
+                        ltext = ifile.read()
+                        llines = ltext.splitlines()
+                        for lline in llines:
+                            ltok = re.split(r' |\t|\(', lline)
+                            if ltok[0] == 'MACRO':
+                                lefmacros.append(ltok[1])
+            elif have_lef:
+                # Nothing to do;  LEF macros were already installed.
+                pass
+            elif have_verilog and os.path.isdir(vlibdir):
+                # Get list of abstract views to make from verilog modules
+                # (NOTE:  no way to apply exclude list here!)
+                vfiles = os.listdir(vlibdir)
+                vfiles = list(item for item in vfiles if os.path.splitext(item)[1] == '.v')
+                # Create exclude list with glob-style matching using fnmatch
+                if len(vfiles) > 0:
+                    vnames = list(os.path.split(item)[1] for item in vfiles)
+                    notvnames = []
+                    for exclude in verilog_exclude:
+                        notvnames.extend(fnmatch.filter(vnames, exclude))
+
+                    # Apply exclude list
+                    if len(notvnames) > 0:
+                        for file in vfiles[:]:
+                            if os.path.split(file)[1] in notvnames:
+                                vfiles.remove(file)
+
+                for vfile in vfiles:
+                    with open(vlibdir + '/' + vfile, 'r') as ifile:
+                        vtext = ifile.read()
+                        vlines = vtext.splitlines()
+                        for vline in vlines:
+                            vtok = re.split(r' |\t|\(', vline)
+                            try:
+                                if vtok[0] == 'module':
+                                    if vtok[1] not in lefmacros:
+                                        lefmacros.append(vtok[1])
+                            except:
+                                pass
+
+            elif have_cdl and os.path.isdir(clibdir):
+                # Get list of abstract views to make from CDL subcircuits
+                cfiles = os.listdir(clibdir)
+                cfiles = list(item for item in cfiles if os.path.splitext(item)[1] == '.cdl')
+                # Create exclude list with glob-style matching using fnmatch
+                if len(cfiles) > 0:
+                    cnames = list(os.path.split(item)[1] for item in cfiles)
+                    notcnames = []
+                    for exclude in cdl_exclude:
+                        notcnames.extend(fnmatch.filter(cnames, exclude))
+
+                    # Apply exclude list
+                    if len(notcnames) > 0:
+                        for file in cfiles[:]:
+                            if os.path.split(file)[1] in notcnames:
+                                cfiles.remove(file)
+
+                for cfile in cfiles:
+                    with open(clibdir + '/' + cfile, 'r') as ifile:
+                        ctext = ifile.read()
+                        clines = ctext.splitlines()
+                        for cline in clines:
+                            ctok = cline.split()
+                            try:
+                                if ctok[0].lower() == '.subckt':
+                                    if ctok[1] not in lefmacros:
+                                        lefmacros.append(ctok[1])
+                            except:
+                                pass
+
+            elif have_spice and os.path.isdir(slibdir):
+                # Get list of abstract views to make from SPICE subcircuits
+                sfiles = os.listdir(slibdir)
+                sfiles = list(item for item in sfiles)
+
+                # Create exclude list with glob-style matching using fnmatch
+                if len(sfiles) > 0:
+                    snames = list(os.path.split(item)[1] for item in sfiles)
+                    notsnames = []
+                    for exclude in spice_exclude:
+                        notsnames.extend(fnmatch.filter(snames, exclude))
+
+                    # Apply exclude list
+                    if len(notsnames) > 0:
+                        for file in sfiles[:]:
+                            if os.path.split(file)[1] in notsnames:
+                                sfiles.remove(file)
+
+                for sfile in sfiles:
+                    with open(slibdir + '/' + sfile, 'r') as ifile:
+                        stext = ifile.read()
+                        slines = stext.splitlines()
+                        for sline in slines:
+                            stok = sline.split()
+                            try:
+                                if stok[0].lower() == '.subckt':
+                                    if stok[1] not in lefmacros:
+                                        lefmacros.append(stok[1])
+                            except:
+                                pass
+
+            if not lefmacros:
+                print('No source for abstract views:  Abstract views not made.')
+            elif have_lefanno or not have_lef:
+                # This library has a GDS database but no LEF database.  Use
+                # magic to create abstract views of the GDS cells.  If
+                # option "annotate" is given, then read the LEF file after
+                # loading the database file to annotate the cell with
+                # information from the LEF file.  This usually indicates
+                # that the LEF file has some weird definition of obstruction
+                # layers and we want to normalize them by using magic's LEF
+                # write procedure, but we still need the pin use and class
+                # information from the LEF file, and maybe the bounding box.
+
+                # For annotation, the LEF file output will overwrite the
+                # original source LEF file.
+                lefdest = lefsrclibdir + '/' if have_lefanno else ''
+
+                # Delete the original files in case the naming is different
+                for leffile in leffiles:
+                    print('file delete ' + lefsrclibdir + '/' + leffile, file=ofile)
+
+                for lefmacro in lefmacros:
+                    print('if {[cellname list exists ' + lefmacro + '] != 0} {', file=ofile)
+                    print('   load ' + lefmacro, file=ofile)
+                    if lefopts:
+                        print('   lef write ' + lefdest + lefmacro + ' ' + lefopts, file=ofile)
+                    else:
+                        print('   lef write ' + lefdest + lefmacro, file=ofile)
+                    print('}', file=ofile)
+
+            print('puts stdout "Done."', file=ofile)
+            print('quit -noprompt', file=ofile)
+
+        print('Running magic to create magic database files.')
+        sys.stdout.flush()
+
+        # Run magic to read in the GDS file and write out magic databases.
+        with open(destlibdir + '/generate_magic.tcl', 'r') as ifile:
+            subprocess_run(
+                'magic',
+                ['magic', '-dnull', '-noconsole'],
+                stdin = ifile,
+                cwd = destlibdir,
+            )
+
+    elif not have_mag_8_2:
+        print('The installer is not able to run magic.')
+    else:
+        print("Master PDK magic startup file not found.")
+        print('(' + targetdir + mag_current + pdkname + '.magicrc)')
+        print("Did you install PDK tech files before PDK vendor files?")
+
+#----------------------------------------------------------------------------
+# When LEF files were used for annotation, remove the vendor LEF library
+# file that was kept for annotation, and build the LEF library from the LEF
+# views written by magic if "compile" or "compile-only" was given.
+#----------------------------------------------------------------------------
+
+def compile_annotated_lef(destlib, lef_savelibname, settings):
+    targetdir = settings['targetdir']
+    lef_reflib = settings['lef_reflib']
+    lef_compile = settings['lef_compile']
+    lef_compile_only = settings['lef_compile_only']
+    lef_exclude = settings['lef_exclude']
+
+    print("Compiling LEF library from magic output.")
+
+    # If a single vendor library file was used for annotation, remove it now.
+    if lef_savelibname:
+        if os.path.isfile(lef_savelibname):
+            os.remove(lef_savelibname)
+
+    if lef_compile or lef_compile_only:
+        lefsrclibdir = targetdir + lef_reflib + destlib + '/lef'
+        create_lef_library(lefsrclibdir, destlib, lef_compile_only, lef_exclude)
+
+#----------------------------------------------------------------------------
+# Generate abstract views (maglef/) of the cells of one library from its
+# LEF files, and annotate them and the full views (mag/) with the GDS
+# properties and the port order from the CDL netlists.  "settings" holds
+# the paths and options of the installation.
+#----------------------------------------------------------------------------
+
+def migrate_lef_library(library, settings):
+    targetdir = settings['targetdir']
+    gds_reflib = settings['gds_reflib']
+    cdl_reflib = settings['cdl_reflib']
+    lef_reflib = settings['lef_reflib']
+    mag_current = settings['mag_current']
+    pdkname = settings['pdkname']
+    have_mag_8_2 = settings['have_mag_8_2']
+    have_mag_8_3_261 = settings['have_mag_8_3_261']
+    do_timestamp = settings['do_timestamp']
+    timestamp_value = settings['timestamp_value']
+    pdklibrary = settings['pdklibrary']
+    devlist = settings['devlist']
+    fixedlist = settings['fixedlist']
+    have_cdl = settings['have_cdl']
+    have_spice = settings['have_spice']
+    lef_exclude = settings['lef_exclude']
+
+    if len(library) == 3:
+        destlib = library[2]
+    else:
+        destlib = library[1]
+
+    destdir = targetdir + '/libs.ref/' + destlib + '/maglef'
+    srcdir = targetdir + lef_reflib + destlib + '/lef'
+    magdir = targetdir + gds_reflib + destlib + '/mag'
+    cdldir = targetdir + cdl_reflib + destlib + '/cdl'
+    cdir = targetdir + cdl_reflib + destlib + '/cdl'
+    sdir = targetdir + cdl_reflib + destlib + '/spice'
+
+    destlibdir = destdir
+    srclibdir = srcdir
+    maglibdir = magdir
+    cdllibdir = cdldir
+    clibdir = cdir
+    slibdir = sdir
+
+    os.makedirs(destlibdir, exist_ok=True)
+
+    # Link to the PDK magic startup file from the target directory
+    startup_script = targetdir + mag_current + pdkname + '-F.magicrc'
+    if not os.path.isfile(startup_script):
+        startup_script = targetdir + mag_current + pdkname + '.magicrc'
+
+    if have_mag_8_2 and os.path.isfile(startup_script):
+        # If the symbolic link exists, remove it.
+        if os.path.isfile(destlibdir + '/.magicrc'):
+            os.remove(destlibdir + '/.magicrc')
+        os.symlink(startup_script, destlibdir + '/.magicrc')
+
+        # Find LEF file names in the source
+        leffiles = []
+        if os.path.isdir(srclibdir):
+            leffiles = os.listdir(srclibdir)
+            leffiles = list(item for item in leffiles if os.path.splitext(item)[1].lower() == '.lef')
+
+        # Get list of abstract views to make from LEF macros
+        lefmacros = []
+        err_no_macros = False
+        for leffile in leffiles:
+            with open(srclibdir + '/' + leffile, 'r') as ifile:
+                ltext = ifile.read()
+                llines = ltext.splitlines()
+                for lline in llines:
+                    ltok = re.split(r' |\t|\(', lline)
+                    if ltok[0] == 'MACRO':
+                        lefmacros.append(ltok[1])
+
+        # Create exclude list with glob-style matching using fnmatch
+        if len(lefmacros) > 0:
+            lefnames = list(os.path.split(item)[1] for item in lefmacros)
+            notlefnames = []
+            for exclude in lef_exclude:
+                notlefnames.extend(fnmatch.filter(lefnames, exclude))
+
+            # Apply exclude list
+            if len(notlefnames) > 0:
+                for file in lefmacros[:]:
+                    if os.path.split(file)[1] in notlefnames:
+                        lefmacros.remove(file)
+
+        if len(leffiles) == 0:
+            print('Warning:  No LEF files found in ' + srclibdir)
+            return
+
+        print('Generating conversion script to create magic databases from LEF')
+
+        # Generate a script called "generate_magic.tcl" and leave it in
+        # the target directory.  Use it as input to magic to create the
+        # .mag files from the database.
+
+        with open(destlibdir + '/generate_magic.tcl', 'w') as ofile:
+            print('#!/usr/bin/env wish', file=ofile)
+            print('#--------------------------------------------', file=ofile)
+            print('# Script to generate .mag files from .lef    ', file=ofile)
+            print('#--------------------------------------------', file=ofile)
+            print('tech unlock *', file=ofile)
+
+            # If there are devices in the LEF file that come from the
+            # PDK library, then copy this list into the script.
+
+            if pdklibrary:
+                shortdevlist = []
+                for macro in lefmacros:
+                    if macro in devlist:
+                        shortdevlist.append(macro)
+
+                tcldevlist = '{' + ' '.join(shortdevlist) + '}'
+                print('set devlist ' + tcldevlist, file=ofile)
+
+            # Force the abstract view timestamps to match the full views
+            if do_timestamp and have_mag_8_3_261:
+                print('lef datestamp ' + str(timestamp_value), file=ofile)
+
+            for leffile in leffiles:
+                print('lef read ' + srclibdir + '/' + leffile, file=ofile)
+
+            # Use CDL or SPICE netlists to make sure that ports are
+            # present, and to set the port order
+
+            if have_cdl or have_spice:
+                if have_cdl:
+                    netdir = clibdir
+                else:
+                    netdir = slibdir
+
+                # Find CDL/SPICE file names in the source
+                # Ignore "sources.txt" if it is in the list.
+                netfiles = os.listdir(netdir)
+                print('puts stdout "Annotating cells from CDL/SPICE"',
+			file=ofile)
+                for netfile in netfiles:
+                    if os.path.split(netfile)[1] != 'sources.txt':
+                        print('catch {readspice ' + netdir + '/' + netfile
+				+ '}', file=ofile)
+
+            for lefmacro in lefmacros:
+
+                if pdklibrary and lefmacro in shortdevlist:
+                    print('set cellname ' + lefmacro, file=ofile)
+                    print('if {[lsearch $devlist $cellname] >= 0} {',
+				file=ofile)
+                    print('    load $cellname', file=ofile)
+                    print('    property gencell $cellname', file=ofile)
+                    print('    property parameter m=1', file=ofile)
+                    print('    property library ' + pdklibrary, file=ofile)
+                    print('}', file=ofile)
+
+            # Load one of the LEF files so that the default (UNNAMED) cell
+            # is not loaded, then delete (UNNAMED) so it doesn't generate
+            # an error message.
+            if len(lefmacros) > 0:
+                print('load ' + lefmacros[0], file=ofile)
+                # print(r'cellname delete \(UNNAMED\)', file=ofile)
+            else:
+                err_no_macros = True
+            print('writeall force', file=ofile)
+            print('puts stdout "Done."', file=ofile)
+            print('quit -noprompt', file=ofile)
+
+        if err_no_macros == True:
+            print('Warning:  No LEF macros were defined.')
+
+        print('Running magic to create magic databases from LEF')
+        sys.stdout.flush()
+
+        # Run magic to read in the LEF file and write out magic databases.
+        with open(destlibdir + '/generate_magic.tcl', 'r') as ifile:
+            subprocess_run(
+                'magic',
+                ['magic', '-dnull', '-noconsole'],
+                stdin = ifile,
+                cwd = destlibdir,
+            )
+
+        # Now list all the .mag files generated, and for each, read the
+        # corresponding file from the mag/ directory, pull the GDS file
+        # properties, and add those properties to the maglef view.  Also
+        # read the CDL (or SPICE) netlist, read the ports, and rewrite
+        # the port order in the mag and maglef file accordingly.
+
+        # Diagnostic
+        print('Annotating files in ' + destlibdir)
+        sys.stdout.flush()
+        magfiles = os.listdir(destlibdir)
+        magfiles = list(item for item in magfiles if os.path.splitext(item)[1] == '.mag')
+        for magroot in magfiles:
+            magname = os.path.splitext(magroot)[0]
+            magfile = maglibdir + '/' + magroot
+            magleffile = destlibdir + '/' + magroot
+            prop_lines = get_gds_properties(magfile)
+
+            # Make sure properties include the Tcl generated cell
+            # information from the PDK script
+
+            prop_gencell = []
+            if pdklibrary:
+                if magname in fixedlist:
+                    prop_gencell.append('gencell ' + magname)
+                    prop_gencell.append('library ' + pdklibrary)
+                    prop_gencell.append('parameter m=1')
+
+            nprops = len(prop_lines) + len(prop_gencell)
+
+            cdlfile = cdllibdir + '/' + magname + '.cdl'
+            if os.path.exists(cdlfile):
+                cdlfiles = [cdlfile]
+            else:
+                # Assume there is at least one file with all cell subcircuits
+                # in it.
+                try:
+                    cdlfiles = glob.glob(cdllibdir + '/*.cdl')
+                    cdlfiles = natural_sort.natural_sort(cdlfiles)
+                except:
+                    pass
+            if len(cdlfiles) > 0:
+                for cdlfile in cdlfiles:
+                    port_dict = get_subckt_ports(cdlfile, magname)
+                    if port_dict != {}:
+                        break
+            else:
+                port_dict = {}
+
+            if port_dict == {}:
+                print('No CDL file contains ' + destlib + ' device ' + magname)
+                cdlfile = None
+                # To be done:  If destlib is 'primitive', then look in
+                # SPICE models for port order.
+                if destlib == 'primitive':
+                    print('Fix me:  Need to look in SPICE models!')
+
+            proprex = re.compile('<< properties >>')
+            endrex = re.compile('<< end >>')
+            rlabrex = re.compile(r'rlabel[ \t]+[^ \t]+[ \t]+[^ \t]+[ \t]+[^ \t]+[ \t]+[^ \t]+[ \t]+[^ \t]+[ \t]+[^ \t]+[ \t]+([^ \t]+)')
+            flabrex = re.compile(r'flabel[ \t]+.*[ \t]+([^ \t]+)[ \t]*')
+            portrex = re.compile(r'port[ \t]+([^ \t]+)[ \t]+(.*)')
+            gcellrex = re.compile('string gencell')
+            portnum = -1
+
+            with open(magleffile, 'r') as ifile:
+                magtext = ifile.read().splitlines()
+
+            with open(magleffile, 'w') as ofile:
+                has_props = False
+                is_gencell = False
+                for line in magtext:
+                    tmatch = portrex.match(line)
+                    if tmatch:
+                        if portnum >= 0:
+                            line = 'port ' + str(portnum) + ' ' + tmatch.group(2)
+                        else:
+                            line = 'port ' + tmatch.group(1) + ' ' + tmatch.group(2)
+                    ematch = endrex.match(line)
+                    if ematch and nprops > 0:
+                        if not has_props:
+                            print('<< properties >>', file=ofile)
+                        if not is_gencell:
+                            for prop in prop_gencell:
+                                print('string ' + prop, file=ofile)
+                        for prop in prop_lines:
+                            print('string ' + prop, file=ofile)
+
+                    print(line, file=ofile)
+                    pmatch = proprex.match(line)
+                    if pmatch:
+                        has_props = True
+
+                    gmatch = gcellrex.match(line)
+                    if gmatch:
+                        is_gencell = True
+
+                    lmatch = flabrex.match(line)
+                    if not lmatch:
+                        lmatch = rlabrex.match(line)
+                    if lmatch:
+                        labname = lmatch.group(1).lower()
+                        try:
+                            portnum = port_dict[labname]
+                        except:
+                            portnum = -1
+
+            if os.path.exists(magfile):
+                with open(magfile, 'r') as ifile:
+                    magtext = ifile.read().splitlines()
+
+                with open(magfile, 'w') as ofile:
+                    for line in magtext:
+                        tmatch = portrex.match(line)
+                        if tmatch:
+                            if portnum >= 0:
+                                line = 'port ' + str(portnum) + ' ' + tmatch.group(2)
+                            else:
+                                line = 'port ' + tmatch.group(1) + ' ' + tmatch.group(2)
+                        ematch = endrex.match(line)
+                        print(line, file=ofile)
+                        lmatch = flabrex.match(line)
+                        if not lmatch:
+                            lmatch = rlabrex.match(line)
+                        if lmatch:
+                            labname = lmatch.group(1).lower()
+                            try:
+                                portnum = port_dict[labname]
+                            except:
+                                portnum = -1
+            elif os.path.splitext(magfile)[1] == '.mag':
+                # NOTE:  Possibly this means the GDS cell has a different name.
+                print('Error: No file ' + magfile + '.  Why is it in maglef???')
+
+    elif not have_mag_8_2:
+        print('The installer is not able to run magic.')
+    else:
+        print("Master PDK magic startup file not found.  Did you install")
+        print("PDK tech files before PDK vendor files?")
+
+#----------------------------------------------------------------------------
+# Convert one CDL netlist to SPICE with cdl2spi.py.  "procopts" is the
+# command line, and "destlibdir" is the directory to run it in.
+#----------------------------------------------------------------------------
+
+def run_cdl2spi(procopts, destlibdir):
+    print('Running (in ' + destlibdir + '): ' + ' '.join(procopts))
+    subprocess_run('cdl2spi.py', procopts, cwd = destlibdir)
+
+#----------------------------------------------------------------------------
+# Generate SPICE netlists for one library by extracting its layout with
+# magic, for libraries that have neither CDL nor SPICE netlists.
+# "settings" holds the paths and options of the installation.
+#----------------------------------------------------------------------------
+
+def extract_gds_library(library, settings):
+    targetdir = settings['targetdir']
+    gds_reflib = settings['gds_reflib']
+    cdl_reflib = settings['cdl_reflib']
+    lef_reflib = settings['lef_reflib']
+    mag_current = settings['mag_current']
+    pdkname = settings['pdkname']
+    tclscript = settings['tclscript']
+    tcllines = settings['tcllines']
+    have_cdl = settings['have_cdl']
+    no_cdl_convert = settings['no_cdl_convert']
+    do_parasitics = settings['do_parasitics']
+    do_compile_only = settings['do_compile_only']
+    do_stub = settings['do_stub']
+    excludelist = settings['excludelist']
+
+    if len(library) == 3:
+        destlib = library[2]
+    else:
+        destlib = library[1]
+
+    destdir = targetdir + cdl_reflib + destlib + '/spice'
+    srcdir = targetdir + gds_reflib + destlib + '/gds'
+    lefdir = targetdir + lef_reflib + destlib + '/lef'
+    cdldir = targetdir + cdl_reflib + destlib + '/cdl'
+
+    destlibdir = destdir
+    srclibdir = srcdir
+    leflibdir = lefdir
+    cdllibdir = cdldir
+
+    os.makedirs(destlibdir, exist_ok=True)
+
+    # Link to the PDK magic startup file from the target directory
+    startup_script = targetdir + mag_current + pdkname + '-F.magicrc'
+    if not os.path.isfile(startup_script):
+        startup_script = targetdir + mag_current + pdkname + '.magicrc'
+    if os.path.isfile(startup_script):
+        # If the symbolic link exists, remove it.
+        if os.path.isfile(destlibdir + '/.magicrc'):
+            os.remove(destlibdir + '/.magicrc')
+        os.symlink(startup_script, destlibdir + '/.magicrc')
+
+    # Get the consolidated GDS library file, or a list of all GDS files
+    # if there is no single consolidated library
+
+    allgdslibname = srclibdir + '/' + destlib + '.gds'
+    if not os.path.isfile(allgdslibname):
+        glist = glob.glob(srclibdir + '/*.gds')
+        glist.extend(glob.glob(srclibdir + '/*.gdsii'))
+        glist.extend(glob.glob(srclibdir + '/*.gds2'))
+        glist = natural_sort.natural_sort(glist)
+
+    allleflibname = leflibdir + '/' + destlib + '.lef'
+    if not os.path.isfile(allleflibname):
+        llist = glob.glob(leflibdir + '/*.lef')
+        llist = natural_sort.natural_sort(llist)
+
+    if have_cdl and no_cdl_convert:
+        # CDL is not being converted directly to SPICE but it exists,
+        # and being the only source of pin order, it should be used
+        # for pin order annotation.
+        allcdllibname = cdllibdir + '/' + destlib + '.cdl'
+        if not os.path.isfile(allcdllibname):
+            clist = glob.glob(cdllibdir + '/*.cdl')
+            clist = natural_sort.natural_sort(clist)
+
+    print('Creating magic generation script to generate SPICE library.') 
+    with open(destlibdir + '/generate_magic.tcl', 'w') as ofile:
+        print('#!/usr/bin/env wish', file=ofile)
+        print('#---------------------------------------------', file=ofile)
+        print('# Script to generate SPICE library from GDS   ', file=ofile)
+        print('#---------------------------------------------', file=ofile)
+        print('drc off', file=ofile)
+        print('locking off', file=ofile)
+        print('gds readonly true', file=ofile)
+        print('gds flatten true', file=ofile)
+        print('gds rescale false', file=ofile)
+        print('tech unlock *', file=ofile)
+
+        # Add custom Tcl script lines before "gds read".
+        if tclscript:
+            for line in tcllines:
+                print(line, file=ofile)
+
+        if not os.path.isfile(allgdslibname):
+            for gdsfile in glist:
+                print('gds read ' + gdsfile, file=ofile)
+        else:
+            print('gds read ' + allgdslibname, file=ofile)
+
+        if not os.path.isfile(allleflibname):
+            # Annotate the cells with information from the LEF files
+            for leffile in llist:
+                print('lef read ' + leffile, file=ofile)
+        else:
+            print('lef read ' + allleflibname, file=ofile)
+
+        if have_cdl and no_cdl_convert:
+            if not os.path.isfile(allcdllibname):
+                # Annotate the cells with pin order from the CDL files
+                for cdlfile in clist:
+                    print('catch {readspice ' + cdlfile + '}', file=ofile)
+            else:
+                print('catch {readspice ' + allcdllibname + '}', file=ofile)
+
+        # Load first file and remove the (UNNAMED) cell
+        if not os.path.isfile(allgdslibname):
+            print('load ' + os.path.splitext(glist[0])[0], file=ofile)
+        else:
+            gdslibroot = os.path.split(allgdslibname)[1]
+            print('load ' + os.path.splitext(gdslibroot)[0], file=ofile)
+        print(r'catch {cellname delete \(UNNAMED\)}', file=ofile)
+
+        print('ext2spice lvs', file=ofile)
+
+        # NOTE:  Leaving "subcircuit top" as "auto" (default) can cause
+        # cells like decap that have no I/O to be output without a subcircuit
+        # wrapper.  Also note that if this happens, it is an indication that
+        # power supplies have not been labeled as ports, which is harder to
+        # handle and should be fixed in the source.
+        print('ext2spice subcircuit top on', file=ofile)
+
+        # Use option "dorcx" if parasitics should be extracted.
+        # NOTE:  Currently only does parasitic capacitance extraction.
+        if do_parasitics:
+            print('ext2spice cthresh 0.1', file=ofile)
+
+        if os.path.isfile(allgdslibname):
+            # Do not depend absolutely on the library having a top
+            # level cell, but query for it from inside magic
+            print('if {[cellname list exists ' + allgdslibname + ']} {',
+			file=ofile)
+            print('   select top cell', file=ofile)
+            print('   set glist [cellname list children]', file=ofile)
+            print('} else {', file=ofile)
+            print('   set glist [cellname list top]', file=ofile)
+            print('}', file=ofile)
+        else:
+            print('set glist [cellname list top]', file=ofile)
+
+        print('foreach cell $glist {', file=ofile)
+        print('    load $cell', file=ofile)
+        print('    puts stdout "Extracting cell $cell"', file=ofile)
+        print('    extract all', file=ofile)
+        print('    ext2spice', file=ofile)
+        print('}', file=ofile)
+
+        print('puts stdout "Done."', file=ofile)
+        print('quit -noprompt', file=ofile)
+
+    # Run magic to read in the individual GDS files and
+    # write out the consolidated GDS library
+
+    print('Running magic to create GDS library.')
+    sys.stdout.flush()
+
+    subprocess_run(
+        'magic',
+        ['magic', '-dnull', '-noconsole',
+         destlibdir + '/generate_magic.tcl'],
+        cwd = destlibdir,
+    )
+
+    # Remove intermediate extraction files
+    extfiles = glob.glob(destlibdir + '/*.ext')
+    for extfile in extfiles:
+        os.remove(extfile)
+
+    # If the GDS file was a consolidated file of all cells, then
+    # create a similar SPICE library of all cells.
+
+    if os.path.isfile(allgdslibname):
+        spiext = '.spice'
+        create_spice_library(destlibdir, destlib, spiext, do_compile_only, do_stub, excludelist)
+
+#----------------------------------------------------------------------------
+# Units of the installation recorded in the manifest (see install_manifest.py).
+# The formats from which the layout views are generated, together with the
+# generated views, make up one unit for each library.  Every other format of
+# a library is a unit of its own.
+#----------------------------------------------------------------------------
+
+layout_formats = ['gds', 'lef', 'cdl', 'spice', 'spi', 'verilog']
+
+def install_unit(format):
+    if format in layout_formats:
+        return 'layout'
+    else:
+        return format
+
+#----------------------------------------------------------------------------
+# Return the files read when installing "option" for one library:  the
+# source files matched by the option's path, the header file, and any
+# scripts or paths given as option arguments (filter, sort, options,
+# include, exclude, no-copy).
+#----------------------------------------------------------------------------
+
+def option_sources(option, library, sourcedir):
+    sources = glob.glob(substitute(sourcedir + '/' + option[1], library[1]))
+    for item in option[2:]:
+        if '=' not in item:
+            continue
+        itemname, value = item.split('=', 1)
+        if itemname == 'header':
+            sources.extend(glob.glob(substitute(sourcedir + '/' + value, library[1])))
+            continue
+        for value in value.split(','):
+            sources.extend(glob.glob(value))
+    return sources
+
 #----------------------------------------------------------------------------
 # This is the main entry point for the foundry install script.
 #----------------------------------------------------------------------------
@@ -521,6 +1880,8 @@ if __name__ == '__main__':
     timestamp_value = 0
     do_clean = False
     lef_savelibname = None
+    jobs = 1
+    do_force = False
 
     have_lef = False
     have_techlef = False
@@ -573,6 +1934,23 @@ if __name__ == '__main__':
         elif option[0] == 'clean':
             do_clean = True
 
+        elif option[0] == 'force':
+            optionlist.remove(option)
+            do_force = True
+
+        elif option[0].split('=')[0] == 'jobs':
+            optionlist.remove(option)
+            if '=' in option[0]:
+                jobsvalue = option[0].split('=')[1]
+            elif len(option) > 1:
+                jobsvalue = option[1]
+            else:
+                jobsvalue = ''
+            try:
+                jobs = int(jobsvalue)
+            except ValueError:
+                print('Error: Option "jobs" used with no valid value.')
+
     # Check for options "source" and "target"
     for option in optionlist[:]:
         if option[0] == 'source':
@@ -644,6 +2022,7 @@ if __name__ == '__main__':
     # it has the wrong version.
     have_mag_8_2 = False
     have_mag_8_3_261 = False
+    mag_version = None
     try:
         mproc = subprocess.run(
             ['magic', '--version'],
@@ -860,6 +2239,62 @@ if __name__ == '__main__':
     # The remaining options in optionlist should all be types like 'lef' or 'liberty'
     # and there should be a corresponding library list specified by '-library'
 
+    # Find the units of each library that are up to date according to the
+    # manifest, and do not install them again.  "libdirs" are the library
+    # directories in which files written by this run are recorded.
+
+    manifest = None
+    unitkeys = {}
+    uptodate = []
+    libdirs = []
+
+    if libraries != []:
+        manifest = InstallManifest(targetdir, str(sourcedir) + ' ' + str(libraries))
+        scriptsources = manifest.hash_sources(glob.glob(scriptdir + '/*.py'))
+        magicsources = manifest.hash_sources([targetdir + mag_current])
+
+        for library in libraries:
+            if len(library) == 3:
+                destlib = library[2]
+            else:
+                destlib = library[1]
+            libdirs.append('libs.ref/' + destlib)
+            libdirs.append('libs.priv/' + destlib)
+
+            unitoptions = {}
+            for option in optionlist:
+                unitoptions.setdefault(install_unit(option[0]), []).append(option)
+
+            for unit, options in unitoptions.items():
+                sources = []
+                for option in options:
+                    sources.extend(option_sources(option, library, sourcedir))
+                keyparts = [unit, library, options, manifest.hash_sources(sources),
+			scriptsources, pdkname]
+                if unit == 'layout':
+                    keyparts.extend([magicsources, mag_version,
+				do_timestamp, timestamp_value])
+                unitname = destlib + '/' + unit
+                unitkeys[unitname] = manifest.key(*keyparts)
+                if not do_force and manifest.up_to_date(unitname, unitkeys[unitname]):
+                    print('Library ' + destlib + ' ' + unit + ' files are up to date.')
+                    uptodate.append(unitname)
+
+        before = manifest.snapshot(libdirs)
+
+    # Each library of each option is installed as a separate step.  Steps
+    # are run in parallel if "-jobs" was given;  "dirsteps" holds the last
+    # step writing into each library directory, which the next step
+    # writing into the same directory must wait for.
+
+    scheduler = InstallScheduler(jobs)
+    install_settings = {'sourcedir': sourcedir, 'targetdir': targetdir,
+		'scriptdir': scriptdir, 'mag_current': mag_current,
+		'pdkname': pdkname, 'have_lefanno': have_lefanno,
+		'removelist': removelist}
+    dirsteps = {}
+    installsteps = []
+
     for option in optionlist[:]:
 
         # Ignore if no library list---should have been taken care of above.
@@ -960,347 +2395,30 @@ if __name__ == '__main__':
         else:
             print('Sorting files with script ' + sortscript)
 
-        # For each library, create the library subdirectory
+        settings = dict(install_settings, hier_up=hier_up,
+		filter_scripts=filter_scripts, do_collate=do_collate,
+		do_stub=do_stub, do_compile=do_compile,
+		do_compile_only=do_compile_only, do_remove_spec=do_remove_spec,
+		do_remove=do_remove, excludelist=excludelist,
+		nocopylist=nocopylist, includelist=includelist,
+		headerfile=headerfile, newname=newname, sortscript=sortscript)
+
+        # For each library, install into the library subdirectory.  Steps
+        # that write into the same directory are run in order.
         for library in libraries:
             if len(library) == 3:
                 destlib = library[2]
             else:
                 destlib = library[1]
 
-            destdir = targetdir + '/libs.ref/' + destlib + '/' + option[0]
-            destlibdir = destdir
-
-            os.makedirs(destlibdir, exist_ok=True)
-
-            # Populate the library subdirectory
-            # Parse the option and replace each '/*/' with the library name,
-            # and check if it is a valid directory name.  Then glob the
-            # resulting option name.  Warning:  This assumes that all
-            # occurences of the text '/*/' match a library name.  It should
-            # be possible to wild-card the directory name in such a way that
-            # this is always true.
-
-            testpath = substitute(sourcedir + '/' + option[1], library[1])
-            liblist = glob.glob(testpath)
-            liblist = natural_sort.natural_sort(liblist)
-
-            if do_collate:
-                # Rework liblist so that file parts are put into a list and
-                # associated with the final filename.  Replace the file parts
-                # in liblist with the collated filename.  Assume that the
-                # parts are named with an additional extension such as ".part1"
-                # ".part2" etc., and that these extensions are in natural sort
-                # order.  Note that it is not necessary for all files in the
-                # list to be split into parts.
-
-                # Regular expression catches filename "a.b.c", handling any
-                # leading dots (such as "../") and returns string "a.b"
-                basenamerex = re.compile(r'(\.?\.?[^.]+\..+)\.+')
-                baseliblist = []
-                splitfiles = {}
-                for libfile in liblist:
-                    bmatch = basenamerex.match(libfile)
-                    if bmatch:
-                        basename = bmatch.group(1)
-                        if basename not in baseliblist:
-                            baseliblist.append(basename)
-                            splitfiles[basename] = [libfile]
-                        else:
-                            splitfiles[basename].append(libfile)
-                    else:
-                        baseliblist.append(libfile)   ;# not a split file
-                liblist = baseliblist
-
-            # Create a file "sources.txt" (or append to it if it exists)
-            # and add the source directory name so that the staging install
-            # script can know where the files came from.
-
-            with open(destlibdir + '/sources.txt', 'a') as ofile:
-                print(testpath, file=ofile)
-
-            # Create exclude list with glob-style matching using fnmatch
-            if len(liblist) > 0:
-                liblistnames = list(os.path.split(item)[1] for item in liblist)
-                notliblist = []
-                for exclude in excludelist:
-                    if '/' in exclude:
-                        # Names come from files in a path that is not the source
-                        excludefiles = os.listdir(os.path.split(exclude)[0])
-                        pattern = os.path.split(exclude)[1]
-                        notliblist.extend(fnmatch.filter(excludefiles, pattern))
-                    else:
-                        notliblist.extend(fnmatch.filter(liblistnames, exclude))
-
-                # Apply exclude list
-                if len(notliblist) > 0:
-                    for file in liblist[:]:
-                        if os.path.split(file)[1] in notliblist:
-                            liblist.remove(file)
-
-                if len(excludelist) > 0 and len(notliblist) == 0:
-                    print('Warning:  Nothing from the exclude list found in sources.')
-                    print('excludelist = ' + str(excludelist))
-                    print('destlibdir = ' + destlibdir)
-
-            # Create a list of cell names not to be copied from "nocopylist"
-            nocopynames = []
-            for nocopy in nocopylist:
-                if '/' in nocopy:
-                    # Names come from files in a path that is not the source
-                    nocopyfiles = os.listdir(os.path.split(nocopy)[0])
-                    pattern = os.path.split(nocopy)[1]
-                    nocopynames.extend(fnmatch.filter(nocopyfiles, pattern))
-                else:
-                    nocopynames.extend(fnmatch.filter(liblistnames, nocopy))
-
-            # Diagnostic
-            print('Collecting files from ' + testpath)
-            print('Files to install:')
-            if len(liblist) < 10:
-                for item in liblist:
-                    print('   ' + item)
-            else:
-                for item in liblist[0:4]:
-                    print('   ' + item)
-                print('   .')
-                print('   .')
-                print('   .')
-                for item in liblist[-6:-1]:
-                    print('   ' + item)
-                print('(' + str(len(liblist)) + ' files total)')
-
-            destfilelist = []
-
-            for libname in liblist:
-     
-                # Note that there may be a hierarchy to the files in option[1],
-                # say for liberty timing files under different conditions, so
-                # make sure directories have been created as needed.
-
-                libfile = os.path.split(libname)[1]
-                libfilepath = os.path.split(libname)[0]
-                destpathcomp = []
-                for i in range(hier_up):
-                    destpathcomp.append('/' + os.path.split(libfilepath)[1])
-                    libfilepath = os.path.split(libfilepath)[0]
-                destpathcomp.reverse()
-                destpath = ''.join(destpathcomp)
-
-                dontcopy = True if libfile in nocopynames else False
-
-                if option[0] == 'verilog':
-                    fileext = '.v'
-                elif option[0] == 'liberty' or option[0] == 'lib':
-                    fileext = '.lib'
-                elif option[0] == 'spice' or option[0] == 'spi':
-                    fileext = '.spice'
-                elif option[0] == 'techlef':
-                    fileext = '.lef'
-                else:
-                    fileext = '.' + option[0]
-
-                if newname:
-                    if os.path.splitext(newname)[1] == '':
-                        newname = newname + fileext
-
-                    if len(liblist) == 1:
-                        destfile = newname
-                    elif newname.startswith('*.'):
-                        destfile = os.path.splitext(libfile)[0] + newname[1:]
-                    elif newname.startswith('.'):
-                        destfile = os.path.splitext(libfile)[0] + newname
-                    else:
-                        if not do_compile and not do_compile_only:
-                            print('Error:  rename specified but more than one file found!')
-                        destfile = libfile
-                else:
-                    destfile = libfile
-
-                targname = destlibdir + destpath + '/' + destfile
-
-                # NOTE:  When using "up" with link_from, could just make
-                # destpath itself a symbolic link;  this way is more flexible
-                # but adds one symbolic link per file.
-
-                if destpath != '':
-                    if not os.path.isdir(destlibdir + destpath):
-                        os.makedirs(destlibdir + destpath, exist_ok=True)
-
-                # Remove any existing file
-                if os.path.isfile(targname):
-                    if not dontcopy:
-                        os.remove(targname)
-                elif os.path.isdir(targname):
-                    if not dontcopy:
-                        shutil.rmtree(targname)
-
-                # Stage items for later removal if requested
-                if do_remove:
-                    removelist.append(targname)
-
-                # NOTE:  Diagnostic, probably much too much output.
-                print('   Install:' + libname + ' to ' + targname)
-                if not os.path.isdir(libname):
-                    if not dontcopy:
-                        if do_collate:
-                            if libname not in splitfiles:
-                                shutil.copy(libname, targname)
-                            else:
-                                allparts = splitfiles[libname]
-                                with open(targname, 'wb') as afd:
-                                    for filepart in allparts:
-                                        with open(filepart, 'rb') as fd:
-                                            shutil.copyfileobj(fd, afd)
-                        else:
-                            shutil.copy(libname, targname)
-                else:
-                    if not dontcopy:
-                        shutil.copytree(libname, targname)
-
-                # File filtering options:  Two options 'stub' and 'nospec' are
-                # handled by scripts in ../common/.  Custom filters can also be
-                # specified.
-
-                local_filter_scripts = filter_scripts[:]
-
-                if option[0] == 'verilog':
-                    # Internally handle syntactical issues with verilog and iverilog
-                    vfilter(targname)
-
-                    if do_remove_spec:
-                        local_filter_scripts.append(scriptdir + '/remove_specify.py')
-
-                elif option[0] == 'cdl' or option[0] == 'spi' or option[0] == 'spice':
-                    if do_stub:
-                        local_filter_scripts.append(scriptdir + '/makestub.py')
-
-                for filter_script in local_filter_scripts:
-                    # Apply filter script to all files in the target directory
-                    tfilter(targname, filter_script)
+            if destlib + '/' + install_unit(option[0]) in uptodate:
+                continue
 
-                destfilelist.append(os.path.split(targname)[1])
-
-            # If headerfile is non-null, then copy this file, too.  Do not add
-            # it to "destfilelist", as it is handled separately.  Recast
-            # headerfile as the name of the file without the path.
-
-            if headerfile:
-                headerpath = substitute(sourcedir + '/' + headerfile, library[1])
-                headerlist = glob.glob(headerpath)
-                if len(headerlist) == 1:
-                    libname = headerlist[0]
-                    destfile = os.path.split(libname)[1]
-                    targname = destlibdir + destpath + '/' + destfile
-                    shutil.copy(libname, targname)
-                    headerfile = destfile
-
-            # Add names from "include" list to destfilelist before writing
-            # filelist.txt for library file compiling.
-
-            for incname in includelist:
-                if '/' in incname:
-                    # Names come from files in a path that is not the source
-                    incfiles = os.listdir(os.path.split(incname)[0])
-                    pattern = os.path.split(incname)[1]
-                    destfilelist.extend(fnmatch.filter(incfiles, pattern))
-                else:
-                    destfilelist.extend(fnmatch.filter(liblistnames, incname))
-
-            if sortscript:
-                with open(destlibdir + '/filelist.txt', 'w') as ofile:
-                    for destfile in destfilelist:
-                        print(destfile, file=ofile)
-                if os.path.isfile(sortscript):
-                    print('Diagnostic:  Sorting files with ' + sortscript)
-                    subprocess.run(
-                        [sortscript, destlibdir],
-                        stdout = subprocess.DEVNULL,
-                        stderr = subprocess.DEVNULL,
-                        check = True,
-                    )
-
-            if do_compile == True or do_compile_only == True:
-                # NOTE:  The purpose of "rename" is to put a destlib-named
-                # library elsewhere so that it can be merged with another
-                # library into a compiled <destlib>.<ext> on another pass.
-
-                compname = destlib
-                    
-                # To do:  Make this compatible with linking from another PDK.
-
-                if option[0] == 'verilog':
-                    # If there is not a single file with all verilog cells in it,
-                    # then compile one, because one does not want to have to have
-                    # an include line for every single cell used in a design.
-
-                    create_verilog_library(destlibdir, compname, do_compile_only, do_stub, excludelist)
-
-                elif option[0] == 'gds' and have_mag_8_2:
-                    # If there is not a single file with all GDS cells in it,
-                    # then compile one.
-
-                    # Link to the PDK magic startup file from the target directory
-                    startup_script = targetdir + mag_current + pdkname + '-F.magicrc'
-                    if not os.path.isfile(startup_script):
-                        startup_script = targetdir + mag_current + pdkname + '.magicrc'
-                    create_gds_library(destlibdir, compname, startup_script, do_compile_only, excludelist)
-
-                elif option[0] == 'liberty' or option[0] == 'lib':
-                    # If there is not a single file with all liberty cells in it,
-                    # then compile one, because one does not want to have to have
-                    # an include line for every single cell used in a design.
-
-                    create_lib_library(destlibdir, compname, do_compile_only, excludelist, headerfile)
-
-                elif option[0] == 'spice' or option[0] == 'spi':
-                    # If there is not a single file with all SPICE subcircuits in it,
-                    # then compile one, because one does not want to have to have
-                    # an include line for every single cell used in a design.
-
-                    spiext = '.spice'
-                    create_spice_library(destlibdir, compname, spiext, do_compile_only, do_stub, excludelist)
-
-                elif option[0] == 'cdl':
-                    # If there is not a single file with all CDL subcircuits in it,
-                    # then compile one, because one does not want to have to have
-                    # an include line for every single cell used in a design.
-
-                    create_spice_library(destlibdir, compname, '.cdl', do_compile_only, do_stub, excludelist)
-
-                elif option[0] == 'lef':
-                    # If there is not a single file with all LEF cells in it,
-                    # then compile one, because one does not want to have to have
-                    # an include line for every single cell used in a design.
-
-                    if not have_lefanno:
-                        create_lef_library(destlibdir, compname, do_compile_only, excludelist)
-
-                    if do_compile_only == True:
-                        if newname and targname:
-                            if os.path.isfile(targname):
-                                if have_lefanno:
-                                    # If the original source is a single file
-                                    # but is used for annotation, then save the
-                                    # file name and delete it just before writing
-                                    # the LEF library
-                                    lef_savelibname = targname
-                                else:
-                                    os.remove(targname)
-
-                # "rename" with "compile" or "compile-only":  Change the name
-                # of the compiled file.
-
-                if newname:
-                    print('   Renaming ' + compname + fileext + ' to ' + newname)
-                    origname = destlibdir + '/' + compname + fileext
-                    targrename = destlibdir + destpath + '/' + newname
-                    if os.path.isfile(origname):
-                        os.rename(origname, targrename)
-      
-            # If "filelist.txt" was created, remove it
-            if sortscript:
-                if os.path.isfile(destlibdir + '/filelist.txt'):
-                    os.remove(destlibdir + '/filelist.txt')
+            dirkey = destlib + '/' + option[0]
+            after = [dirsteps[dirkey]] if dirkey in dirsteps else []
+            dirsteps[dirkey] = scheduler.add('install ' + option[0] + ' ' + destlib,
+			install_library_files, option, library, settings, after=after)
+            installsteps.append(dirsteps[dirkey])
 
         # Find any libraries/options marked as "privileged" (or "private") and
         # move the files from libs.tech or libs.ref to libs.priv, leaving a
@@ -1319,28 +2437,18 @@ if __name__ == '__main__':
                 else:
                     destlib = library[1]
 
-                srclibdir = targetdir + '/libs.ref/' + destlib + '/' + option[0]
-                destlibdir = targetdir + '/libs.priv/' + destlib + '/' + option[0]
-
-                if not os.path.exists(destlibdir):
-                    os.makedirs(destlibdir)
-
-                print('Moving files in ' + srclibdir + ' to privileged space.')
-                filelist = os.listdir(srclibdir)
-                for file in filelist:
-                    srcfile = srclibdir + '/' + file
-                    destfile = destlibdir + '/' + file
-                    if os.path.isfile(destfile):
-                        os.remove(destfile)
-                    elif os.path.isdir(destfile):
-                        shutil.rmtree(destfile)
-
-                    if os.path.isfile(srcfile):
-                        shutil.copy(srcfile, destfile)
-                        os.remove(srcfile)
-                    else:
-                        shutil.copytree(srcfile, destfile)
-                        shutil.rmtree(srcfile)
+                if destlib + '/' + install_unit(option[0]) in uptodate:
+                    continue
+
+                dirkey = destlib + '/' + option[0]
+                after = [dirsteps[dirkey]] if dirkey in dirsteps else []
+                dirsteps[dirkey] = scheduler.add('privileged ' + option[0] + ' ' + destlib,
+			move_to_privileged, option, library, targetdir, after=after)
+
+    scheduler.run()
+    for stepname in installsteps:
+        if scheduler.result(stepname):
+            lef_savelibname = scheduler.result(stepname)
 
     print("Completed installation of vendor files.")
 
@@ -1353,6 +2461,7 @@ if __name__ == '__main__':
 
     ignorelist = []
     tclscript = None
+    tcllines = []
     do_cdl_scaleu  = False
     no_cdl_convert = False
     no_gds_convert = False
@@ -1453,6 +2562,7 @@ if __name__ == '__main__':
                     lefopts = item.split('=')[1].strip('"')
  
     devlist = []
+    fixedlist = []
     pdklibrary = None
 
     if tclscript:
@@ -1464,6 +2574,24 @@ if __name__ == '__main__':
         else:
             tcllines = list(tclscript)
 
+    gds_settings = {'targetdir': targetdir, 'gds_reflib': gds_reflib,
+		'cdl_reflib': cdl_reflib, 'lef_reflib': lef_reflib,
+		'mag_current': mag_current, 'pdkname': pdkname,
+		'have_mag_8_2': have_mag_8_2, 'have_mag_8_3_261': have_mag_8_3_261,
+		'do_timestamp': do_timestamp, 'timestamp_value': timestamp_value,
+		'tclscript': tclscript, 'tcllines': tcllines, 'have_lef': have_lef,
+		'have_lefanno': have_lefanno, 'have_cdl': have_cdl,
+		'have_spice': have_spice, 'have_verilog': have_verilog,
+		'gds_exclude': gds_exclude, 'lef_exclude': lef_exclude,
+		'verilog_exclude': verilog_exclude, 'cdl_exclude': cdl_exclude,
+		'spice_exclude': spice_exclude, 'lefopts': lefopts}
+
+    # Steps generating each library's layout and LEF views, by target
+    # library name, which later steps depend on.
+    gdssteps = {}
+    lefsteps = {}
+    annostep = None
+
     if have_gds and not no_gds_convert:
         print("Migrating GDS files to layout.")
 
@@ -1474,19 +2602,6 @@ if __name__ == '__main__':
             else:
                 destlib = library[1]
 
-            destdir = targetdir + gds_reflib + destlib + '/mag'
-            srcdir = targetdir + gds_reflib + destlib + '/gds'
-            vdir = targetdir + '/libs.ref/' + destlib + '/verilog'
-            cdir = targetdir + cdl_reflib + destlib + '/cdl'
-            sdir = targetdir + cdl_reflib + destlib + '/spice'
-            destlibdir = destdir
-            srclibdir = srcdir
-            vlibdir = vdir
-            clibdir = cdir
-            slibdir = sdir
-
-            os.makedirs(destlibdir, exist_ok=True)
-
             # For primitive devices, check the PDK script and find the name
             # of the library and get a list of supported devices.
 
@@ -1518,335 +2633,30 @@ if __name__ == '__main__':
                 # Diagnostic
                 print("PDK library is " + str(pdklibrary))
 
-            # Link to the PDK magic startup file from the target directory
-            # If there is no -F version then look for one without -F (open source PDK)
-            startup_script = targetdir + mag_current + pdkname + '-F.magicrc'
-            if not os.path.isfile(startup_script):
-                startup_script = targetdir + mag_current + pdkname + '.magicrc'
-
-            if have_mag_8_2 and os.path.isfile(startup_script):
-                # If the symbolic link exists, remove it.
-                if os.path.isfile(destlibdir + '/.magicrc'):
-                    os.remove(destlibdir + '/.magicrc')
-                os.symlink(startup_script, destlibdir + '/.magicrc')
- 
-                # Find GDS file names in the source
-                print('Getting GDS file list from ' + srclibdir + '.')
-                gdsfilesraw = os.listdir(srclibdir)
-                gdsfiles = []
-                for gdsfile in gdsfilesraw:
-                    gdsext = os.path.splitext(gdsfile)[1].lower()
-                    if gdsext == '.gds' or gdsext == '.gdsii' or gdsext == '.gds2':
-                        gdsfiles.append(gdsfile)
+            if destlib + '/layout' in uptodate:
+                continue
 
-                # Create exclude list with glob-style matching using fnmatch
-                if len(gdsfiles) > 0:
-                    gdsnames = list(os.path.split(item)[1] for item in gdsfiles)
-                    notgdsnames = []
-                    for exclude in gds_exclude:
-                        notgdsnames.extend(fnmatch.filter(gdsnames, exclude))
+            libsettings = dict(gds_settings, pdklibrary=pdklibrary, fixedlist=fixedlist)
+            gdssteps[destlib] = scheduler.add('gds to mag ' + destlib,
+			migrate_gds_library, library, libsettings)
 
-                    # Apply exclude list
-                    if len(notgdsnames) > 0:
-                        for file in gdsfiles[:]:
-                            if os.path.split(file)[1] in notgdsnames:
-                                gdsfiles.remove(file)
-
-                # Generate a script called "generate_magic.tcl" and leave it in
-                # the target directory.  Use it as input to magic to create the
-                # .mag files from the database.
-
-                print('Creating magic generation script to generate magic database files.') 
-                with open(destlibdir + '/generate_magic.tcl', 'w') as ofile:
-                    print('#!/usr/bin/env wish', file=ofile)
-                    print('#--------------------------------------------', file=ofile)
-                    print('# Script to generate .mag files from .gds    ', file=ofile)
-                    print('#--------------------------------------------', file=ofile)
-                    print('crashbackups stop', file=ofile)
-                    print('drc off', file=ofile)
-                    print('locking off', file=ofile)
-                    if do_timestamp and have_mag_8_3_261:
-                        print('gds datestamp ' + str(timestamp_value), file=ofile)
-                    print('gds readonly true', file=ofile)
-                    print('gds drccheck false', file=ofile)
-                    print('gds flatten true', file=ofile)
-                    print('gds rescale false', file=ofile)
-                    print('tech unlock *', file=ofile)
-
-                    # Add custom Tcl script lines before "gds read".
-                    if tclscript:
-                        for line in tcllines:
-                            print(line, file=ofile)
-
-                    for gdsfile in gdsfiles:
-                        # Note:  DO NOT use a relative path here.
-                        print('gds read ' + srclibdir + '/' + gdsfile, file=ofile)
-
-                    # Make sure properties include the Tcl generated cell
-                    # information from the PDK script
-
-                    if pdklibrary:
-                        tclfixedlist = '{' + ' '.join(fixedlist) + '}'
-                        print('set devlist ' + tclfixedlist, file=ofile)
-                        print('set topcell [lindex [cellname list top] 0]',
-				    file=ofile)
-
-                        print('foreach cellname $devlist {', file=ofile)
-                        print('    load $cellname', file=ofile)
-                        print('    property gencell $cellname', file=ofile)
-                        print('    property parameter m=1', file=ofile)
-                        print('    property library ' + pdklibrary, file=ofile)
-                        print('}', file=ofile)
-                        print('load $topcell', file=ofile)
+        # Set have_lef now that LEF files are made from the layout, so
+        # they can be used to generate the maglef/ databases.
+        startup_script = targetdir + mag_current + pdkname + '-F.magicrc'
+        if not os.path.isfile(startup_script):
+            startup_script = targetdir + mag_current + pdkname + '.magicrc'
+        if libraries != [] and have_mag_8_2 and os.path.isfile(startup_script):
+            have_lef = True
 
-                    else:
-                        # Use LEF files to set the port properties
-                        if have_lefanno or have_lef:
-                            lefdirname = 'lef'
-
-                            # Find LEF file names in the source
-                            lefsrcdir = targetdir + lef_reflib + destlib + '/' + lefdirname
-                            lefsrclibdir = lefsrcdir
-
-                            leffiles = os.listdir(lefsrclibdir)
-                            leffiles = list(item for item in leffiles if os.path.splitext(item)[1] == '.lef')
-                            if len(leffiles) > 0:
-                                lefnames = list(os.path.split(item)[1] for item in leffiles)
-                                notlefnames = []
-                                for exclude in lef_exclude:
-                                    notlefnames.extend(fnmatch.filter(lefnames, exclude))
-
-                                # Apply exclude list
-                                if len(notlefnames) > 0:
-                                    for file in leffiles[:]:
-                                        if os.path.split(file)[1] in notlefnames:
-                                            leffiles.remove(file)
-
-                            if len(leffiles) > 0:
-                                print('puts stdout "Annotating cells from LEF"', file=ofile)
-                            for leffile in leffiles:
-                                print('lef read ' + lefsrclibdir + '/' + leffile, file=ofile)
-                     
-                        # Use CDL or SPICE netlists to set the port order
-                        if have_cdl or have_spice:
-                            if have_cdl:
-                                netdir = clibdir
-                            else:
-                                netdir = slibdir
-
-                            # Find CDL/SPICE file names in the source
-                            # Ignore "sources.txt" if it is in the list.
-                            netfiles = os.listdir(netdir)
-                            print('puts stdout "Annotating cells from CDL/SPICE"',
-					file=ofile)
-                            for netfile in netfiles:
-                                if os.path.split(netfile)[1] != 'sources.txt':
-                                    print('catch {readspice ' + netdir + '/' + netfile
-						+ '}', file=ofile)
-
-                    # print(r'cellname delete \(UNNAMED\)', file=ofile)
-                    print('puts stdout "Writing all magic database files"', file=ofile)
-                    print('writeall force', file=ofile)
-
-                    leffiles = []
-                    lefmacros = []
-                    if have_lefanno:
-                        # Find LEF file names in the source
-                        lefsrcdir = targetdir + lef_reflib + destlib + '/lef'
-                        lefsrclibdir = lefsrcdir
-
-                        leffiles = os.listdir(lefsrclibdir)
-                        leffiles = list(item for item in leffiles if os.path.splitext(item)[1] == '.lef')
-                        # Create exclude list with glob-style matching using fnmatch
-                        if len(leffiles) > 0:
-                            lefnames = list(os.path.split(item)[1] for item in leffiles)
-                            notlefnames = []
-                            for exclude in lef_exclude:
-                                notlefnames.extend(fnmatch.filter(lefnames, exclude))
-
-                            # Apply exclude list
-                            if len(notlefnames) > 0:
-                                for file in leffiles[:]:
-                                    if os.path.split(file)[1] in notlefnames:
-                                        leffiles.remove(file)
-
-                        # Get list of abstract views to make from LEF macros
-                        # (Note:  exclude list can only contain the file being
-                        # read, not individual macro names in the file;  might
-                        # need some additional feature to accommodate this.)
-                        for leffile in leffiles:
-                            with open(lefsrclibdir + '/' + leffile, 'r') as ifile:
-                                ltext = ifile.read()
-                                llines = ltext.splitlines()
-                                for lline in llines:
-                                    ltok = re.split(r' |\t|\(', lline)
-                                    if ltok[0] == 'MACRO':
-                                        lefmacros.append(ltok[1])
-                    elif have_lef:
-                        # Nothing to do;  LEF macros were already installed.
-                        pass
-                    elif have_verilog and os.path.isdir(vlibdir):
-                        # Get list of abstract views to make from verilog modules
-                        # (NOTE:  no way to apply exclude list here!)
-                        vfiles = os.listdir(vlibdir)
-                        vfiles = list(item for item in vfiles if os.path.splitext(item)[1] == '.v')
-                        # Create exclude list with glob-style matching using fnmatch
-                        if len(vfiles) > 0:
-                            vnames = list(os.path.split(item)[1] for item in vfiles)
-                            notvnames = []
-                            for exclude in verilog_exclude:
-                                notvnames.extend(fnmatch.filter(vnames, exclude))
-
-                            # Apply exclude list
-                            if len(notvnames) > 0:
-                                for file in vfiles[:]:
-                                    if os.path.split(file)[1] in notvnames:
-                                        vfiles.remove(file)
-
-                        for vfile in vfiles:
-                            with open(vlibdir + '/' + vfile, 'r') as ifile:
-                                vtext = ifile.read()
-                                vlines = vtext.splitlines()
-                                for vline in vlines:
-                                    vtok = re.split(r' |\t|\(', vline)
-                                    try:
-                                        if vtok[0] == 'module':
-                                            if vtok[1] not in lefmacros:
-                                                lefmacros.append(vtok[1])
-                                    except:
-                                        pass
-
-                    elif have_cdl and os.path.isdir(clibdir):
-                        # Get list of abstract views to make from CDL subcircuits
-                        cfiles = os.listdir(clibdir)
-                        cfiles = list(item for item in cfiles if os.path.splitext(item)[1] == '.cdl')
-                        # Create exclude list with glob-style matching using fnmatch
-                        if len(cfiles) > 0:
-                            cnames = list(os.path.split(item)[1] for item in cfiles)
-                            notcnames = []
-                            for exclude in cdl_exclude:
-                                notcnames.extend(fnmatch.filter(cnames, exclude))
-
-                            # Apply exclude list
-                            if len(notcnames) > 0:
-                                for file in cfiles[:]:
-                                    if os.path.split(file)[1] in notcnames:
-                                        cfiles.remove(file)
-
-                        for cfile in cfiles:
-                            with open(clibdir + '/' + cfile, 'r') as ifile:
-                                ctext = ifile.read()
-                                clines = ctext.splitlines()
-                                for cline in clines:
-                                    ctok = cline.split()
-                                    try:
-                                        if ctok[0].lower() == '.subckt':
-                                            if ctok[1] not in lefmacros:
-                                                lefmacros.append(ctok[1])
-                                    except:
-                                        pass
-
-                    elif have_spice and os.path.isdir(slibdir):
-                        # Get list of abstract views to make from SPICE subcircuits
-                        sfiles = os.listdir(slibdir)
-                        sfiles = list(item for item in sfiles)
-
-                        # Create exclude list with glob-style matching using fnmatch
-                        if len(sfiles) > 0:
-                            snames = list(os.path.split(item)[1] for item in sfiles)
-                            notsnames = []
-                            for exclude in spice_exclude:
-                                notsnames.extend(fnmatch.filter(snames, exclude))
-
-                            # Apply exclude list
-                            if len(notsnames) > 0:
-                                for file in sfiles[:]:
-                                    if os.path.split(file)[1] in notsnames:
-                                        sfiles.remove(file)
-
-                        for sfile in sfiles:
-                            with open(slibdir + '/' + sfile, 'r') as ifile:
-                                stext = ifile.read()
-                                slines = stext.splitlines()
-                                for sline in slines:
-                                    stok = sline.split()
-                                    try:
-                                        if stok[0].lower() == '.subckt':
-                                            if stok[1] not in lefmacros:
-                                                lefmacros.append(stok[1])
-                                    except:
-                                        pass
-
-                    if not lefmacros:
-                        print('No source for abstract views:  Abstract views not made.')
-                    elif have_lefanno or not have_lef:
-                        # This library has a GDS database but no LEF database.  Use
-                        # magic to create abstract views of the GDS cells.  If
-                        # option "annotate" is given, then read the LEF file after
-                        # loading the database file to annotate the cell with
-                        # information from the LEF file.  This usually indicates
-                        # that the LEF file has some weird definition of obstruction
-                        # layers and we want to normalize them by using magic's LEF
-                        # write procedure, but we still need the pin use and class
-                        # information from the LEF file, and maybe the bounding box.
-
-                        # For annotation, the LEF file output will overwrite the
-                        # original source LEF file.
-                        lefdest = lefsrclibdir + '/' if have_lefanno else ''
-
-                        # Delete the original files in case the naming is different
-                        for leffile in leffiles:
-                            print('file delete ' + lefsrclibdir + '/' + leffile, file=ofile)
-
-                        for lefmacro in lefmacros:
-                            print('if {[cellname list exists ' + lefmacro + '] != 0} {', file=ofile)
-                            print('   load ' + lefmacro, file=ofile)
-                            if lefopts:
-                                print('   lef write ' + lefdest + lefmacro + ' ' + lefopts, file=ofile)
-                            else:
-                                print('   lef write ' + lefdest + lefmacro, file=ofile)
-                            print('}', file=ofile)
-
-                    print('puts stdout "Done."', file=ofile)
-                    print('quit -noprompt', file=ofile)
-
-                print('Running magic to create magic database files.')
-                sys.stdout.flush()
-
-                # Run magic to read in the GDS file and write out magic databases.
-                with open(destlibdir + '/generate_magic.tcl', 'r') as ifile:
-                    subprocess_run(
-                        'magic',
-                        ['magic', '-dnull', '-noconsole'],
-                        stdin = ifile,
-                        cwd = destlibdir,
-                    )
-
-                # Set have_lef now that LEF files were made, so they
-                # can be used to generate the maglef/ databases.
-                have_lef = True
-
-            elif not have_mag_8_2:
-                print('The installer is not able to run magic.')
-            else:
-                print("Master PDK magic startup file not found.")
-                print('(' + targetdir + mag_current + pdkname + '.magicrc)')
-                print("Did you install PDK tech files before PDK vendor files?")
-
-    if have_lefanno:
+    if have_lefanno and destlib + '/layout' not in uptodate:
         # LEF files were used for annotation.  If "compile" or "compile-only"
         # was also passed as an option, then build the LEF library now from
         # the LEF output from magic.
-        print("Compiling LEF library from magic output.")
-
-        # If a single vendor library file was used for annotation, remove it now.
-        if lef_savelibname:
-            if os.path.isfile(lef_savelibname):
-                os.remove(lef_savelibname)
-
-        if lef_compile or lef_compile_only:
-            lefsrclibdir = targetdir + lef_reflib + destlib + '/lef'
-            create_lef_library(lefsrclibdir, destlib, lef_compile_only, lef_exclude)
+        anno_settings = {'targetdir': targetdir, 'lef_reflib': lef_reflib,
+		'lef_compile': lef_compile, 'lef_compile_only': lef_compile_only,
+		'lef_exclude': lef_exclude}
+        annostep = scheduler.add('compile lef ' + destlib, compile_annotated_lef,
+		destlib, lef_savelibname, anno_settings, after=list(gdssteps.values()))
 
     if have_lef and not no_lef_convert:
         print("Migrating LEF files to layout.")
@@ -1856,6 +2666,15 @@ if __name__ == '__main__':
         cdldir = targetdir + cdl_reflib + 'cdl'
         os.makedirs(destdir, exist_ok=True)
 
+        lef_settings = {'targetdir': targetdir, 'gds_reflib': gds_reflib,
+		'cdl_reflib': cdl_reflib, 'lef_reflib': lef_reflib,
+		'mag_current': mag_current, 'pdkname': pdkname,
+		'have_mag_8_2': have_mag_8_2, 'have_mag_8_3_261': have_mag_8_3_261,
+		'do_timestamp': do_timestamp, 'timestamp_value': timestamp_value,
+		'pdklibrary': pdklibrary, 'devlist': devlist, 'fixedlist': fixedlist,
+		'have_cdl': have_cdl, 'have_spice': have_spice,
+		'lef_exclude': lef_exclude}
+
         # For each library, create the library subdirectory
         for library in libraries:
             if len(library) == 3:
@@ -1863,296 +2682,17 @@ if __name__ == '__main__':
             else:
                 destlib = library[1]
 
-            destdir = targetdir + '/libs.ref/' + destlib + '/maglef'
-            srcdir = targetdir + lef_reflib + destlib + '/lef'
-            magdir = targetdir + gds_reflib + destlib + '/mag'
-            cdldir = targetdir + cdl_reflib + destlib + '/cdl'
-            cdir = targetdir + cdl_reflib + destlib + '/cdl'
-            sdir = targetdir + cdl_reflib + destlib + '/spice'
-
-            destlibdir = destdir
-            srclibdir = srcdir
-            maglibdir = magdir
-            cdllibdir = cdldir
-            clibdir = cdir
-            slibdir = sdir
-
-            os.makedirs(destlibdir, exist_ok=True)
-
-            # Link to the PDK magic startup file from the target directory
-            startup_script = targetdir + mag_current + pdkname + '-F.magicrc'
-            if not os.path.isfile(startup_script):
-                startup_script = targetdir + mag_current + pdkname + '.magicrc'
-
-            if have_mag_8_2 and os.path.isfile(startup_script):
-                # If the symbolic link exists, remove it.
-                if os.path.isfile(destlibdir + '/.magicrc'):
-                    os.remove(destlibdir + '/.magicrc')
-                os.symlink(startup_script, destlibdir + '/.magicrc')
- 
-                # Find LEF file names in the source
-                leffiles = []
-                if os.path.isdir(srclibdir):
-                    leffiles = os.listdir(srclibdir)
-                    leffiles = list(item for item in leffiles if os.path.splitext(item)[1].lower() == '.lef')
-
-                # Get list of abstract views to make from LEF macros
-                lefmacros = []
-                err_no_macros = False
-                for leffile in leffiles:
-                    with open(srclibdir + '/' + leffile, 'r') as ifile:
-                        ltext = ifile.read()
-                        llines = ltext.splitlines()
-                        for lline in llines:
-                            ltok = re.split(r' |\t|\(', lline)
-                            if ltok[0] == 'MACRO':
-                                lefmacros.append(ltok[1])
-
-                # Create exclude list with glob-style matching using fnmatch
-                if len(lefmacros) > 0:
-                    lefnames = list(os.path.split(item)[1] for item in lefmacros)
-                    notlefnames = []
-                    for exclude in lef_exclude:
-                        notlefnames.extend(fnmatch.filter(lefnames, exclude))
-
-                    # Apply exclude list
-                    if len(notlefnames) > 0:
-                        for file in lefmacros[:]:
-                            if os.path.split(file)[1] in notlefnames:
-                                lefmacros.remove(file)
-
-                if len(leffiles) == 0:
-                    print('Warning:  No LEF files found in ' + srclibdir)
-                    continue
-
-                print('Generating conversion script to create magic databases from LEF')
-
-                # Generate a script called "generate_magic.tcl" and leave it in
-                # the target directory.  Use it as input to magic to create the
-                # .mag files from the database.
+            if destlib + '/layout' in uptodate:
+                continue
 
-                with open(destlibdir + '/generate_magic.tcl', 'w') as ofile:
-                    print('#!/usr/bin/env wish', file=ofile)
-                    print('#--------------------------------------------', file=ofile)
-                    print('# Script to generate .mag files from .lef    ', file=ofile)
-                    print('#--------------------------------------------', file=ofile)
-                    print('tech unlock *', file=ofile)
-
-                    # If there are devices in the LEF file that come from the
-                    # PDK library, then copy this list into the script.
-
-                    if pdklibrary:
-                        shortdevlist = []
-                        for macro in lefmacros:
-                            if macro in devlist:
-                                shortdevlist.append(macro)
-
-                        tcldevlist = '{' + ' '.join(shortdevlist) + '}'
-                        print('set devlist ' + tcldevlist, file=ofile)
-
-                    # Force the abstract view timestamps to match the full views
-                    if do_timestamp and have_mag_8_3_261:
-                        print('lef datestamp ' + str(timestamp_value), file=ofile)
-
-                    for leffile in leffiles:
-                        print('lef read ' + srclibdir + '/' + leffile, file=ofile)
-
-                    # Use CDL or SPICE netlists to make sure that ports are
-                    # present, and to set the port order
-
-                    if have_cdl or have_spice:
-                        if have_cdl:
-                            netdir = clibdir
-                        else:
-                            netdir = slibdir
-
-                        # Find CDL/SPICE file names in the source
-                        # Ignore "sources.txt" if it is in the list.
-                        netfiles = os.listdir(netdir)
-                        print('puts stdout "Annotating cells from CDL/SPICE"',
-				file=ofile)
-                        for netfile in netfiles:
-                            if os.path.split(netfile)[1] != 'sources.txt':
-                                print('catch {readspice ' + netdir + '/' + netfile
-					+ '}', file=ofile)
-
-                    for lefmacro in lefmacros:
-
-                        if pdklibrary and lefmacro in shortdevlist:
-                            print('set cellname ' + lefmacro, file=ofile)
-                            print('if {[lsearch $devlist $cellname] >= 0} {',
-					file=ofile)
-                            print('    load $cellname', file=ofile)
-                            print('    property gencell $cellname', file=ofile)
-                            print('    property parameter m=1', file=ofile)
-                            print('    property library ' + pdklibrary, file=ofile)
-                            print('}', file=ofile)
-
-                    # Load one of the LEF files so that the default (UNNAMED) cell
-                    # is not loaded, then delete (UNNAMED) so it doesn't generate
-                    # an error message.
-                    if len(lefmacros) > 0:
-                        print('load ' + lefmacros[0], file=ofile)
-                        # print(r'cellname delete \(UNNAMED\)', file=ofile)
-                    else:
-                        err_no_macros = True
-                    print('writeall force', file=ofile)
-                    print('puts stdout "Done."', file=ofile)
-                    print('quit -noprompt', file=ofile)
-
-                if err_no_macros == True:
-                    print('Warning:  No LEF macros were defined.')
-
-                print('Running magic to create magic databases from LEF')
-                sys.stdout.flush()
-
-                # Run magic to read in the LEF file and write out magic databases.
-                with open(destlibdir + '/generate_magic.tcl', 'r') as ifile:
-                    subprocess_run(
-                        'magic',
-                        ['magic', '-dnull', '-noconsole'],
-                        stdin = ifile,
-                        cwd = destlibdir,
-                    )
-
-                # Now list all the .mag files generated, and for each, read the
-                # corresponding file from the mag/ directory, pull the GDS file
-                # properties, and add those properties to the maglef view.  Also
-                # read the CDL (or SPICE) netlist, read the ports, and rewrite
-                # the port order in the mag and maglef file accordingly.
-
-                # Diagnostic
-                print('Annotating files in ' + destlibdir)
-                sys.stdout.flush()
-                magfiles = os.listdir(destlibdir)
-                magfiles = list(item for item in magfiles if os.path.splitext(item)[1] == '.mag')
-                for magroot in magfiles:
-                    magname = os.path.splitext(magroot)[0]
-                    magfile = maglibdir + '/' + magroot
-                    magleffile = destlibdir + '/' + magroot
-                    prop_lines = get_gds_properties(magfile)
-
-                    # Make sure properties include the Tcl generated cell
-                    # information from the PDK script
-
-                    prop_gencell = []
-                    if pdklibrary:
-                        if magname in fixedlist:
-                            prop_gencell.append('gencell ' + magname)
-                            prop_gencell.append('library ' + pdklibrary)
-                            prop_gencell.append('parameter m=1')
-
-                    nprops = len(prop_lines) + len(prop_gencell)
-
-                    cdlfile = cdllibdir + '/' + magname + '.cdl'
-                    if os.path.exists(cdlfile):
-                        cdlfiles = [cdlfile]
-                    else:
-                        # Assume there is at least one file with all cell subcircuits
-                        # in it.
-                        try:
-                            cdlfiles = glob.glob(cdllibdir + '/*.cdl')
-                            cdlfiles = natural_sort.natural_sort(cdlfiles)
-                        except:
-                            pass
-                    if len(cdlfiles) > 0:
-                        for cdlfile in cdlfiles:
-                            port_dict = get_subckt_ports(cdlfile, magname)
-                            if port_dict != {}:
-                                break
-                    else:
-                        port_dict = {}
-
-                    if port_dict == {}:
-                        print('No CDL file contains ' + destlib + ' device ' + magname)
-                        cdlfile = None
-                        # To be done:  If destlib is 'primitive', then look in
-                        # SPICE models for port order.
-                        if destlib == 'primitive':
-                            print('Fix me:  Need to look in SPICE models!')
-
-                    proprex = re.compile('<< properties >>')
-                    endrex = re.compile('<< end >>')
-                    rlabrex = re.compile(r'rlabel[ \t]+[^ \t]+[ \t]+[^ \t]+[ \t]+[^ \t]+[ \t]+[^ \t]+[ \t]+[^ \t]+[ \t]+[^ \t]+[ \t]+([^ \t]+)')
-                    flabrex = re.compile(r'flabel[ \t]+.*[ \t]+([^ \t]+)[ \t]*')
-                    portrex = re.compile(r'port[ \t]+([^ \t]+)[ \t]+(.*)')
-                    gcellrex = re.compile('string gencell')
-                    portnum = -1
-
-                    with open(magleffile, 'r') as ifile:
-                        magtext = ifile.read().splitlines()
-
-                    with open(magleffile, 'w') as ofile:
-                        has_props = False
-                        is_gencell = False
-                        for line in magtext:
-                            tmatch = portrex.match(line)
-                            if tmatch:
-                                if portnum >= 0:
-                                    line = 'port ' + str(portnum) + ' ' + tmatch.group(2)
-                                else:
-                                    line = 'port ' + tmatch.group(1) + ' ' + tmatch.group(2)
-                            ematch = endrex.match(line)
-                            if ematch and nprops > 0:
-                                if not has_props:
-                                    print('<< properties >>', file=ofile)
-                                if not is_gencell:
-                                    for prop in prop_gencell:
-                                        print('string ' + prop, file=ofile)
-                                for prop in prop_lines:
-                                    print('string ' + prop, file=ofile)
-
-                            print(line, file=ofile)
-                            pmatch = proprex.match(line)
-                            if pmatch:
-                                has_props = True
-
-                            gmatch = gcellrex.match(line)
-                            if gmatch:
-                                is_gencell = True
-
-                            lmatch = flabrex.match(line)
-                            if not lmatch:
-                                lmatch = rlabrex.match(line)
-                            if lmatch:
-                                labname = lmatch.group(1).lower()
-                                try:
-                                    portnum = port_dict[labname]
-                                except:
-                                    portnum = -1
-
-                    if os.path.exists(magfile):
-                        with open(magfile, 'r') as ifile:
-                            magtext = ifile.read().splitlines()
-
-                        with open(magfile, 'w') as ofile:
-                            for line in magtext:
-                                tmatch = portrex.match(line)
-                                if tmatch:
-                                    if portnum >= 0:
-                                        line = 'port ' + str(portnum) + ' ' + tmatch.group(2)
-                                    else:
-                                        line = 'port ' + tmatch.group(1) + ' ' + tmatch.group(2)
-                                ematch = endrex.match(line)
-                                print(line, file=ofile)
-                                lmatch = flabrex.match(line)
-                                if not lmatch:
-                                    lmatch = rlabrex.match(line)
-                                if lmatch:
-                                    labname = lmatch.group(1).lower()
-                                    try:
-                                        portnum = port_dict[labname]
-                                    except:
-                                        portnum = -1
-                    elif os.path.splitext(magfile)[1] == '.mag':
-                        # NOTE:  Possibly this means the GDS cell has a different name.
-                        print('Error: No file ' + magfile + '.  Why is it in maglef???')
-
-            elif not have_mag_8_2:
-                print('The installer is not able to run magic.')
-            else:
-                print("Master PDK magic startup file not found.  Did you install")
-                print("PDK tech files before PDK vendor files?")
+            # The abstract views are annotated from the full views.
+            after = []
+            if destlib in gdssteps:
+                after.append(gdssteps[destlib])
+            if annostep:
+                after.append(annostep)
+            lefsteps[destlib] = scheduler.add('lef to maglef ' + destlib,
+			migrate_lef_library, library, lef_settings, after=after)
 
     # If SPICE or CDL databases were specified, then convert them to
     # a form that can be used by ngspice, using the cdl2spi.py script 
@@ -2172,6 +2712,9 @@ if __name__ == '__main__':
             else:
                 destlib = library[1]
 
+            if destlib + '/layout' in uptodate:
+                continue
+
             destdir = targetdir + cdl_reflib + destlib + '/spice'
             srcdir = targetdir + cdl_reflib + destlib + '/cdl'
 
@@ -2189,24 +2732,26 @@ if __name__ == '__main__':
                 else:
                     cdlfiles = [alllibname]
 
-            if not cdl_compile_only:
-                cdlfiles = os.listdir(srclibdir)
-                cdlfiles = list(item for item in cdlfiles if os.path.splitext(item)[1].lower() == '.cdl')
-
             # The directory with scripts should be in ../common with respect
             # to the Makefile that determines the cwd.
 
-            # Run cdl2spi.py script to read in the CDL file and write out SPICE
-            for cdlfile in cdlfiles:
-                spiname = os.path.splitext(cdlfile)[0] + '.spice'
-                procopts = [scriptdir + '/cdl2spi.py', srclibdir + '/' + cdlfile, destlibdir + '/' + spiname]
-                if do_cdl_scaleu:
-                    procopts.append('-dscale=u')
-                for item in ignorelist:
-                    procopts.append('-ignore=' + item)
+            # Run cdl2spi.py script to read in the CDL file and write out SPICE.
+            # Other than the compiled library alone, all of the CDL files are
+            # converted by one run of cdl2spi.py on the source directory.  The
+            # scheduler already runs up to "jobs" steps at once, so cdl2spi.py
+            # is run with one job, and "-jobs" remains the number of processes
+            # overall.
+            if cdl_compile_only:
+                spiname = os.path.splitext(cdlfiles[0])[0] + '.spice'
+                procopts = [scriptdir + '/cdl2spi.py', srclibdir + '/' + cdlfiles[0], destlibdir + '/' + spiname]
+            else:
+                procopts = [scriptdir + '/cdl2spi.py', srclibdir, destlibdir, '-jobs=1']
+            if do_cdl_scaleu:
+                procopts.append('-dscale=u')
+            for item in ignorelist:
+                procopts.append('-ignore=' + item)
 
-                print('Running (in ' + destlibdir + '): ' + ' '.join(procopts))
-                subprocess_run('cdl2spi.py', procopts, cwd = destlibdir)
+            scheduler.add('cdl2spi ' + destlib, run_cdl2spi, procopts, destlibdir)
 
     elif have_gds and not no_gds_convert and not no_extract:
         # If neither SPICE nor CDL formats is available in the source, then
@@ -2223,160 +2768,30 @@ if __name__ == '__main__':
             else:
                 destlib = library[1]
 
-            destdir = targetdir + cdl_reflib + destlib + '/spice'
-            srcdir = targetdir + gds_reflib + destlib + '/gds'
-            lefdir = targetdir + lef_reflib + destlib + '/lef'
-            cdldir = targetdir + cdl_reflib + destlib + '/cdl'
-
-            destlibdir = destdir
-            srclibdir = srcdir
-            leflibdir = lefdir
-            cdllibdir = cdldir
-
-            os.makedirs(destlibdir, exist_ok=True)
-
-            # Link to the PDK magic startup file from the target directory
-            startup_script = targetdir + mag_current + pdkname + '-F.magicrc'
-            if not os.path.isfile(startup_script):
-                startup_script = targetdir + mag_current + pdkname + '.magicrc'
-            if os.path.isfile(startup_script):
-                # If the symbolic link exists, remove it.
-                if os.path.isfile(destlibdir + '/.magicrc'):
-                    os.remove(destlibdir + '/.magicrc')
-                os.symlink(startup_script, destlibdir + '/.magicrc')
-
-            # Get the consolidated GDS library file, or a list of all GDS files
-            # if there is no single consolidated library
-
-            allgdslibname = srclibdir + '/' + destlib + '.gds'
-            if not os.path.isfile(allgdslibname):
-                glist = glob.glob(srclibdir + '/*.gds')
-                glist.extend(glob.glob(srclibdir + '/*.gdsii'))
-                glist.extend(glob.glob(srclibdir + '/*.gds2'))
-                glist = natural_sort.natural_sort(glist)
-
-            allleflibname = leflibdir + '/' + destlib + '.lef'
-            if not os.path.isfile(allleflibname):
-                llist = glob.glob(leflibdir + '/*.lef')
-                llist = natural_sort.natural_sort(llist)
-
-            if have_cdl and no_cdl_convert:
-                # CDL is not being converted directly to SPICE but it exists,
-                # and being the only source of pin order, it should be used
-                # for pin order annotation.
-                allcdllibname = cdllibdir + '/' + destlib + '.cdl'
-                if not os.path.isfile(allcdllibname):
-                    clist = glob.glob(cdllibdir + '/*.cdl')
-                    clist = natural_sort.natural_sort(clist)
-
-            print('Creating magic generation script to generate SPICE library.') 
-            with open(destlibdir + '/generate_magic.tcl', 'w') as ofile:
-                print('#!/usr/bin/env wish', file=ofile)
-                print('#---------------------------------------------', file=ofile)
-                print('# Script to generate SPICE library from GDS   ', file=ofile)
-                print('#---------------------------------------------', file=ofile)
-                print('drc off', file=ofile)
-                print('locking off', file=ofile)
-                print('gds readonly true', file=ofile)
-                print('gds flatten true', file=ofile)
-                print('gds rescale false', file=ofile)
-                print('tech unlock *', file=ofile)
-
-                # Add custom Tcl script lines before "gds read".
-                if tclscript:
-                    for line in tcllines:
-                        print(line, file=ofile)
-
-                if not os.path.isfile(allgdslibname):
-                    for gdsfile in glist:
-                        print('gds read ' + gdsfile, file=ofile)
-                else:
-                    print('gds read ' + allgdslibname, file=ofile)
-
-                if not os.path.isfile(allleflibname):
-                    # Annotate the cells with information from the LEF files
-                    for leffile in llist:
-                        print('lef read ' + leffile, file=ofile)
-                else:
-                    print('lef read ' + allleflibname, file=ofile)
-
-                if have_cdl and no_cdl_convert:
-                    if not os.path.isfile(allcdllibname):
-                        # Annotate the cells with pin order from the CDL files
-                        for cdlfile in clist:
-                            print('catch {readspice ' + cdlfile + '}', file=ofile)
-                    else:
-                        print('catch {readspice ' + allcdllibname + '}', file=ofile)
-
-                # Load first file and remove the (UNNAMED) cell
-                if not os.path.isfile(allgdslibname):
-                    print('load ' + os.path.splitext(glist[0])[0], file=ofile)
-                else:
-                    gdslibroot = os.path.split(allgdslibname)[1]
-                    print('load ' + os.path.splitext(gdslibroot)[0], file=ofile)
-                print(r'catch {cellname delete \(UNNAMED\)}', file=ofile)
-
-                print('ext2spice lvs', file=ofile)
-
-                # NOTE:  Leaving "subcircuit top" as "auto" (default) can cause
-                # cells like decap that have no I/O to be output without a subcircuit
-                # wrapper.  Also note that if this happens, it is an indication that
-                # power supplies have not been labeled as ports, which is harder to
-                # handle and should be fixed in the source.
-                print('ext2spice subcircuit top on', file=ofile)
-
-                # Use option "dorcx" if parasitics should be extracted.
-                # NOTE:  Currently only does parasitic capacitance extraction.
-                if do_parasitics:
-                    print('ext2spice cthresh 0.1', file=ofile)
-
-                if os.path.isfile(allgdslibname):
-                    # Do not depend absolutely on the library having a top
-                    # level cell, but query for it from inside magic
-                    print('if {[cellname list exists ' + allgdslibname + ']} {',
-				file=ofile)
-                    print('   select top cell', file=ofile)
-                    print('   set glist [cellname list children]', file=ofile)
-                    print('} else {', file=ofile)
-                    print('   set glist [cellname list top]', file=ofile)
-                    print('}', file=ofile)
-                else:
-                    print('set glist [cellname list top]', file=ofile)
-
-                print('foreach cell $glist {', file=ofile)
-                print('    load $cell', file=ofile)
-                print('    puts stdout "Extracting cell $cell"', file=ofile)
-                print('    extract all', file=ofile)
-                print('    ext2spice', file=ofile)
-                print('}', file=ofile)
-
-                print('puts stdout "Done."', file=ofile)
-                print('quit -noprompt', file=ofile)
-
-            # Run magic to read in the individual GDS files and
-            # write out the consolidated GDS library
-
-            print('Running magic to create GDS library.')
-            sys.stdout.flush()
-
-            subprocess_run(
-                'magic',
-                ['magic', '-dnull', '-noconsole',
-                 destlibdir + '/generate_magic.tcl'],
-                cwd = destlibdir,
-            )
-
-            # Remove intermediate extraction files
-            extfiles = glob.glob(destlibdir + '/*.ext')
-            for extfile in extfiles:
-                os.remove(extfile)
-
-            # If the GDS file was a consolidated file of all cells, then
-            # create a similar SPICE library of all cells.
-
-            if os.path.isfile(allgdslibname):
-                spiext = '.spice'
-                create_spice_library(destlibdir, destlib, spiext, do_compile_only, do_stub, excludelist)
+            if destlib + '/layout' in uptodate:
+                continue
+
+            extract_settings = {'targetdir': targetdir, 'gds_reflib': gds_reflib,
+			'cdl_reflib': cdl_reflib, 'lef_reflib': lef_reflib,
+			'mag_current': mag_current, 'pdkname': pdkname,
+			'tclscript': tclscript, 'tcllines': tcllines,
+			'have_cdl': have_cdl, 'no_cdl_convert': no_cdl_convert,
+			'do_parasitics': do_parasitics,
+			'do_compile_only': do_compile_only, 'do_stub': do_stub,
+			'excludelist': excludelist}
+
+            # Extraction reads the LEF files generated from the layout.
+            after = []
+            if destlib in gdssteps:
+                after.append(gdssteps[destlib])
+            if destlib in lefsteps:
+                after.append(lefsteps[destlib])
+            if annostep:
+                after.append(annostep)
+            scheduler.add('extract spice ' + destlib, extract_gds_library,
+			library, extract_settings, after=after)
+
+    scheduler.run()
 
     # Remove any files/directories that were marked for removal
     for targname in removelist:
@@ -2385,4 +2800,22 @@ if __name__ == '__main__':
         elif os.path.isdir(targname):
             shutil.rmtree(targname)
 
+    # Record the files written by each unit that was installed, by the
+    # library subdirectory they were written to.
+    if manifest:
+        written = {}
+        for relpath, state in manifest.snapshot(libdirs).items():
+            if before.get(relpath) == state:
+                continue
+            pathparts = relpath.split('/')
+            unitname = pathparts[1] + '/' + install_unit(pathparts[2])
+            if unitname not in unitkeys:
+                unitname = pathparts[1] + '/layout'
+            written.setdefault(unitname, []).append(relpath)
+        for unitname, key in unitkeys.items():
+            if unitname not in uptodate:
+                manifest.record(unitname, key, written.get(unitname, []))
+        manifest.save()
+
+    scheduler.report()
     sys.exit(0)
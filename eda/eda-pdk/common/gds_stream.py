@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+gds_stream.py
+Record-level access to GDSII stream files for the GDS tools
+(change_gds_date.py, change_gds_string.py, and change_gds_cell.py in
+runtime/, and get_gds_date.py in common/, which has its own copy of this
+file).
+
+The input file is memory-mapped and its records are walked in place, so
+reading a file never loads it into memory.  Edits are written in a single
+pass:  runs of unchanged records are copied straight from the mapped input
+to the output, and only the records being replaced are constructed in
+memory.  Time is linear in the size of the file and memory use is constant.
+"""
+
+import os
+import mmap
+import struct
+import tempfile
+import contextlib
+
+# Record types (byte 3 of the record header)
+HEADER = 0
+BGNLIB = 1
+LIBNAME = 2
+UNITS = 3
+ENDLIB = 4
+BGNSTR = 5
+STRNAME = 6
+ENDSTR = 7
+SNAME = 18
+STRING = 25
+
+# Data types (byte 4 of the record header)
+NODATA = 0
+BITARRAY = 1
+INT2 = 2
+INT4 = 3
+REAL4 = 4
+REAL8 = 5
+ASCII = 6
+
+# Unchanged data is copied to the output in blocks of this size
+COPY_BLOCK = 1 << 24
+
+header = struct.Struct('>HBB')
+
+@contextlib.contextmanager
+def open_gds(path):
+    """
+    Memory-map the GDS file "path" for reading.  Yields an object that can
+    be indexed and sliced like bytes (an empty bytes object for an empty file).
+    """
+    with open(path, 'rb') as ifile:
+        if os.fstat(ifile.fileno()).st_size == 0:
+            yield b''
+            return
+        data = mmap.mmap(ifile.fileno(), 0, access=mmap.ACCESS_READ)
+        # Records are read front to back
+        if hasattr(data, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+            data.madvise(mmap.MADV_SEQUENTIAL)
+        try:
+            yield data
+        finally:
+            data.close()
+
+def records(data, start=0, end=None):
+    """
+    Iterate over the records of GDS data "data" from offset "start" up to
+    "end", yielding (offset, reclen, rectype, datatype) for each record.
+    Stops with an error message at a zero-length record.
+    """
+    if end is None:
+        end = len(data)
+    dataptr = start
+    unpack = header.unpack_from
+    while dataptr + 4 <= end:
+        reclen, rectype, datatype = unpack(data, dataptr)
+        if reclen == 0:
+            print('Error: found zero-length record at position ' + str(dataptr))
+            return
+        yield dataptr, reclen, rectype, datatype
+        dataptr += reclen
+
+def record_string(data, offset, reclen):
+    """Return the string data of a record, without any null padding byte."""
+    bstring = data[offset + 4:offset + reclen]
+    if bstring and bstring[-1] == 0:
+        bstring = bstring[:-1]
+    return bstring
+
+def make_record(rectype, datatype, payload):
+    """Return a complete record with header for the given data."""
+    return header.pack(len(payload) + 4, rectype, datatype) + payload
+
+def copy_data(data, start, end, ofile):
+    """Write data[start:end] to "ofile" without copying it all into memory."""
+    with memoryview(data) as view:
+        while start < end:
+            stop = min(end, start + COPY_BLOCK)
+            ofile.write(view[start:stop])
+            start = stop
+
+@contextlib.contextmanager
+def output_file(dest):
+    """
+    Open "dest" for writing through a temporary file in the same directory,
+    which replaces "dest" only when writing has completed.  The destination
+    may be the file being read.
+    """
+    destdir = os.path.split(os.path.abspath(dest))[0]
+    fd, tmpname = tempfile.mkstemp(dir=destdir, suffix='.gds.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as ofile:
+            yield ofile
+        if os.path.exists(dest):
+            os.chmod(tmpname, os.stat(dest).st_mode & 0o7777)
+        else:
+            os.chmod(tmpname, 0o666 & ~current_umask())
+        os.replace(tmpname, dest)
+    except BaseException:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+        raise
+
+def current_umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+def rewrite(source, dest, edit, rectypes=None):
+    """
+    Copy GDS file "source" to "dest" in one pass, replacing records.  For
+    each record (only those whose type is in "rectypes", if given),
+    edit(data, offset, reclen, rectype, datatype) is called and returns
+    either None to keep the record or the bytes of its replacement.  Data
+    following a zero-length record is copied unchanged.  "dest" may be
+    the same file as "source".
+    """
+    with open_gds(source) as data, output_file(dest) as ofile:
+        copyptr = 0
+        for offset, reclen, rectype, datatype in records(data):
+            if rectypes is not None and rectype not in rectypes:
+                continue
+            newrecord = edit(data, offset, reclen, rectype, datatype)
+            if newrecord is None:
+                continue
+            copy_data(data, copyptr, offset, ofile)
+            ofile.write(newrecord)
+            copyptr = offset + reclen
+        copy_data(data, copyptr, len(data), ofile)
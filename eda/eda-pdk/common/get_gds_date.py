@@ -4,6 +4,7 @@
 import os
 import sys
 import datetime
+import gds_stream
 
 def usage():
     print('get_gds_date.py <path_to_gds_in> [-created | -modified]')
@@ -45,26 +46,12 @@ if __name__ == '__main__':
     sourcedir = os.path.split(source)[0]
     gdsinfile = os.path.split(source)[1]
 
-    with open(source, 'rb') as ifile:
-        gdsdata = ifile.read()
-
-    datalen = len(gdsdata)
-    dataptr = 0
-    while dataptr < datalen:
-        # Read stream records up to any string, then search for search text.
-        bheader = gdsdata[dataptr:dataptr + 2]
-        reclen = int.from_bytes(bheader, 'big')
-        if reclen == 0:
-            print('Error: found zero-length record at position ' + str(dataptr))
-            break
-
-        rectype = gdsdata[dataptr + 2]
-        datatype = gdsdata[dataptr + 3]
+    # Only the records up to the library header are read from the file
+    with gds_stream.open_gds(source) as gdsdata:
+        for dataptr, reclen, rectype, datatype in gds_stream.records(gdsdata):
+            if rectype != gds_stream.BGNLIB:
+                continue
 
-        brectype = rectype.to_bytes(1, byteorder='big')
-        bdatatype = datatype.to_bytes(1, byteorder='big')
-
-        if rectype == 1:		# 1 = beginlib
             # Datatype should be 2
             if datatype != 2:
                 print('Error:  Header data type is not 2-byte integer!')
@@ -110,7 +97,4 @@ if __name__ == '__main__':
                 print('Modified date: {}-{}-{}-{}-{}-{}'.format(year, month, day, hour, minute, second))
             break
 
-        # Advance the pointer past the data
-        dataptr += reclen
-
     exit(0)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+#
+# install_manifest.py
+#
+#----------------------------------------------------------------------------
+# Record of what foundry_install.py has installed into a staging area, so
+# that running it again can skip the parts of the installation whose
+# inputs have not changed.
+#
+# The installation of each library is divided into units (see
+# foundry_install.py), each of which is either done completely or not at
+# all.  For each unit the manifest holds a key, which is a hash of the
+# options that produced it and of the contents of every source file and
+# script it was made from, the files that it wrote into the staging area,
+# and the time it was made.  A unit is up to date if its key has not
+# changed, all of the files it wrote still exist, and no unit installed by
+# an earlier run of foundry_install.py into the same directories has been
+# made again since.  (The Makefile installs some libraries in several
+# runs, for example custom additions followed by the vendor files, and
+# the later runs compile or convert all the files in the directory.)
+#
+# Each run of foundry_install.py, identified by its source directory and
+# library list, keeps its own manifest file in the directory
+# ".install_manifest" of the staging area, so that runs do not need to
+# lock anything.  The order of the runs is the order in which each was
+# first made.  Removing the staging area with "-clean" removes the
+# manifest along with it.
+#----------------------------------------------------------------------------
+
+import os
+import json
+import time
+import hashlib
+
+manifest_dirname = '.install_manifest'
+
+#----------------------------------------------------------------------------
+
+class InstallManifest(object):
+    def __init__(self, targetdir, invocation):
+        self.targetdir = targetdir
+        self.dirpath = targetdir + '/' + manifest_dirname
+        ident = hashlib.sha1(invocation.encode('utf-8')).hexdigest()[0:16]
+        self.filename = self.dirpath + '/' + ident + '.json'
+        self.started = time.time()
+        self.created = self.started
+        self.units = {}
+        self.oldhashes = {}
+        self.hashes = {}
+
+        manifest = self.read(self.filename)
+        if manifest:
+            self.created = manifest['created']
+            self.units = manifest['units']
+            self.oldhashes = manifest['hashes']
+
+        # Units installed into the staging area by earlier runs
+        self.earlier = []
+        if os.path.isdir(self.dirpath):
+            for filename in sorted(os.listdir(self.dirpath)):
+                filepath = self.dirpath + '/' + filename
+                if filepath == self.filename or not filename.endswith('.json'):
+                    continue
+                other = self.read(filepath)
+                if other and other['created'] < self.created:
+                    self.earlier.extend(other['units'].values())
+
+    def read(self, filepath):
+        try:
+            with open(filepath, 'r') as ifile:
+                manifest = json.load(ifile)
+            manifest['created'], manifest['units'], manifest['hashes']
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        return manifest
+
+    def save(self):
+        """Write the manifest into the staging area."""
+        os.makedirs(self.dirpath, exist_ok=True)
+        tmpfile = self.filename + '.tmp'
+        with open(tmpfile, 'w') as ofile:
+            json.dump({'created': self.created, 'units': self.units,
+			'hashes': self.hashes}, ofile, indent=1, sort_keys=True)
+        os.replace(tmpfile, self.filename)
+
+    # Return the SHA-256 hash of the contents of "filepath".  Hashes are
+    # remembered by size and modification time, so that a file is only read
+    # again after it has changed.
+
+    def hash_file(self, filepath):
+        filepath = os.path.abspath(filepath)
+        statbuf = os.stat(filepath)
+        stamp = [statbuf.st_size, statbuf.st_mtime_ns]
+        known = self.hashes.get(filepath) or self.oldhashes.get(filepath)
+        if known and known[0:2] == stamp:
+            self.hashes[filepath] = known
+            return known[2]
+        hasher = hashlib.sha256()
+        with open(filepath, 'rb') as ifile:
+            for block in iter(lambda: ifile.read(1 << 20), b''):
+                hasher.update(block)
+        self.hashes[filepath] = stamp + [hasher.hexdigest()]
+        return hasher.hexdigest()
+
+    def hash_sources(self, sources):
+        """
+        Return a list of [path, hash] for every file in "sources", which may
+        name files or directories (whose files are all included).  Paths that
+        do not exist are listed with a hash of None.
+        """
+        hashlist = []
+        for source in sorted(set(sources)):
+            if os.path.isdir(source):
+                for dirpath, dirnames, filenames in os.walk(source):
+                    dirnames.sort()
+                    for filename in sorted(filenames):
+                        filepath = os.path.join(dirpath, filename)
+                        if os.path.isfile(filepath):
+                            hashlist.append([filepath, self.hash_file(filepath)])
+            elif os.path.isfile(source):
+                hashlist.append([source, self.hash_file(source)])
+            else:
+                hashlist.append([source, None])
+        return hashlist
+
+    def key(self, *parts):
+        """Return the key of a unit made from "parts" (any JSON data)."""
+        text = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def snapshot(self, dirs):
+        """
+        Return the size and modification time of every file under the
+        directories "dirs" (relative to the staging area), by path.
+        """
+        state = {}
+        for topdir in dirs:
+            for dirpath, dirnames, filenames in os.walk(self.targetdir + '/' + topdir):
+                # Symbolic links (e.g., to libs.priv/) are recorded but not followed
+                for name in filenames + dirnames:
+                    filepath = os.path.join(dirpath, name)
+                    if name in dirnames and not os.path.islink(filepath):
+                        continue
+                    try:
+                        statbuf = os.lstat(filepath)
+                    except OSError:
+                        continue
+                    relpath = os.path.relpath(filepath, self.targetdir)
+                    state[relpath] = (statbuf.st_size, statbuf.st_mtime_ns)
+        return state
+
+    def up_to_date(self, name, key):
+        """Return True if unit "name" was last made with the same key and is intact."""
+        entry = self.units.get(name)
+        if not entry or entry['key'] != key:
+            return False
+        for relpath in entry['outputs']:
+            if not os.path.lexists(self.targetdir + '/' + relpath):
+                return False
+        outdirs = unit_dirs(entry)
+        for other in self.earlier:
+            if other['built'] > entry['built'] and outdirs & unit_dirs(other):
+                return False
+        return True
+
+    def record(self, name, key, outputs):
+        """Record that unit "name" was made with "key", writing files "outputs"."""
+        self.units[name] = {'key': key, 'built': self.started,
+		'outputs': sorted(outputs)}
+
+# Directories (libs.ref/<library>/<format>) a unit has written files into
+
+def unit_dirs(entry):
+    return set('/'.join(relpath.split('/')[0:3]) for relpath in entry['outputs'])
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+#
+# install_scheduler.py
+#
+#----------------------------------------------------------------------------
+# Run the steps of an installation (see foundry_install.py) in parallel.
+# Each step is a function call with a name and a list of the steps that
+# must be finished before it can start.  Steps that do not depend on each
+# other run at the same time, up to a maximum number of jobs, and the time
+# taken by each step is recorded so that it can be reported at the end.
+#
+# Steps are expected to spend most of their time in subprocesses (magic
+# and filter scripts) or copying files, so they are run in threads.  The
+# output printed by a step is held until the step is finished and then
+# printed all at once, so that the output from steps running at the same
+# time is not interleaved.  With one job, each step is run as soon as it is
+# added and its output is printed as it happens, exactly as if the function
+# had been called directly.
+#
+# If a step fails, no further steps are started, and the exception raised
+# by the step is raised again once the steps already running have finished.
+#----------------------------------------------------------------------------
+
+import io
+import sys
+import time
+import threading
+import concurrent.futures
+
+#----------------------------------------------------------------------------
+# Stand-in for sys.stdout while steps are running in parallel.  Text written
+# from a thread running a step goes to that step's buffer;  text written
+# from any other thread goes straight to the output.
+#----------------------------------------------------------------------------
+
+class StepOutput(object):
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer is None:
+            return self.stream.write(text)
+        return buffer.write(text)
+
+    def flush(self):
+        if getattr(self.local, 'buffer', None) is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+#----------------------------------------------------------------------------
+
+class Step(object):
+    def __init__(self, name, function, args, after):
+        self.name = name
+        self.function = function
+        self.args = args
+        self.after = after
+        self.result = None
+        self.error = None
+        self.output = ''
+        self.elapsed = None
+        self.finished = False
+
+#----------------------------------------------------------------------------
+
+class InstallScheduler(object):
+    def __init__(self, jobs=1):
+        self.jobs = max(1, jobs)
+        self.steps = []
+        self.names = {}
+        self.log = []
+        self.walltime = 0.0
+
+    def add(self, name, function, *args, after=[]):
+        """
+        Add a step that calls function(*args) after all of the steps named
+        in "after" are done.  Steps in "after" must already have been added.
+        Returns the name of the step, which is made unique if necessary.
+        With one job, the step is run before returning.
+        """
+        basename = name
+        count = 1
+        while name in self.names:
+            count += 1
+            name = basename + ' (' + str(count) + ')'
+        for depend in after:
+            if depend not in self.names:
+                raise ValueError('Step "' + name + '" depends on unknown step "' + depend + '"')
+        step = Step(name, function, args, list(after))
+        self.names[name] = step
+        if self.jobs == 1:
+            self.run_step(step)
+            step.finished = True
+            if step.error:
+                raise step.error
+        else:
+            self.steps.append(step)
+        return name
+
+    def result(self, name):
+        """Return the value returned by the function of step "name"."""
+        return self.names[name].result
+
+    # Run one step, recording its result or exception and its run time.
+    # If "output" is given, it is the StepOutput collecting text printed
+    # by the step.
+
+    def run_step(self, step, output=None):
+        if output:
+            output.local.buffer = io.StringIO()
+        starttime = time.perf_counter()
+        try:
+            step.result = step.function(*step.args)
+        except BaseException as error:
+            step.error = error
+        step.elapsed = time.perf_counter() - starttime
+        if output:
+            step.output = output.local.buffer.getvalue()
+            output.local.buffer = None
+        self.log.append((step.name, step.elapsed))
+        return step
+
+    def run(self):
+        """
+        Run all steps that have been added since the last call (none, with
+        one job), and return when they are finished.  Raises the exception
+        of the first step that failed, if any.
+        """
+        pending = self.steps
+        self.steps = []
+        if not pending:
+            return
+
+        starttime = time.perf_counter()
+        running = {}
+        failed = None
+        output = StepOutput(sys.stdout)
+        savestdout = sys.stdout
+        sys.stdout = output
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                while pending or running:
+                    # Start every step whose prerequisites are done, in the
+                    # order the steps were added.
+                    if not failed:
+                        for step in pending[:]:
+                            if len(running) >= self.jobs:
+                                break
+                            if all(self.names[depend].finished for depend in step.after):
+                                pending.remove(step)
+                                running[pool.submit(self.run_step, step, output)] = step
+                    if not running:
+                        break
+                    done, notdone = concurrent.futures.wait(running,
+				return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        step = running.pop(future)
+                        step.finished = True
+                        output.stream.write(step.output)
+                        output.stream.flush()
+                        if step.error and not failed:
+                            failed = step
+        finally:
+            sys.stdout = savestdout
+            self.walltime += time.perf_counter() - starttime
+
+        if failed:
+            print('Step "' + failed.name + '" failed;  remaining steps were not run.')
+            raise failed.error
+
+    def report(self):
+        """Print the time taken by each step that has been run, longest first."""
+        if not self.log:
+            return
+        print('')
+        print('Installation step times:')
+        for name, elapsed in sorted(self.log, key=lambda item: item[1], reverse=True):
+            print('{:10.2f}s   '.format(elapsed) + name)
+        print('{:10.2f}s   '.format(sum(item[1] for item in self.log))
+		+ 'total (' + str(len(self.log)) + ' steps)')
+        if self.jobs > 1:
+            print('{:10.2f}s   '.format(self.walltime)
+			+ 'elapsed running ' + str(self.jobs) + ' jobs in parallel')
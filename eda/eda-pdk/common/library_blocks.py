@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+#
+# library_blocks.py
+#
+#----------------------------------------------------------------------------
+# Index of the named blocks (".subckt ... .ends" in SPICE and CDL, "module
+# ... endmodule" in verilog) in the text of a netlist, used to remove
+# redundant blocks when compiling a library from individual files (see
+# create_spice_library.py and create_verilog_library.py).
+#
+# The text is scanned once to find all of the blocks, which are grouped by
+# name.  Deciding which blocks to remove then only looks at the blocks of
+# each name, and the result is written in a single pass over the text, so
+# the time taken is linear in the size of the text and not in the size of
+# the text times the number of names.
+#----------------------------------------------------------------------------
+
+import re
+
+# A subcircuit starts at the newline before ".subckt <name>" and ends with
+# the first ".ends" after it that is at the start of a line.  The text
+# following ".ends" up to the next non-space character is removed along
+# with the subcircuit.
+subckt_begin = re.compile(r'\n\.subckt[ \t]+([^ \t\n]+)[ \t\n]', re.IGNORECASE)
+subckt_end = re.compile(r'\n\.ends(?=[ \t\n])', re.IGNORECASE)
+
+# A module starts with the whitespace in front of "module <name>" and ends
+# with the first "endmodule" after it that follows whitespace.
+module_begin = re.compile(r'[ \t\n]+module[ \t]+([^ \t\n\(]+)[ \t\n\(]')
+module_end = re.compile(r'[ \t\n]endmodule')
+
+#----------------------------------------------------------------------------
+
+class LibraryBlocks(object):
+    def __init__(self, text, beginrex, endrex, nocase=False, strip_after=False):
+        """
+        Find the blocks in "text" that start with a match of "beginrex",
+        whose first group is the block name, and end with the next match
+        of "endrex".  Names are compared without case if "nocase" is set.
+        If "strip_after" is set, the whitespace following a removed block
+        is removed with it.
+        """
+        self.text = text
+        self.nocase = nocase
+        self.strip_after = strip_after
+        self.starts = []
+        self.ends = []
+        self.groups = {}
+
+        pos = 0
+        while True:
+            bmatch = beginrex.search(text, pos)
+            if not bmatch:
+                break
+            ematch = endrex.search(text, bmatch.end())
+            if not ematch:
+                # A block that is never ended is not a block
+                pos = bmatch.end()
+                continue
+            name = bmatch.group(1)
+            self.groups.setdefault(self.fold(name), []).append(len(self.starts))
+            self.starts.append(bmatch.start())
+            self.ends.append(ematch.end())
+            pos = ematch.end()
+
+        count = len(self.starts)
+        self.alive = [True] * count
+
+        # "nextalive" links each removed block to a later block, for finding
+        # the next block that has not been removed.  "blankgaps[i]" is the
+        # number of gaps between blocks, before block i, that contain
+        # anything other than whitespace.
+        self.nextalive = list(range(count + 1))
+        self.blankgaps = [0]
+        if strip_after:
+            prevend = 0
+            for index in range(count):
+                gap = text[prevend:self.starts[index]]
+                nonblank = 1 if gap.strip(' \t\n') else 0
+                self.blankgaps.append(self.blankgaps[-1] + nonblank)
+                prevend = self.ends[index]
+
+    def fold(self, name):
+        return name.lower() if self.nocase else name
+
+    def next_alive(self, index):
+        # Return the first block at or after "index" that has not been
+        # removed (or the number of blocks, if there is none).
+        root = index
+        while self.nextalive[root] != root:
+            root = self.nextalive[root]
+        while self.nextalive[index] != root:
+            self.nextalive[index], index = root, self.nextalive[index]
+        return root
+
+    def remove(self, index):
+        self.alive[index] = False
+        self.nextalive[index] = index + 1
+
+    def adjacent(self, first, second):
+        # True if only whitespace remains between the end of block "first"
+        # and block "second", in which case the whitespace removed along
+        # with "first" would include the start of "second".
+        if self.next_alive(first + 1) != second:
+            return False
+        return self.blankgaps[second + 1] == self.blankgaps[first + 1]
+
+    def matches(self, name):
+        """
+        Return the blocks named "name" that have not been removed, as a
+        regular expression search for the blocks in the current text would
+        find them:  a block that is adjacent to the previous one found
+        (see adjacent()) is not found.
+        """
+        found = []
+        for index in self.groups.get(self.fold(name), []):
+            if not self.alive[index]:
+                continue
+            if self.strip_after and found and self.adjacent(found[-1], index):
+                continue
+            found.append(index)
+        return found
+
+    def remove_redundant(self, names, seen):
+        """
+        For each name in "names", remove all blocks of that name if it is
+        in "seen" (defined elsewhere), or else remove all but the last of
+        the blocks of that name.
+        """
+        for name in names:
+            found = self.matches(name)
+            if name in seen:
+                for index in found:
+                    self.remove(index)
+            elif len(found) > 1:
+                for index in found[:-1]:
+                    self.remove(index)
+
+    def pieces(self):
+        """
+        Yield the pieces of the text with the removed blocks replaced by a
+        newline.  Each removed block is replaced along with the whitespace
+        after it if "strip_after" is set.
+        """
+        text = self.text
+        pos = 0
+        pending = False
+        for index in range(len(self.starts)):
+            start = self.starts[index]
+            if start > pos:
+                gap = text[pos:start]
+                if pending:
+                    gap = gap.lstrip(' \t\n')
+                    if gap:
+                        yield '\n'
+                        yield gap
+                        pending = False
+                else:
+                    yield gap
+            if self.alive[index]:
+                # A pending newline stands in for the newline that starts
+                # the block, which went with the whitespace.
+                yield text[start:self.ends[index]]
+                pending = False
+            elif not pending:
+                if self.strip_after:
+                    pending = True
+                else:
+                    yield '\n'
+            pos = self.ends[index]
+
+        gap = text[pos:]
+        if pending:
+            gap = gap.lstrip(' \t\n')
+            yield '\n'
+        yield gap
+
+    def result(self):
+        """Return the text with the removed blocks replaced."""
+        if all(self.alive):
+            return self.text
+        return ''.join(self.pieces())
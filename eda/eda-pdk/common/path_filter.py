@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+#
+# path_filter.py
+#
+#----------------------------------------------------------------------------
+# Substitution of the staging area path in the text files of an installed
+# PDK, used by staging_install.py (see filter_recursive() there).
+#
+# All of the strings to be replaced in a file are found by one regular
+# expression, so each file is scanned once, and each occurrence is replaced
+# once (a replacement is never itself substituted again).  Files are handled
+# as bytes, so line endings and any bytes that are not valid UTF-8 are kept
+# as they are.  A file in which nothing is found is not written, leaving its
+# modification time unchanged.  Files are recognized as binary by their
+# extension or by a null byte near the start of the file, and are left
+# alone.  The files of a directory tree are processed in parallel threads.
+#----------------------------------------------------------------------------
+
+import os
+import re
+import stat
+import concurrent.futures
+
+# Files with these extensions are never read
+bintypes = ['.gds', '.gds2', '.gdsii', '.png', '.swp']
+
+# A file with a null byte in this many bytes at the start is binary
+sniff_size = 8192
+
+#----------------------------------------------------------------------------
+
+class PathFilter(object):
+    def __init__(self, jobs=None):
+        self.jobs = max(1, jobs or os.cpu_count() or 1)
+        self.files = 0
+        self.rewritten = 0
+
+    def filter_tree(self, tooldir, substitutions):
+        """
+        Replace strings in every text file under "tooldir" (not following
+        symbolic links).  "substitutions" is a function returning the list
+        of (old string, new string) for a file path, in order of priority.
+        Returns the number of files that were changed.
+        """
+        filepaths = []
+        find_text_files(tooldir, filepaths)
+
+        # Files mostly share a few lists of substitutions, so the pattern
+        # for each list is only made once.
+        matchers = {}
+        work = []
+        for filepath in filepaths:
+            subs = tuple(substitutions(filepath))
+            if subs not in matchers:
+                matchers[subs] = make_matcher(subs)
+            work.append((filepath,) + matchers[subs])
+
+        if self.jobs > 1 and len(work) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                results = list(pool.map(lambda args: filter_file(*args), work))
+        else:
+            results = [filter_file(*args) for args in work]
+
+        total = 0
+        for nbytes in results:
+            if nbytes is not None:
+                total += 1
+                self.rewritten += nbytes
+        self.files += total
+        return total
+
+    def report(self):
+        """Print the number of files changed and the number of bytes written."""
+        if self.files == 0:
+            return
+        filestr = 'files' if self.files > 1 else 'file'
+        print('Substituted paths in ' + str(self.files) + ' ' + filestr + ', rewriting '
+		+ str(self.rewritten) + ' bytes.')
+
+# Add the path of every file under "dirpath" that is not a symbolic link
+# and does not have a binary file extension to the list "filepaths".
+
+def find_text_files(dirpath, filepaths):
+    if os.path.islink(dirpath) or not os.path.isdir(dirpath):
+        return
+    for file in os.listdir(dirpath):
+        if os.path.splitext(file)[1] in bintypes:
+            continue
+        filepath = dirpath + '/' + file
+        if os.path.islink(filepath):
+            continue
+        elif os.path.isdir(filepath):
+            find_text_files(filepath, filepaths)
+        else:
+            filepaths.append(filepath)
+
+# Make a combined pattern for a list of (old string, new string).  Where
+# more than one string matches at the same place, the earliest in the list
+# is used.
+
+def make_matcher(substitutions):
+    replacements = {}
+    for old, new in substitutions:
+        if old:
+            replacements.setdefault(os.fsencode(old), os.fsencode(new))
+    if not replacements:
+        return None, replacements
+    pattern = b'|'.join(re.escape(old) for old in replacements)
+    return re.compile(pattern), replacements
+
+# Replace the strings found by "matcher" in file "filepath" with their
+# "replacements" (see make_matcher()).  Returns the number of bytes written,
+# or None if the file was not changed (or is binary).
+
+def filter_file(filepath, matcher, replacements):
+    if not matcher:
+        return None
+    try:
+        with open(filepath, 'rb') as ifile:
+            data = ifile.read()
+    except OSError:
+        print('Failure to read file ' + filepath)
+        return None
+
+    # Do not attempt to do text substitutions on a binary file!
+    if b'\0' in data[0:sniff_size]:
+        return None
+
+    newdata = matcher.sub(lambda match: replacements[match.group(0)], data)
+    if newdata == data:
+        return None
+
+    # Make sure this file is writable (as the original may not be)
+    statbuf = os.stat(filepath)
+    if not statbuf.st_mode & stat.S_IWUSR:
+        os.chmod(filepath, statbuf.st_mode | stat.S_IWUSR)
+    with open(filepath, 'wb') as ofile:
+        ofile.write(newdata)
+    return len(newdata)
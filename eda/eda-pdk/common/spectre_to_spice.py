@@ -2,13 +2,19 @@
 # Script to read all files in a directory of SPECTRE-compatible device model
 # files, and convert them to a form that is compatible with ngspice.
 
+import io
 import os
 import sys
 import re
-import glob
+import contextlib
+import concurrent.futures
 
 def usage():
-    print('spectre_to_spice.py <path_to_spectre> <path_to_spice>')
+    print('spectre_to_spice.py [-jobs=<number>] <path_to_spectre> <path_to_spice>')
+    print('')
+    print('If <path_to_spectre> is a directory, all files in it and in its')
+    print('subdirectories are converted, up to <number> files at a time')
+    print('(default is the number of processors).')
 
 # Check if a parameter value is a valid number (real, float, integer)
 # or is some kind of expression.
@@ -288,14 +294,17 @@ def convert_file(in_file, out_file):
     #---------------------------------------------------------------
 
     allsubrex = re.compile(r'.*subckt[ \t]+([^ \t\(]+)')
-    subnames = []
+    subnames = set()
     for line in speclines:
+        # (Quick check before the regular expression)
+        if 'subckt' not in line:
+            continue
         testline = line.strip()
         if testline.startswith('//') or testline.startswith('*'):
             continue
         smatch = allsubrex.match(testline)
         if smatch:
-            subnames.append(smatch.group(1))
+            subnames.add(smatch.group(1))
 
     #---------------------------------------------------------------
     # Now do the main pass (this is probably a bad idea and it would
@@ -321,6 +330,13 @@ def convert_file(in_file, out_file):
     othermodtypes = []
     linenum = 0
 
+    # Lines of "spicelines" that are "x" device calls (see the check of
+    # model types at the end of each subcircuit, below), as the line number
+    # and the text following the device name.  Lines up to "xscanned" have
+    # been checked for device calls.
+    xlines = []
+    xscanned = 0
+
     for line in speclines:
         linenum = linenum + 1
 
@@ -596,28 +612,51 @@ def convert_file(in_file, out_file):
                     # are called within the subcircuit?  Spectre makes it very
                     # hard to know what type of device is being instantiated. . .
    
+                    # Only lines that are "x" device calls can be changed,
+                    # so only those lines are checked against the models.
+
+                    for j in range(xscanned, len(spicelines)):
+                        cmatch = stddev3rex.match(spicelines[j])
+                        if cmatch and cmatch.group(1).lower() == 'x':
+                            xlines.append((j, cmatch.group(3)))
+                    xscanned = len(spicelines)
+
+                    models = []
                     for modelline in modellines:
                         mmatch = stdmodelrex.match(modelline)
                         if mmatch:
                             modelname = mmatch.group(1).lower().split('.')[0]
                             modeltype = mmatch.group(2).lower()
-                            newspicelines = []
-                            for line in spicelines:
-                                cmatch = stddev3rex.match(line)
-                                if cmatch:
-                                    devtype = cmatch.group(1).lower()
-                                    if modelname in cmatch.group(3):
-                                        if devtype == 'x':
-                                            if modeltype == 'pnp' or modeltype == 'npn':
-                                                line = 'q' + line[1:]
-                                            elif modeltype == 'c' or modeltype == 'r':
-                                                line = modeltype + line[1:]
-                                            elif modeltype == 'd':
-                                                line = modeltype + line[1:]
-                                            elif modeltype == 'nmos' or modeltype == 'pmos':
-                                                line = 'm' + line[1:]
-                                newspicelines.append(line)
-                            spicelines = newspicelines
+                            models.append((modelname, modeltype))
+
+                    if models:
+                        newxlines = []
+                        for j, rest in xlines:
+                            line = spicelines[j]
+                            for modelname, modeltype in models:
+                                if rest is None:
+                                    break
+                                if modelname in rest:
+                                    if modeltype == 'pnp' or modeltype == 'npn':
+                                        line = 'q' + line[1:]
+                                    elif modeltype == 'c' or modeltype == 'r':
+                                        line = modeltype + line[1:]
+                                    elif modeltype == 'd':
+                                        line = modeltype + line[1:]
+                                    elif modeltype == 'nmos' or modeltype == 'pmos':
+                                        line = 'm' + line[1:]
+                                    else:
+                                        continue
+                                    # No longer an "x" call (unless the line
+                                    # started with a space)
+                                    cmatch = stddev3rex.match(line)
+                                    rest = None
+                                    if cmatch and cmatch.group(1).lower() == 'x':
+                                        rest = cmatch.group(3)
+                            if rest is not None:
+                                newxlines.append((j, rest))
+                            spicelines[j] = line
+                        xlines = newxlines
 
                     # Now add any in-circuit models
                     spicelines.append('')
@@ -837,14 +876,58 @@ def convert_file(in_file, out_file):
 
     # Output the result to out_file.
     with open(out_file, 'w') as ofile:
-        for line in spicelines:
-            print(line, file=ofile)
+        ofile.writelines(line + '\n' for line in spicelines)
 
     # Debug info
     # print('Defined subcircuits: ' + ' '.join(subnames))
 
+# Convert one file for convert_directory(), returning the output printed
+# while converting it.
+
+def convert_one(in_file, out_file):
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        convert_file(in_file, out_file)
+    return output.getvalue()
+
+# Convert all files in directory "specpath" and its subdirectories, writing
+# the converted files to the same place under "spicepath".  Files are
+# converted in up to "jobs" separate processes at once.  The output from
+# converting each file is printed in the order of the files.
+
+def convert_directory(specpath, spicepath, jobs=None):
+    jobs = max(1, jobs or os.cpu_count() or 1)
+    tasks = []
+    for dirpath, dirnames, filenames in os.walk(specpath):
+        dirnames.sort()
+        outdir = os.path.join(spicepath, os.path.relpath(dirpath, specpath))
+        for filename in sorted(filenames):
+            fileext = os.path.splitext(filename)[1]
+
+            # Ignore verilog or verilog-A files that might be in a model directory
+            if fileext == '.v' or fileext == '.va':
+                continue
+
+            # .scs files are purely spectre and meaningless to SPICE, so ignore them.
+            if fileext == '.scs':
+                continue
+
+            os.makedirs(outdir, exist_ok=True)
+            tasks.append((os.path.join(dirpath, filename), os.path.join(outdir, filename)))
+
+    if jobs == 1 or len(tasks) < 2:
+        for in_file, out_file in tasks:
+            convert_file(in_file, out_file)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(convert_one, in_file, out_file) for in_file, out_file in tasks]
+        for future in futures:
+            print(future.result(), end='')
+
 if __name__ == '__main__':
     debug = False
+    jobs = None
 
     if len(sys.argv) == 1:
         print("No options given to spectre_to_spice.py.")
@@ -868,6 +951,14 @@ if __name__ == '__main__':
     if '-debug' in optionlist:
         debug = True
 
+    for option in optionlist:
+        if option.split('=')[0] == '-jobs':
+            try:
+                jobs = int(option.split('=')[1])
+            except (IndexError, ValueError):
+                print('Option usage:  -jobs=<number>')
+                sys.exit(1)
+
     specpath = arguments[0]
     spicepath = arguments[1]
     do_one_file = False
@@ -889,21 +980,7 @@ if __name__ == '__main__':
         if not os.path.exists(spicepath):
             os.makedirs(spicepath)
 
-        specfilelist = glob.glob(specpath + '/*')
-
-        for filename in specfilelist:
-            fileext = os.path.splitext(filename)[1]
-
-            # Ignore verilog or verilog-A files that might be in a model directory
-            if fileext == '.v' or fileext == '.va':
-                continue
-
-            # .scs files are purely spectre and meaningless to SPICE, so ignore them.
-            if fileext == '.scs':
-                continue
-
-            froot = os.path.split(filename)[1]
-            convert_file(filename, spicepath + '/' + froot)
+        convert_directory(specpath, spicepath, jobs)
 
     print('Done.')
     exit(0)
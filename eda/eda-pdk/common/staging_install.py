@@ -60,6 +60,15 @@ Less common options:
 
   -verbose           Output more information about the install process.
 
+  -jobs <number>     Number of files to filter or compare at once when
+                     changing path references and looking for files to
+                     replace with symbolic links.  Default is the number
+                     of processors.
+
+Files are compared by the hash of their contents.  The hashes are kept in
+the staging directory (".install_manifest/file_index.cache"), so files that
+have not changed since the last install are not read again.
+
 If <target> is unspecified then <name> is used for the target.
 """
 
@@ -67,11 +76,12 @@ import re
 import os
 import sys
 import glob
-import stat
 import shutil
-import filecmp
 import subprocess
 
+from file_index import FileIndex
+from path_filter import PathFilter
+
 # NOTE:  This version of copy_tree from distutils works like shutil.copytree()
 # in Python 3.8 and up ONLY using "dirs_exist_ok=True".  Since
 # distutils.dir_util has been deprecated and there are very few systems any
@@ -83,19 +93,18 @@ import subprocess
 # except:
 #     from distutils.dir_util import copy_tree
 
-def makeuserwritable(filepath):
-    if os.path.exists(filepath):
-        st = os.stat(filepath)
-        os.chmod(filepath, st.st_mode | stat.S_IWUSR)
-
 # Filter files to replace all strings matching "stagingdir" with "finaldir" for
 # every file in "tooldir".  If "tooldir" contains subdirectories, then recursively
 # apply the replacement filter to all files in the subdirectories.  Do not follow
 # symbolic links.
+#
+# The files are filtered by "pathfilter" (a PathFilter, see path_filter.py),
+# which only writes the files that are changed.  Returns the number of files
+# changed.
 
-def filter_recursive(tooldir, stagingdir, finaldir):
-    # Add any non-ASCII file types here
-    bintypes = ['.gds', '.gds2', '.gdsii', '.png', '.swp']
+def filter_recursive(tooldir, stagingdir, finaldir, pathfilter=None):
+    if not pathfilter:
+        pathfilter = PathFilter()
 
     # Also do substitutions on strings containing the stagingdir parent
     # directory (replace with the finaldir parent directory).
@@ -118,65 +127,24 @@ def filter_recursive(tooldir, stagingdir, finaldir):
     tclfinaldir = finaldir.replace(homedir, '$::env(HOME)')
     tcllocalparent = localparent.replace(homedir, '$::env(HOME)')
 
-    if not os.path.exists(tooldir):
-        return 0
-    elif os.path.islink(tooldir):
-        return 0
-    elif not os.path.isdir(tooldir):
-        return 0
-
-    toolfiles = os.listdir(tooldir)
-    total = 0
+    # For cases in which the target is in the home directory, make
+    # the PDK more portable by replacing the home directory with the
+    # appropriate environment variable.  This is found in Tcl and shell
+    # scripts and needs to be handled accordingly.
 
-    for file in toolfiles:
-        # Do not attempt to do text substitutions on a binary file!
-        if os.path.splitext(file)[1] in bintypes:
-            continue
+    def substitutions(filepath):
+        fext = os.path.splitext(filepath)[1]
+        isshell = True if fext == '.sh' else False
+        istcl = True if fext.endswith('rc') else False
 
-        filepath = tooldir + '/' + file
-        if os.path.islink(filepath):
-            continue
-        elif os.path.isdir(filepath):
-            total += filter_recursive(filepath, stagingdir, finaldir)
+        if isshell:
+            return [(stagingdir, shfinaldir), (stagingparent, shlocalparent)]
+        elif istcl:
+            return [(stagingdir, tclfinaldir), (stagingparent, tcllocalparent)]
         else:
-            with open(filepath, 'r', encoding='utf-8', errors='replace') as ifile:
-                try:
-                    flines = ifile.readlines()
-                except UnicodeDecodeError:
-                    print('Failure to read file ' + filepath + '; non-ASCII content.')
-                    continue
-
-            # Make sure this file is writable (as the original may not be)
-            makeuserwritable(filepath)
-
-            # For cases in which the target is in the home directory, make
-            # the PDK more portable by replacing the home directory with the
-            # appropriate environment variable.  This is found in Tcl and shell
-            # scripts and needs to be handled accordingly.
-
-            fext = os.path.splitext(filepath)[1]
-            isshell = True if fext == '.sh' else False
-            istcl = True if fext.endswith('rc') else False
-
-            modified = False
-            with open(filepath, 'wb') as ofile:
-                for line in flines:
-                    if isshell:
-                        newline = line.replace(stagingdir, shfinaldir)
-                        newline = newline.replace(stagingparent, shlocalparent)
-                    elif istcl:
-                        newline = line.replace(stagingdir, tclfinaldir)
-                        newline = newline.replace(stagingparent, tcllocalparent)
-                    else:
-                        newline = line.replace(stagingdir, finaldir)
-                        newline = newline.replace(stagingparent, localparent)
-                    ofile.write(newline.encode('utf-8'))
-                    if newline != line:
-                        modified = True
+            return [(stagingdir, finaldir), (stagingparent, localparent)]
 
-            if modified:
-                total += 1
-    return total
+    return pathfilter.filter_tree(tooldir, substitutions)
 
 # To avoid problems with various library functions that copy hierarchical
 # directory trees, remove all the files from the target that are going to
@@ -221,32 +189,41 @@ def make_source_list(sources):
 # Because the installation may be distributed, there may be a difference
 # between where the files to be linked to currently are (checklist)
 # and where they will eventually be located (sourcelist).
+#
+# Files are compared through "index" (a FileIndex, see file_index.py), which
+# compares all of the files found in one batch.
+
+def replace_with_symlinks(libfiles, sourcelist, index=None):
+    if not index:
+        index = FileIndex()
+    links = []
+    find_source_links(libfiles, sourcelist, links)
+    return index.replace_with_links(links)
 
-def replace_with_symlinks(libfiles, sourcelist):
+# Add to "links" the (file, link target, file to compare) for each file in
+# "libfiles" that has a file of the same name in "sourcelist".  Where more
+# than one source has the same name, the first is used.
+
+def find_source_links(libfiles, sourcelist, links):
     # List of files that never get installed
     exclude = ['generate_magic.tcl', '.magicrc', 'sources.txt']
-    total = 0
+    sourcenames = {}
+    for item in sourcelist:
+        sourcenames.setdefault(os.path.split(item)[1], item)
     for libfile in libfiles:
         if os.path.islink(libfile):
             continue
-        else:
-            try:
-                sourcefile = next(item for item in sourcelist if os.path.split(item)[1] == os.path.split(libfile)[1])
-            except:
-                pass
-            else:
-                if os.path.isdir(libfile):
-                    newlibfiles = glob.glob(libfile + '/*')
-                    newsourcelist = glob.glob(sourcefile + '/*')
-                    total += replace_with_symlinks(newlibfiles, newsourcelist)
-                elif filecmp.cmp(libfile, sourcefile, shallow=False):
-                    if not os.path.split(libfile)[1] in exclude:
-                        os.remove(libfile)
-                        # Use absolute path for the source file
-                        sourcepath = os.path.abspath(sourcefile)
-                        os.symlink(sourcepath, libfile)
-                        total += 1
-    return total
+        libname = os.path.split(libfile)[1]
+        sourcefile = sourcenames.get(libname)
+        if not sourcefile:
+            continue
+        if os.path.isdir(libfile):
+            newlibfiles = glob.glob(libfile + '/*')
+            newsourcelist = glob.glob(sourcefile + '/*')
+            find_source_links(newlibfiles, newsourcelist, links)
+        elif not libname in exclude:
+            # Use absolute path for the source file
+            links.append((libfile, os.path.abspath(sourcefile), sourcefile))
 
 # Similar to the routine above, replace files in "libdir" with symbolic
 # links to the files in "srclibdir", where the files are found to be the
@@ -259,30 +236,37 @@ def replace_with_symlinks(libfiles, sourcelist):
 # between where the files to be linked to currently are (checklibdir)
 # and where they will eventually be located (srclibdir).
 
-def replace_all_with_symlinks(libdir, srclibdir, checklibdir):
-    total = 0
+def replace_all_with_symlinks(libdir, srclibdir, checklibdir, index=None):
+    if not index:
+        index = FileIndex()
+    links = []
+    find_pdk_links(libdir, srclibdir, checklibdir, links)
+    return index.replace_with_links(links)
+
+def find_pdk_links(libdir, srclibdir, checklibdir, links):
     try:
         libfiles = os.listdir(libdir)
     except FileNotFoundError:
         print('Cannot list directory ' + libdir)
         print('Called: replace_all_with_symlinks(' + libdir + ', ' + srclibdir + ', ' + checklibdir + ')')
-        return total
+        return
     except NotADirectoryError:
         print('File entry ' + libdir + ' is not a directory.')
         print('Called: replace_all_with_symlinks(' + libdir + ', ' + srclibdir + ', ' + checklibdir + ')')
-        return total
+        return
 
     try:
         checkfiles = os.listdir(checklibdir)
     except FileNotFoundError:
         print('Cannot list check directory ' + checklibdir)
         print('Called: replace_all_with_symlinks(' + libdir + ', ' + srclibdir + ', ' + checklibdir + ')')
-        return total
+        return
     except NotADirectoryError:
         print('File entry ' + checklibdir + ' is not a directory.')
         print('Called: replace_all_with_symlinks(' + libdir + ', ' + srclibdir + ', ' + checklibdir + ')')
-        return total
+        return
 
+    checkfiles = set(checkfiles)
     for libfile in libfiles:
         if libfile in checkfiles:
             libpath = libdir + '/' + libfile
@@ -291,17 +275,11 @@ def replace_all_with_symlinks(libdir, srclibdir, checklibdir):
 
             if os.path.isdir(libpath):
                 if os.path.isdir(checkpath):
-                    total += replace_all_with_symlinks(libpath, srcpath, checkpath)
+                    find_pdk_links(libpath, srcpath, checkpath, links)
+            elif not os.path.exists(libpath) or not os.path.exists(checkpath):
+                print('Failed file compare with libpath=' + libpath + ', checkpath=' + checkpath)
             else:
-                try:
-                    if filecmp.cmp(libpath, checkpath, shallow=False):
-                        os.remove(libpath)
-                        os.symlink(srcpath, libpath)
-                        total += 1
-                except FileNotFoundError:
-                    print('Failed file compare with libpath=' + libpath + ', checkpath=' + checkpath)
-
-    return total
+                links.append((libpath, srcpath, checkpath))
 
 #----------------------------------------------------------------
 # This is the main entry point for the staging install script.
@@ -327,6 +305,7 @@ if __name__ == '__main__':
     finaldir = None  # Directory files will end up installed to.
 
     do_install = True
+    jobs = None
 
     # Break arguments into groups where the first word begins with "-".
     # All following words not beginning with "-" are appended to the
@@ -386,6 +365,13 @@ if __name__ == '__main__':
         elif option[0] == 'variable':
             optionlist.remove(option)
             variable = option[1]
+        elif option[0] == 'jobs':
+            optionlist.remove(option)
+            try:
+                jobs = int(option[1])
+            except (IndexError, ValueError):
+                print('Error: Option "jobs" used with no valid value.')
+                sys.exit(1)
 
     # Error if no staging or dest specified
     if not stagingdir:
@@ -452,6 +438,12 @@ if __name__ == '__main__':
 
     mag_current = '/libs.tech/magic/'
 
+    # Index of file contents for finding files to replace with symbolic links
+    index = FileIndex(stagingdir + '/.install_manifest/file_index.cache', jobs)
+
+    # Filter for changing path references in the installed files
+    pathfilter = PathFilter(jobs)
+
     # First install everything by direct copy.  Keep the staging files
     # as they will be used to reference the target area to know which
     # files need to be checked and/or modified.
@@ -469,7 +461,9 @@ if __name__ == '__main__':
 
     print('Copying staging files to target')
     # print('Diagnostic:  copytree ' + stagingdir + ' ' + writedir)
-    shutil.copytree(stagingdir, writedir, symlinks=True, dirs_exist_ok=True)
+    # (The manifest kept by foundry_install.py is not part of the PDK.)
+    shutil.copytree(stagingdir, writedir, symlinks=True, dirs_exist_ok=True,
+		ignore=shutil.ignore_patterns('.install_manifest'))
     print('Done.')
 
     # Magic and qflow setup files have references to the staging area that have
@@ -500,7 +494,7 @@ if __name__ == '__main__':
             # no attempt to check for possible symlinks to link_from if link_from
             # is a base PDK.
 
-            total = filter_recursive(tooldir, stagingdir, finaldir)
+            total = filter_recursive(tooldir, stagingdir, finaldir, pathfilter)
             if total > 0:
                 substr = 'substitutions' if total > 1 else 'substitution'
                 print('      ' + tool + ' (' + str(total) + ' ' + substr + ')')
@@ -528,7 +522,7 @@ if __name__ == '__main__':
                     else:
                         checktooldir = srctooldir
                     if os.path.exists(tooldir):
-                        total = replace_all_with_symlinks(tooldir, srctooldir, checktooldir)
+                        total = replace_all_with_symlinks(tooldir, srctooldir, checktooldir, index)
                         if total > 0:
                             symstr = 'symlinks' if total > 1 else 'symlink'
                             print('      ' + tool + ' (' + str(total) + ' ' + symstr + ')')
@@ -554,11 +548,13 @@ if __name__ == '__main__':
             print('   ' + library)
             for filetype in needcheck:
                 filedir = writedir + refdir + library + '/' + filetype
-                total = filter_recursive(filedir, stagingdir, localname)
+                total = filter_recursive(filedir, stagingdir, localname, pathfilter)
                 if total > 0:
                     substr = 'substitutions' if total > 1 else 'substitution'
                     print('      ' + filetype + ' (' + str(total) + ' ' + substr + ')')
 
+    pathfilter.report()
+
     # If "link_from" is "source", then check all files against the source
     # directory, and replace the file with a symbolic link if the file
     # contents match.  The "foundry_install.py" script should have added a
@@ -583,7 +579,7 @@ if __name__ == '__main__':
                             with open(libdir + '/sources.txt') as ifile:
                                 sources = ifile.read().splitlines()
                             sourcelist = make_source_list(sources)
-                            total = replace_with_symlinks(libfiles, sourcelist)
+                            total = replace_with_symlinks(libfiles, sourcelist, index)
                             if total > 0:
                                 symstr = 'symlinks' if total > 1 else 'symlink'
                                 print('      ' + filedir + ' (' + str(total) + ' ' + symstr + ')')
@@ -613,11 +609,15 @@ if __name__ == '__main__':
                         else:
                             checklibdir = srclibdir
                         if os.path.exists(libdir):
-                            total = replace_all_with_symlinks(libdir, srclibdir, checklibdir)
+                            total = replace_all_with_symlinks(libdir, srclibdir, checklibdir, index)
                             if total > 0:
                                 symstr = 'symlinks' if total > 1 else 'symlink'
                                 print('      ' + filedir + ' (' + str(total) + ' ' + symstr + ')')
 
+    index.report()
+    if index.hashes:
+        index.save()
+
     # Remove temporary files:  Magic generation scripts, sources.txt
     # file, and magic extract files.
 
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+test_spectre_to_spice.py
+Golden output test of spectre_to_spice.py.
+
+The spectre decks under spectre_to_spice/spectre are converted and compared
+with the SPICE files under spectre_to_spice/spice, which were written by
+the version of the script from before it was changed to convert files in
+parallel.  models.lib is a generated deck with binned models, statistics
+blocks, spectre and SPICE sections, and subcircuit calls that are retyped
+to the model they name;  devices/diodes.lib exercises the "perim" to "pj",
+"sqrt(w*m)" to "mult" and "tc1r" to "tc1" passes.  The .va and .scs files
+must be left out in directory mode.
+
+Run with "python3 -m unittest discover eda/eda-pdk/common/tests".
+"""
+
+import os
+import sys
+import io
+import shutil
+import tempfile
+import contextlib
+import unittest
+
+testdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(testdir))
+
+import spectre_to_spice
+
+specpath = os.path.join(testdir, 'spectre_to_spice', 'spectre')
+goldpath = os.path.join(testdir, 'spectre_to_spice', 'spice')
+
+def read_tree(path):
+    # All files under path, by name relative to path
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            filepath = os.path.join(dirpath, filename)
+            with open(filepath, 'r') as ifile:
+                files[os.path.relpath(filepath, path)] = ifile.read()
+    return files
+
+class ConvertTest(unittest.TestCase):
+
+    def setUp(self):
+        self.outpath = tempfile.mkdtemp()
+        self.golden = read_tree(goldpath)
+
+    def tearDown(self):
+        shutil.rmtree(self.outpath)
+
+    def test_convert_file(self):
+        for filename, expected in self.golden.items():
+            with self.subTest(file=filename):
+                out_file = os.path.join(self.outpath, os.path.basename(filename))
+                with contextlib.redirect_stdout(io.StringIO()):
+                    spectre_to_spice.convert_file(os.path.join(specpath, filename), out_file)
+                with open(out_file, 'r') as ifile:
+                    self.assertEqual(ifile.read(), expected)
+
+    def test_convert_directory(self):
+        for jobs in [1, 2]:
+            with self.subTest(jobs=jobs):
+                spicepath = os.path.join(self.outpath, 'jobs' + str(jobs))
+                with contextlib.redirect_stdout(io.StringIO()):
+                    spectre_to_spice.convert_directory(specpath, spicepath, jobs)
+                converted = read_tree(spicepath)
+                self.assertEqual(sorted(converted), sorted(self.golden))
+                for filename, expected in self.golden.items():
+                    self.assertEqual(converted[filename], expected, filename)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -47,6 +47,21 @@ options:
         test mode:  do not post results to the marketplace
    -nosim
         test mode:  set up all files for simulation but do not simulate
+   -jobs=<N>
+        run up to N simulations in parallel (0 = number of CPUs)
+   -shared[=<path>]
+        run ngspice in long-lived sessions through its shared library
+        (libngspice, or the library at <path>) instead of as a new process
+        for every testbench
+   -nocache
+        always simulate, ignoring results cached from earlier runs
+   -cachedir=<path>
+        is the location of the simulation result cache (default ~/.cache/cace)
+   -cachesize=<MB>
+        is the size limit of the simulation result cache (default 2048)
+   -shard=<k>/<n>
+        generate and simulate only the k-th of n parts of each parameter's
+        set of conditions (e.g., to split a large sweep across machines)
 
 Quick local run---Use:
 
@@ -57,6 +72,7 @@ e.g.,
     cace_gensim.py ~/design/XBG_1V23LC_V01 -local -method=DCVOLTAGE_VBG.1
 """
 
+import io
 import os
 import sys
 import json
@@ -67,9 +83,9 @@ import signal
 import datetime
 import subprocess
 import faulthandler
-from functools import reduce
 from spiceunits import spice_unit_convert
 from spiceunits import numeric
+import netlist_index
 
 # Application path (path where this script is located)
 apps_path = os.path.realpath(os.path.dirname(__file__))
@@ -286,6 +302,67 @@ def condition_gen(cond):
     elif "typ" in cond:
         yield(lcond, unit, cond["typ"])
 
+# Lazy Cartesian product of the values of a list of conditions, which
+# is the set of simulations to run for an electrical parameter.  Point
+# number k (counting from zero) takes the value of condition i at index
+# (k // stride[i]) % len(values[i]), where stride[i] is the number of
+# combinations of all conditions before i;  that is, the first condition
+# varies fastest.  Duplicate values of a condition are dropped, so every
+# point is unique.  Only the values of each condition are held in memory,
+# and points are generated on demand, so a caller can stream the whole
+# set, pick out a single point, or take one shard of the set.
+
+class ConditionProduct(object):
+    def __init__(self, lcondlist):
+        self.names = []
+        self.values = []
+        for cond in lcondlist:
+            self.names.append(cond['condition'])
+            self.values.append(uniquify(list(condition_gen(cond))))
+        self.update_strides()
+
+    def update_strides(self):
+        self.strides = []
+        self.size = 1
+        for vlist in self.values:
+            self.strides.append(self.size)
+            self.size *= len(vlist)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.size
+        if index < 0 or index >= self.size:
+            raise IndexError('Condition set index out of range')
+        return [vlist[(index // stride) % len(vlist)]
+			for vlist, stride in zip(self.values, self.strides)]
+
+    def __iter__(self):
+        for index in range(self.size):
+            yield self[index]
+
+    def condition_values(self, condition):
+        # Return the list of values of the named condition, or None.
+        try:
+            return self.values[self.names.index(condition)]
+        except ValueError:
+            return None
+
+    def remove_condition(self, condition):
+        # Remove a condition from all points (e.g., one that is swept
+        # within each simulation).
+        idx = self.names.index(condition)
+        self.names.pop(idx)
+        self.values.pop(idx)
+        self.update_strides()
+
+    def shard(self, k, n):
+        # Return the range of point indices in shard k (1 to n) of n,
+        # dividing the set into contiguous ranges of nearly equal size.
+        return range((k - 1) * self.size // n, k * self.size // n)
+
 # Find the maximum time to run a simulation.  This is the maximum of:
 # (1) maximum value, if method is RISETIME or FALLTIME, and (2) maximum
 # RISETIME or FALLTIME of any condition.
@@ -527,39 +604,346 @@ def inline_dut(filename, functional, rootpath, ofile):
 
     ofile.write('\n')
 
-# Define how to write a simulation file by making substitutions into a
-# template schematic.
+# A testbench template compiled for substitution.  The template is parsed
+# once into a list of chunks, each being either literal text (lines that
+# come out the same in every netlist, joined together) or a template line
+# with its list of placeholders.  Each placeholder is resolved at compile
+# time to the kind of substitution it gets:  fixed text, a value taken
+# from the condition point at a known position, or one of the special
+# names that depend on the netlist being written (N, RANDOM, DUT_PATH,
+# INCLUDE_DUT, PIN, FUNCTIONAL, and the stack math operators).  render()
+# then only evaluates the placeholders and joins the chunks.  Placeholders
+# are applied to each line in order by string replacement, exactly as
+# substitute() has always done, so the output is unchanged.
 
-def substitute(filename, fileinfo, template, simvals, maxtime, schemline,
-		localmode, param):
-    """Simulation derived by substitution into template schematic"""
+class TestbenchTemplate(object):
 
     # Regular expressions
     varex = re.compile(r'(\$\{[^ \}\t]+\})')		# variable name ${name}
     defaultex = re.compile(r'\$\{([^=]+)=([^=\}]+)\}')	# name in ${name=default} format
-    condpinex = re.compile(r'\$\{([^:]+):([^:\}]+)\}')	# name in ${cond:pin} format
     condex = re.compile(r'\$\{([^\}]+)\}')		# name in ${cond} format
     sweepex = re.compile(r'\$\{([^\}]+):SWEEP([^\}]+)\}') # name in ${cond:[pin:]sweep} format
     pinex = re.compile(r'PIN:([^:]+):([^:]+)')		# name in ${PIN:pin_name:net_name} format
     funcrex = re.compile(r'FUNCTIONAL:([^:]+)')		# name in ${FUNCTIONAL:ip_name} format
-    colonsepex = re.compile(r'^([^:]+):([^:]+)$')	# a:b (colon-separated values)
     vectrex = re.compile(r'([^\[]+)\[([0-9]+)\]')       # pin name is a vector signal
     vect2rex = re.compile(r'([^<]+)<([0-9]+)>')         # pin name is a vector signal (alternate style)
     vect3rex = re.compile(r'([a-zA-Z][^0-9]*)([0-9]+)') # pin name is a vector signal (alternate style)
-    libdirrex = re.compile(r'.lib[ \t]+(.*)[ \t]+')     # pick up library name from .lib
     vinclrex = re.compile(r'[ \t]*`include[ \t]+"([^"]+)"')	# verilog include statement
 
-    # Information about the DUT
-    simfilepath = fileinfo['simulation-path']
-    schempath = fileinfo['design-netlist-path']
-    schemname = fileinfo['design-netlist-name']
-    testbenchpath = fileinfo['testbench-netlist-path']
-    rootpath = fileinfo['root-path']
-    schempins = schemline.upper().split()[1:-1]
-    simpins = [None] * len(schempins)
+    # Stack math operators.  Each acts on the last two values (or, for NEG
+    # and INT, the last value) in the line before the operator.
+    binary_ops = {'+': lambda a, b: a + b, '-': lambda a, b: a - b,
+		'*': lambda a, b: a * b, '/': lambda a, b: a / b,
+		'MAX': max, 'MIN': min}
+    unary_ops = {'NEG': lambda a: str(-numeric(a)), 'INT': lambda a: str(int(a))}
+
+    def __init__(self, filename, fileinfo, template, simlines, sweeps, condnames,
+		maxtime, schemline, param):
+        self.template = template
+        self.simfilepath = fileinfo['simulation-path']
+        self.schemfile = fileinfo['design-netlist-path'] + '/' + fileinfo['design-netlist-name']
+        self.rootpath = fileinfo['root-path']
+        self.schemline = schemline
+        self.schempins = schemline.upper().split()[1:-1]
+        self.simpins = [None] * len(self.schempins)
+        self.functional = []
+        self.convcache = {}
+        self.inlinecache = {}
+
+        # Hints are written ahead of the DUT_PATH or INCLUDE_DUT line
+        hintfile = io.StringIO()
+        insert_hints(param, hintfile)
+        self.hints = hintfile.getvalue()
+
+        # Fixed substitutions
+        self.special = {
+		'MAXTIME': str(maxtime),
+		'STEPTIME': str(maxtime / 100),
+		'DUT_CALL': schemline,
+		'FILENAME': filename}
+
+        self.chunks = []
+        literal = []
+        controlblock = False
+        for line in simlines:
+            # Check if the parser is in the ngspice control block section
+            if '.control' in line:
+                controlblock = True
+            elif '.endc' in line:
+                controlblock = False
+            elif controlblock == True:
+                literal.append('set sqrnoise\n')
+                # This will need to be more nuanced if controlblock is used
+                # to do more than just insert the noise sim hack.
+                controlblock = False
+
+            placeholders = [self.compile_placeholder(patmatch, sweeps, condnames)
+			for patmatch in self.varex.finditer(line)]
+
+            # Lines that have only fixed substitutions are resolved now.
+            if all(kind == 'text' and (repl or default)
+			for pattern, default, kind, repl in placeholders):
+                subsline = line
+                for pattern, default, kind, repl in placeholders:
+                    subsline = subsline.replace(pattern, repl or default)
+                if '${PIN}' not in subsline:
+                    literal.append(self.verilog_include(subsline) + '\n')
+                    continue
 
+            if literal:
+                self.chunks.append(''.join(literal))
+                literal = []
+            self.chunks.append((line, placeholders))
+
+        if literal:
+            self.chunks.append(''.join(literal))
+
+    # Parse one ${...} placeholder and return a tuple (pattern, default,
+    # kind, argument).
+
+    def compile_placeholder(self, patmatch, sweeps, condnames):
+        pattern = patmatch.group(1)
+        # If variable is in ${x=y} format, it declares a default value
+        # Remove the =y default part and keep it for later if needed.
+        defmatch = self.defaultex.match(pattern)
+        if defmatch:
+            default = defmatch.group(2)
+            vpattern = '${' + defmatch.group(1) + '}'
+        else:
+            default = []
+            vpattern = pattern
+
+        sweeprec = self.sweepex.match(vpattern)
+        if sweeprec:
+            sweeptype = sweeprec.group(2)
+            condition = sweeprec.group(1)
+            entry = next(item for item in sweeps if item['condition'] == condition)
+            uval = spice_unit_convert((entry['unit'], entry[sweeptype]))
+            return (pattern, default, 'text', str(uval))
+
+        cond = self.condex.match(vpattern)
+        if not cond:
+            return (pattern, default, 'text', [])
+        condition = cond.group(1)
+
+        # Check if the condition contains a pin vector
+        lmatch = self.vectrex.match(condition)
+        vtype = 0
+        if not lmatch:
+            lmatch = self.vect2rex.match(condition)
+            vtype = 1
+        if not lmatch:
+            lmatch = self.vect3rex.match(condition)
+            vtype = 3
+        if lmatch:
+            pinidx = int(lmatch.group(2))
+            vcondition = lmatch.group(1)
+
+        if condition in condnames:
+            position = condnames.index(condition)
+            if lmatch:
+                return (pattern, default, 'bit', (position, pinidx))
+            else:
+                return (pattern, default, 'value', position)
+
+        # check against known names
+        if condition in self.special:
+            return (pattern, default, 'text', self.special[condition])
+        elif condition == 'DUT_NAME':
+            # This verifies pin list of schematic vs. the netlist.
+            return (pattern, default, 'text', self.schemline.split()[-1])
+        elif condition == 'N' or condition == 'RANDOM':
+            return (pattern, default, condition, None)
+        elif condition == 'DUT_PATH':
+            # DUT_PATH is required and is a good spot to
+            # insert hints (but deprecated in fafor of INCLUDE_DUT)
+            return (pattern, default, condition, self.schemfile + '\n')
+        elif condition == 'INCLUDE_DUT':
+            return (pattern, default, condition, '.include ' + self.schemfile + '\n')
+        elif condition in self.binary_ops or condition in self.unary_ops:
+            return (pattern, default, 'stack', (condition, patmatch.end()))
+        elif condition.find('PIN:') == 0:
+            # Parse for ${PIN:<pin_name>:<net_name>}
+            # Replace <pin_name> with index of pin from DUT subcircuit
+            pinrec = self.pinex.match(condition)
+            pinname = pinrec.group(1).upper()
+            netname = pinrec.group(2).upper()
+            try:
+                idx = self.schempins.index(pinname)
+            except ValueError:
+                return (pattern, default, 'text', netname)
+            return (pattern, default, 'PIN', (idx, netname))
+        elif condition.find('FUNCTIONAL:') == 0:
+            # Parse for ${FUNCTIONAL:<ip_name>}
+            funcrec = self.funcrex.match(condition)
+            return (pattern, default, 'FUNCTIONAL', funcrec.group(1))
+        elif lmatch:
+            # Vector bit slice of a condition given without the index
+            for position, name in enumerate(condnames):
+                if name.split('[')[0].split('<')[0] == vcondition:
+                    return (pattern, default, 'bit', (position, pinidx))
+            if vtype == 3:
+                for position, name in enumerate(condnames):
+                    vmatch = self.vect3rex.match(name)
+                    if vmatch and vmatch.group(1) == vcondition:
+                        return (pattern, default, 'bit', (position, pinidx))
+
+        # if no match, subsline remains as-is.
+        return (pattern, default, 'text', [])
+
+    # Check for a verilog include file, and if any is found, copy it
+    # to the target simulation directory.  Replace any leading path
+    # with the local current working directory '.'.
+
+    def verilog_include(self, subsline):
+        vmatch = self.vinclrex.match(subsline)
+        if vmatch:
+            incfile = vmatch.group(1)
+            incroot = os.path.split(incfile)[1]
+            curpath = os.path.split(self.template)[0]
+            incpath = os.path.abspath(os.path.join(curpath, incfile))
+            shutil.copy(incpath, self.simfilepath + '/' + incroot)
+            subsline = '   `include "./' + incroot + '"'
+        return subsline
+
+    # Perform a stack math operation and replace the operands with the result.
+    # Note that ngspice is finicky about space around "=" so handle this in a
+    # way that keeps ngspice happy.
+
+    def stack_op(self, subsline, line, operator, end):
+        smatch = self.varex.search(subsline)
+        watchend = smatch.start()
+        ltok = subsline[0:watchend].replace('=', ' = ').split()
+        if operator in self.unary_ops:
+            ntok = ltok[:-1]
+            ntok.append(self.unary_ops[operator](ltok[-1]))
+        else:
+            ntok = ltok[:-2]
+            ntok.append(str(self.binary_ops[operator](numeric(ltok[-2]),
+			numeric(ltok[-1]))))
+        return ' '.join(ntok).replace(' = ', '=') + line[end:]
+
+    # Unit conversion of a condition value.  Condition points share their
+    # values, so each value is converted only once.
+
+    def convert(self, entry):
+        try:
+            return self.convcache[entry]
+        except KeyError:
+            repl = str(spice_unit_convert(entry[1:]))
+            self.convcache[entry] = repl
+            return repl
+        except TypeError:
+            return str(spice_unit_convert(entry[1:]))
+
+    # Contents of the DUT netlist with functional views substituted, which
+    # only changes when more FUNCTIONAL declarations have been seen.
+
+    def inline(self):
+        key = tuple(self.functional)
+        if key not in self.inlinecache:
+            dutfile = io.StringIO()
+            inline_dut(self.schemfile, self.functional, self.rootpath, dutfile)
+            self.inlinecache[key] = dutfile.getvalue()
+        return self.inlinecache[key]
+
+    # Return the text of the netlist for condition point "simval", number
+    # "simnum".
+
+    def render(self, simval, simnum):
+        out = []
+        for chunk in self.chunks:
+            if isinstance(chunk, str):
+                out.append(chunk)
+                continue
+
+            line, placeholders = chunk
+            subsline = line
+            for pattern, default, kind, arg in placeholders:
+                repl = []
+                no_repl_ok = False
+                if kind == 'text':
+                    repl = arg
+                elif kind == 'value':
+                    repl = self.convert(simval[arg])
+                elif kind == 'bit':
+                    # pull signal at pinidx out of the vector.
+                    # Note: DIGITAL assumes binary value.
+                    position, pinidx = arg
+                    vlen = len(simval[position][2])
+                    repl = str(simval[position][2][(vlen - 1) - pinidx])
+                elif kind == 'N':
+                    repl = str(simnum)
+                elif kind == 'RANDOM':
+                    repl = str(int(time.time() * 1000) & 0x7fffffff)
+                elif kind == 'DUT_PATH':
+                    repl = arg
+                    out.append(self.hints)
+                elif kind == 'INCLUDE_DUT':
+                    if len(self.functional) == 0:
+                        repl = arg
+                    else:
+                        out.append(self.inline())
+                        repl = '** End of in-line DUT subcircuit'
+                    out.append(self.hints)
+                elif kind == 'stack':
+                    subsline = self.stack_op(subsline, line, *arg)
+                    repl = ''
+                    no_repl_ok = True
+                elif kind == 'PIN':
+                    idx, netname = arg
+                    self.simpins[idx] = netname
+                    repl = '${PIN}'
+                elif kind == 'FUNCTIONAL':
+                    # Add <ip_name> to "functional" array.
+                    # 'FUNCTIONAL' declarations must come before 'INCLUDE_DUT' or else
+                    # substitution will not be made.  'INCLUDE_DUT' must be used in place
+                    # of 'DUT_PATH' to get the correct behavior.
+                    if arg.upper() not in self.functional:
+                        self.functional.append(arg.upper())
+                    repl = '** Using functional view for ' + arg
+
+                if not repl and default:
+                    # Use default if no match was found and default was specified
+                    repl = default
+
+                if repl:
+                    # Make the variable substitution
+                    subsline = subsline.replace(pattern, repl)
+                elif not no_repl_ok:
+                    print('Warning: Variable ' + pattern + ' had no substitution')
+
+            # Check if ${PIN} are in line.  If so, order by index and
+            # rewrite pins in order
+            if '${PIN}' in subsline:
+                for i in range(len(self.simpins)):
+                    if '${PIN}' in subsline:
+                        if self.simpins[i]:
+                            subsline = subsline.replace('${PIN}', self.simpins[i], 1)
+                        else:
+                            print("Error:  simpins is " + str(self.simpins) + '\n')
+                            print("        subsline is " + subsline + '\n')
+                            print("        i is " + str(i) + '\n')
+
+            out.append(self.verilog_include(subsline) + '\n')
+
+        return ''.join(out)
+
+# Define how to write a simulation file by making substitutions into a
+# template schematic.
+
+def substitute(filename, fileinfo, template, simvals, maxtime, schemline,
+		localmode, param, shard=None):
+    """Simulation derived by substitution into template schematic"""
+
+    # "simvals" is a ConditionProduct.  Any condition that is swept within
+    # the simulation is removed from it.  If "shard" is given as (k, n),
+    # only the k-th of n equal parts of the condition set is written.
+
+    sweepex = TestbenchTemplate.sweepex
+
+    simfilepath = fileinfo['simulation-path']
     suffix = os.path.splitext(template)[1]
-    functional = []
 
     # Read ifile into a list
     # Concatenate any continuation lines
@@ -586,22 +970,21 @@ def substitute(filename, fileinfo, template, simvals, maxtime, schemline,
                 entry = {'condition':condition}
                 sweeps.append(entry)
 
-                # Find each entry in simvals with the same condition.
-                # Record the minimum, maximum, and step for substitution, at the same
-                # time removing that item from the entry.
+                # Find the values of the condition.  Record the minimum, maximum,
+                # and step for substitution, at the same time removing the
+                # condition from the set of simulations.
                 lvals = []
                 units = ''
-                for simval in simvals:
-                    try:
-                        simrec = next(item for item in simval if item[0] == condition)
-                    except StopIteration:
-                        print('No condition = ' + condition + ' in record:\n')
-                        ptext = str(simval) + '\n'
-                        sys.stdout.buffer.write(ptext.encode('utf-8'))
-                    else:
-                        units = simrec[1]
-                        lvals.append(numeric(simrec[2]))
-                        simval.remove(simrec)
+                simrecs = simvals.condition_values(condition)
+                if simrecs is None:
+                    print('No condition = ' + condition + ' in record:\n')
+                    ptext = str(simvals.names) + '\n'
+                    sys.stdout.buffer.write(ptext.encode('utf-8'))
+                    continue
+                for simrec in simrecs:
+                    units = simrec[1]
+                    lvals.append(numeric(simrec[2]))
+                simvals.remove_condition(condition)
 
                 # Remove non-unique entries from lvals
                 lvals = list(set(lvals))
@@ -620,285 +1003,27 @@ def substitute(filename, fileinfo, template, simvals, maxtime, schemline,
                     entry['STEPS'] = "1"
                     entry['STEP'] = str(minval)
 
-    # Remove non-unique entries from simvals
-    simvals = uniquify(simvals)
+    # Netlists are numbered by their position in the full condition set,
+    # so that shards generated separately do not overlap.
+    if shard:
+        simindices = simvals.shard(*shard)
+    else:
+        simindices = range(len(simvals))
 
-    simnum = 0
     testbenches = []
-    for simval in simvals:
+    if len(simindices) == 0:
+        return testbenches
+
+    tbtemplate = TestbenchTemplate(filename, fileinfo, template, simlines, sweeps,
+		simvals.names, maxtime, schemline, param)
+
+    for simidx in simindices:
         # Create the file
-        simnum += 1
+        simval = simvals[simidx]
+        simnum = simidx + 1
         simfilename = simfilepath + '/' + filename + '_' + str(simnum) + suffix
-        controlblock = False
         with open(simfilename, 'w') as ofile:
-            for line in simlines:
-
-                # Check if the parser is in the ngspice control block section
-                if '.control' in line:
-                    controlblock = True
-                elif '.endc' in line:
-                    controlblock = False
-                elif controlblock == True:
-                    ofile.write('set sqrnoise\n')
-                    # This will need to be more nuanced if controlblock is used
-                    # to do more than just insert the noise sim hack.
-                    controlblock = False
-
-                # This will be replaced
-                subsline = line
-
-                # Find all variables to substitute
-                for patmatch in varex.finditer(line):
-                    pattern = patmatch.group(1)
-                    # If variable is in ${x=y} format, it declares a default value
-                    # Remove the =y default part and keep it for later if needed.
-                    defmatch = defaultex.match(pattern)
-                    if defmatch:
-                        default = defmatch.group(2)
-                        vpattern = '${' + defmatch.group(1) + '}'
-                    else:
-                        default = []
-                        vpattern = pattern
-
-                    repl = []
-                    no_repl_ok = False
-                    vtype = -1
-                    sweeprec = sweepex.match(vpattern)
-                    if sweeprec:
-                        sweeptype = sweeprec.group(2)
-                        condition = sweeprec.group(1)
-
-                        entry = next(item for item in sweeps if item['condition'] == condition)
-                        uval = spice_unit_convert((entry['unit'], entry[sweeptype]))
-                        repl = str(uval)
-                    else:
-                        cond = condex.match(vpattern)
-                        if cond:
-                            condition = cond.group(1)
-
-                            # Check if the condition contains a pin vector
-                            lmatch = vectrex.match(condition)
-                            if lmatch:
-                                pinidx = int(lmatch.group(2))
-                                vcondition = lmatch.group(1)
-                                vtype = 0
-                            else:
-                                lmatch = vect2rex.match(condition)
-                                if lmatch:
-                                    pinidx = int(lmatch.group(2))
-                                    vcondition = lmatch.group(1)
-                                    vtype = 1
-                                else:
-                                    lmatch = vect3rex.match(condition)
-                                    if lmatch:
-                                        pinidx = int(lmatch.group(2))
-                                        vcondition = lmatch.group(1)
-                                        vtype = 3
-                                
-                            try:
-                                 entry = next((item for item in simval if item[0] == condition))
-                            except (StopIteration, KeyError):
-                                # check against known names (to-do: change if block to array of procs)
-                                if condition == 'N':
-                                    repl = str(simnum)
-                                elif condition == 'MAXTIME':
-                                    repl = str(maxtime)
-                                elif condition == 'STEPTIME':
-                                    repl = str(maxtime / 100)
-                                elif condition == 'DUT_PATH':
-                                    repl = schempath + '/' + schemname + '\n'
-                                    # DUT_PATH is required and is a good spot to
-                                    # insert hints (but deprecated in fafor of INCLUDE_DUT)
-                                    insert_hints(param, ofile)
-                                elif condition == 'INCLUDE_DUT':
-                                    if len(functional) == 0:
-                                        repl = '.include ' + schempath + '/' + schemname + '\n'
-                                    else:
-                                        inline_dut(schempath + '/' + schemname, functional, rootpath, ofile)
-                                        repl = '** End of in-line DUT subcircuit'
-                                    insert_hints(param, ofile)
-                                elif condition == 'DUT_CALL':
-                                    repl = schemline
-                                elif condition == 'DUT_NAME':
-                                    # This verifies pin list of schematic vs. the netlist.
-                                    repl = schemline.split()[-1]
-                                elif condition == 'FILENAME':
-                                    repl = filename
-                                elif condition == 'RANDOM':
-                                    repl = str(int(time.time() * 1000) & 0x7fffffff)
-                                # Stack math operators.  Perform specified math
-                                # operation on the last two values and replace.
-                                #
-                                # Note that ngspice is finicky about space around "=" so
-                                # handle this in a way that keeps ngspice happy.
-                                elif condition == '+':
-                                    smatch = varex.search(subsline)
-                                    watchend = smatch.start()
-                                    ltok = subsline[0:watchend].replace('=', ' = ').split()
-                                    ntok = ltok[:-2]
-                                    ntok.append(str(numeric(ltok[-2]) + numeric(ltok[-1])))
-                                    subsline = ' '.join(ntok).replace(' = ', '=') + line[patmatch.end():]
-                                    repl = ''
-                                    no_repl_ok = True
-                                elif condition == '-':
-                                    smatch = varex.search(subsline)
-                                    watchend = smatch.start()
-                                    ltok = subsline[0:watchend].replace('=', ' = ').split()
-                                    ntok = ltok[:-2]
-                                    ntok.append(str(numeric(ltok[-2]) - numeric(ltok[-1])))
-                                    subsline = ' '.join(ntok).replace(' = ', '=') + line[patmatch.end():]
-                                    repl = ''
-                                    no_repl_ok = True
-                                elif condition == '*':
-                                    smatch = varex.search(subsline)
-                                    watchend = smatch.start()
-                                    ltok = subsline[0:watchend].replace('=', ' = ').split()
-                                    ntok = ltok[:-2]
-                                    ntok.append(str(numeric(ltok[-2]) * numeric(ltok[-1])))
-                                    subsline = ' '.join(ntok).replace(' = ', '=') + line[patmatch.end():]
-                                    repl = ''
-                                    no_repl_ok = True
-                                elif condition == '/':
-                                    smatch = varex.search(subsline)
-                                    watchend = smatch.start()
-                                    ltok = subsline[0:watchend].replace('=', ' = ').split()
-                                    ntok = ltok[:-2]
-                                    ntok.append(str(numeric(ltok[-2]) / numeric(ltok[-1])))
-                                    subsline = ' '.join(ntok).replace(' = ', '=') + line[patmatch.end():]
-                                    repl = ''
-                                    no_repl_ok = True
-                                elif condition == 'MAX':
-                                    smatch = varex.search(subsline)
-                                    watchend = smatch.start()
-                                    ltok = subsline[0:watchend].replace('=', ' = ').split()
-                                    ntok = ltok[:-2]
-                                    ntok.append(str(max(numeric(ltok[-2]), numeric(ltok[-1]))))
-                                    subsline = ' '.join(ntok).replace(' = ', '=') + line[patmatch.end():]
-                                    repl = ''
-                                    no_repl_ok = True
-                                elif condition == 'MIN':
-                                    smatch = varex.search(subsline)
-                                    watchend = smatch.start()
-                                    ltok = subsline[0:watchend].replace('=', ' = ').split()
-                                    ntok = ltok[:-2]
-                                    ntok.append(str(min(numeric(ltok[-2]), numeric(ltok[-1]))))
-                                    subsline = ' '.join(ntok).replace(' = ', '=') + line[patmatch.end():]
-                                    repl = ''
-                                    no_repl_ok = True
-                                # 'NEG' acts on only the previous value in the string.
-                                elif condition == 'NEG':
-                                    smatch = varex.search(subsline)
-                                    watchend = smatch.start()
-                                    ltok = subsline[0:watchend].replace('=', ' = ').split()
-                                    ntok = ltok[:-1]
-                                    ntok.append(str(-numeric(ltok[-1])))
-                                    subsline = ' '.join(ntok).replace(' = ', '=') + line[patmatch.end():]
-                                    repl = ''
-                                    no_repl_ok = True
-                                # 'INT' also acts on only the previous value in the string.
-                                elif condition == 'INT':
-                                    smatch = varex.search(subsline)
-                                    watchend = smatch.start()
-                                    ltok = subsline[0:watchend].replace('=', ' = ').split()
-                                    ntok = ltok[:-1]
-                                    ntok.append(str(int(ltok[-1])))
-                                    subsline = ' '.join(ntok).replace(' = ', '=') + line[patmatch.end():]
-                                    repl = ''
-                                    no_repl_ok = True
-                                elif condition.find('PIN:') == 0:
-                                    # Parse for ${PIN:<pin_name>:<net_name>}
-                                    # Replace <pin_name> with index of pin from DUT subcircuit
-                                    pinrec = pinex.match(condition)
-                                    pinname = pinrec.group(1).upper()
-                                    netname = pinrec.group(2).upper()
-                                    try:
-                                       idx = schempins.index(pinname)
-                                    except ValueError:
-                                       repl = netname
-                                    else:
-                                       repl = '${PIN}'
-                                       simpins[idx] = netname
-                                elif condition.find('FUNCTIONAL:') == 0:
-                                    # Parse for ${FUNCTIONAL:<ip_name>}
-                                    # Add <ip_name> to "functional" array.
-                                    # 'FUNCTIONAL' declarations must come before 'INCLUDE_DUT' or else
-                                    # substitution will not be made.  'INCLUDE_DUT' must be used in place
-                                    # of 'DUT_PATH' to get the correct behavior.
-                                    funcrec = funcrex.match(condition)
-                                    ipname = funcrec.group(1)
-                                    functional.append(ipname.upper())
-                                    repl = '** Using functional view for ' + ipname
-                                else:
-                                    if lmatch:
-                                        try:
-                                            entry = next((item for item in simval if item[0].split('[')[0].split('<')[0] == vcondition))
-                                        except:
-                                            if vtype == 3:
-                                                for entry in simval:
-                                                    lmatch = vect3rex.match(entry[0])
-                                                    if lmatch:
-                                                        if lmatch.group(1) == vcondition:
-                                                            vlen = len(entry[2])
-                                                            uval = entry[2][(vlen - 1) - pinidx]
-                                                            repl = str(uval)
-                                                            break
-                                            else:
-                                                # if no match, subsline remains as-is.
-                                                pass
-                                        else:
-                                            # Handle as vector bit slice (see below)
-                                            vlen = len(entry[2])
-                                            uval = entry[2][(vlen - 1) - pinidx]
-                                            repl = str(uval)
-                                    # else if no match, subsline remains as-is.
-
-                            else:
-                                if lmatch:
-                                    # pull signal at pinidx out of the vector.
-                                    # Note: DIGITAL assumes binary value.  May want to
-                                    # allow general case of real-valued vectors, which would
-                                    # require a spice unit conversion routine without indexing.
-                                    vlen = len(entry[2])
-                                    uval = entry[2][(vlen - 1) - pinidx]
-                                else:
-                                    uval = spice_unit_convert(entry[1:])
-                                repl = str(uval)
-
-                    if not repl and default:
-                        # Use default if no match was found and default was specified
-                        repl = default
-
-                    if repl:
-                        # Make the variable substitution
-                        subsline = subsline.replace(pattern, repl)
-                    elif not no_repl_ok:
-                        print('Warning: Variable ' + pattern + ' had no substitution')
-
-                # Check if ${PIN} are in line.  If so, order by index and
-                # rewrite pins in order
-                for i in range(len(simpins)):
-                    if '${PIN}' in subsline:
-                        if simpins[i]:
-                            subsline = subsline.replace('${PIN}', simpins[i], 1)
-                        else:
-                            print("Error:  simpins is " + str(simpins) + '\n')
-                            print("        subsline is " + subsline + '\n')
-                            print("        i is " + str(i) + '\n')
-
-                # Check for a verilog include file, and if any is found, copy it
-                # to the target simulation directory.  Replace any leading path
-                # with the local current working directory '.'.
-                vmatch = vinclrex.match(subsline)
-                if vmatch:
-                    incfile = vmatch.group(1)
-                    incroot = os.path.split(incfile)[1]
-                    curpath = os.path.split(template)[0]
-                    incpath = os.path.abspath(os.path.join(curpath, incfile))
-                    shutil.copy(incpath, simfilepath + '/' + incroot)
-                    subsline = '   `include "./' + incroot + '"'
-
-                # Write the modified output line (with variable substitutions)
-                ofile.write(subsline + '\n')
+            ofile.write(tbtemplate.render(simval, simnum))
 
         # Add information about testbench file and conditions to datasheet JSON,
         # which can be parsed by cace_launch.py.
@@ -912,7 +1037,7 @@ def substitute(filename, fileinfo, template, simvals, maxtime, schemline,
 
 # Define how to write simulation devices
 
-def generate_simfiles(datatop, fileinfo, arguments, methods, localmode):
+def generate_simfiles(datatop, fileinfo, arguments, methods, localmode, shard=None):
 
     # pull out the relevant part, which is "data-sheet"
     dsheet = datatop['data-sheet']
@@ -1168,28 +1293,9 @@ def generate_simfiles(datatop, fileinfo, arguments, methods, localmode):
 
         list.sort(lcondlist, key=lambda k: k['order'])
 
-        # Find the length of each generator
-        cgenlen = []
-        for cond in lcondlist:
-            cgenlen.append(len(list(condition_gen(cond))))
-
-        # The lengths of all generators multiplied together is the number of
-        # simulations to be run
-        numsims = reduce(lambda x, y: x * y, cgenlen)
-        rlen = [x for x in cgenlen]	# note floor division operator
-
-        # This code repeats each condition as necessary such that the final list
-        # (transposed) is a complete set of unique condition combinations.
-        cgensim = []
-        for i in range(len(rlen)):
-            mpre = reduce(lambda x, y: x * y, rlen[0:i], 1)
-            mpost = reduce(lambda x, y: x * y, rlen[i + 1:], 1)
-            clist = list(condition_gen(lcondlist[i]))
-            duplist = [item for item in list(condition_gen(lcondlist[i])) for j in range(mpre)]
-            cgensim.append(duplist * mpost)
-
-        # Transpose this list
-        simvals = list(map(list, zip(*cgensim)))
+        # The complete set of unique condition combinations.  Combinations
+        # are generated one at a time as the netlists are written.
+        simvals = ConditionProduct(lcondlist)
 
         # Generate filename prefix for this electrical parameter
         filename = testbench + fsuffix
@@ -1209,7 +1315,7 @@ def generate_simfiles(datatop, fileinfo, arguments, methods, localmode):
 
         if os.path.isfile(template):
             param['testbenches'] = substitute(filename, fileinfo, template,
-			simvals, maxtime, schemline, localmode, param)
+			simvals, maxtime, schemline, localmode, param, shard)
 
             # For cosimulations, if there is a '.tv' file corresponding to the '.spice' file,
             # then make substitutions as for the .spice file, and place in characterization
@@ -1218,7 +1324,7 @@ def generate_simfiles(datatop, fileinfo, arguments, methods, localmode):
             vtemplate = testbenchpath + '/' + testbench.lower() + '.tv'
             if os.path.isfile(vtemplate):
                 substitute(filename, fileinfo, vtemplate,
-			simvals, maxtime, schemline, localmode, param)
+			simvals, maxtime, schemline, localmode, param, shard)
 
         else:
             print('Error:  No testbench file ' + template + '.')
@@ -1254,47 +1360,27 @@ def generate_simfiles(datatop, fileinfo, arguments, methods, localmode):
 
     return prescore
 
-def check_layout_out_of_date(spicepath, layoutpath):
+def check_layout_out_of_date(spicepath, layoutpath, index=None):
     # Check if a netlist (spicepath) is out-of-date relative to the layouts
-    # (layoutpath).  Need to read the netlist and check all of the subcells.
+    # (layoutpath) of the top level and all of the subcells.  The subcells
+    # and file dates are kept in the project's netlist index.
     need_capture = False
     if not os.path.isfile(spicepath):
         need_capture = True
     elif not os.path.isfile(layoutpath):
         need_capture = True
     else:
-        spi_statbuf = os.stat(spicepath)
-        lay_statbuf = os.stat(layoutpath)
-        if spi_statbuf.st_mtime < lay_statbuf.st_mtime:
+        if not index:
+            index = netlist_index.NetlistIndex()
+        if index.layout_out_of_date(spicepath, layoutpath):
             # netlist exists but is out-of-date
             need_capture = True
-        else:
-            # only found that the top-level-layout is older than the
-            # netlist.  Now need to read the netlist, find all subcircuits,
-            # and check those dates, too.
-            layoutdir = os.path.split(layoutpath)[0]
-            subrex = re.compile('^[^\*]*[ \t]*.subckt[ \t]+([^ \t]+).*$', re.IGNORECASE)
-            with open(spicepath, 'r') as ifile:
-                duttext = ifile.read()
-            dutlines = duttext.replace('\n+', ' ').splitlines()
-            for line in dutlines:
-                lmatch = subrex.match(line)
-                if lmatch:
-                    subname = lmatch.group(1)
-                    sublayout = layoutdir + '/' + subname + '.mag'
-                    # subcircuits that cannot be found in the current directory are
-                    # assumed to be library components and therefore never out-of-date.
-                    if os.path.exists(sublayout):
-                        sub_statbuf = os.stat(sublayout)
-                        if spi_statbuf.st_mtime < lay_statbuf.st_mtime:
-                            # netlist exists but is out-of-date
-                            need_capture = True
-                            break
     return need_capture
 
-def check_schematic_out_of_date(spicepath, schempath):
+def check_schematic_out_of_date(spicepath, schempath, index=None):
     # Check if a netlist (spicepath) is out-of-date relative to the schematics
-    # (schempath).  Need to read the netlist and check all of the subcells.
+    # (schempath) of the top level and all of the subcells.  The subcells
+    # and file dates are kept in the project's netlist index.
     need_capture = False
     if not os.path.isfile(spicepath):
         print('Schematic-captured netlist does not exist.  Need to regenerate.')
@@ -1302,45 +1388,18 @@ def check_schematic_out_of_date(spicepath, schempath):
     elif not os.path.isfile(schempath):
         need_capture = True
     else:
-        spi_statbuf = os.stat(spicepath)
-        sch_statbuf = os.stat(schempath)
+        if not index:
+            index = netlist_index.NetlistIndex()
         print('DIAGNOSTIC:  Comparing ' + spicepath + ' to ' + schempath)
-        if spi_statbuf.st_mtime < sch_statbuf.st_mtime:
+        subschem = index.schematic_out_of_date(spicepath, schempath)
+        if subschem == schempath:
             # netlist exists but is out-of-date
             print('Netlist is older than top-level schematic')
             need_capture = True
-        else:
-            print('Netlist is newer than top-level schematic, but must check subcircuits')
-            # only found that the top-level-schematic is older than the
-            # netlist.  Now need to read the netlist, find all subcircuits,
-            # and check those dates, too.
-            schemdir = os.path.split(schempath)[0]
-            schrex = re.compile('\*\*[ \t]*sch_path:[ \t]*([^ \t\n]+)', re.IGNORECASE)
-            subrex = re.compile('^[^\*]*[ \t]*.subckt[ \t]+([^ \t]+).*$', re.IGNORECASE)
-            with open(spicepath, 'r') as ifile:
-                duttext = ifile.read()
-
-            dutlines = duttext.replace('\n+', ' ').splitlines()
-            for line in dutlines:
-                # xschem helpfully adds a "sch_path" comment line for every subcircuit
-                # coming from a separate schematic file.
-
-                lmatch = schrex.match(line)
-                if lmatch:
-                    subschem = lmatch.group(1)
-                    subfile = os.path.split(subschem)[1]
-                    subname = os.path.splitext(subfile)[0]
-
-                    # subcircuits that cannot be found in the current directory are
-                    # assumed to be library components or read-only IP components and
-                    # therefore never out-of-date.
-                    if os.path.exists(subschem):
-                        sub_statbuf = os.stat(subschem)
-                        if spi_statbuf.st_mtime < sch_statbuf.st_mtime:
-                            # netlist exists but is out-of-date
-                            print('Netlist is older than subcircuit schematic ' + subname)
-                            need_capture = True
-                            break
+        elif subschem:
+            subname = os.path.splitext(os.path.split(subschem)[1])[0]
+            print('Netlist is older than subcircuit schematic ' + subname)
+            need_capture = True
     return need_capture
 
 def printwarn(output):
@@ -1646,15 +1705,17 @@ def regenerate_netlists(localmode, dspath, dsheet):
     if localmode and ('netlist-source' in dsheet) and (not force_regenerate):
         print("Checking for out-of-date netlists.\n")
         netlist_source = dsheet['netlist-source']
-        need_sch_capture = check_schematic_out_of_date(schnetlist, schempath)
+        index = netlist_index.NetlistIndex(dspath)
+        need_sch_capture = check_schematic_out_of_date(schnetlist, schempath, index)
         if netlist_source == 'layout':
             netlist_path = pexnetlist
-            need_pex_extract = check_layout_out_of_date(pexnetlist, layoutpath)
-            need_lvs_extract = check_layout_out_of_date(laynetlist, layoutpath)
+            need_pex_extract = check_layout_out_of_date(pexnetlist, layoutpath, index)
+            need_lvs_extract = check_layout_out_of_date(lvsnetlist, layoutpath, index)
         else:
             netlist_path = schnetlist
             need_lvs_extract = False
             need_pex_extract = False
+        index.save()
     else:
         if not localmode:
             print("Remote use, ", end='');
@@ -1724,7 +1785,7 @@ def regenerate_netlists(localmode, dspath, dsheet):
         if need_lvs_extract:
             mproc.stdin.write("ext2spice cthresh infinite\n")
             mproc.stdin.write("ext2spice rthresh infinite\n")
-            mproc.stdin.write("ext2spice -o " + laynetlist + "\n")
+            mproc.stdin.write("ext2spice -o " + lvsnetlist + "\n")
         if need_pex_extract:
             mproc.stdin.write("ext2spice cthresh 0.005\n")
             mproc.stdin.write("ext2spice rthresh 1\n")
@@ -1735,12 +1796,12 @@ def regenerate_netlists(localmode, dspath, dsheet):
         if mproc.returncode != 0:
             print('Magic process returned error code ' + str(mproc.returncode) + '\n')
 
-        if need_lvs_extract and not os.path.isfile(laynetlist):
+        if need_lvs_extract and not os.path.isfile(lvsnetlist):
             print('Error:  No LVS netlist extracted from magic.')
         if need_pex_extract and not os.path.isfile(pexnetlist):
             print('Error:  No parasitic extracted netlist extracted from magic.')
 
-        if (mproc.returncode != 0) or (need_lvs_extract and not os.path.isfile(laynetlist)) or (need_pex_extract and not os.path.isfile(pexnetlist)):
+        if (mproc.returncode != 0) or (need_lvs_extract and not os.path.isfile(lvsnetlist)) or (need_pex_extract and not os.path.isfile(pexnetlist)):
             return False
 
         if need_pex_extract and os.path.isfile(pexnetlist):
@@ -1862,6 +1923,20 @@ if __name__ == '__main__':
         print('      test mode:  do not post results to the marketplace')
         print(' -nosim')
         print('      test mode:  set up all files for simulation but do not simulate')
+        print(' -jobs=<N>')
+        print('      run up to N simulations in parallel (0 = number of CPUs)')
+        print(' -shared[=<path>]')
+        print('      run ngspice in long-lived sessions through its shared library')
+        print('      (libngspice, or the library at <path>)')
+        print(' -nocache')
+        print('      always simulate, ignoring results cached from earlier runs')
+        print(' -cachedir=<path>')
+        print('      is the location of the simulation result cache (default ~/.cache/cace)')
+        print(' -cachesize=<MB>')
+        print('      is the size limit of the simulation result cache (default 2048)')
+        print(' -shard=<k>/<n>')
+        print("      generate and simulate only the k-th of n parts of each parameter's")
+        print('      set of conditions (e.g., to split a large sweep across machines)')
         sys.exit(0)
 
     simulation_path = []
@@ -1871,6 +1946,7 @@ if __name__ == '__main__':
     layout_path = []
     datasheet_name = []
     methods = []
+    shard = None
     for option in options[:]:
         result = option.split('=')
         if result[0] == '-simdir':
@@ -1899,6 +1975,15 @@ if __name__ == '__main__':
             options.remove(option)
         elif result[0] == '-local':
             localmode = True
+        elif result[0] == '-shard':
+            try:
+                shard = tuple(int(i) for i in result[1].split('/'))
+                if len(shard) != 2 or shard[0] < 1 or shard[0] > shard[1]:
+                    raise ValueError
+            except (IndexError, ValueError):
+                print('Error:  Option -shard requires the form -shard=<k>/<n>, 1 <= k <= n.')
+                sys.exit(1)
+            options.remove(option)
 
     # To be valid, must either have a root path or all other options must have been
     # specified with full paths.
@@ -2074,7 +2159,7 @@ if __name__ == '__main__':
     fileinfo['root-path'] = root_path
 
     # Generate the simulation files
-    prescore = generate_simfiles(datatop, fileinfo, arguments, methods, localmode)
+    prescore = generate_simfiles(datatop, fileinfo, arguments, methods, localmode, shard)
     if prescore == 'fail':
         # In case of failure
         options.append('-score=fail')
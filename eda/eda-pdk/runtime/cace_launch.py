@@ -10,8 +10,10 @@ annotated structure is passed back to the marketplace.
 
 # NOTE:  This file is only a local stand-in for the script that launches
 # and manages jobs in parallel and that communicates job status with the
-# front-end.  This stand-alone version should not be used for any significant
-# project, as all simulations are run sequentially and will tie up resources.
+# front-end.  By default all simulations are run sequentially and will tie
+# up resources.  Use the option -jobs=N to run up to N simulations at once.
+# Use the option -shared to run ngspice in long-lived sessions through its
+# shared library (libngspice) instead of starting it for every testbench.
 
 import os
 import sys
@@ -25,11 +27,18 @@ import datetime
 import requests
 import subprocess
 import faulthandler
+import io
+from concurrent.futures import ThreadPoolExecutor
 from spiceunits import spice_unit_unconvert
 from spiceunits import spice_unit_convert
 
+import numpy as np
+
 import file_compressor
 import cace_makeplot
+import cace_rawfile
+import cace_simcache
+import cace_ngshared
 
 # Fix this. . .
 simulation_path = ""
@@ -43,6 +52,15 @@ netlist_path = []
 root_path = []
 hashname = ""
 spiceproc = None
+spiceprocs = []		# Simulations running in the worker pool (-jobs=N)
+simpool = None
+jobs = 1
+sessionpool = None	# ngspice shared library sessions (-shared)
+sharedmode = False
+sharedlib = None
+cachemode = True
+cachedir = cace_simcache.default_cachedir
+cachesize = cace_simcache.default_cachesize
 localmode = False
 bypassmode = False
 statdoc = {}
@@ -73,10 +91,19 @@ def cleanup_exit(signum, frame):
     global spiceproc
     global statdoc
     global localmode
-    if spiceproc:
+    if simpool:
+        # Do not start any simulations still waiting in the queue
+        simpool.shutdown(wait=False, cancel_futures=True)
+    if sessionpool:
+        sessionpool.terminate()
+    if spiceproc or spiceprocs:
         print("CACE launch:  Termination signal received.")
+    if spiceproc:
         spiceproc.terminate()
         spiceproc.wait()
+    for proc in spiceprocs[:]:
+        proc.terminate()
+        proc.wait()
 
     # Remove simulation files
     print("CACE launch:  Simulations have been terminated.")
@@ -112,6 +139,71 @@ def cleanup_exit(signum, frame):
     # Exit
     sys.exit(0)
 
+# Stand-in for the Popen object of a simulation that was run to completion
+# in the worker pool.  The captured output is replayed line by line, so
+# that the results are parsed exactly as they are when read from a running
+# simulator.  "datafiles" holds the columns of data files that were
+# collected in memory by an ngspice shared library session.
+
+class CompletedSimulation(object):
+    def __init__(self, returncode, output, datafiles=None):
+        self.returncode = returncode
+        self.stdout = io.StringIO(output)
+        self.datafiles = datafiles if datafiles is not None else {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.stdout.close()
+
+    def wait(self):
+        return self.returncode
+
+    def terminate(self):
+        pass
+
+# Run a simulation in the worker pool and capture its output.  The process
+# is tracked in "spiceprocs" so that it can be stopped by cleanup_exit().
+
+def run_simulation(simulator, simargs, filename, env):
+    proc = subprocess.Popen([simulator, *simargs, filename],
+		stdout=subprocess.PIPE, universal_newlines=True, env=env)
+    spiceprocs.append(proc)
+    try:
+        output = proc.communicate()[0]
+    finally:
+        spiceprocs.remove(proc)
+    return CompletedSimulation(proc.returncode, output)
+
+# Run an ngspice simulation in a shared library session (-shared).  If the
+# session fails, the simulation is run again with the ngspice executable.
+
+def run_shared_simulation(filename, env):
+    try:
+        returncode, output, datafiles = sessionpool.run(filename)
+    except cace_ngshared.SessionError as e:
+        print('ngspice session failed (' + str(e) + ');  running ngspice -b ' + filename)
+        return run_simulation('ngspice', ['-b'], filename, env)
+    return CompletedSimulation(returncode, output, datafiles)
+
+# Environment used to run ngspice in batch mode.  Copies the PDK's ngspice
+# configuration into the simulation directory if one is not already there.
+
+def ngspice_environment():
+    my_env = os.environ.copy()
+    # Do not generate LXT files, as CACE does not have any methods to handle
+    # the data in them anyway.
+    my_env['NGSPICE_LXT2NO'] = '1'
+
+    # Is there a .spiceinit file in the simulation directory, and is
+    # one needed?
+    if not os.path.exists('.spiceinit'):
+        if os.path.exists(PDK_ROOT + node + '/libs.tech/ngspice/spinit'):
+            print('Copying ngspice configuration file from PDK.')
+            shutil.copy(PDK_ROOT + node + '/libs.tech/ngspice/spinit', '.spiceinit')
+    return my_env
+
 # Handling of 2s complement values in calculations (e.g., "1000" is -8, not +8)
 # If a value should be unsigned, then the units for the value should be one bit
 # larger than represented.  e.g., if unit = "4'b" and value = "1000" then value
@@ -123,6 +215,100 @@ def twos_complement(val, bits):
         val = val - (1 << bits)        # compute negative value
     return val                         # return positive value as is
 
+# Vector handling for measurements and calculations.  Results and
+# conditions are collected as lists, or as NumPy arrays when read from
+# raw files.  Both are converted to arrays so that filters and reductions
+# work on whole columns at once.
+
+def column_array(vector):
+    # Numeric values become a float or integer array.  Anything else (e.g.,
+    # corner names or digital values kept as strings) becomes an object
+    # array, so that comparisons behave exactly as they do on the list.
+    if isinstance(vector, np.ndarray):
+        return vector
+    array = np.asarray(vector)
+    if array.ndim != 1 or array.dtype.kind not in 'biuf':
+        array = np.empty(len(vector), dtype=object)
+        array[:] = vector
+    return array
+
+def masked_values(vector, mask):
+    # Select entries of "vector" where "mask" is True.  Like zip(), only
+    # the length common to both is considered.
+    n = min(len(vector), len(mask))
+    return vector[:n][mask[:n]]
+
+def first_index(mask):
+    # Index of the first True entry of a boolean vector, or None.
+    if len(mask) == 0:
+        return None
+    idx = int(np.argmax(mask))
+    if not mask[idx]:
+        return None
+    return idx
+
+def last_index(mask):
+    # Index of the last True entry of a boolean vector, or None.
+    idx = first_index(mask[::-1])
+    if idx is None:
+        return None
+    return len(mask) - 1 - idx
+
+def time_index(timevector, time, default):
+    # Index of the first time point at or after "time", or "default".
+    idx = first_index(timevector >= time)
+    if idx is None:
+        return default
+    return idx
+
+def vector_min(vector):
+    # Minimum with the same result as the builtin min():  NaN values are
+    # skipped, unless the first value is NaN, in which case it is returned.
+    if vector.dtype.kind != 'f':
+        return min(vector)
+    if np.isnan(vector[0]):
+        return vector[0]
+    return np.nanmin(vector)
+
+def vector_max(vector):
+    # Maximum with the same result as the builtin max() (see vector_min()).
+    if vector.dtype.kind != 'f':
+        return max(vector)
+    if np.isnan(vector[0]):
+        return vector[0]
+    return np.nanmax(vector)
+
+# Lookup table from ASCII character code to digit value (-1 if not a digit)
+digit_values = np.full(256, -1, dtype=np.int64)
+for c in range(10):
+    digit_values[ord('0') + c] = c
+for c in range(6):
+    digit_values[ord('a') + c] = 10 + c
+    digit_values[ord('A') + c] = 10 + c
+
+def decode_digital(data, base, digits):
+    # Convert a vector of binary, octal, decimal, or hex strings to signed
+    # integers of width "digits" (see twos_complement()).  Plain digit
+    # strings that fit in 62 bits are converted all at once;  anything else
+    # (signs, prefixes, very wide words) goes through int().
+    strings = np.asarray(data, dtype=str)
+    width = max(strings.dtype.itemsize // 4, 1)
+    if 0 < digits <= 62 and width * math.log2(base) <= 62:
+        try:
+            codes = np.char.rjust(strings, width, '0').astype('S' + str(width))
+        except UnicodeEncodeError:
+            codes = None
+        if codes is not None:
+            values = digit_values[codes.view(np.uint8).reshape(-1, width)]
+            if len(values) > 0 and values.min() >= 0 and values.max() < base \
+			and np.char.str_len(strings).min() > 0:
+                weights = base ** np.arange(width - 1, -1, -1, dtype=np.int64)
+                a = values @ weights
+                sign = 1 << (digits - 1)
+                a = np.where(a & sign, a - (1 << digits), a)
+                return a.tolist()
+    return list(twos_complement(int(x, base), digits) for x in data)
+
 # Calculation of results from collected data for an output record,
 # given the type of calculation to perform in 'calctype'.  Known
 # calculations are minimum, maximum, and average (others can be
@@ -146,6 +332,7 @@ def calculate(record, rawdata, conditions, calcrec, score, units, param):
 
     binrex = re.compile(r'([0-9]*)\'([bodh])', re.IGNORECASE)
 
+    rawdata = column_array(rawdata)
     data = rawdata
     if 'filter' in record:
         # Filter data by condition range.
@@ -156,11 +343,11 @@ def calculate(record, rawdata, conditions, calcrec, score, units, param):
             # Pick data according to filter, which specifies a condition and value, or condition
             # and range of values in the form "a:b".  Syntax is limited and needs to be expanded. 
             if condition in conditions:
-                condvec = conditions[condition]
+                condvec = column_array(conditions[condition])
                 if len(valuerange) == 2:
                     valuemin = int(valuerange[0])
                     valuemax = int(valuerange[1])
-                    data = list(i for i, j in zip(rawdata, condvec) if j >= valuemin and j <= valuemax)
+                    data = masked_values(rawdata, (condvec >= valuemin) & (condvec <= valuemax))
                 else:
                     try:
                         valueonly = float(valuerange[0])
@@ -168,15 +355,20 @@ def calculate(record, rawdata, conditions, calcrec, score, units, param):
                         valueonly = valuerange[0]
                     vtype = type(valueonly)
                     if vtype == type('str') or vtype == type('int'):
-                        data = list(i for i, j in zip(rawdata, condvec) if j == valueonly)
-                        if not data:
+                        if condvec.dtype == object:
+                            mask = condvec == valueonly
+                        else:
+                            # Numbers never match a string
+                            mask = np.zeros(len(condvec), dtype=bool)
+                        data = masked_values(rawdata, mask)
+                        if len(data) == 0:
                             print('Error: no data match ' + condition + ' = ' + str(valueonly))
                             data = rawdata
                     else:
                         # Avoid round-off problems from floating-point values
                         d = valueonly * 0.001
-                        data = list(i for i, j in zip(rawdata, condvec) if j - d < valueonly and j + d > valueonly)
-                        if not data:
+                        data = masked_values(rawdata, (condvec - d < valueonly) & (condvec + d > valueonly))
+                        if len(data) == 0:
                             print('Error: no data match ' + condition + ' ~= ' + str(valueonly))
                             data = rawdata
 
@@ -186,7 +378,7 @@ def calculate(record, rawdata, conditions, calcrec, score, units, param):
         elif record['filter'] == 'typ' or record['filter'] == 'typical':
 
             # Create a boolean vector to track which results are under typical conditions
-            typvec = [True] * len(rawdata)
+            typvec = np.ones(len(rawdata), dtype=bool)
             for condition in conditions:
                 # Pull record of the condition (this must exist by definition)
                 condrec = next(item for item in param['conditions'] if item['condition'] == condition)
@@ -196,11 +388,15 @@ def calculate(record, rawdata, conditions, calcrec, score, units, param):
                     valueonly = float(condrec['typ'])
                 except ValueError:
                     valueonly = condrec['typ']
-                condvec = conditions[condition]
-                typloc = list(i == valueonly for i in condvec)
-                typvec = list(i and j for i, j in zip(typloc, typvec))
+                condvec = column_array(conditions[condition])
+                if condvec.dtype != object and isinstance(valueonly, str):
+                    typloc = np.zeros(len(condvec), dtype=bool)
+                else:
+                    typloc = condvec == valueonly
+                n = min(len(typloc), len(typvec))
+                typvec = typvec[:n] & typloc[:n]
             # Limit data to marked entries
-            data = list(i for i, j in zip(rawdata, typvec) if j)
+            data = masked_values(rawdata, typvec)
     try:
         calctype, limittype = calcrec.split('-')
     except ValueError:
@@ -221,7 +417,7 @@ def calculate(record, rawdata, conditions, calcrec, score, units, param):
     # Quick format sanity check---may need binary or hex conversion
     # using the new method of letting units be 'b or 'h, etc.
     # (to be done:  signed conversion, see cace_makeplot.py)
-    if type(data[0]) == type('str'):
+    if isinstance(data[0], str):
         bmatch = binrex.match(units)
         if (bmatch):
             digits = bmatch.group(1)
@@ -231,17 +427,17 @@ def calculate(record, rawdata, conditions, calcrec, score, units, param):
                 digits = int(digits)
             base = bmatch.group(2)
             if base == 'b':
-                a = list(int(x, 2) for x in data)
+                data = decode_digital(data, 2, digits)
             elif base == 'o':
-                a = list(int(x, 8) for x in data)
+                data = decode_digital(data, 8, digits)
             elif base == 'd':
-                a = list(int(x, 10) for x in data)
+                data = decode_digital(data, 10, digits)
             else:
-                a = list(int(x, 16) for x in data)
-            data = list(twos_complement(x, digits) for x in a)
+                data = decode_digital(data, 16, digits)
+            data = column_array(data)
         else:
             print("Warning: result data do not correspond to specified units.")
-            print("Data = " + str(data))
+            print("Data = " + str(data.tolist()))
             return 0
 
     # The target and result should both match the specified units, so convert
@@ -273,17 +469,19 @@ def calculate(record, rawdata, conditions, calcrec, score, units, param):
 
     if calctype == 'min':
         # Result is the minimum of the data
-        value = min(data)
+        value = vector_min(data)
     elif calctype == 'max':
         # Result is the maximum of the data
-        value = max(data)
+        value = vector_max(data)
     elif calctype == 'avg':
-        # Result is the average of the data
-        value = sum(data) / len(data)
+        # Result is the average of the data.  The sums are python sum() over
+        # python values, not np.sum(), whose pairwise summation can change
+        # the last bits of the result and so the score.
+        value = sum(data.tolist()) / len(data)
     elif calctype[0:3] == 'std':
         # Result is the standard deviation of the data
-        mean = sum(data) / len(data)
-        value = pow(sum([((i - mean) * (i - mean)) for i in data]) / len(data), 0.5)
+        mean = sum(data.tolist()) / len(data)
+        value = pow(sum(((data - mean) * (data - mean)).tolist()) / len(data), 0.5)
         # For "stdX", where "X" is an integer, multiply the standard deviation by X
         if len(calctype) > 3:
             value *= int(calctype[3])
@@ -296,12 +494,16 @@ def calculate(record, rawdata, conditions, calcrec, score, units, param):
             elif calctype[4] == 'p':
                 value = mean + value
     elif calctype == 'diffmax':
-        value = max(data) - min(data)
+        value = vector_max(data) - vector_min(data)
     elif calctype == 'diffmin':
-        value = min(data) - max(data)
+        value = vector_min(data) - vector_max(data)
     else:
         return 0
 
+    # Scores are computed on plain python values
+    if isinstance(value, np.generic):
+        value = value.item()
+
     try:
         record['value'] = '{0:.4g}'.format(value)
     except ValueError:
@@ -603,6 +805,8 @@ def apply_measure(varresult, measure, variables):
     # Apply a measurement (record "measure") using vectors found in
     # "varresult" and produce new vectors which overwrite the original
     # ones.  Operations may reduce "varresult" vectors to a single value.
+    # All vectors are converted to NumPy arrays and operated on as whole
+    # columns.
 
     # 'condition' defaults to TIME;  but this only applies to transient analysis data!
     if 'condition' in measure:
@@ -640,6 +844,9 @@ def apply_measure(varresult, measure, variables):
         else:
             activeunit = ''
 
+    for key in varresult:
+        varresult[key] = column_array(varresult[key])
+
     try:
         activetrace = varresult[condition]
     except KeyError:
@@ -661,13 +868,36 @@ def apply_measure(varresult, measure, variables):
             else:
                 timeunit = 's'
     else:
-        timevector = []
+        timevector = column_array([])
         timeunit = ''
 
     calctype = measure['calc']
     # Diagnostic
     # print("Measure calctype = " + calctype)
 
+    # Most measurements operate on a time range given by 'from' and 'to'.
+    # fromidx is the first point at or after the start time, and toidx is
+    # one past the first point at or after the end time.
+    if calctype in ['CLIP', 'MEAN', 'RISINGEDGE', 'FALLINGEDGE', 'STABLETIME', 'INSIDE']:
+        if len(timevector) == 0:
+            return
+        if 'from' in measure:
+            fromtime = float(spice_unit_convert([timeunit, measure['from'], 'time']))
+        else:
+            fromtime = timevector[0] 
+        if 'to' in measure:
+            totime = float(spice_unit_convert([timeunit, measure['to'], 'time']))
+        else:
+            totime = timevector[-1]
+
+        fromidx = time_index(timevector, fromtime, len(timevector) - 1)
+        if calctype == 'STABLETIME':
+            # STABLETIME works backwards from the end time, which is
+            # included in the range.
+            toidx = time_index(timevector, totime, len(timevector) - 1)
+        else:
+            toidx = time_index(timevector, totime, len(timevector) - 1) + 1
+
     if calctype == 'RESULT':
         # Change the 'result' marker to the indicated condition.
         for var in variables:
@@ -682,64 +912,42 @@ def apply_measure(varresult, measure, variables):
 
     elif calctype == 'REBASE':
         # Rebase specified vector (subtract minimum value from all components)
-        base = min(activetrace)
-        varresult[condition] = [i - base for i in activetrace]
+        base = vector_min(activetrace)
+        varresult[condition] = activetrace - base
 
     elif calctype == 'ABS':
         # Take absolute value of activetrace.
-        varresult[condition] = [abs(i) for i in activetrace]
+        varresult[condition] = np.abs(activetrace)
         
     elif calctype == 'NEGATE':
         # Negate the specified vector
-        varresult[condition] = [-i for i in activetrace]
-        
-    elif calctype == 'ADD':
-        if 'value' in measure:
-            v = float(measure['value'])
-            varresult[condition] = [i + v for i in activetrace]
-        else: 
-            # Add the specified vector to the result and replace the result
-            varresult[condition] = [i + j for i, j in zip(activetrace, paramresult)]
+        varresult[condition] = -activetrace
         
-    elif calctype == 'SUBTRACT':
+    elif calctype in ['ADD', 'SUBTRACT', 'MULTIPLY']:
         if 'value' in measure:
             v = float(measure['value'])
-            varresult[condition] = [i - v for i in activetrace]
+            othertrace = activetrace
         else: 
-            # Subtract the specified vector from the result
-            varresult[condition] = [j - i for i, j in zip(activetrace, paramresult)]
-
-    elif calctype == 'MULTIPLY':
-        if 'value' in measure:
-            v = float(measure['value'])
-            varresult[condition] = [i * v for i in activetrace]
-        else: 
-            # Multiply the specified vector by the result (e.g., to get power)
-            varresult[condition] = [j * i for i, j in zip(activetrace, paramresult)]
+            # Combine the specified vector with the result (e.g., multiply
+            # to get power).  Like zip(), only the common length is kept.
+            v = column_array(paramresult)
+            n = min(len(activetrace), len(v))
+            othertrace = activetrace[:n]
+            v = v[:n]
+
+        if calctype == 'ADD':
+            varresult[condition] = othertrace + v
+        elif calctype == 'SUBTRACT':
+            if 'value' in measure:
+                varresult[condition] = othertrace - v
+            else:
+                # Subtract the specified vector from the result
+                varresult[condition] = v - othertrace
+        else:
+            varresult[condition] = othertrace * v
         
     elif calctype == 'CLIP':
-        if timevector == []:
-            return
         # Clip specified vector to the indicated times
-        if 'from' in measure:
-            fromtime = float(spice_unit_convert([timeunit, measure['from'], 'time']))
-        else:
-            fromtime = timevector[0] 
-        if 'to' in measure:
-            totime = float(spice_unit_convert([timeunit, measure['to'], 'time']))
-        else:
-            totime = timevector[-1]
-
-        try:
-            fromidx = next(i for i, j in enumerate(timevector) if j >= fromtime)
-        except StopIteration:
-            fromidx = len(timevector) - 1
-        try:
-            toidx = next(i for i, j in enumerate(timevector) if j >= totime)
-            toidx += 1
-        except StopIteration:
-            toidx = len(timevector)
-
         for key in varresult:
             vector = varresult[key]
             varresult[key] = vector[fromidx:toidx]
@@ -747,175 +955,78 @@ def apply_measure(varresult, measure, variables):
         rsize = toidx - fromidx
 
     elif calctype == 'MEAN':
-        if timevector == []:
-            return
-
         # Get the mean value of all traces in the indicated range.  Results are 
 	# collapsed to the single mean value.
-        if 'from' in measure:
-            fromtime = float(spice_unit_convert([timeunit, measure['from'], 'time']))
-        else:
-            fromtime = timevector[0] 
-        if 'to' in measure:
-            totime = float(spice_unit_convert([timeunit, measure['to'], 'time']))
-        else:
-            totime = timevector[-1]
-
-        try:
-            fromidx = next(i for i, j in enumerate(timevector) if j >= fromtime)
-        except StopIteration:
-            fromidx = len(timevector) - 1
-        try:
-            toidx = next(i for i, j in enumerate(timevector) if j >= totime)
-            toidx += 1
-        except StopIteration:
-            toidx = len(timevector)
 
         # Correct time average requires weighting according to the size of the
         # time slice.
-        tsum = timevector[toidx - 1] - timevector[fromidx]
+        tsum = float(timevector[toidx - 1] - timevector[fromidx])
+        tslice = np.diff(timevector[fromidx:toidx])
 
         for key in varresult:
             vector = varresult[key]
-            try:
-                # Test if condition is a numeric value
-                varresult[key] = vector[fromidx] + 1
-            except TypeError:
+            if vector.dtype.kind not in 'biuf':
                 # Some conditions like 'corner' cannot be averaged, so just take the
                 # first entry (may want to consider different handling)
                 varresult[key] = [vector[fromidx]]
             else:
-                vtot = 0.0
-                for i in range(fromidx + 1, toidx):
-                    # Note:  This expression can and should be optimized!
-                    vtot += ((vector[i] + vector[i - 1]) / 2) * (timevector[i] - timevector[i - 1])
+                vslice = vector[fromidx:toidx]
+                # (cumsum adds in order, as the time slices were once added
+                # one by one, so that the result does not change)
+                terms = ((vslice[1:] + vslice[:-1]) / 2) * tslice
+                vtot = float(np.cumsum(terms)[-1]) if len(terms) else 0.0
                 varresult[key] = [vtot / tsum]
 
         rsize = 1
         
-    elif calctype == 'RISINGEDGE':
-        if timevector == []:
-            return
-
-        # RISINGEDGE finds the time of a signal rising edge.
+    elif calctype == 'RISINGEDGE' or calctype == 'FALLINGEDGE':
+        # RISINGEDGE finds the time of a signal rising edge;  FALLINGEDGE
+        # finds the time of a signal falling edge.
         # parameters used are:
         # 'from':   start time of search (default zero)
         # 'to':     end time of search (default end)
         # 'number': edge number (default first edge, or zero) (to be done)
         # 'cross':  measure time when signal crosses this value
         # 'keep':  determines what part of the vectors to keep
-        if 'from' in measure:
-            fromtime = float(spice_unit_convert([timeunit, measure['from'], 'time']))
-        else:
-            fromtime = timevector[0] 
-        if 'to' in measure:
-            totime = float(spice_unit_convert([timeunit, measure['to'], 'time']))
-        else:
-            totime = timevector[-1]
         if 'cross' in measure:
             crossval = float(measure['cross'])
         else:
-            crossval = (max(activetrace) + min(activetrace)) / 2;
-        try:
-            fromidx = next(i for i, j in enumerate(timevector) if j >= fromtime)
-        except StopIteration:
-            fromidx = len(timevector) - 1
-        try:
-            toidx = next(i for i, j in enumerate(timevector) if j >= totime)
-            toidx += 1
-        except StopIteration:
-            toidx = len(timevector)
-        try:
-            startidx = next(i for i, j in enumerate(activetrace[fromidx:toidx]) if j < crossval)
-        except StopIteration:
-            startidx = 0
-        startidx += fromidx
-        try:
-            riseidx = next(i for i, j in enumerate(activetrace[startidx:toidx]) if j >= crossval)
-        except StopIteration:
-            riseidx = toidx - startidx - 1
-        riseidx += startidx
-
-        # If not specified, 'keep' defaults to 'INSTANT'.
-        if 'keep' in measure:
-            keeptype = measure['keep']
-            if keeptype == 'BEFORE':
-                istart = 0
-                istop = riseidx
-            elif keeptype == 'AFTER':
-                istart = riseidx
-                istop = len(timevector)
-            else:
-                istart = riseidx
-                istop = riseidx + 1
-        else:
-            istart = riseidx
-            istop = riseidx + 1
-
-        for key in varresult:
-            vector = varresult[key]
-            varresult[key] = vector[istart:istop]
-
-        rsize = istop - istart
-        
-    elif calctype == 'FALLINGEDGE':
-        if timevector == []:
-            return
+            crossval = (vector_max(activetrace) + vector_min(activetrace)) / 2;
 
-        # FALLINGEDGE finds the time of a signal rising edge.
-        # parameters used are:
-        # 'from':   start time of search (default zero)
-        # 'to':     end time of search (default end)
-        # 'number': edge number (default first edge, or zero) (to be done)
-        # 'cross':  measure time when signal crosses this value
-        # 'keep':  determines what part of the vectors to keep
-        if 'from' in measure:
-            fromtime = float(spice_unit_convert([timeunit, measure['from'], 'time']))
-        else:
-            fromtime = timevector[0] 
-        if 'to' in measure:
-            totime = float(spice_unit_convert([timeunit, measure['to'], 'time']))
+        # Find the first point on the wrong side of the crossing, then the
+        # first point after it on the other side.
+        window = activetrace[fromidx:toidx]
+        if calctype == 'RISINGEDGE':
+            startidx = first_index(window < crossval)
         else:
-            totime = timevector[-1]
-        if 'cross' in measure:
-            crossval = measure['cross']
-        else:
-            crossval = (max(activetrace) + min(activetrace)) / 2;
-        try:
-            fromidx = next(i for i, j in enumerate(timevector) if j >= fromtime)
-        except StopIteration:
-            fromidx = len(timevector) - 1
-        try:
-            toidx = next(i for i, j in enumerate(timevector) if j >= totime)
-            toidx += 1
-        except StopIteration:
-            toidx = len(timevector)
-        try:
-            startidx = next(i for i, j in enumerate(activetrace[fromidx:toidx]) if j > crossval)
-        except StopIteration:
+            startidx = first_index(window > crossval)
+        if startidx is None:
             startidx = 0
         startidx += fromidx
-        try:
-            fallidx = next(i for i, j in enumerate(activetrace[startidx:toidx]) if j <= crossval)
-        except StopIteration:
-            fallidx = toidx - startidx - 1
-        fallidx += startidx
+        window = activetrace[startidx:toidx]
+        if calctype == 'RISINGEDGE':
+            edgeidx = first_index(window >= crossval)
+        else:
+            edgeidx = first_index(window <= crossval)
+        if edgeidx is None:
+            edgeidx = toidx - startidx - 1
+        edgeidx += startidx
 
         # If not specified, 'keep' defaults to 'INSTANT'.
         if 'keep' in measure:
             keeptype = measure['keep']
             if keeptype == 'BEFORE':
                 istart = 0
-                istop = fallidx
+                istop = edgeidx
             elif keeptype == 'AFTER':
-                istart = fallidx
+                istart = edgeidx
                 istop = len(timevector)
             else:
-                istart = fallidx
-                istop = fallidx + 1
+                istart = edgeidx
+                istop = edgeidx + 1
         else:
-            istart = fallidx
-            istop = fallidx + 1
+            istart = edgeidx
+            istop = edgeidx + 1
 
         for key in varresult:
             vector = varresult[key]
@@ -924,43 +1035,24 @@ def apply_measure(varresult, measure, variables):
         rsize = istop - istart
 
     elif calctype == 'STABLETIME':
-        if timevector == []:
-            return
-
         # STABLETIME finds the time at which the signal stabilizes
         # parameters used are:
         # 'from':  start time of search (default zero)
         # 'to':    end time of search (works backwards from here) (default end)
         # 'slope': measure time when signal rate of change equals this slope
         # 'keep':  determines what part of the vectors to keep
-        if 'from' in measure:
-            fromtime = float(spice_unit_convert([timeunit, measure['from'], 'time']))
-        else:
-            fromtime = timevector[0] 
-        if 'to' in measure:
-            totime = float(spice_unit_convert([timeunit, measure['to'], 'time']))
-        else:
-            totime = timevector[-1]
         if 'limit' in measure:
             limit = float(measure['limit'])
         else:
             # Default is 5% higher or lower than final value
             limit = 0.05
-        try:
-            fromidx = next(i for i, j in enumerate(timevector) if j >= fromtime)
-        except StopIteration:
-            fromidx = len(timevector) - 1
-        try:
-            toidx = next(i for i, j in enumerate(timevector) if j >= totime)
-        except StopIteration:
-            toidx = len(timevector) - 1
         finalval = activetrace[toidx]
         toidx += 1
         highval = finalval * (1.0 + limit)
         lowval = finalval * (1.0 - limit)
-        try:
-            breakidx = next(i for i, j in reversed(list(enumerate(activetrace[fromidx:toidx]))) if j >= highval or j <= lowval)
-        except StopIteration:
+        window = activetrace[fromidx:toidx]
+        breakidx = last_index((window >= highval) | (window <= lowval))
+        if breakidx is None:
             breakidx = 0
         breakidx += fromidx
 
@@ -987,53 +1079,34 @@ def apply_measure(varresult, measure, variables):
         rsize = istop - istart
 
     elif calctype == 'INSIDE':
-        if timevector == []:
-            return
-
         # INSIDE retains only values which are inside the indicated limits
         # 'min':  minimum value limit to keep results
         # 'max':  maximum value limit to keep results
-        if 'from' in measure:
-            fromtime = float(spice_unit_convert([timeunit, measure['from'], 'time']))
-        else:
-            fromtime = timevector[0] 
-        if 'to' in measure:
-            totime = float(spice_unit_convert([timeunit, measure['to'], 'time']))
-        else:
-            totime = timevector[-1]
         if 'min' in measure:
             minval = float(spice_unit_convert([activeunit, measure['min']]))
         else:
-            minval = min(activetrace)
+            minval = vector_min(activetrace)
         if 'max' in measure:
             maxval = float(spice_unit_convert([activeunit, measure['max']]))
         else:
-            maxval = max(activetrace)
+            maxval = vector_max(activetrace)
 
-        try:
-            fromidx = next(i for i, j in enumerate(timevector) if j >= fromtime)
-        except StopIteration:
-            fromidx = len(timevector) - 1
-        try:
-            toidx = next(i for i, j in enumerate(timevector) if j >= totime)
-            toidx += 1
-        except StopIteration:
-            toidx = len(timevector)
-        goodidx = list(i for i, j in enumerate(activetrace[fromidx:toidx]) if j >= minval and j <= maxval)
+        window = activetrace[fromidx:toidx]
+        goodidx = np.flatnonzero((window >= minval) & (window <= maxval))
         # Diagnostic
-        if goodidx == []:
-            print('All vector components failed bounds test.  max = ' + str(max(activetrace[fromidx:toidx])) + '; min = ' + str(min(activetrace[fromidx:toidx])))
+        if len(goodidx) == 0:
+            print('All vector components failed bounds test.  max = ' + str(vector_max(window)) + '; min = ' + str(vector_min(window)))
 
-        goodidx = [i + fromidx for i in goodidx]
+        goodidx += fromidx
         for key in varresult:
             vector = varresult[key]
-            varresult[key] = [vector[i] for i in goodidx]
+            varresult[key] = vector[goodidx]
 
         rsize = len(goodidx)
 
     return rsize
 
-def read_ascii_datafile(file, *args):
+def read_ascii_datafile(file, *args, columns=None):
     # Read a file of data produced by the 'wrdata' command in ngspice
     # (simple ASCII data in columnar format)
     # No unit conversions occur at this time.
@@ -1043,11 +1116,20 @@ def read_ascii_datafile(file, *args):
     # additional columns in the data file, and should be treated similarly
     # to the analysis variable.  Note, however, that the wrdata format
     # redundantly puts the analysis variable in every other column.
+    #
+    # If "columns" is given, it holds the columns of the file as collected
+    # by an ngspice shared library session, and the file is not read.
 
     if not args:
         print('Error:  testbench does not specify contents of data file!')
         return
 
+    if columns is not None:
+        dmatrix = [columns[0]] + columns[1::2]
+        for dvalues, dvec in zip(dmatrix, args):
+            dvec.extend(dvalues)
+        return len(columns[0])
+
     dmatrix = []
     filepath = simfiles_path + '/' + file
     if not os.path.isfile(filepath):
@@ -1094,6 +1176,67 @@ def read_ascii_datafile(file, *args):
             rval = 1
         return rval
 
+def read_raw_datafile(file, varresult, *names):
+    # Read vectors from a binary rawfile produced by the 'write' command
+    # in ngspice into the dictionary "varresult".  Vectors are assigned to
+    # "names" in the order they appear in the file, the first one being the
+    # analysis variable, which matches the column order of the data files
+    # read by read_ascii_datafile() (a complex vector takes two names, for
+    # its real and imaginary parts).  Vectors are NumPy arrays mapped from
+    # the file, so large transient outputs are not copied into lists.
+
+    if not names:
+        print('Error:  testbench does not specify contents of data file!')
+        return 0
+
+    filepath = simfiles_path + '/' + file
+    if not os.path.isfile(filepath):
+        print('Failed to find raw file at path ' + filepath)
+        return 0
+
+    try:
+        columns = cace_rawfile.rawcolumns(filepath)
+    except (ValueError, IndexError) as e:
+        print('Error reading raw file ' + filepath + ': ' + str(e))
+        return 0
+
+    if len(columns) < len(names):
+        print('Warning:  raw file ' + file + ' has ' + str(len(columns))
+		+ ' vectors but ' + str(len(names)) + ' were expected.')
+
+    for name, column in zip(names, columns):
+        if name in varresult and len(varresult[name]) > 0:
+            varresult[name] = np.concatenate((varresult[name], column))
+        else:
+            varresult[name] = column
+
+    if columns:
+        return len(columns[0])
+    else:
+        return 0
+
+def result_datafiles(lines, outrexall):
+    # Return the names of the data files (wrdata or raw) that are read for
+    # the result lines in the simulator output "lines".
+    datafiles = []
+    for line in lines:
+        matchline = outrexall.match(line)
+        if matchline:
+            rest = matchline.group(1)
+            if '.data' in rest or '.raw' in rest:
+                datafile = rest.split()[0]
+                # ngspice may add a second ".data" extension (see
+                # read_ascii_datafile())
+                datafiles.extend([datafile, datafile + '.data'])
+    return datafiles
+
+def vector_values(vector):
+    # Results and conditions are collected as lists of values;  convert
+    # vectors read from raw files (NumPy arrays) to match.
+    if isinstance(vector, np.ndarray):
+        return vector.tolist()
+    return vector
+
 if __name__ == '__main__':
 
     # Exit in response to terminate signal by terminating ngspice processes
@@ -1157,8 +1300,32 @@ if __name__ == '__main__':
             keepmode = False
         elif result[0] == '-score':
             score = result[1]
+        elif result[0] == '-nocache':
+            cachemode = False
+        elif result[0] == '-cachedir':
+            cachedir = os.path.expanduser(result[1])
+        elif result[0] == '-cachesize':
+            try:
+                cachesize = float(result[1])
+            except (IndexError, ValueError):
+                cachesize = -1
+            if not math.isfinite(cachesize) or cachesize < 0:
+                print('Error:  Option -cachesize requires a size in megabytes, e.g., -cachesize=2048')
+                print('Usage: ' + sys.argv[0] + ' json_file [-options]')
+                sys.exit(1)
+        elif result[0] == '-jobs':
+            try:
+                jobs = int(result[1])
+            except (IndexError, ValueError):
+                raise SyntaxError('Option -jobs requires an integer value, e.g., -jobs=8\n')
+            if jobs == 0:
+                jobs = os.cpu_count()
+        elif result[0] == '-shared':
+            sharedmode = True
+            if len(result) > 1:
+                sharedlib = os.path.expanduser(result[1])
         else:
-            raise SyntaxError('Bad option ' + item + ', options are -keep, -nosim, -nopost, -local, and -simdir=\n')
+            raise SyntaxError('Bad option ' + item + ', options are -keep, -nosim, -nopost, -local, -jobs=, -shared, -nocache, -cachedir=, -cachesize=, and -simdir=\n')
 
     # Various information could be obtained from the input JSON file
     # name, but it will be assumed that all information should be
@@ -1270,6 +1437,50 @@ if __name__ == '__main__':
         status['total'] = str(totalsims)
         send_status(statdoc)
 
+    # With -jobs=N, queue every ngspice testbench at once on a pool of N
+    # workers.  Each simulation's output is captured separately and is
+    # processed below in testbench order, so results are identical to the
+    # sequential run.  Cosimulations share the file 'simulator_pipe' in the
+    # simulation directory, so they are always run sequentially.
+
+    # Simulations found in the result cache are not queued.
+
+    # With -shared, ngspice testbenches are run in a pool of N (from -jobs)
+    # long-lived ngspice sessions using the ngspice shared library.  The
+    # ngspice executable is used if the library cannot be found, and for
+    # any simulation whose session fails.
+
+    if sharedmode and totalsims > 0:
+        libpath = cace_ngshared.find_library(sharedlib)
+        if libpath:
+            print('Running ngspice simulations in shared library ' + libpath)
+            sessionpool = cace_ngshared.SessionPool(jobs, libpath,
+			ngspice_environment(), os.getcwd())
+        else:
+            print('ngspice shared library not found;  running ngspice -b.')
+
+    simjobs = {}
+    if jobs > 1 and totalsims > 1:
+        print('Running up to ' + str(jobs) + ' simulations in parallel.')
+        simpool = ThreadPoolExecutor(max_workers=jobs)
+        for param in eparamlist:
+            if 'testbenches' not in param:
+                continue
+            for testbench in param['testbenches']:
+                filename = testbench['filename']
+                if os.path.exists(os.path.splitext(filename)[0] + '.tv'):
+                    continue
+                my_env = ngspice_environment()
+                if cachemode and cace_simcache.contains(cachedir,
+				cace_simcache.netlist_key(filename)):
+                    continue
+                if sessionpool:
+                    simjobs[filename] = simpool.submit(run_shared_simulation,
+				filename, my_env)
+                else:
+                    simjobs[filename] = simpool.submit(run_simulation, 'ngspice',
+				['-b'], filename, my_env)
+
     for param in eparamlist:
         # Process only entries in JSON that have 'testbenches' record
         if 'testbenches' not in param:
@@ -1347,16 +1558,7 @@ if __name__ == '__main__':
                 cosim = False
                 simulator = 'ngspice'
                 simargs = ['-b']
-                # Do not generate LXT files, as CACE does not have any methods to handle
-                # the data in them anyway.
-                my_env['NGSPICE_LXT2NO'] = '1'
-
-                # Is there a .spiceinit file in the simulation directory, and is
-                # one needed?
-                if not os.path.exists('.spiceinit'):
-                    if os.path.exists(PDK_ROOT + node + '/libs.tech/ngspice/spinit'):
-                        print('Copying ngspice configuration file from PDK.')
-                        shutil.copy(PDK_ROOT + node + '/libs.tech/ngspice/spinit', '.spiceinit')
+                my_env = ngspice_environment()
 
             # ngspice writes to both stdout and stderr;  capture all
             # output equally.  Print each line in real-time, flush the
@@ -1364,14 +1566,41 @@ if __name__ == '__main__':
 
             # Note:  bufsize = 1 and universal_newlines = True sets line-buffered output
 
-            print('Running: ' + simulator + ' ' + ' '.join(simargs) + ' ' + filename)
-
-            with subprocess.Popen([simulator, *simargs, filename],
+            # Look for the results of an identical simulation in the cache
+            simkey = None
+            cachedoutput = None
+            if cachemode and not cosim:
+                simkey = cace_simcache.netlist_key(filename)
+                cachedoutput = cace_simcache.lookup(cachedir, simkey, simfiles_path)
+
+            simoutput = []
+            if cachedoutput is not None:
+                print('Using cached results for ' + filename)
+                simproc = CompletedSimulation(0, cachedoutput)
+            elif filename in simjobs:
+                # Already run by the worker pool;  wait for it to finish.
+                print('Running: ' + simulator + ' ' + ' '.join(simargs) + ' ' + filename)
+                simproc = simjobs.pop(filename).result()
+            elif sessionpool and not cosim:
+                print('Running: ngspice (shared library) ' + filename)
+                simproc = run_shared_simulation(filename, my_env)
+            else:
+                print('Running: ' + simulator + ' ' + ' '.join(simargs) + ' ' + filename)
+                simproc = subprocess.Popen([simulator, *simargs, filename],
 			stdout=subprocess.PIPE,
-			bufsize=1, universal_newlines=True, env=my_env) as spiceproc:
+			bufsize=1, universal_newlines=True, env=my_env)
+
+            # Data files already collected in memory by a shared library session
+            if isinstance(simproc, CompletedSimulation):
+                simdatafiles = simproc.datafiles
+            else:
+                simdatafiles = {}
+
+            with simproc as spiceproc:
                 for line in spiceproc.stdout:
                     print(line, end='')
                     sys.stdout.flush()
+                    simoutput.append(line)
 
                     # Each netlist can have as many results as there are in
                     # the "measurements" list for the electrical parameter,
@@ -1392,8 +1621,10 @@ if __name__ == '__main__':
                         # always the first and every other column of the data file.
                         # The primary result is implicit.  All other columns
                         # must be explicitly called out on the echo line.
-                        if '.data' in rest:
-                            print('Reading data from ASCII file.')
+                        # Binary rawfiles (ngspice 'write' command, file name
+                        # ending in '.raw') are handled the same way, with
+                        # vectors taken in the order they appear in the file.
+                        if '.data' in rest or '.raw' in rest:
 
                             # "variables" are similar to conditions but describe what is
                             # being output from ngspice.  There should be one entry for
@@ -1426,13 +1657,27 @@ if __name__ == '__main__':
                                     print('Error:  No variables specified in testbench or datasheet.')
                                     rest = ''
 
-                            if len(extra) > 1:
+                            if len(extra) > 1 and os.path.splitext(extra[0])[1] == '.raw':
+                                print('Reading data from binary rawfile.')
+                                rsize = read_raw_datafile(extra[0], locvarresult, *extra[1:])
+
+                            elif len(extra) > 1:
+                                if extra[0] in simdatafiles:
+                                    print('Reading data from ngspice session.')
+                                else:
+                                    print('Reading data from ASCII file.')
                                 for varname in extra[1:]:
                                     if varname not in locvarresult:
                                         locvarresult[varname] = []
+                                    else:
+                                        # Measurements leave arrays behind
+                                        locvarresult[varname] = vector_values(locvarresult[varname])
                                     data_args.append(locvarresult[varname])
 
-                                rsize = read_ascii_datafile(extra[0], *data_args)
+                                rsize = read_ascii_datafile(extra[0], *data_args,
+					columns=simdatafiles.get(extra[0]))
+
+                            if len(extra) > 1:
                                 # print('Read data file, rsize = ' + str(rsize))
 
                                 # All values in extra[1:] should be param['variables'].  If not, add
@@ -1479,11 +1724,11 @@ if __name__ == '__main__':
                                         varrec = next(item for item in pvars if item['condition'] == varname)
                                         if 'result' in varrec:
                                             # print('Result for ' + varname + ' = ' + str(locvarresult[varname]))
-                                            locparamresult = locvarresult[varname]
+                                            locparamresult = vector_values(locvarresult[varname])
                                             paramname = varname
                                         else:
                                             # print('Condition ' + varname + ' = ' + str(locvarresult[varname]))
-                                            loccondresult[varname] = locvarresult[varname]
+                                            loccondresult[varname] = vector_values(locvarresult[varname])
                                         # Diagnostic
                                         # print("Variable " + varname + " length = " + str(len(locvarresult[varname])))
                                     rest = ''
@@ -1497,18 +1742,16 @@ if __name__ == '__main__':
                                         varrec = next(item for item in pvars if item['condition'] == varname)
                                         if 'result' in varrec:
                                             # print('Result for ' + varname + ' = ' + str(locvarresult[varname]))
-                                            locparamresult = locvarresult[varname]
+                                            locparamresult = vector_values(locvarresult[varname])
                                             rsize = len(locparamresult)
                                             paramname = varname
                                         else:
                                             # print('Condition ' + varname + ' = ' + str(locvarresult[varname]))
-                                            loccondresult[varname] = locvarresult[varname]
+                                            loccondresult[varname] = vector_values(locvarresult[varname])
                                     rest = ''
                         else:
                             rsize = 0
 
-                        # To-do:  Handle raw files in similar manner to ASCII files.
-                          
                         while rest:
                             # This code depends on values coming first, followed by conditions.
                             matchtext = dictrex.match(rest)
@@ -1643,6 +1886,11 @@ if __name__ == '__main__':
                         else:
                             condresult[key].extend(loccondresult[key])
 
+                    # Save a successful simulation in the cache
+                    if simkey and cachedoutput is None:
+                        cace_simcache.store(cachedir, simkey, ''.join(simoutput),
+				simfiles_path, result_datafiles(simoutput, outrexall))
+
                 else:
                     # Catch simulation failures
                     simfailures += 1
@@ -2010,6 +2258,16 @@ if __name__ == '__main__':
                     if fileext == '.tv':
                         os.remove(filename)
 
+    if simpool:
+        simpool.shutdown()
+        simpool = None
+    if sessionpool:
+        sessionpool.close()
+        sessionpool = None
+
+    if cachemode:
+        cace_simcache.evict(cachedir, cachesize)
+
     # Report the final score, and save it to the JSON data
 
     print('Completed ' + str(simulations) + ' of ' + str(totalsims) + ' simulations');
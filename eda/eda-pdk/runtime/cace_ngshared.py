@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+"""
+cace_ngshared.py
+Pool of long-lived ngspice sessions for CACE, using ngspice built as a
+shared library (configure --with-ngshared;  see sharedspice.h and
+README.shared-xspice in the ngspice sources).
+
+Each session is a worker process that loads libngspice once and then runs
+one testbench netlist after another, resetting ngspice between netlists,
+so the cost of starting the simulator and loading its code models is paid
+once per session instead of once per testbench.  (ngspice has no way to
+keep parsed model libraries across circuits, so each netlist still parses
+its own.)  The output that ngspice would print on stdout is collected in
+memory through the library's print callback and handed back as one
+string, so that it can be parsed exactly like the output of "ngspice -b".
+
+Where the control block of a netlist is a plain list of commands, the
+circuit is loaded with ngSpice_Circ and the commands are run one at a
+time.  After each "wrdata" command, the vectors it wrote are read back
+from ngspice with ngGet_Vec_Info and handed back with the output, so
+that cace_launch.py takes the results of the data file from memory
+instead of reading the file again.  The file is still written, for the
+simulation cache and for -keep.  A netlist whose control block has loops
+or conditionals, or that sets one of the variables that change what
+"wrdata" writes, is run with "source" instead, and its data files are
+read as usual.
+
+A netlist that ends ngspice with "quit" under "source" (or an error that
+ngspice cannot recover from) calls the controlled exit callback, after
+which the library must not be used again;  the session then ends, and
+the pool starts a new one in its place.  When commands are run one at a
+time, a "quit" simply ends the netlist.
+
+libngspice keeps all of its state in globals, so it can only run one
+circuit at a time in a process;  sessions run in separate processes for
+that reason, which also protects cace_launch.py from a simulator crash.
+A session that dies raises SessionError, and the caller can run the
+netlist with the ngspice executable instead.
+"""
+
+import os
+import re
+import sys
+import queue
+import ctypes
+import ctypes.util
+import threading
+import multiprocessing
+
+import numpy as np
+
+# Structures and callback types from sharedspice.h
+class NgComplex(ctypes.Structure):
+    _fields_ = [('cx_real', ctypes.c_double), ('cx_imag', ctypes.c_double)]
+
+class VectorInfo(ctypes.Structure):
+    _fields_ = [('v_name', ctypes.c_char_p), ('v_type', ctypes.c_int),
+		('v_flags', ctypes.c_short),
+		('v_realdata', ctypes.POINTER(ctypes.c_double)),
+		('v_compdata', ctypes.POINTER(NgComplex)),
+		('v_length', ctypes.c_int)]
+
+class VecInfo(ctypes.Structure):
+    _fields_ = [('number', ctypes.c_int), ('vecname', ctypes.c_char_p),
+		('is_real', ctypes.c_bool), ('pdvec', ctypes.c_void_p),
+		('pdvecscale', ctypes.c_void_p)]
+
+class VecInfoAll(ctypes.Structure):
+    _fields_ = [('name', ctypes.c_char_p), ('title', ctypes.c_char_p),
+		('date', ctypes.c_char_p), ('type', ctypes.c_char_p),
+		('veccount', ctypes.c_int),
+		('vecs', ctypes.POINTER(ctypes.POINTER(VecInfo)))]
+
+SendChar = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_void_p)
+ControlledExit = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_int, ctypes.c_bool,
+		ctypes.c_bool, ctypes.c_int, ctypes.c_void_p)
+SendInitData = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.POINTER(VecInfoAll),
+		ctypes.c_int, ctypes.c_void_p)
+
+VF_REAL = 1	# v_flags bit of a real vector (dvec.h)
+
+# Control structures, which cannot be run one command at a time
+control_structures = ['if', 'else', 'end', 'while', 'repeat', 'dowhile',
+		'foreach', 'break', 'continue', 'label', 'goto']
+
+# Variables that change the layout or the precision of "wrdata" files
+wrdata_variables = ['appendwrite', 'wr_singlescale', 'wr_vecnames', 'numdgt']
+
+# Vector names that ngGet_Vec_Info resolves the way "wrdata" does:  a plain
+# vector name, or v(node) or i(source).  Anything else is an expression.
+vector_name = re.compile(r'([A-Za-z_][\w#]*|[vViI]\([\w#]+\))$')
+
+class SessionError(Exception):
+    pass
+
+def find_library(libpath=None):
+    """
+    Return the path of the ngspice shared library, or None if it cannot
+    be found.  "libpath" (e.g., from the -shared=<path> option) is used if
+    given, then the environment variable NGSPICE_LIBRARY, then the system
+    library search path.
+    """
+    if not libpath:
+        libpath = os.environ.get('NGSPICE_LIBRARY')
+    if not libpath:
+        libpath = ctypes.util.find_library('ngspice')
+    if libpath and os.path.sep in libpath and not os.path.exists(libpath):
+        return None
+    return libpath
+
+def split_netlist(netlist):
+    """
+    Split the netlist file "netlist" into the lines of its circuit and the
+    commands of its control blocks, so that the circuit can be loaded with
+    ngSpice_Circ and the commands run one at a time.  Returns None if the
+    netlist is better run with "source":  if it has no "wrdata" command,
+    if a control block uses control structures or continuation lines, or
+    if the netlist or the .spiceinit file in the current directory sets
+    one of the variables that change what "wrdata" writes.
+    """
+    with open(netlist, 'r') as ifile:
+        lines = ifile.read().splitlines()
+    settings = '\n'.join(lines).lower()
+    if os.path.isfile('.spiceinit'):
+        with open('.spiceinit', 'r') as ifile:
+            settings += ifile.read().lower()
+    if any(var in settings for var in wrdata_variables):
+        return None
+
+    circuit = []
+    commands = []
+    incontrol = False
+    for line in lines:
+        tokens = line.split()
+        keyword = tokens[0].lower() if tokens else ''
+        if keyword == '.end':
+            # ngspice reads nothing after .end
+            circuit.append(line)
+            break
+        elif keyword == '.control':
+            incontrol = True
+        elif keyword == '.endc':
+            incontrol = False
+        elif not incontrol:
+            circuit.append(line)
+        elif not tokens or keyword.startswith('*') or keyword.startswith('#'):
+            continue
+        elif keyword.startswith('+') or keyword in control_structures:
+            return None
+        else:
+            commands.append(line.strip())
+
+    if incontrol or not any(command.split()[0].lower() == 'wrdata' for command in commands):
+        return None
+    return circuit, commands
+
+def wrdata_columns(scale, vectors):
+    """
+    Return the columns of the file that "wrdata" writes for the NumPy
+    arrays "vectors" over "scale":  for each vector, the scale and the
+    vector, a complex vector taking two columns for its real and imaginary
+    parts.  Values are rounded to the 8 digits that "wrdata" prints, so
+    that the results are the same as those read from the file.
+    """
+    columns = []
+    for vector in vectors:
+        columns.append(scale.real)
+        if np.iscomplexobj(vector):
+            columns.extend([vector.real, vector.imag])
+        else:
+            columns.append(vector)
+    return [[float('% .8e' % value) for value in column] for column in columns]
+
+# Main loop of a session worker process.  Requests arrive on "conn" as
+# (netlist, directory) tuples;  the answer to each is (returncode, output,
+# datafiles, retired), where "datafiles" maps the name of each file that
+# "wrdata" wrote to its columns (see wrdata_columns()), and "retired" is
+# true if ngspice made a controlled exit, in which case the session ends.
+# A request of None also ends the session.
+
+def session_main(libpath, env, workdir, conn):
+    os.environ.update(env)
+    os.chdir(workdir)
+    ngspice = ctypes.CDLL(libpath)
+    ngspice.ngSpice_Command.argtypes = [ctypes.c_char_p]
+    ngspice.ngSpice_Command.restype = ctypes.c_int
+    ngspice.ngSpice_Circ.argtypes = [ctypes.POINTER(ctypes.c_char_p)]
+    ngspice.ngSpice_Circ.restype = ctypes.c_int
+    ngspice.ngSpice_CurPlot.restype = ctypes.c_char_p
+    ngspice.ngGet_Vec_Info.argtypes = [ctypes.c_char_p]
+    ngspice.ngGet_Vec_Info.restype = ctypes.POINTER(VectorInfo)
+
+    output = []
+    exitstatus = []
+    scales = {}
+
+    # Each call passes one line, prefixed with the stream it was printed on.
+    # Only stdout is collected, as it is when running "ngspice -b";  stderr
+    # goes to this process's stderr.
+    def send_char(text, ident, userdata):
+        line = text.decode('utf-8', errors='replace')
+        if line.startswith('stdout '):
+            output.append(line[7:] + '\n')
+        elif line.startswith('stderr '):
+            print(line[7:], file=sys.stderr)
+        return 0
+
+    # Called on "quit" in the netlist's control block, or when ngspice
+    # cannot recover from an error.  Either way the library expects to be
+    # detached, so this process runs no further netlists.
+    def controlled_exit(status, immediate, quit, ident, userdata):
+        exitstatus.append(status)
+        return 0
+
+    # Called when an analysis starts a new plot.  Records the name of the
+    # plot's scale vector (e.g., "time"), which ngGet_Vec_Info does not give.
+    def send_init_data(plotinfo, ident, userdata):
+        plotinfo = plotinfo.contents
+        for i in range(plotinfo.veccount):
+            vecinfo = plotinfo.vecs[i].contents
+            if vecinfo.pdvec == vecinfo.pdvecscale:
+                scales[plotinfo.type] = vecinfo.vecname.decode('utf-8')
+        return 0
+
+    # Keep references to the callbacks for as long as the library may call them
+    callbacks = (SendChar(send_char), ControlledExit(controlled_exit),
+		SendInitData(send_init_data))
+
+    def initialize():
+        ngspice.ngSpice_Init(callbacks[0], None, callbacks[1], None, callbacks[2],
+		None, None)
+
+    # Return vector "name" of the current plot as a NumPy array, or None
+    # if there is no such vector.
+    def get_vector(name):
+        info = ngspice.ngGet_Vec_Info(name.encode('utf-8'))
+        if not info:
+            return None
+        vecinfo = info.contents
+        if vecinfo.v_length == 0:
+            return np.zeros(0)
+        if vecinfo.v_flags & VF_REAL:
+            if not vecinfo.v_realdata:
+                return None
+            return np.ctypeslib.as_array(vecinfo.v_realdata,
+			(vecinfo.v_length,)).copy()
+        if not vecinfo.v_compdata:
+            return None
+        data = np.ctypeslib.as_array(ctypes.cast(vecinfo.v_compdata,
+		ctypes.POINTER(ctypes.c_double)), (vecinfo.v_length, 2))
+        return data[:, 0] + 1j * data[:, 1]
+
+    # Return the columns of the file written by the command "wrdata <file>
+    # <vectors>" (as tokens), or None if they cannot be had from ngspice:
+    # if a vector is an expression, or vectors and scale differ in length.
+    def get_wrdata(tokens):
+        curplot = ngspice.ngSpice_CurPlot()
+        if len(tokens) < 3 or curplot not in scales:
+            return None
+        if not all(vector_name.match(token) for token in tokens[2:]):
+            return None
+        scale = get_vector(scales[curplot])
+        if scale is None:
+            return None
+        vectors = [get_vector(token) for token in tokens[2:]]
+        if any(vector is None or len(vector) != len(scale) for vector in vectors):
+            return None
+        return wrdata_columns(scale, vectors)
+
+    # Load the circuit of "netlist", then run "commands" one at a time,
+    # collecting the data files written by "wrdata" into "datafiles".
+    # Include files are found relative to the netlist, as with "source".
+    def run_commands(netlist, circuit, commands, datafiles):
+        lines = [line.encode('utf-8') for line in circuit] + [None]
+        simdir = os.getcwd()
+        os.chdir(os.path.dirname(netlist))
+        try:
+            ngspice.ngSpice_Circ((ctypes.c_char_p * len(lines))(*lines))
+        finally:
+            os.chdir(simdir)
+        for command in commands:
+            tokens = command.split()
+            if tokens[0].lower() in ['quit', 'exit']:
+                break
+            ngspice.ngSpice_Command(command.encode('utf-8'))
+            if exitstatus:
+                break
+            if tokens[0].lower() == 'wrdata' and len(tokens) > 1:
+                # A file written again replaces what was collected before
+                datafile = tokens[1].strip('"')
+                columns = get_wrdata(tokens)
+                if columns is None:
+                    datafiles.pop(datafile, None)
+                else:
+                    datafiles[datafile] = columns
+
+    initialize()
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        netlist, simdir = request
+        os.chdir(simdir)
+        del output[:]
+        del exitstatus[:]
+        scales.clear()
+        datafiles = {}
+        try:
+            split = split_netlist(netlist)
+        except (OSError, UnicodeDecodeError):
+            # Let ngspice report the error
+            split = None
+        if split:
+            run_commands(netlist, *split, datafiles)
+        else:
+            ngspice.ngSpice_Command(('source "' + netlist + '"').encode('utf-8'))
+        if exitstatus:
+            conn.send((exitstatus[0], ''.join(output), datafiles, True))
+            break
+        ngspice.ngSpice_Reset()
+        initialize()
+        conn.send((0, ''.join(output), datafiles, False))
+    conn.close()
+
+# One ngspice session, running in its own process.
+
+class Session(object):
+    def __init__(self, libpath, env, workdir):
+        context = multiprocessing.get_context('spawn')
+        self.conn, childconn = context.Pipe()
+        self.proc = context.Process(target=session_main,
+		args=(libpath, env, workdir, childconn), daemon=True)
+        self.proc.start()
+        childconn.close()
+        self.used = False
+        self.retired = False
+
+    def run(self, netlist):
+        # Simulate "netlist" and return (returncode, output, datafiles).  If
+        # ngspice made a controlled exit, the session is marked "retired" and
+        # its process ends.
+        try:
+            self.conn.send((os.path.abspath(netlist), os.getcwd()))
+            returncode, output, datafiles, self.retired = self.conn.recv()
+            return returncode, output, datafiles
+        except (EOFError, OSError):
+            self.proc.join(1)
+            raise SessionError('ngspice session exited with code ' + str(self.proc.exitcode))
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.proc.join(5)
+        self.terminate()
+
+    def terminate(self):
+        if self.proc.is_alive():
+            self.proc.terminate()
+            self.proc.join()
+        self.conn.close()
+
+# Pool of up to "size" sessions shared by the threads that run simulations.
+# Sessions are started as they are first needed.  A session that fails is
+# discarded and replaced by a new one on a later request, unless it failed
+# on its very first netlist, which means that ngspice cannot be run this
+# way at all;  the pool then refuses all further requests.  A session
+# retired by a controlled exit of ngspice is closed and replaced at once,
+# so that the new session loads the library while the caller goes on.
+
+class SessionPool(object):
+    def __init__(self, size, libpath, env, workdir):
+        self.size = size
+        self.libpath = libpath
+        self.env = env
+        self.workdir = workdir
+        self.idle = queue.Queue()
+        self.sessions = []
+        self.broken = False
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            try:
+                session = self.idle.get_nowait()
+            except queue.Empty:
+                with self.lock:
+                    if len(self.sessions) < self.size:
+                        session = Session(self.libpath, self.env, self.workdir)
+                        self.sessions.append(session)
+                        return session
+                session = self.idle.get()
+            # None only wakes up a waiting thread after a session has failed
+            if session is not None:
+                return session
+
+    def run(self, netlist):
+        """
+        Simulate "netlist" in an idle session and return (returncode,
+        output, datafiles), where "datafiles" maps the names of the data
+        files written by "wrdata" to their columns, where these could be
+        read from ngspice.
+        """
+        if self.broken:
+            raise SessionError('ngspice shared library sessions are disabled')
+        session = self.acquire()
+        try:
+            result = session.run(netlist)
+        except SessionError:
+            with self.lock:
+                if session in self.sessions:
+                    self.sessions.remove(session)
+                if not session.used:
+                    self.broken = True
+            session.terminate()
+            self.idle.put(None)
+            raise
+        session.used = True
+        if session.retired:
+            session.close()
+            with self.lock:
+                if session in self.sessions:
+                    self.sessions.remove(session)
+                session = Session(self.libpath, self.env, self.workdir)
+                session.used = True
+                self.sessions.append(session)
+        self.idle.put(session)
+        return result
+
+    def close(self):
+        with self.lock:
+            sessions = self.sessions
+            self.sessions = []
+        for session in sessions:
+            session.close()
+
+    def terminate(self):
+        with self.lock:
+            sessions = self.sessions
+            self.sessions = []
+        for session in sessions:
+            session.terminate()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+cace_rawfile.py
+Reader for ngspice binary rawfiles (output of the "write" command with
+the default "filetype=binary").  Each plot in the file is returned as a
+memory-mapped NumPy structured array with one field per vector, so that
+columns can be pulled out without reading the whole file into memory.
+"""
+
+import os
+import numpy as np
+
+BSIZE_SP = 512  # Max size of a line of header data
+MDATA_LIST = [b'title', b'date', b'plotname', b'flags', b'no. variables',
+              b'no. points', b'dimensions', b'command', b'option']
+
+def rawread(fname):
+    """
+    Read an ngspice binary rawfile.  Returns a tuple (arrays, plots) where
+    "arrays" is a list of memory-mapped structured arrays, one per plot,
+    and "plots" is a list of dictionaries holding the header information
+    for each plot (including 'varnames' and 'varunits').
+    """
+    filesize = os.path.getsize(fname)
+    arrs = []
+    plots = []
+    plot = {}
+    with open(fname, 'rb') as fp:
+        while True:
+            line = fp.readline(BSIZE_SP)
+            if not line:
+                break
+            mdata = line.split(b':', maxsplit=1)
+            if len(mdata) != 2:
+                continue
+            key = mdata[0].lower()
+            val = mdata[1].strip()
+            if key in MDATA_LIST:
+                plot[key] = val
+            if key == b'variables':
+                nvars = int(plot[b'no. variables'])
+                plot['varnames'] = []
+                plot['varunits'] = []
+                for varn in range(nvars):
+                    varspec = fp.readline(BSIZE_SP).strip().decode('ascii').split()
+                    if varn != int(varspec[0]):
+                        raise ValueError('Malformed variable list in rawfile ' + fname)
+                    plot['varnames'].append(varspec[1])
+                    plot['varunits'].append(varspec[2])
+            elif key == b'values':
+                raise ValueError('ASCII rawfile ' + fname + ' is not supported;  '
+			+ 'use "set filetype=binary" in the testbench.')
+            elif key == b'binary':
+                if b'complex' in plot.get(b'flags', b''):
+                    vtype = np.complex128
+                else:
+                    vtype = np.float64
+                # Vector names are not guaranteed to be unique (e.g., "v(out)"
+                # written twice), so fields are named by position and the
+                # real names are kept in plot['varnames'].
+                rowdtype = np.dtype({
+			'names': ['v' + str(i) for i in range(len(plot['varnames']))],
+			'formats': [vtype] * len(plot['varnames'])})
+                offset = fp.tell()
+                # An interrupted simulation may leave fewer points than
+                # the header claims.
+                npoints = int(plot[b'no. points'])
+                npoints = min(npoints, (filesize - offset) // rowdtype.itemsize)
+                if npoints > 0:
+                    arr = np.memmap(fname, dtype=rowdtype, mode='r',
+				offset=offset, shape=(npoints,))
+                else:
+                    arr = np.zeros(0, dtype=rowdtype)
+                arrs.append(arr)
+                plots.append(plot)
+                plot = {}
+                fp.seek(offset + npoints * rowdtype.itemsize)
+    return arrs, plots
+
+def rawcolumns(fname, plotidx=0):
+    """
+    Return the vectors of one plot in an ngspice binary rawfile as a list
+    of 1D NumPy arrays, in the order they appear in the file (the first
+    one being the analysis variable, e.g., time).  Arrays are views into
+    the memory-mapped file.  In complex data (e.g., from an AC analysis)
+    every vector is complex:  the frequency and vectors with no imaginary
+    part (e.g., vdb() or vp()) are returned as their real part, and other
+    vectors as two columns, the real and the imaginary part, in the way
+    that "wrdata" writes them.
+    """
+    arrs, plots = rawread(fname)
+    if plotidx >= len(arrs):
+        return []
+    arr = arrs[plotidx]
+    columns = []
+    for i, name in enumerate(arr.dtype.names):
+        column = arr[name]
+        if np.iscomplexobj(column):
+            if i > 0 and np.any(column.imag):
+                columns.append(column.real)
+                column = column.imag
+            else:
+                column = column.real
+        columns.append(column)
+    return columns
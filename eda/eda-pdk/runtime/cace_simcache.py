@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+cace_simcache.py
+Persistent cache of simulation results for CACE.  Each entry is keyed by
+a hash of the fully substituted testbench netlist together with the
+contents of every file it reads through .include or .lib (followed
+recursively), and the ngspice configuration in the simulation directory.
+An entry holds the simulator output and the data files (.data, .raw)
+named on the result lines, which is everything cace_launch.py needs to
+reproduce the results without running the simulator again.
+
+Entries are evicted least-recently-used first when the cache grows past
+its size limit.
+"""
+
+import os
+import re
+import shutil
+import hashlib
+import tempfile
+
+# Default location and size limit of the cache
+default_cachedir = os.path.join(os.path.expanduser('~'), '.cache', 'cace')
+default_cachesize = 2048	# Megabytes
+
+increx = re.compile(r'^[ \t]*\.(include|inc|lib)[ \t]+["\']?([^ \t"\']+)["\']?', re.IGNORECASE)
+
+def hash_file(filepath, hasher, visited):
+    # Add the contents of "filepath" and all files it includes to "hasher".
+    # Paths are resolved relative to the including file first, then to the
+    # current directory, as ngspice does.  Each file is hashed only once,
+    # which also breaks include cycles.
+    filepath = os.path.realpath(filepath)
+    if filepath in visited:
+        return
+    visited.add(filepath)
+    hasher.update(filepath.encode('utf-8'))
+    try:
+        with open(filepath, 'rb') as ifile:
+            text = ifile.read()
+    except OSError:
+        # Missing includes make the simulation fail anyway;  hash the name only.
+        hasher.update(b'\0missing')
+        return
+    hasher.update(hashlib.sha256(text).digest())
+
+    filedir = os.path.dirname(filepath)
+    for line in text.decode('utf-8', errors='replace').splitlines():
+        imatch = increx.match(line)
+        if imatch:
+            incname = os.path.expanduser(imatch.group(2))
+            if not os.path.isabs(incname):
+                if os.path.exists(os.path.join(filedir, incname)):
+                    incname = os.path.join(filedir, incname)
+            hash_file(incname, hasher, visited)
+
+def netlist_key(filename, simulator='ngspice'):
+    """
+    Return the cache key for simulating netlist "filename" (a hex string).
+    The key covers the netlist, its transitive includes, the simulator
+    name, and any .spiceinit file in the current directory.
+    """
+    hasher = hashlib.sha256()
+    hasher.update(simulator.encode('utf-8'))
+    visited = set()
+    if os.path.exists('.spiceinit'):
+        hash_file('.spiceinit', hasher, visited)
+    hash_file(filename, hasher, visited)
+    return hasher.hexdigest()
+
+def entry_path(cachedir, key):
+    return os.path.join(cachedir, key[0:2], key)
+
+def contains(cachedir, key):
+    """Return True if the cache has an entry for "key"."""
+    return os.path.isfile(os.path.join(entry_path(cachedir, key), 'output.txt'))
+
+def lookup(cachedir, key, destdir):
+    """
+    Look up "key" in the cache.  On a hit, restore the cached data files
+    into "destdir" and return the simulator output as a string;  otherwise
+    return None.
+    """
+    entry = entry_path(cachedir, key)
+    outfile = os.path.join(entry, 'output.txt')
+    if not os.path.isfile(outfile):
+        return None
+    try:
+        with open(outfile, 'r') as ifile:
+            output = ifile.read()
+        filesdir = os.path.join(entry, 'files')
+        for dirpath, dirnames, filenames in os.walk(filesdir):
+            for filename in filenames:
+                source = os.path.join(dirpath, filename)
+                target = os.path.join(destdir, os.path.relpath(source, filesdir))
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copy(source, target)
+        # Mark entry as recently used
+        os.utime(entry)
+    except OSError:
+        return None
+    return output
+
+def store(cachedir, key, output, sourcedir, datafiles):
+    """
+    Save the simulator output and the data files "datafiles" (paths
+    relative to "sourcedir") under "key".  An existing entry is kept.
+    """
+    entry = entry_path(cachedir, key)
+    if os.path.isdir(entry):
+        return
+    # Data files outside of the simulation directory cannot be restored.
+    for datafile in datafiles:
+        if os.path.isabs(datafile) or '..' in datafile.split(os.sep):
+            return
+    parent = os.path.dirname(entry)
+    os.makedirs(parent, exist_ok=True)
+
+    # Build the entry in a temporary directory and move it into place, so
+    # that concurrent runs never see a partial entry.
+    tmpentry = tempfile.mkdtemp(dir=parent)
+    try:
+        with open(os.path.join(tmpentry, 'output.txt'), 'w') as ofile:
+            ofile.write(output)
+        for datafile in datafiles:
+            source = os.path.join(sourcedir, datafile)
+            if not os.path.isfile(source):
+                continue
+            target = os.path.join(tmpentry, 'files', datafile)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copy(source, target)
+        os.rename(tmpentry, entry)
+    except OSError:
+        shutil.rmtree(tmpentry, ignore_errors=True)
+
+def entry_size(entry):
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(entry):
+        for filename in filenames:
+            try:
+                size += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return size
+
+def evict(cachedir, maxsize=default_cachesize):
+    """
+    Remove the least recently used entries until the cache occupies no
+    more than "maxsize" megabytes.  Returns the number of entries removed.
+    """
+    if not os.path.isdir(cachedir):
+        return 0
+    entries = []
+    for subdir in os.listdir(cachedir):
+        subpath = os.path.join(cachedir, subdir)
+        if not os.path.isdir(subpath):
+            continue
+        for key in os.listdir(subpath):
+            entry = os.path.join(subpath, key)
+            try:
+                mtime = os.path.getmtime(entry)
+            except OSError:
+                continue
+            entries.append((mtime, entry, entry_size(entry)))
+
+    total = sum(item[2] for item in entries)
+    limit = maxsize * 1024 * 1024
+    removed = 0
+    for mtime, entry, size in sorted(entries):
+        if total <= limit:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+        removed += 1
+    return removed
@@ -13,6 +13,7 @@
 
 import os
 import sys
+import gds_stream
 
 def usage():
     print('change_gds_cell.py <cell_name> <path_to_cell_gds> <path_to_gds_in> [<path_to_gds_out>] [-checksum=<checksum>]')
@@ -70,155 +71,91 @@ if __name__ == '__main__':
     destdir = os.path.split(dest)[0]
     gdsoutfile = os.path.split(dest)[1]
 
-    print('Reading GDS file for alternate cell ' + cellname)
-    with open(cellsource, 'rb') as ifile:
-        celldata = ifile.read()
-
-    #----------------------------------------------------------------------
-    # Assume that celldata contains the cell in question.
-    # Find the extend of the data from 'beginstr' to 'endstr'
-    #----------------------------------------------------------------------
-    
-    datalen = len(celldata)
-    dataptr = 0
-    incell = False
-    datastart = dataend = -1
-    while dataptr < datalen:
-        # Read stream records up to 'beginstr', then save data through 'endstr'
-        bheader = celldata[dataptr:dataptr + 2]
-        reclen = int.from_bytes(bheader, 'big')
-        if reclen == 0:
-            print('Error: found zero-length record at position ' + str(dataptr))
-            break
-
-        rectype = celldata[dataptr + 2]
-        datatype = celldata[dataptr + 3]
-
-        brectype = rectype.to_bytes(1, byteorder='big')
-        bdatatype = datatype.to_bytes(1, byteorder='big')
-
-        if rectype == 5:            # beginstr
-            saveptr = dataptr
-
-        elif rectype == 6:            # strname
-            if datatype != 6:
-                print('Error: Structure name record is not a string!')
-                sys.exit(1)
-
-            bstring = celldata[dataptr + 4: dataptr + reclen]
-            # Odd length strings end in null byte which needs to be removed
-            if bstring[-1] == 0:
-                bstring = bstring[:-1]
-            strname = bstring.decode('ascii')
-            if strname == cellname:
-                print('Cell ' + cellname + ' found at position ' + str(saveptr))
-                datastart = saveptr
-                incell = True
-            elif debug:
-                print('Cell ' + strname + ' position ' + str(dataptr) + ' (ignored)')
-
-        elif rectype == 7:		# endstr
+    # Find the start and end of structure "cellname" in GDS data "gdsdata".
+    # Returns (start, end, checksum), where start and end are -1 if the
+    # cell was not found.
+
+    def find_cell(gdsdata, action):
+        incell = False
+        cellchecksum = 0
+        cellstart = cellend = -1
+        for dataptr, reclen, rectype, datatype in gds_stream.records(gdsdata):
+            if rectype == gds_stream.BGNSTR:
+                saveptr = dataptr
+
+            elif rectype == gds_stream.STRNAME:
+                if datatype != gds_stream.ASCII:
+                    print('Error: Structure name record is not a string!')
+                    sys.exit(1)
+
+                # Odd length strings end in null byte which is removed
+                bstring = gds_stream.record_string(gdsdata, dataptr, reclen)
+                strname = bstring.decode('ascii')
+                if strname == cellname:
+                    print('Cell ' + cellname + ' found at position ' + str(saveptr))
+                    cellstart = saveptr
+                    incell = True
+                elif debug:
+                    print('Cell ' + strname + ' position ' + str(dataptr) + ' (' + action + ')')
+
+            elif rectype == gds_stream.ENDSTR:
+                if incell:
+                    incell = False
+                    cellchecksum = cellchecksum + reclen
+                    cellend = dataptr + reclen
+                    print('Cell ' + cellname + ' ends at position ' + str(cellend))
+                    if action == 'copied':
+                        print('Cell ' + cellname + ' checksum is ' + str(cellchecksum))
+
+            # Find checksum (sum of length of all records in the cell of interest)
             if incell:
-                incell = False
-                dataend = dataptr + reclen
-                print('Cell ' + cellname + ' ends at position ' + str(dataend))
-
-        # Advance the pointer past the data
-        dataptr += reclen
-
-    if datastart == -1 or dataend == -1:
-        print('Failed to find the cell data for ' + cellname)
-        sys.exit(1)
-
-    #-----------------------------------------------------------------
-    # Now do the same thing for the source GDS file.
-    #-----------------------------------------------------------------
-
-    print('Reading GDS file for original source ' + source)
-    with open(source, 'rb') as ifile:
-        gdsdata = ifile.read()
-
-    datalen = len(gdsdata)
-    dataptr = 0
-    incell = False
-    cellchecksum = 0
-    oldstart = oldend = -1
-    while dataptr < datalen:
-        # Read stream records up to any structure, then check for structure name
-        bheader = gdsdata[dataptr:dataptr + 2]
-        reclen = int.from_bytes(bheader, 'big')
-        if reclen == 0:
-            print('Error: found zero-length record at position ' + str(dataptr))
-            break
-
-        rectype = gdsdata[dataptr + 2]
-        datatype = gdsdata[dataptr + 3]
-
-        brectype = rectype.to_bytes(1, byteorder='big')
-        bdatatype = datatype.to_bytes(1, byteorder='big')
-
-        if rectype == 5:            # beginstr
-            saveptr = dataptr
-
-        elif rectype == 6:            # strname
-            if datatype != 6:
-                print('Error: Structure name record is not a string!')
-                sys.exit(1)
-
-            bstring = gdsdata[dataptr + 4: dataptr + reclen]
-            # Odd length strings end in null byte which needs to be removed
-            if bstring[-1] == 0:
-                bstring = bstring[:-1]
-            strname = bstring.decode('ascii')
-            if strname == cellname:
-                print('Cell ' + cellname + ' found at position ' + str(saveptr))
-                oldstart = saveptr
-                incell = True
-            elif debug:
-                print('Cell ' + strname + ' position ' + str(dataptr) + ' (copied)')
-
-        elif rectype == 7:		# endstr
-            if incell:
-                incell = False
                 cellchecksum = cellchecksum + reclen
-                oldend = dataptr + reclen
-                print('Cell ' + cellname + ' ends at position ' + str(oldend))
-                print('Cell ' + cellname + ' checksum is ' + str(cellchecksum))
 
-        # Find checksum (sum of length of all records in the cell of interest)
-        if incell:
-            cellchecksum = cellchecksum + reclen
+        return cellstart, cellend, cellchecksum
 
-        # Advance the pointer past the data
-        dataptr += reclen
+    #----------------------------------------------------------------------
+    # Assume that the cell GDS file contains the cell in question.
+    # Find the extent of the data from 'beginstr' to 'endstr'
+    #----------------------------------------------------------------------
 
-    if oldstart == -1 or oldend == -1:
-        print('Failed to find the cell data for ' + cellname)
-        sys.exit(1)
+    print('Reading GDS file for alternate cell ' + cellname)
+    with gds_stream.open_gds(cellsource) as celldata:
+        datastart, dataend, altchecksum = find_cell(celldata, 'ignored')
 
-    if checksum != 0:
-        if cellchecksum == checksum:
-            print('Info:  Structure ' + cellname + ' matches checksum ' + str(checksum))
-        else:
-            print('Info:  Structure ' + cellname + ' at ' + str(oldstart) + ' to ' +
-		str(oldend) + ' has checksum ' + str(cellchecksum) +
-		' != ' + str(checksum) + ' (checksum failure)')
+        if datastart == -1 or dataend == -1:
+            print('Failed to find the cell data for ' + cellname)
             sys.exit(1)
-    else:
-        print('Info:  Structure ' + cellname + ' checksum is ' + str(cellchecksum))
 
-    print('Info:  Structure ' + cellname + ' at ' + str(oldstart) + ' to ' +
-		str(oldend) + ' will be replaced by alternate data.')
+        #-----------------------------------------------------------------
+        # Now do the same thing for the source GDS file.
+        #-----------------------------------------------------------------
 
-    before = gdsdata[0:oldstart]
-    after = gdsdata[oldend:]
+        print('Reading GDS file for original source ' + source)
+        with gds_stream.open_gds(source) as gdsdata:
+            oldstart, oldend, cellchecksum = find_cell(gdsdata, 'copied')
 
-    cellstrdata = celldata[datastart:dataend]
+            if oldstart == -1 or oldend == -1:
+                print('Failed to find the cell data for ' + cellname)
+                sys.exit(1)
 
-    # Reassemble the GDS data around the new cell
-    gdsdata = before + cellstrdata + after
+            if checksum != 0:
+                if cellchecksum == checksum:
+                    print('Info:  Structure ' + cellname + ' matches checksum ' + str(checksum))
+                else:
+                    print('Info:  Structure ' + cellname + ' at ' + str(oldstart) + ' to ' +
+			str(oldend) + ' has checksum ' + str(cellchecksum) +
+			' != ' + str(checksum) + ' (checksum failure)')
+                    sys.exit(1)
+            else:
+                print('Info:  Structure ' + cellname + ' checksum is ' + str(cellchecksum))
+
+            print('Info:  Structure ' + cellname + ' at ' + str(oldstart) + ' to ' +
+			str(oldend) + ' will be replaced by alternate data.')
 
-    with open(dest, 'wb') as ofile:
-        ofile.write(gdsdata)
+            # Write the GDS data with the new cell in place of the old one
+            with gds_stream.output_file(dest) as ofile:
+                gds_stream.copy_data(gdsdata, 0, oldstart, ofile)
+                gds_stream.copy_data(celldata, datastart, dataend, ofile)
+                gds_stream.copy_data(gdsdata, oldend, len(gdsdata), ofile)
 
     exit(0)
@@ -4,6 +4,7 @@
 import os
 import sys
 import datetime
+import gds_stream
 
 def usage():
     print('change_gds_date.py <create_stamp> <mod_stamp> <path_to_gds_in> [<path_to_gds_out>]')
@@ -57,9 +58,6 @@ if __name__ == '__main__':
     destdir = os.path.split(dest)[0]
     gdsoutfile = os.path.split(dest)[1]
 
-    with open(source, 'rb') as ifile:
-        gdsdata = ifile.read()
-
     # Generate 12-byte modification timestamp data from date.
     try:
         modtime = datetime.datetime.fromtimestamp(int(modstamp))
@@ -98,45 +96,22 @@ if __name__ == '__main__':
     # (library or structure).  Otherwise, apply the same datestamps to both.
 
     recordtypes = ['beginstr', 'beginlib']
-    recordfilter = [5, 1]
-
-    datalen = len(gdsdata)
-    dataptr = 0
-    while dataptr < datalen:
-        # Read stream records up to any string, then search for search text.
-        bheader = gdsdata[dataptr:dataptr + 2]
-        reclen = int.from_bytes(bheader, 'big')
-        if reclen == 0:
-            print('Error: found zero-length record at position ' + str(dataptr))
-            break
-
-        rectype = gdsdata[dataptr + 2]
-        datatype = gdsdata[dataptr + 3]
-
-        brectype = rectype.to_bytes(1, byteorder='big')
-        bdatatype = datatype.to_bytes(1, byteorder='big')
-
-        if rectype in recordfilter:
-            # Datatype should be 2
-            if datatype != 2:
-                print('Error:  Header data type is not 2-byte integer!')
-            if reclen != 28:
-                print('Error:  Header record length is not 28!')
-            if debug:
-                print('Record type = ' + str(rectype) + ' data type = ' + str(datatype) + ' length = ' + str(reclen))
-
-            before = gdsdata[0:dataptr]
-            after = gdsdata[dataptr + reclen:]
-
-            # Assemble the new record
-            newrecord = bheader + brectype + bdatatype + gdscreatestamp + gdsmodstamp
-            # Reassemble the GDS data around the new record
-            gdsdata = before + newrecord + after
-
-        # Advance the pointer past the data
-        dataptr += reclen
-
-    with open(dest, 'wb') as ofile:
-        ofile.write(gdsdata)
+    recordfilter = [gds_stream.BGNSTR, gds_stream.BGNLIB]
+
+    def new_datestamp(gdsdata, dataptr, reclen, rectype, datatype):
+        # Datatype should be 2
+        if datatype != 2:
+            print('Error:  Header data type is not 2-byte integer!')
+        if reclen != 28:
+            print('Error:  Header record length is not 28!')
+        if debug:
+            print('Record type = ' + str(rectype) + ' data type = ' + str(datatype) + ' length = ' + str(reclen))
+
+        # Assemble the new record (keeping the original record length)
+        bheader = gdsdata[dataptr:dataptr + 4]
+        return bheader + gdscreatestamp + gdsmodstamp
+
+    # Write the new GDS data in one pass over the file
+    gds_stream.rewrite(source, dest, new_datestamp, recordfilter)
 
     exit(0)
@@ -8,6 +8,7 @@
 import os
 import re
 import sys
+import gds_stream
 
 def usage():
     print('change_gds_string.py <old_string> <new_string> [...] <path_to_gds_in> [<path_to_gds_out>]')
@@ -69,93 +70,65 @@ if __name__ == '__main__':
     destdir = os.path.split(dest)[0]
     gdsoutfile = os.path.split(dest)[1]
 
-    with open(source, 'rb') as ifile:
-        gdsdata = ifile.read()
-
     # To be done:  Allow the user to select a specific record type or types
     # in which to restrict the string substitution.  If no restrictions are
     # specified, then substitue in library name, structure name, and strings.
 
     recordtypes = ['libname', 'strname', 'sname', 'string']
-    recordfilter = [2, 6, 18, 25]
-    bsearchlist = list(bytes(item, 'ascii') for item in oldstrings)
+    recordfilter = [gds_stream.LIBNAME, gds_stream.STRNAME, gds_stream.SNAME, gds_stream.STRING]
+    bsearchlist = list(re.compile(bytes(item, 'ascii')) for item in oldstrings)
     breplist = list(bytes(item, 'ascii') for item in newstrings)
 
     if debug > 1:
-        print('Search list = ' + str(bsearchlist))
+        print('Search list = ' + str([item.pattern for item in bsearchlist]))
         print('Replace list = ' + str(breplist))
 
-    datalen = len(gdsdata)
     if debug > 0:
-        print('Original data length = ' + str(datalen))
-    dataptr = 0
-    while dataptr < datalen:
-        # Read stream records up to any string, then search for search text.
-        bheader = gdsdata[dataptr:dataptr + 2]
-        reclen = int.from_bytes(bheader, 'big')
-        newlen = reclen
-        if newlen == 0:
-            print('Error: found zero-length record at position ' + str(dataptr))
-            break
-
-        rectype = gdsdata[dataptr + 2]
-        datatype = gdsdata[dataptr + 3]
-
-        if rectype in recordfilter:
-            # Datatype 6 is STRING
-            if datatype == 6:
-                bstring = gdsdata[dataptr + 4: dataptr + reclen]
-                if debug > 1:
-                    idx = recordfilter.index(rectype)
-                    print(recordtypes[idx] + ' string = ' + str(bstring))
-
-                for bsearch,brep in zip(bsearchlist, breplist):
-                    # Verbatim option:  search string must match GDS string exactly
-                    if verbatim:
-                        blen = reclen - 4
-                        if bstring[-1] == 0:
-                            blen = blen - 1
-                        if len(bsearch) != blen:
-                            continue
-                    repstring = re.sub(bsearch, brep, bstring)
-                    if repstring != bstring:
-                        before = gdsdata[0:dataptr]
-                        after = gdsdata[dataptr + reclen:]
-                        newlen = len(repstring) + 4
-                        # Record sizes must be even
-                        if newlen % 2 != 0:
-                            # Was original string padded with null byte?  If so,
-                            # remove the null byte and reduce newlen.  Otherwise,
-                            # add a null byte and increase newlen.
-                            if bstring[-1] == 0:
-                                repstring = repstring[0:-1]
-                                newlen -= 1
-                            else:
-                                repstring += b'\x00'
-                                newlen += 1
-                            
-                        bnewlen = newlen.to_bytes(2, byteorder='big')
-                        brectype = rectype.to_bytes(1, byteorder='big')
-                        bdatatype = datatype.to_bytes(1, byteorder='big')
-
-                        # Assemble the new record
-                        newrecord = bnewlen + brectype + bdatatype + repstring
-                        # Reassemble the GDS data around the new record
-                        gdsdata = before + newrecord[0:newlen] + after
-                        # Adjust the data end location
-                        datalen += (newlen - reclen)
-
-                        if debug > 0:
-                            print('Replaced ' + str(bstring) + ' with ' + str(repstring)) 
-            else:
-                if debug > 1:
-                    idx = recordfilter.index(rectype)
-                    print(recordtypes[idx] + ' record = ' + str(datatype) + ' is not a string')
-
-        # Advance the pointer past the data
-        dataptr += newlen
-
-    with open(dest, 'wb') as ofile:
-        ofile.write(gdsdata)
+        print('Original data length = ' + str(os.path.getsize(source)))
+
+    def replace_string(gdsdata, dataptr, reclen, rectype, datatype):
+        # Datatype 6 is STRING
+        if datatype != 6:
+            if debug > 1:
+                idx = recordfilter.index(rectype)
+                print(recordtypes[idx] + ' record = ' + str(datatype) + ' is not a string')
+            return None
+
+        bstring = gdsdata[dataptr + 4: dataptr + reclen]
+        if debug > 1:
+            idx = recordfilter.index(rectype)
+            print(recordtypes[idx] + ' string = ' + str(bstring))
+
+        # Each replacement is made on the result of the previous one
+        repstring = bstring
+        for bsearch,brep in zip(bsearchlist, breplist):
+            # Verbatim option:  search string must match GDS string exactly
+            if verbatim:
+                blen = len(repstring)
+                if repstring[-1:] == b'\x00':
+                    blen = blen - 1
+                if len(bsearch.pattern) != blen:
+                    continue
+            newstring = bsearch.sub(brep, repstring)
+            if newstring != repstring:
+                # Record sizes must be even
+                if len(newstring) % 2 != 0:
+                    # Was original string padded with null byte?  If so,
+                    # remove the null byte and reduce the length.  Otherwise,
+                    # add a null byte and increase the length.
+                    if repstring[-1:] == b'\x00':
+                        newstring = newstring[0:-1]
+                    else:
+                        newstring += b'\x00'
+                if debug > 0:
+                    print('Replaced ' + str(repstring) + ' with ' + str(newstring))
+                repstring = newstring
+
+        if repstring == bstring:
+            return None
+        return gds_stream.make_record(rectype, datatype, repstring)
+
+    # Write the new GDS data in one pass over the file
+    gds_stream.rewrite(source, dest, replace_string, recordfilter)
 
     exit(0)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+test_cace_ngshared.py
+Test of the parts of cace_ngshared.py that do not need libngspice.
+
+A netlist is only run one command at a time if its control block has no
+control structures and nothing changes what "wrdata" writes.  The columns
+collected for a data file must give cace_launch.py the same results, to
+the last bit, as reading the file that "wrdata" writes.
+
+Run with "python3 -m unittest discover eda/eda-pdk/runtime/tests".
+"""
+
+import os
+import sys
+import io
+import shutil
+import tempfile
+import contextlib
+import unittest
+
+import numpy as np
+
+testdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(testdir))
+
+import cace_ngshared
+
+try:
+    import cace_launch
+except ImportError as e:
+    cace_launch = None
+    missing = str(e)
+
+def write_wrdata(path, scale, vectors):
+    # Write a data file the way ngspice "wrdata" does
+    with open(path, 'w') as ofile:
+        for i in range(len(scale)):
+            for vector in vectors:
+                ofile.write('% .8e ' % scale[i])
+                if np.iscomplexobj(vector):
+                    ofile.write('% .8e % .8e ' % (vector[i].real, vector[i].imag))
+                else:
+                    ofile.write('% .8e ' % vector[i])
+            ofile.write('\n')
+
+class SplitNetlistTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def split(self, text):
+        with open('tb.spice', 'w') as ofile:
+            ofile.write(text)
+        return cace_ngshared.split_netlist('tb.spice')
+
+    def test_commands(self):
+        circuit, commands = self.split('* title\nV1 out 0 1\n.control\n'
+		'* comment\n\ntran 1n 10n\n  wrdata tb.data v(out)\n.endc\n'
+		'.end\n.control\necho ignored\n.endc\n')
+        self.assertEqual(circuit, ['* title', 'V1 out 0 1', '.end'])
+        self.assertEqual(commands, ['tran 1n 10n', 'wrdata tb.data v(out)'])
+
+    def test_source(self):
+        for text in ['* no wrdata\n.control\ntran 1n 10n\n.endc\n.end\n',
+		'* loop\n.control\nrepeat 2\nwrdata tb.data out\nend\n.endc\n.end\n',
+		'* append\n.control\nset appendwrite\nwrdata tb.data out\n.endc\n.end\n',
+		'* precision\n.option numdgt=12\n.control\nwrdata tb.data out\n.endc\n.end\n',
+		'* unterminated\n.control\nwrdata tb.data out\n']:
+            with self.subTest(text=text.splitlines()[0]):
+                self.assertIsNone(self.split(text))
+
+    def test_spiceinit(self):
+        with open('.spiceinit', 'w') as ofile:
+            ofile.write('set wr_singlescale\n')
+        self.assertIsNone(self.split('* title\n.control\nwrdata tb.data out\n.endc\n.end\n'))
+
+@unittest.skipIf(cace_launch is None, 'cace_launch cannot be imported')
+class WrdataColumnsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.simfiles_path = cace_launch.simfiles_path
+        cace_launch.simfiles_path = self.tmpdir
+
+    def tearDown(self):
+        cace_launch.simfiles_path = self.simfiles_path
+        shutil.rmtree(self.tmpdir)
+
+    def compare(self, scale, vectors, nargs):
+        write_wrdata(os.path.join(self.tmpdir, 'tb.data'), scale, vectors)
+        fromfile = [[] for i in range(nargs)]
+        frommemory = [[] for i in range(nargs)]
+        with contextlib.redirect_stdout(io.StringIO()):
+            cace_launch.read_ascii_datafile('tb.data', *fromfile)
+            cace_launch.read_ascii_datafile('tb.data', *frommemory,
+			columns=cace_ngshared.wrdata_columns(scale, vectors))
+        self.assertEqual(frommemory, fromfile)
+
+    def test_transient(self):
+        rng = np.random.default_rng(1)
+        time = np.linspace(0, 1e-6, 101)
+        self.compare(time, [rng.normal(size=101), rng.normal(size=101) * 1e-7], 3)
+
+    def test_ac(self):
+        rng = np.random.default_rng(2)
+        freq = np.logspace(3, 9, 61) + 0j
+        vout = rng.normal(size=61) + 1j * rng.normal(size=61)
+        self.compare(freq, [vout], 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+test_cace_rawfile.py
+Test of reading ngspice binary rawfiles with cace_rawfile.py.
+
+An AC analysis writes every vector as complex, including real-valued ones
+such as vdb(out) and vp(out), whose negative values must not lose their
+sign.
+
+Run with "python3 -m unittest discover eda/eda-pdk/runtime/tests".
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+testdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(testdir))
+
+import cace_rawfile
+
+def write_rawfile(path, plotname, names, units, data):
+    # Write an ngspice binary rawfile with one plot of the rows in "data"
+    iscomplex = np.iscomplexobj(data)
+    header = ['Title: test', 'Date: Sat Oct 17 00:00:00  2026',
+		'Plotname: ' + plotname,
+		'Flags: ' + ('complex' if iscomplex else 'real'),
+		'No. Variables: ' + str(len(names)),
+		'No. Points: ' + str(len(data)), 'Variables:']
+    for i, (name, unit) in enumerate(zip(names, units)):
+        header.append('\t' + str(i) + '\t' + name + '\t' + unit)
+    header.append('Binary:')
+    with open(path, 'wb') as ofile:
+        ofile.write(('\n'.join(header) + '\n').encode('ascii'))
+        dtype = np.complex128 if iscomplex else np.float64
+        ofile.write(np.asarray(data, dtype=dtype).tobytes())
+
+class RawColumnsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_ac_real_vectors(self):
+        freq = np.array([1e3, 1e4, 1e5, 1e6])
+        vdb = np.array([-3.5, -10.25, -40.0, 2.0])
+        vp = np.array([-0.1, -0.785, -1.5708, -3.0])
+        path = os.path.join(self.tmpdir, 'ac.raw')
+        write_rawfile(path, 'AC Analysis', ['frequency', 'vdb(out)', 'vp(out)'],
+		['frequency', 'decibel', 'voltage'],
+		np.column_stack((freq, vdb, vp)).astype(np.complex128))
+        columns = cace_rawfile.rawcolumns(path)
+        self.assertEqual(len(columns), 3)
+        for column, expected in zip(columns, [freq, vdb, vp]):
+            self.assertFalse(np.iscomplexobj(column))
+            np.testing.assert_array_equal(column, expected)
+
+    def test_ac_complex_vector(self):
+        freq = np.array([1e3, 1e4, 1e5])
+        vout = np.array([0.5 - 0.25j, -0.125 + 1j, -2 - 3j])
+        path = os.path.join(self.tmpdir, 'ac.raw')
+        write_rawfile(path, 'AC Analysis', ['frequency', 'v(out)'],
+		['frequency', 'voltage'], np.column_stack((freq, vout)))
+        columns = cace_rawfile.rawcolumns(path)
+        # Real and imaginary parts in separate columns, as from "wrdata"
+        self.assertEqual(len(columns), 3)
+        np.testing.assert_array_equal(columns[0], freq)
+        np.testing.assert_array_equal(columns[1], vout.real)
+        np.testing.assert_array_equal(columns[2], vout.imag)
+
+    def test_transient(self):
+        time = np.linspace(0, 1e-6, 5)
+        vout = np.array([0.0, -0.5, 1.8, -1.8, 0.25])
+        path = os.path.join(self.tmpdir, 'tran.raw')
+        write_rawfile(path, 'Transient Analysis', ['time', 'v(out)'],
+		['time', 'voltage'], np.column_stack((time, vout)))
+        columns = cace_rawfile.rawcolumns(path)
+        np.testing.assert_array_equal(columns[0], time)
+        np.testing.assert_array_equal(columns[1], vout)
+
+if __name__ == '__main__':
+    unittest.main()
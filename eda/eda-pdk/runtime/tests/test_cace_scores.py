@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+test_cace_scores.py
+Regression test of the scores and measurements of cace_launch.py.
+
+cace_scores.json holds randomly generated cases of calculate() and
+apply_measure() together with the results (return value, error, and the
+modified record or vectors) of the implementation from before these were
+converted to NumPy.  The results must be the same to the last bit, so that
+no datasheet score changes.
+
+Run with "python3 -m unittest discover eda/eda-pdk/runtime/tests".
+"""
+
+import os
+import sys
+import io
+import json
+import copy
+import contextlib
+import unittest
+
+import numpy as np
+
+testdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(testdir))
+
+try:
+    import cace_launch
+except ImportError as e:
+    cace_launch = None
+    missing = str(e)
+
+def plain(value):
+    # Results as they would be written to the datasheet
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(type(value).__name__)
+
+def same(a, b):
+    # Compare through JSON, so that NaN equals NaN and floats are exact
+    return json.dumps(a, default=plain, sort_keys=True) == \
+		json.dumps(b, default=plain, sort_keys=True)
+
+def call(func, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            return func(*args), None
+        except Exception as e:
+            return None, type(e).__name__
+
+@unittest.skipIf(cace_launch is None, 'cace_launch cannot be imported')
+class ScoreTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with open(os.path.join(testdir, 'cace_scores.json')) as ifile:
+            cls.cases = json.load(ifile)
+
+    def test_calculate(self):
+        for number, case in enumerate(self.cases['calculate']):
+            with self.subTest(case=number, calc=case['calc']):
+                record = copy.deepcopy(case['record'])
+                result, error = call(cace_launch.calculate, record,
+			list(case['data']), copy.deepcopy(case['conditions']),
+			case['calc'], 0.0, case['units'],
+			copy.deepcopy(case['param']))
+                self.assertEqual(error, case['error'])
+                self.assertTrue(same(result, case['result']),
+			f'{result!r} != {case["result"]!r}')
+                self.assertTrue(same(record, case['result_record']),
+			f'{record!r} != {case["result_record"]!r}')
+
+    def test_apply_measure(self):
+        for number, case in enumerate(self.cases['apply_measure']):
+            with self.subTest(case=number, calc=case['measure']['calc']):
+                cace_launch.paramresult = list(case['paramresult'])
+                varresult = copy.deepcopy(case['varresult'])
+                result, error = call(cace_launch.apply_measure, varresult,
+			dict(case['measure']), copy.deepcopy(case['variables']))
+                self.assertEqual(error, case['error'])
+                self.assertTrue(same(result, case['result']),
+			f'{result!r} != {case["result"]!r}')
+                if error:
+                    # (The vectors are left half-modified on an error)
+                    continue
+                # Vectors are compared as lists of floats
+                varresult = {key: np.asarray(value, dtype=float).tolist()
+			for key, value in varresult.items()}
+                self.assertTrue(same(varresult, case['result_varresult']),
+			f'{varresult!r} != {case["result_varresult"]!r}')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -24,20 +24,156 @@ import sys
 import os
 import re
 import glob
+import csv
+import json
 import select
 import subprocess
+import numpy as np
+
+# Layers checked, in the order reported:  name in the magic output, name
+# in the report, and the minimum and maximum allowed density (None if the
+# layer has no density rule).
+
+density_layers = [
+	('FOM',  'FOM',  0.33, 0.57),
+	('POLY', 'POLY', None, None),
+	('LI1',  'LI',   0.35, 0.60),
+	('MET1', 'MET1', 0.35, 0.60),
+	('MET2', 'MET2', 0.35, 0.60),
+	('MET3', 'MET3', 0.35, 0.60),
+	('MET4', 'MET4', 0.35, 0.60),
+	('MET5', 'MET5', 0.45, 0.76)]
+
+# The stepped density window is 700um x 700um, or 10 x 10 tiles of 70um.
+window_tiles = 10
 
 def usage():
     print("Usage:")
-    print("check_density.py [<layout_file_name>] [-keep]")
+    print("check_density.py [<layout_file_name>] [-keep] [-csv=<file>] [-json=<file>]")
     print("")
     print("where:")
     print("   <layout_file_name> is the path to the .gds or .mag file to be checked.")
     print("")
     print("  If '-keep' is specified, then keep the check script.")
     print("  If '-debug' is specified, then print diagnostic information.")
+    print("  If '-csv=<file>' is specified, then also write all results to <file> as CSV.")
+    print("  If '-json=<file>' is specified, then also write all results to <file> as JSON.")
     return 0
 
+#----------------------------------------------------------------------------
+# Density calculation.  Tile densities are held in 2D arrays indexed [y, x],
+# and densities over windows of tiles are computed from summed-area tables.
+#----------------------------------------------------------------------------
+
+# Return the weight of each tile in an area:  1 for a full tile, and the
+# fraction of a tile covered by the layout for the last column ("xfrac")
+# and the last row ("yfrac"), which are only partly inside the layout.
+
+def tile_weights(xtiles, ytiles, xfrac, yfrac):
+    weights = np.ones((ytiles, xtiles))
+    weights[:, -1] *= xfrac
+    weights[-1, :] *= yfrac
+    return weights
+
+# Return the summed-area table of 2D array "values".  The table has an
+# extra leading row and column of zeros, so that the sum of
+# values[y0:y1, x0:x1] is sat[y1, x1] - sat[y0, x1] - sat[y1, x0] + sat[y0, x0].
+
+def summed_area_table(values):
+    sat = np.zeros((values.shape[0] + 1, values.shape[1] + 1))
+    np.cumsum(values, axis=0, out=sat[1:, 1:])
+    np.cumsum(sat[1:, 1:], axis=1, out=sat[1:, 1:])
+    return sat
+
+# Return the sums of "values" over all windows of size x size entries,
+# stepped by one entry in each direction.
+
+def window_sums(values, size):
+    sat = summed_area_table(values)
+    return sat[size:, size:] - sat[:-size, size:] - sat[size:, :-size] + sat[:-size, :-size]
+
+def window_densities(tiles, weights, size=window_tiles):
+    """
+    Return the density of each stepped window of size x size tiles as a
+    2D array indexed [y, x] by the lower left tile of the window.  Tiles
+    on the right and top edges count in proportion to their weight, and
+    the area of the window is prorated to match.
+    """
+    return window_sums(tiles * weights, size) / window_sums(weights, size)
+
+def global_density(tiles, weights):
+    """Return the density of the whole layout."""
+    return float((tiles * weights).sum() / weights.sum())
+
+def density_violations(densities, mindens, maxdens):
+    """
+    Return two arrays of (x, y) window positions, one for the windows with
+    density below "mindens" and one for those above "maxdens".
+    """
+    low = np.zeros((0, 2), dtype=int)
+    high = np.zeros((0, 2), dtype=int)
+    if mindens is not None:
+        low = np.argwhere(densities < mindens)[:, ::-1]
+    if maxdens is not None:
+        high = np.argwhere(densities > maxdens)[:, ::-1]
+    return low, high
+
+# Return 'low', 'high', or 'ok' for each density in "densities" (an array
+# or a single value).
+
+def window_status(densities, mindens, maxdens):
+    status = np.full(np.shape(densities), 'ok', dtype=object)
+    if maxdens is not None:
+        status[np.asarray(densities) > maxdens] = 'high'
+    if mindens is not None:
+        status[np.asarray(densities) < mindens] = 'low'
+    if status.ndim == 0:
+        return status.item()
+    return status
+
+def limit_error(label, status, mindens, maxdens):
+    if status == 'low':
+        return '***Error:  ' + label + ' Density < ' + '{:.0f}'.format(mindens * 100) + '%'
+    else:
+        return '***Error:  ' + label + ' Density > ' + '{:.0f}'.format(maxdens * 100) + '%'
+
+#----------------------------------------------------------------------------
+# Write the results in machine-readable form.  The CSV file has one row per
+# window and layer, followed by one row per layer for the whole layout
+# (with empty x and y).
+#----------------------------------------------------------------------------
+
+def write_csv(filename, results):
+    with open(filename, 'w', newline='') as ofile:
+        writer = csv.writer(ofile)
+        writer.writerow(['layer', 'x', 'y', 'density', 'status'])
+        for result in results:
+            windows = result['windows']
+            status = window_status(windows, result['min'], result['max'])
+            for y in range(0, windows.shape[0]):
+                for x in range(0, windows.shape[1]):
+                    writer.writerow([result['layer'], x, y,
+				'{:.6f}'.format(windows[y, x]), status[y, x]])
+        for result in results:
+            writer.writerow([result['layer'], '', '',
+			'{:.6f}'.format(result['global']),
+			window_status(result['global'], result['min'], result['max'])])
+
+def write_json(filename, layout, xtiles, ytiles, xfrac, yfrac, results):
+    layers = {}
+    for result in results:
+        layers[result['layer']] = {
+		'min': result['min'],
+		'max': result['max'],
+		'global': result['global'],
+		'windows': result['windows'].tolist(),
+		'low': result['low'].tolist(),
+		'high': result['high'].tolist()}
+    with open(filename, 'w') as ofile:
+        json.dump({'layout': layout, 'xtiles': xtiles, 'ytiles': ytiles,
+		'xfrac': xfrac, 'yfrac': yfrac, 'window': window_tiles,
+		'layers': layers}, ofile, indent=1)
+
 if __name__ == '__main__':
 
     optionlist = []
@@ -69,6 +205,15 @@ if __name__ == '__main__':
     elif debugmode:
         print('Temporary files will be removed after running.')
 
+    csvfile = None
+    jsonfile = None
+    for option in optionlist:
+        result = option.split('=', 1)
+        if result[0] == '-csv' and len(result) == 2:
+            csvfile = result[1]
+        elif result[0] == '-json' and len(result) == 2:
+            jsonfile = result[1]
+
     # Find layout from command-line argument
 
     user_project_path = arguments[0]
@@ -341,14 +486,9 @@ if __name__ == '__main__':
                 else:
                     break
 
-    fomfill  = []
-    polyfill = []
-    lifill   = []
-    met1fill = []
-    met2fill = []
-    met3fill = []
-    met4fill = []
-    met5fill = []
+    tilefill = {}
+    for layer in density_layers:
+        tilefill[layer[0]] = []
     xtiles = 0
     ytiles = 0
     xfrac = 0.0
@@ -364,22 +504,8 @@ if __name__ == '__main__':
                 density = float(dpair[1].strip())
             except:
                 continue
-            if layer == 'FOM':
-                fomfill.append(density)
-            elif layer == 'POLY':
-                polyfill.append(density)
-            elif layer == 'LI1':
-                lifill.append(density)
-            elif layer == 'MET1':
-                met1fill.append(density)
-            elif layer == 'MET2':
-                met2fill.append(density)
-            elif layer == 'MET3':
-                met3fill.append(density)
-            elif layer == 'MET4':
-                met4fill.append(density)
-            elif layer == 'MET5':
-                met5fill.append(density)
+            if layer in tilefill:
+                tilefill[layer].append(density)
             elif layer == 'XTILES':
                 xtiles = int(dpair[1].strip())
             elif layer == 'YTILES':
@@ -397,6 +523,12 @@ if __name__ == '__main__':
         print('Layout is < 700um x 700um;  cannot run density checks.')
         sys.exit(1)
 
+    for layer in density_layers:
+        if len(tilefill[layer[0]]) != xtiles * ytiles:
+            print('Expected ' + str(xtiles * ytiles) + ' ' + layer[0] + ' tile densities,'
+			+ ' but found ' + str(len(tilefill[layer[0]])) + '.')
+            sys.exit(1)
+
     total_tiles = (ytiles - 9) * (xtiles - 9)
 
     print('')
@@ -410,412 +542,44 @@ if __name__ == '__main__':
 
     if debugmode:
         with open('tile_densities.txt', 'w') as dfile:
-            print(str(fomfill), file=dfile)
-            print(str(polyfill), file=dfile)
-            print(str(lifill), file=dfile)
-            print(str(met1fill), file=dfile)
-            print(str(met2fill), file=dfile)
-            print(str(met3fill), file=dfile)
-            print(str(met4fill), file=dfile)
-            print(str(met5fill), file=dfile)
-
-    print('')
-    print('FOM Density:')
-    for y in range(0, ytiles - 9):
-        if y == ytiles - 10:
-            locyfrac = yfrac
-        else:
-            locyfrac = 1.0
-        for x in range(0, xtiles - 9):
-            if x == xtiles - 10:
-                locxfrac = xfrac
-            else:
-                locxfrac = 1.0
-
-            fomaccum = 0
-            atotal = 81.0 + 9.0 * locxfrac + 9.0 * locyfrac + locxfrac * locyfrac
-
-            for w in range(y, y + 9):
-                base = xtiles * w + x
-                fomaccum += sum(fomfill[base : base + 9])
-                fomaccum += fomfill[base + 9] * locxfrac
-            base = xtiles * (y + 9) + x
-            fomaccum += sum(fomfill[base : base + 9]) * locyfrac
-            fomaccum += fomfill[base + 9] * locxfrac * locyfrac
-                    
-            fomaccum /= atotal
-            fomstr = "{:.3f}".format(fomaccum)
-            print('Tile (' + str(x) + ', ' + str(y) + '):   ' + fomstr)
-            if fomaccum < 0.33:
-                print('***Error:  FOM Density < 33%')
-            elif fomaccum > 0.57:
-                print('***Error:  FOM Density > 57%')
-
-    print('')
-    print('POLY Density:')
-    for y in range(0, ytiles - 9):
-        if y == ytiles - 10:
-            locyfrac = yfrac
-        else:
-            locyfrac = 1.0
-        for x in range(0, xtiles - 9):
-            if x == xtiles - 10:
-                locxfrac = xfrac
-            else:
-                locxfrac = 1.0
-
-            polyaccum = 0
-            atotal = 81.0 + 9.0 * locxfrac + 9.0 * locyfrac + locxfrac * locyfrac
-
-            for w in range(y, y + 9):
-                base = xtiles * w + x
-                polyaccum += sum(polyfill[base : base + 9])
-                polyaccum += polyfill[base + 9] * locxfrac
-            base = xtiles * (y + 9) + x
-            polyaccum += sum(polyfill[base : base + 9]) * locyfrac
-            polyaccum += polyfill[base + 9] * locxfrac * locyfrac
-                    
-            polyaccum /= atotal
-            polystr = "{:.3f}".format(polyaccum)
-            print('Tile (' + str(x) + ', ' + str(y) + '):   ' + polystr)
-
-    print('')
-    print('LI Density:')
-    for y in range(0, ytiles - 9):
-        if y == ytiles - 10:
-            locyfrac = yfrac
-        else:
-            locyfrac = 1.0
-        for x in range(0, xtiles - 9):
-            if x == xtiles - 10:
-                locxfrac = xfrac
-            else:
-                locxfrac = 1.0
-
-            liaccum = 0
-            atotal = 81.0 + 9.0 * locxfrac + 9.0 * locyfrac + locxfrac * locyfrac
-
-            for w in range(y, y + 9):
-                base = xtiles * w + x
-                liaccum += sum(lifill[base : base + 9])
-                liaccum += lifill[base + 9] * locxfrac
-            base = xtiles * (y + 9) + x
-            liaccum += sum(lifill[base : base + 9]) * locyfrac
-            liaccum += lifill[base + 9] * locxfrac * locyfrac
-                    
-            liaccum /= atotal
-            listr = "{:.3f}".format(liaccum)
-            print('Tile (' + str(x) + ', ' + str(y) + '):   ' + listr)
-            if liaccum < 0.35:
-                print('***Error:  LI Density < 35%')
-            elif liaccum > 0.60:
-                print('***Error:  LI Density > 60%')
-
-    print('')
-    print('MET1 Density:')
-    for y in range(0, ytiles - 9):
-        if y == ytiles - 10:
-            locyfrac = yfrac
-        else:
-            locyfrac = 1.0
-        for x in range(0, xtiles - 9):
-            if x == xtiles - 10:
-                locxfrac = xfrac
-            else:
-                locxfrac = 1.0
-
-            met1accum = 0
-            atotal = 81.0 + 9.0 * locxfrac + 9.0 * locyfrac + locxfrac * locyfrac
-
-            for w in range(y, y + 9):
-                base = xtiles * w + x
-                met1accum += sum(met1fill[base : base + 9])
-                met1accum += met1fill[base + 9] * locxfrac
-            base = xtiles * (y + 9) + x
-            met1accum += sum(met1fill[base : base + 9]) * locyfrac
-            met1accum += met1fill[base + 9] * locxfrac * locyfrac
-                    
-            met1accum /= atotal
-            met1str = "{:.3f}".format(met1accum)
-            print('Tile (' + str(x) + ', ' + str(y) + '):   ' + met1str)
-            if met1accum < 0.35:
-                print('***Error:  MET1 Density < 35%')
-            elif met1accum > 0.60:
-                print('***Error:  MET1 Density > 60%')
-
-    print('')
-    print('MET2 Density:')
-    for y in range(0, ytiles - 9):
-        if y == ytiles - 10:
-            locyfrac = yfrac
-        else:
-            locyfrac = 1.0
-        for x in range(0, xtiles - 9):
-            if x == xtiles - 10:
-                locxfrac = xfrac
-            else:
-                locxfrac = 1.0
-
-            met2accum = 0
-            atotal = 81.0 + 9.0 * locxfrac + 9.0 * locyfrac + locxfrac * locyfrac
-
-            for w in range(y, y + 9):
-                base = xtiles * w + x
-                met2accum += sum(met2fill[base : base + 9])
-                met2accum += met2fill[base + 9] * locxfrac
-            base = xtiles * (y + 9) + x
-            met2accum += sum(met2fill[base : base + 9]) * locyfrac
-            met2accum += met2fill[base + 9] * locxfrac * locyfrac
-                    
-            met2accum /= atotal
-            met2str = "{:.3f}".format(met2accum)
-            print('Tile (' + str(x) + ', ' + str(y) + '):   ' + met2str)
-            if met2accum < 0.35:
-                print('***Error:  MET2 Density < 35%')
-            elif met2accum > 0.60:
-                print('***Error:  MET2 Density > 60%')
-
-    print('')
-    print('MET3 Density:')
-    for y in range(0, ytiles - 9):
-        if y == ytiles - 10:
-            locyfrac = yfrac
-        else:
-            locyfrac = 1.0
-        for x in range(0, xtiles - 9):
-            if x == xtiles - 10:
-                locxfrac = xfrac
-            else:
-                locxfrac = 1.0
-
-            met3accum = 0
-            atotal = 81.0 + 9.0 * locxfrac + 9.0 * locyfrac + locxfrac * locyfrac
-
-            for w in range(y, y + 9):
-                base = xtiles * w + x
-                met3accum += sum(met3fill[base : base + 9])
-                met3accum += met3fill[base + 9] * locxfrac
-            base = xtiles * (y + 9) + x
-            met3accum += sum(met3fill[base : base + 9]) * locyfrac
-            met3accum += met3fill[base + 9] * locxfrac * locyfrac
-                    
-            met3accum /= atotal
-            met3str = "{:.3f}".format(met3accum)
-            print('Tile (' + str(x) + ', ' + str(y) + '):   ' + met3str)
-            if met3accum < 0.35:
-                print('***Error:  MET3 Density < 35%')
-            elif met3accum > 0.60:
-                print('***Error:  MET3 Density > 60%')
-
-    print('')
-    print('MET4 Density:')
-    for y in range(0, ytiles - 9):
-        if y == ytiles - 10:
-            locyfrac = yfrac
-        else:
-            locyfrac = 1.0
-
-        for x in range(0, xtiles - 9):
-            if x == xtiles - 10:
-                locxfrac = xfrac
-            else:
-                locxfrac = 1.0
-
-            met4accum = 0
-            atotal = 81.0 + 9.0 * locxfrac + 9.0 * locyfrac + locxfrac * locyfrac
-
-            for w in range(y, y + 9):
-                base = xtiles * w + x
-                met4accum += sum(met4fill[base : base + 9])
-                met4accum += met4fill[base + 9] * locxfrac
-            base = xtiles * (y + 9) + x
-            met4accum += sum(met4fill[base : base + 9]) * locyfrac
-            met4accum += met4fill[base + 9] * locxfrac * locyfrac
-                    
-            met4accum /= atotal
-            met4str = "{:.3f}".format(met4accum)
-            print('Tile (' + str(x) + ', ' + str(y) + '):   ' + met4str)
-            if met4accum < 0.35:
-                print('***Error:  MET4 Density < 35%')
-            elif met4accum > 0.60:
-                print('***Error:  MET4 Density > 60%')
-
-    print('')
-    print('MET5 Density:')
-    for y in range(0, ytiles - 9):
-        if y == ytiles - 10:
-            locyfrac = yfrac
-        else:
-            locyfrac = 1.0
-        for x in range(0, xtiles - 9):
-            if x == xtiles - 10:
-                locxfrac = xfrac
-            else:
-                locxfrac = 1.0
-
-            met5accum = 0
-            atotal = 81.0 + 9.0 * locxfrac + 9.0 * locyfrac + locxfrac * locyfrac
-
-            for w in range(y, y + 9):
-                base = xtiles * w + x
-                met5accum += sum(met5fill[base : base + 9])
-                met5accum += met5fill[base + 9] * locxfrac
-            base = xtiles * (y + 9) + x
-            met5accum += sum(met5fill[base : base + 9]) * locyfrac
-            met5accum += met5fill[base + 9] * locxfrac * locyfrac
-                    
-            met5accum /= atotal
-            met5str = "{:.3f}".format(met5accum)
-            print('Tile (' + str(x) + ', ' + str(y) + '):   ' + met5str)
-            if met5accum < 0.45:
-                print('***Error:  MET5 Density < 45%')
-            elif met5accum > 0.76:
-                print('***Error:  MET5 Density > 76%')
+            for layer in density_layers:
+                print(str(tilefill[layer[0]]), file=dfile)
+
+    weights = tile_weights(xtiles, ytiles, xfrac, yfrac)
+    results = []
+    for name, label, mindens, maxdens in density_layers:
+        tiles = np.array(tilefill[name]).reshape(ytiles, xtiles)
+        windows = window_densities(tiles, weights)
+        low, high = density_violations(windows, mindens, maxdens)
+        results.append({'layer': label, 'min': mindens, 'max': maxdens,
+		'windows': windows, 'low': low, 'high': high,
+		'global': global_density(tiles, weights)})
+
+    for result in results:
+        windows = result['windows']
+        status = window_status(windows, result['min'], result['max'])
+        print('')
+        print(result['layer'] + ' Density:')
+        for y in range(0, windows.shape[0]):
+            for x in range(0, windows.shape[1]):
+                print('Tile (' + str(x) + ', ' + str(y) + '):   ' + '{:.3f}'.format(windows[y, x]))
+                if status[y, x] != 'ok':
+                    print(limit_error(result['layer'], status[y, x], result['min'], result['max']))
 
     print('')
     print('Whole-chip (global) density results:')
 
-    atotal = ((xtiles - 1.0) * (ytiles - 1.0)) + ((ytiles - 1.0) * xfrac) + ((xtiles - 1.0) * yfrac) + (xfrac * yfrac)
-
-    fomaccum = 0
-    for y in range(0, ytiles - 1):
-        base = xtiles * y
-        fomaccum += sum(fomfill[base:base + xtiles - 1])
-        fomaccum += fomfill[base + xtiles - 1] * xfrac
-    base = xtiles * (ytiles - 1)
-    fomaccum += sum(fomfill[base:base + xtiles - 1]) * yfrac
-    fomaccum += fomfill[base + xtiles - 1] * xfrac * yfrac
+    for result in results:
+        print('')
+        print(result['layer'] + ' Density: ' + '{:.3f}'.format(result['global']))
+        globalstatus = window_status(result['global'], result['min'], result['max'])
+        if globalstatus != 'ok':
+            print(limit_error(result['layer'], globalstatus, result['min'], result['max']))
 
-    fomaccum /= atotal
-    fomstr = "{:.3f}".format(fomaccum)
-    print('')
-    print('FOM Density: ' + fomstr)
-    if fomaccum < 0.33:
-        print('***Error:  FOM Density < 33%')
-    elif fomaccum > 0.57:
-        print('***Error:  FOM Density > 57%')
-
-    polyaccum = 0
-    for y in range(0, ytiles - 1):
-        base = xtiles * y
-        polyaccum += sum(polyfill[base:base + xtiles - 1])
-        polyaccum += polyfill[base + xtiles - 1] * xfrac
-    base = xtiles * (ytiles - 1)
-    polyaccum += sum(polyfill[base:base + xtiles - 1]) * yfrac
-    polyaccum += polyfill[base + xtiles - 1] * xfrac * yfrac
-
-    polyaccum /= atotal
-    polystr = "{:.3f}".format(polyaccum)
-    print('')
-    print('POLY Density: ' + polystr)
-
-    liaccum = 0
-    for y in range(0, ytiles - 1):
-        base = xtiles * y
-        liaccum += sum(lifill[base:base + xtiles - 1])
-        liaccum += lifill[base + xtiles - 1] * xfrac
-    base = xtiles * (ytiles - 1)
-    liaccum += sum(lifill[base:base + xtiles - 1]) * yfrac
-    liaccum += lifill[base + xtiles - 1] * xfrac * yfrac
-
-    liaccum /= atotal
-    listr = "{:.3f}".format(liaccum)
-    print('')
-    print('LI Density: ' + listr)
-    if liaccum < 0.35:
-        print('***Error:  LI Density < 35%')
-    elif liaccum > 0.60:
-        print('***Error:  LI Density > 60%')
-
-    met1accum = 0
-    for y in range(0, ytiles - 1):
-        base = xtiles * y
-        met1accum += sum(met1fill[base:base + xtiles - 1])
-        met1accum += met1fill[base + xtiles - 1] * xfrac
-    base = xtiles * (ytiles - 1)
-    met1accum += sum(met1fill[base:base + xtiles - 1]) * yfrac
-    met1accum += met1fill[base + xtiles - 1] * xfrac * yfrac
-
-    met1accum /= atotal
-    met1str = "{:.3f}".format(met1accum)
-    print('')
-    print('MET1 Density: ' + met1str)
-    if met1accum < 0.35:
-        print('***Error:  MET1 Density < 35%')
-    elif met1accum > 0.60:
-        print('***Error:  MET1 Density > 60%')
-
-    met2accum = 0
-    for y in range(0, ytiles - 1):
-        base = xtiles * y
-        met2accum += sum(met2fill[base:base + xtiles - 1])
-        met2accum += met2fill[base + xtiles - 1] * xfrac
-    base = xtiles * (ytiles - 1)
-    met2accum += sum(met2fill[base:base + xtiles - 1]) * yfrac
-    met2accum += met2fill[base + xtiles - 1] * xfrac * yfrac
-
-    met2accum /= atotal
-    met2str = "{:.3f}".format(met2accum)
-    print('')
-    print('MET2 Density: ' + met2str)
-    if met2accum < 0.35:
-        print('***Error:  MET2 Density < 35%')
-    elif met2accum > 0.60:
-        print('***Error:  MET2 Density > 60%')
-
-    met3accum = 0
-    for y in range(0, ytiles - 1):
-        base = xtiles * y
-        met3accum += sum(met3fill[base:base + xtiles - 1])
-        met3accum += met3fill[base + xtiles - 1] * xfrac
-    base = xtiles * (ytiles - 1)
-    met3accum += sum(met3fill[base:base + xtiles - 1]) * yfrac
-    met3accum += met3fill[base + xtiles - 1] * xfrac * yfrac
-
-    met3accum /= atotal
-    met3str = "{:.3f}".format(met3accum)
-    print('')
-    print('MET3 Density: ' + met3str)
-    if met3accum < 0.35:
-        print('***Error:  MET3 Density < 35%')
-    elif met3accum > 0.60:
-        print('***Error:  MET3 Density > 60%')
-
-    met4accum = 0
-    for y in range(0, ytiles - 1):
-        base = xtiles * y
-        met4accum += sum(met4fill[base:base + xtiles - 1])
-        met4accum += met4fill[base + xtiles - 1] * xfrac
-    base = xtiles * (ytiles - 1)
-    met4accum += sum(met4fill[base:base + xtiles - 1]) * yfrac
-    met4accum += met4fill[base + xtiles - 1] * xfrac * yfrac
-
-    met4accum /= atotal
-    met4str = "{:.3f}".format(met4accum)
-    print('')
-    print('MET4 Density: ' + met4str)
-    if met4accum < 0.35:
-        print('***Error:  MET4 Density < 35%')
-    elif met4accum > 0.60:
-        print('***Error:  MET4 Density > 60%')
-
-    met5accum = 0
-    for y in range(0, ytiles - 1):
-        base = xtiles * y
-        met5accum += sum(met5fill[base:base + xtiles - 1])
-        met5accum += met5fill[base + xtiles - 1] * xfrac
-    base = xtiles * (ytiles - 1)
-    met5accum += sum(met5fill[base:base + xtiles - 1]) * yfrac
-    met5accum += met5fill[base + xtiles - 1] * xfrac * yfrac
-
-    met5accum /= atotal
-    met5str = "{:.3f}".format(met5accum)
-    print('')
-    print('MET5 Density: ' + met5str)
-    if met5accum < 0.45:
-        print('***Error:  MET5 Density < 45%')
-    elif met5accum > 0.76:
-        print('***Error:  MET5 Density > 76%')
+    if csvfile:
+        write_csv(csvfile, results)
+    if jsonfile:
+        write_json(jsonfile, user_project_path, xtiles, ytiles, xfrac, yfrac, results)
 
     if not keepmode:
         if os.path.isfile(layoutpath + '/check_density.tcl'):
@@ -824,4 +588,3 @@ if __name__ == '__main__':
     print('')
     print('Done!')
     sys.exit(0)
-
@@ -5,21 +5,31 @@ import os
 import re
 import sys
 import subprocess
+import threading
+import concurrent.futures
 
 #---------------------------------------------------------------------------
-# usage:  run_all.py [-nosim] [-keep]
+# usage:  run_all.py [-nosim] [-keep] [-resume] [-jobs=<number>]
 #
 # Run ngspice simulations on all major transistor devices in the process
 # (excluding high-voltage > 3V devices) at all corners, and generate
 # IRSIM parameter files for each corner.
 #
 # The "-nosim" option assumes that simulation output files have been
-# saved, and will run the parser to generate the parameterf files from
-# the existing ngspice output files.
+# saved (see "-keep"), and will run the parser to generate the parameter
+# files from the existing ngspice output files.
 #
 # The "-keep" option will retain the ngspice input and output files
-# after each parameter file has been generated.  Otherwise, they will
-# be removed.
+# after the parameter files have been generated.  Otherwise, they will
+# be removed once every parameter file of the sweep has been generated
+# (they are kept if the sweep fails or is interrupted, for "-resume").
+#
+# The "-resume" option continues a sweep that was interrupted or that
+# had failed simulations:  Any simulation whose netlist is unchanged
+# and whose output file is complete is not run again.
+#
+# The "-jobs" option sets the number of ngspice simulations to run at
+# once (by default, the number of processors).
 #---------------------------------------------------------------------------
 
 #---------------------------------------------------------------------------
@@ -37,13 +47,23 @@ import subprocess
 #---------------------------------------------------------------------------
  
 #---------------------------------------------------------------------------
-# To do:  Speed this up by using multiprocessing
+# All of the netlists are generated from the template before any
+# simulation is run.  Simulations are run in parallel, and the output of
+# each is saved in a file next to its netlist, which is what "-nosim"
+# and "-resume" read back.  Results are collected in the order of the
+# sweep, so the parameter files do not depend on which simulation
+# finished first, and each parameter file is written as soon as all of
+# its simulations are done.
 #---------------------------------------------------------------------------
 
+usage = "Usage:  run_all.py [-nosim] [-keep] [-resume] [-jobs=<number>]"
+
 # Parse options
 
 keep = False
 nosim = False
+resume = False
+jobs = None
 
 options = []
 arguments = []
@@ -54,7 +74,7 @@ for item in sys.argv[1:]:
         arguments.append(item)
 
 if len(arguments) > 0:
-    print("Usage:  run_all.py [-nosim] [-keep]")
+    print(usage)
     sys.exit(1)
 
 if '-keep' in options:
@@ -65,8 +85,20 @@ if '-nosim' in options:
     nosim = True
     print("No-sim mode:  Not running any simulations.")
 
+if '-resume' in options:
+    resume = True
+    print("Resume mode:  Reusing the results of completed simulations.")
+
+for option in options:
+    if option.split('=')[0] == '-jobs':
+        try:
+            jobs = int(option.split('=')[1])
+        except:
+            print('Option usage:  -jobs=<number>')
+            sys.exit(1)
+
 if '-help' in options:
-    print("Usage:  run_all.py [-nosim] [-keep]")
+    print(usage)
     sys.exit(0)
 
 #---------------------------------------------------------------------------
@@ -123,188 +155,334 @@ temps = [ -40, 27, 125 ]
 
 corners = [ "ss", "tt", "ff" ]
 
-# Read the parameter file header and save the contents
+# Values printed by the simulation.  Values starting with "n" are for the
+# nFET device and values starting with "p" are for the pFET device.
+
+resultnames = [ 'ndynh', 'ndynl', 'nstat', 'pdynh', 'pdynl', 'pstat' ]
+
+# Keywords in the simulation template that are replaced for each simulation
+
+keywords = [ 'CORNER', 'FULL_VOLTAGE', 'HALF_VOLTAGE', 'TEMPERATURE',
+		'DEVICENAME_N', 'DEVICENAME_P', 'WIDTH_N', 'WIDTH_P',
+		'LENGTH_N', 'LENGTH_P', 'LOADCAP' ]
+
+keyrex = re.compile('|'.join(keywords))
+
+#---------------------------------------------------------------------------
+# Generate a SPICE simulation netlist from the template by replacing all
+# of the keywords in one pass.  "values" is a dictionary of the replacement
+# text for each keyword.
+#---------------------------------------------------------------------------
+
+def render_netlist(template, values):
+    return keyrex.sub(lambda match: values[match.group(0)], template)
+
+#---------------------------------------------------------------------------
+# Return a dictionary of the values found in ngspice output "text".  Where
+# a value is printed more than once, the first one is used.
+#---------------------------------------------------------------------------
+
+def parse_results(text):
+    results = {}
+    for parameter in text.splitlines():
+        valueline = parameter.split()
+        if len(valueline) < 3:
+            continue
+        if valueline[0] in resultnames and valueline[0] not in results:
+            results[valueline[0]] = valueline[2]
+    return results
+
+#---------------------------------------------------------------------------
+# Return the values saved in the ngspice output file of simulation "sim",
+# or None if there is no output file.
+#---------------------------------------------------------------------------
+
+def read_results(sim):
+    try:
+        with open(sim['outname'], 'r') as ifile:
+            return parse_results(ifile.read())
+    except OSError:
+        return None
+
+#---------------------------------------------------------------------------
+# Return True if simulation "sim" was already run on the same netlist and
+# produced all of the values.
+#---------------------------------------------------------------------------
+
+def is_complete(sim):
+    try:
+        with open(sim['simname'], 'r') as ifile:
+            if ifile.read() != sim['netlist']:
+                return False
+    except OSError:
+        return False
+    results = read_results(sim)
+    return results is not None and len(results) == len(resultnames)
+
+#---------------------------------------------------------------------------
+# ngspice processes running in the worker threads, which are terminated
+# if the sweep is interrupted.  Once "stopping" is set, no new process is
+# started.
+#---------------------------------------------------------------------------
+
+spiceprocs = []
+spicelock = threading.Lock()
+stopping = False
+
+#---------------------------------------------------------------------------
+# Run the ngspice simulation "sim" (or, with "-nosim", read its saved
+# output).  This is run in a worker thread, so messages are returned to
+# be printed in order with the results, and not printed here.  Returns
+# a list of messages and the dictionary of values found.
+#---------------------------------------------------------------------------
+
+def run_simulation(sim):
+    messages = []
+    simname = sim['simname']
+    outname = sim['outname']
+
+    if nosim:
+        results = read_results(sim)
+        if results is None:
+            messages.append('** No file ' + outname + '; skipping.')
+            results = {}
+        return messages, results
+
+    if resume and is_complete(sim):
+        messages.append('** Reusing simulation of ' + sim['devset'] + ' (file ' + outname + ')')
+        return messages, read_results(sim)
+
+    with open(simname, 'w') as ofile:
+        ofile.write(sim['netlist'])
+
+    messages.append('** Running simulation on ' + sim['devset'] + '(file ' + simname + ')')
+    messages.append('** Conditions: temp=' + sim['tname'] + ' corner=' + sim['corner']
+		+ ' volt=' + sim['vname'])
+    with spicelock:
+        if stopping:
+            return messages, {}
+        p = subprocess.Popen(['ngspice', simname],
+		stdout = subprocess.PIPE,
+		universal_newlines = True)
+        spiceprocs.append(p)
+    try:
+        output = p.communicate()[0] or ''
+    finally:
+        with spicelock:
+            spiceprocs.remove(p)
+
+    # A simulation that was terminated leaves no output file behind.
+    if stopping:
+        return messages, {}
+
+    # Save the output under a temporary name until it is complete, so that
+    # an interrupted simulation never leaves an output file behind.
+    with open(outname + '.tmp', 'w') as ofile:
+        ofile.write(output)
+    os.replace(outname + '.tmp', outname)
+
+    return messages, parse_results(output)
+
+#---------------------------------------------------------------------------
+# Write parameter file "paramfile" from the values found by simulations
+# "sims" (in the same order), where the first value found for each device
+# is used.  Returns False and does not write the file if any device is
+# missing any value.
+#---------------------------------------------------------------------------
+
+def write_parameters(paramfile, sims, simresults):
+    ndevtypes = []
+    pdevtypes = []
+    values = {}
+    for name in resultnames:
+        values[name] = {}
+
+    for sim, results in zip(sims, simresults):
+        ntype = sim['ntype']
+        ptype = sim['ptype']
+        if ntype not in ndevtypes:
+            ndevtypes.append(ntype)
+        if ptype not in pdevtypes:
+            pdevtypes.append(ptype)
+        for name in results:
+            devtype = ntype if name[0] == 'n' else ptype
+            if devtype not in values[name]:
+                values[name][devtype] = results[name]
+
+    missing = []
+    for name in resultnames:
+        devtypes = ndevtypes if name[0] == 'n' else pdevtypes
+        for devtype in devtypes:
+            if devtype not in values[name]:
+                missing.append(name + ' of ' + devtype)
+    if missing:
+        print('Error:  No value for ' + ', '.join(missing) + '; not writing ' + paramfile + '.')
+        return False
+
+    ndynh = values['ndynh']
+    ndynl = values['ndynl']
+    nstat = values['nstat']
+    pdynh = values['pdynh']
+    pdynl = values['pdynl']
+    pstat = values['pstat']
+
+    with open(paramfile, 'w') as ofile:
+        for line in hlines:
+            print(line, file=ofile)
+
+        # Now output information for every device
+        print('', file=ofile)
+
+        for device in ndevtypes:
+            devicepair = next(item for item in devices if item[2] == device)
+            ntype = devicepair[2]
+            nlength = devicepair[6]
+            nwidth = devicepair[7]
+            loadcap = devicepair[8]
+
+            print('; C=' + str(loadcap) + ', N(w=' + str(nwidth) + ', l=' + str(nlength) + ')', file=ofile)
+            print('resistance ' + ntype + ' dynamic-high   ' + str(nwidth) + '    ' + str(nlength) + '  ' + ndynh[ntype], file=ofile)
+            print('resistance ' + ntype + ' dynamic-low    ' + str(nwidth) + '    ' + str(nlength) + '  ' + ndynl[ntype], file=ofile)
+            print('resistance ' + ntype + ' static         ' + str(nwidth) + '    ' + str(nlength) + '  ' + nstat[ntype], file=ofile)
+            print('', file=ofile)
+
+        for device in pdevtypes:
+            devicepair = next(item for item in devices if item[1] == device)
+            ptype = devicepair[1]
+            plength = devicepair[4]
+            pwidth = devicepair[5]
+            loadcap = devicepair[8]
+
+            print('; C=' + str(loadcap) + ', P(w=' + str(pwidth) + ', l=' + str(plength) + ')', file=ofile)
+            print('resistance ' + ptype + ' dynamic-high   ' + str(pwidth) + '    ' + str(plength) + '  ' + pdynh[ptype], file=ofile)
+            print('resistance ' + ptype + ' dynamic-low    ' + str(pwidth) + '    ' + str(plength) + '  ' + pdynl[ptype], file=ofile)
+            print('resistance ' + ptype + ' static         ' + str(pwidth) + '    ' + str(plength) + '  ' + pstat[ptype], file=ofile)
+            print('', file=ofile)
+
+    return True
+
+#---------------------------------------------------------------------------
+# Read the parameter file header and the simulation template, and save
+# the contents
 
-header = []
 with open('header.txt', 'r') as ifile:
     hlines = ifile.read().splitlines()
 
+with open('circuit_template.spi', 'r') as ifile:
+    template = '\n'.join(ifile.read().splitlines()) + '\n'
+
+goodidx = []
+for devidx in range(0, len(devices)):
+    devicepair = devices[devidx]
+    if len(devicepair) != 9:
+        print('Error:  Bad entry for device set ' + devicepair[0] + '.\n')
+        continue
+    goodidx.append(devidx)
+
+# Generate the netlists of all simulations for every parameter file
+
+paramsets = []
 for corner in corners:
     for temp in temps:
         tname = str(temp).replace('-', 'n')
         for vidx in range(0,3):
             vname = vnames[vidx]
+            rootname = 'sky130_' + corner + '_' + vname + '_' + tname
 
-            generated_files = []
-            ndevtypes = []
-            pdevtypes = []
-
-            ndynh = {}
-            ndynl = {}
-            pdynh = {}
-            pdynl = {}
-            nstat = {}
-            pstat = {}
-
-            for devidx in range(0, len(devices)):
+            sims = []
+            for devidx in goodidx:
                 devicepair = devices[devidx]
-                devset = devicepair[0]
-                if len(devicepair) != 9:
-                    print('Error:  Bad entry for device set ' + devset + '.\n')
-                    continue
-                ptype = devicepair[1]
-                ntype = devicepair[2]
                 vtype = devicepair[3]
-                plength = devicepair[4]
-                pwidth = devicepair[5]
-                nlength = devicepair[6]
-                nwidth = devicepair[7]
-                loadcap = devicepair[8]
-
-                if ntype not in ndevtypes:
-                    ndevtypes.append(ntype)
-                if ptype not in pdevtypes:
-                    pdevtypes.append(ptype)
-
                 if vtype == '1v8':
                     volt = voltages1v8[vidx]
                 else:
                     volt = voltages3v3[vidx]
 
-                if not nosim:
-
-                    # Read template and generate SPICE simulation netlist
-                    newlines = []
-                    with open('circuit_template.spi', 'r') as ifile:
-                        template = ifile.read().splitlines()
-                        for line in template:
-                            outline = re.sub('CORNER', corner, line)
-                            outline = re.sub('FULL_VOLTAGE', str(volt), outline)
-                            outline = re.sub('HALF_VOLTAGE', str(volt / 2.0), outline)
-                            outline = re.sub('TEMPERATURE', str(temp), outline)
-                            outline = re.sub('DEVICENAME_N', ntype, outline)
-                            outline = re.sub('DEVICENAME_P', ptype, outline)
-                            outline = re.sub('WIDTH_N', str(nwidth), outline)
-                            outline = re.sub('WIDTH_P', str(pwidth), outline)
-                            outline = re.sub('LENGTH_N', str(nlength), outline)
-                            outline = re.sub('LENGTH_P', str(plength), outline)
-                            outline = re.sub('LOADCAP', str(loadcap), outline)
-                            newlines.append(outline)
-
-                    simname = 'sky130_' + corner + '_' + vname + '_' + tname + '_devpair' + str(devidx) + '.spice'
-
-                    with open(simname, 'w') as ofile:
-                        for line in newlines:
-                            print(line, file=ofile)
-
-                    generated_files.append(simname)
-
-                    # Run ngspice simulation
-
-                    print('** Running simulation on ' + devset + '(file ' + simname + ')')
-                    print('** Conditions: temp=' + tname + ' corner=' + corner
-				+ ' volt=' + vname)
-                    p = subprocess.run(['ngspice', simname],
-				stdout = subprocess.PIPE,
-				universal_newlines = True)
-			
-                    if p.stdout:
-                        parameters = p.stdout.splitlines()
-              
-                        for parameter in parameters:
-                            valueline = parameter.split()
-                            if len(valueline) < 3:
-                                continue
-                            if valueline[0] == 'ndynh':
-                                try:
-                                    ndynh[ntype]
-                                except:
-                                    ndynh[ntype] = valueline[2]
-                            elif valueline[0] == 'pdynh':
-                                try:
-                                    pdynh[ptype]
-                                except:
-                                    pdynh[ptype] = valueline[2]
-                            elif valueline[0] == 'ndynl':
-                                try:
-                                    ndynl[ntype]
-                                except:
-                                    ndynl[ntype] = valueline[2]
-                            elif valueline[0] == 'pdynl':
-                                try:
-                                    pdynl[ptype]
-                                except:
-                                    pdynl[ptype] = valueline[2]
-                            elif valueline[0] == 'nstat':
-                                try:
-                                    nstat[ntype]
-                                except:
-                                    nstat[ntype] = valueline[2]
-                            elif valueline[0] == 'pstat':
-                                try:
-                                    pstat[ptype]
-                                except:
-                                    pstat[ptype] = valueline[2]
-                else:
-                    print('** No file ' + outname + '; skipping.')
-                        
-            paramfile = 'sky130_' + corner + '_' + vname + '_' + tname + '.prm'
-
-            with open(paramfile, 'w') as ofile:
-                for line in hlines:
-                    print(line, file=ofile)
-
-                # Now output information for every device
-                print('', file=ofile)
-
-                for device in ndevtypes:
-                    devicepair = next(item for item in devices if item[2] == device)
-                    if not devicepair:
-                        print('Error:  Bad entry for nFET device ' + device + '.\n')
-                        continue
-                    devset = devicepair[0]
-                    if len(devicepair) != 9:
-                        print('Error:  Bad entry for device set ' + devset + '.\n')
-                        continue
-                    ntype = devicepair[2]
-                    vtype = devicepair[3]
-                    nlength = devicepair[6]
-                    nwidth = devicepair[7]
-                    loadcap = devicepair[8]
-
-                    print('; C=' + str(loadcap) + ', N(w=' + str(nwidth) + ', l=' + str(nlength) + ')', file=ofile)
-                    print('resistance ' + ntype + ' dynamic-high   ' + str(nwidth) + '    ' + str(nlength) + '  ' + ndynh[ntype], file=ofile)
-                    print('resistance ' + ntype + ' dynamic-low    ' + str(nwidth) + '    ' + str(nlength) + '  ' + ndynl[ntype], file=ofile)
-                    print('resistance ' + ntype + ' static         ' + str(nwidth) + '    ' + str(nlength) + '  ' + nstat[ntype], file=ofile)
-                    print('', file=ofile)
-
-                for device in pdevtypes:
-                    devicepair = next(item for item in devices if item[1] == device)
-                    if not devicepair:
-                        print('Error:  Bad entry for pFET device ' + device + '.\n')
-                        continue
-                    devset = devicepair[0]
-                    if len(devicepair) != 9:
-                        print('Error:  Bad entry for device set ' + devset + '.\n')
-                        continue
-                    ptype = devicepair[1]
-                    vtype = devicepair[3]
-                    plength = devicepair[4]
-                    pwidth = devicepair[5]
-                    loadcap = devicepair[8]
-
-                    print('; C=' + str(loadcap) + ', P(w=' + str(pwidth) + ', l=' + str(plength) + ')', file=ofile)
-                    print('resistance ' + ptype + ' dynamic-high   ' + str(pwidth) + '    ' + str(plength) + '  ' + pdynh[ptype], file=ofile)
-                    print('resistance ' + ptype + ' dynamic-low    ' + str(pwidth) + '    ' + str(plength) + '  ' + pdynl[ptype], file=ofile)
-                    print('resistance ' + ptype + ' static         ' + str(pwidth) + '    ' + str(plength) + '  ' + pstat[ptype], file=ofile)
-                    print('', file=ofile)
-            
-            if not keep:
-                print('**Removing generated intermediate files.')
-                for file in generated_files:
-                    try:
-                        os.remove(file)
-                    except:
-                        pass
+                values = {
+			'CORNER': corner,
+			'FULL_VOLTAGE': str(volt),
+			'HALF_VOLTAGE': str(volt / 2.0),
+			'TEMPERATURE': str(temp),
+			'DEVICENAME_N': devicepair[2],
+			'DEVICENAME_P': devicepair[1],
+			'WIDTH_N': str(devicepair[7]),
+			'WIDTH_P': str(devicepair[5]),
+			'LENGTH_N': str(devicepair[6]),
+			'LENGTH_P': str(devicepair[4]),
+			'LOADCAP': str(devicepair[8])
+		}
+
+                simname = rootname + '_devpair' + str(devidx) + '.spice'
+                sims.append({
+			'devset': devicepair[0],
+			'ptype': devicepair[1],
+			'ntype': devicepair[2],
+			'corner': corner,
+			'tname': tname,
+			'vname': vname,
+			'simname': simname,
+			'outname': os.path.splitext(simname)[0] + '.out',
+			'netlist': render_netlist(template, values)
+		})
+
+            paramsets.append([rootname + '.prm', sims])
+
+# Run all of the simulations, and write each parameter file once all of
+# its simulations are done.  The intermediate files are removed only
+# after the whole sweep has succeeded, as "-resume" needs them to know
+# which simulations are complete.
+
+if not jobs:
+    jobs = os.cpu_count() or 1
+
+failed = 0
+pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, jobs))
+futures = []
+for paramfile, sims in paramsets:
+    for sim in sims:
+        futures.append(pool.submit(run_simulation, sim))
+
+try:
+    findex = 0
+    for paramfile, sims in paramsets:
+        simresults = []
+        for sim in sims:
+            messages, results = futures[findex].result()
+            findex += 1
+            for message in messages:
+                print(message)
+            simresults.append(results)
+
+        if not write_parameters(paramfile, sims, simresults):
+            failed += 1
+
+except KeyboardInterrupt:
+    with spicelock:
+        stopping = True
+        for future in futures:
+            future.cancel()
+        for p in spiceprocs:
+            p.terminate()
+    pool.shutdown()
+    print('Interrupted:  Use "-resume" to continue the sweep.')
+    sys.exit(1)
+
+pool.shutdown()
+
+if failed == 0 and not keep and not nosim:
+    print('**Removing generated intermediate files.')
+    for paramfile, sims in paramsets:
+        for sim in sims:
+            for file in [sim['simname'], sim['outname']]:
+                try:
+                    os.remove(file)
+                except:
+                    pass
+
+if failed > 0:
+    print('Error:  ' + str(failed) + ' parameter files were not generated.')
+    if not nosim:
+        print('Use "-resume" to run only the failed simulations again.')
+    sys.exit(1)
 
 sys.exit(0)
@@ -12,6 +12,11 @@ from PyQt6.QtCore import Qt
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
 from matplotlib.figure import Figure
+from rawfile import read_waveforms
+from waveform_expr import Evaluator
+
+# np.trapz was renamed np.trapezoid in NumPy 2.0 (and later removed)
+trapezoid = getattr(np, 'trapezoid', None) or np.trapz
 
 # ---------- Draggable Cursor ----------
 class DraggableCursor:
@@ -140,9 +145,9 @@ class WaveformViewer(QMainWindow):
 
         # data storage
         self.loaded_waveforms = []
-        self.time = None
-        self.data = None
-        self.labels = []
+        self.waveform_sets = []         # (x, data, labels) of each set plotted
+        self.xlabel = "Time (s)"
+        self.evaluator = Evaluator()    # expressions over the loaded waveforms
 
         # cursors
         self.v_cursors = []
@@ -261,52 +266,35 @@ class WaveformViewer(QMainWindow):
                 time = df.iloc[:, 0].values
                 data = df.iloc[:, 1:].values
                 labels = [f"{file_path.split('/')[-1]}_{col}" for col in df.columns[1:]]
+                self.loaded_waveforms.append((time, data, labels, file_path))
             elif file_path.endswith(".raw"):
-                time, data, labels = self.parse_raw_multi(file_path)
-            else:
-                continue
-            self.loaded_waveforms.append((time, data, labels, file_path))
+                # one set of waveforms for each plot (and step) in the file
+                for wave in read_waveforms(file_path):
+                    time, data = wave.x, wave.data
+                    if np.iscomplexobj(data):
+                        # AC results are shown by their magnitude, except for
+                        # vectors with no imaginary part (e.g. vdb() or vp())
+                        magnitude = np.any(data.imag, axis=0)
+                        time, data = time.real, np.where(magnitude, np.abs(data), data.real)
+                    labels = [f"{file_path.split('/')[-1]}_{lab}" for lab in wave.labels]
+                    self.loaded_waveforms.append((time, data, labels, file_path))
+                    self.xlabel = wave.xlabel + (f" ({wave.xunit})" if wave.xunit else "")
         self.plot_all_waveforms()
 
-    def parse_raw_multi(self, file_path):
-        time = []
-        values = []
-        with open(file_path, "r") as f:
-            for line in f:
-                # skip header/comments typical in some RAW formats
-                if line.strip() == "" or line.startswith("*") or line.lower().startswith("title") or line.lower().startswith("variables"):
-                    continue
-                parts = line.strip().split()
-                if len(parts) > 1:
-                    try:
-                        time.append(float(parts[0]))
-                        values.append([float(x) for x in parts[1:]])
-                    except Exception:
-                        # ignore lines that don't parse
-                        pass
-        data = np.array(values)
-        labels = [f"{file_path.split('/')[-1]}_V{i}" for i in range(data.shape[1])]
-        return np.array(time), data, labels
-
     # ---------- Plot ----------
     def plot_all_waveforms(self):
         self.ax.clear()
-        self.time = None
-        self.data = None
-        self.labels = []
+        self.waveform_sets = []
+        self.evaluator = Evaluator()
         for time_arr, data_arr, labels_arr, fname in self.loaded_waveforms:
+            self.evaluator.add(time_arr, data_arr, labels_arr)
             for i in range(data_arr.shape[1]):
                 self.ax.plot(time_arr, data_arr[:, i], label=labels_arr[i])
-            if self.time is None:
-                self.time = time_arr
-                self.data = data_arr
-                self.labels = labels_arr.copy()
-            else:
-                # stack additional channels to the right
-                self.data = np.hstack((self.data, data_arr))
-                self.labels.extend(labels_arr)
+            # each set keeps its own x values, as the plots of a file (or the
+            # steps of a sweep) need not have the same points
+            self.waveform_sets.append((time_arr, data_arr, labels_arr))
         self.ax.legend()
-        self.ax.set_xlabel("Time (s)")
+        self.ax.set_xlabel(self.xlabel)
         self.ax.set_ylabel("Amplitude")
         self.canvas.draw()
         self.original_xlim = self.ax.get_xlim()
@@ -326,7 +314,7 @@ class WaveformViewer(QMainWindow):
 
     # ---------- Hover Tooltip ----------
     def show_hover(self, event):
-        if event.inaxes != self.ax or self.data is None:
+        if event.inaxes != self.ax or not self.waveform_sets:
             if self.tooltip.get_visible():
                 self.tooltip.set_visible(False)
                 self.canvas.draw_idle()
@@ -334,19 +322,22 @@ class WaveformViewer(QMainWindow):
         x = event.xdata
         if x is None:
             return
-        idx = np.searchsorted(self.time, x)
-        if idx >= len(self.time):
-            idx = -1
-        # prepare tooltip text
-        try:
-            y_values = [self.data[idx, i] for i in range(self.data.shape[1])]
-        except Exception:
+        # prepare tooltip text, with the nearest point of each set
+        lines = []
+        anchor = None
+        for time_arr, data_arr, labels_arr in self.waveform_sets:
+            if len(time_arr) == 0 or data_arr.shape[1] == 0:
+                continue
+            idx = min(np.searchsorted(time_arr, x), len(time_arr) - 1)
+            lines.append(f"X={time_arr[idx]:.6f}")
+            for i, lbl in enumerate(labels_arr):
+                lines.append(f"{lbl}={data_arr[idx, i]:.6f}")
+            if anchor is None:
+                anchor = (time_arr[idx], data_arr[idx, 0])
+        if anchor is None:
             return
-        lines = [f"X={self.time[idx]:.6f}"]
-        for i, lbl in enumerate(self.labels):
-            lines.append(f"{lbl}={y_values[i]:.6f}")
         text = "\n".join(lines)
-        self.tooltip.xy = (self.time[idx], y_values[0])
+        self.tooltip.xy = anchor
         self.tooltip.set_text(text)
         self.tooltip.set_visible(True)
         self.canvas.draw_idle()
@@ -378,7 +369,7 @@ class WaveformViewer(QMainWindow):
 
     # ---------- Expressions ----------
     def calculate_expression(self):
-        if self.data is None:
+        if not self.waveform_sets:
             self.expr_output.append("No data loaded.")
             return
         expr = self.expr_input.text().strip()
@@ -386,14 +377,12 @@ class WaveformViewer(QMainWindow):
             self.expr_output.append("Enter an expression first.")
             return
         try:
-            # local dict maps label -> array
-            local_dict = {label: self.data[:, i] for i, label in enumerate(self.labels)}
-            # evaluate expression safely-ish (note: eval can run arbitrary code; only use trusted expressions)
-            result = eval(expr, {"np": np}, local_dict)
-            result = np.asarray(result)
-            if result.shape[0] != len(self.time):
-                raise ValueError("Expression length does not match time axis")
-            self.ax.plot(self.time, result, label=f"Expr: {expr}", color='magenta')
+            result = self.evaluator.evaluate(expr)
+            if result.x is None:
+                self.expr_output.append(f"{expr} = {result.y}")
+                return
+            values = np.abs(result.y) if np.any(np.imag(result.y)) else np.real(result.y)
+            self.ax.plot(result.x, values, label=f"Expr: {expr}", color='magenta')
             self.ax.legend()
             self.canvas.draw()
             self.expr_output.append(f"Expression '{expr}' plotted successfully.")
@@ -402,44 +391,45 @@ class WaveformViewer(QMainWindow):
 
     # ---------- Analysis ----------
     def run_analysis(self):
-        if self.data is None or len(self.v_cursors) < 2:
+        if not self.waveform_sets or len(self.v_cursors) < 2:
             QMessageBox.warning(self, "Warning", "Load waveform and place 2 vertical cursors first")
             return
         x1, x2 = sorted([self.v_cursors[0].line.get_xdata()[0], self.v_cursors[1].line.get_xdata()[0]])
-        idx1 = np.searchsorted(self.time, x1)
-        idx2 = np.searchsorted(self.time, x2)
-        # clamp indices
-        idx1 = max(0, min(idx1, len(self.time)-1))
-        idx2 = max(0, min(idx2, len(self.time)))
-        if idx2 <= idx1:
+        # the points of each set between the cursors
+        segments = []
+        for time_arr, data_arr, labels_arr in self.waveform_sets:
+            idx1 = np.searchsorted(time_arr, x1)
+            idx2 = np.searchsorted(time_arr, x2)
+            # clamp indices
+            idx1 = max(0, min(idx1, len(time_arr)-1))
+            idx2 = max(0, min(idx2, len(time_arr)))
+            if idx2 > idx1:
+                segments.append((time_arr[idx1:idx2], data_arr[idx1:idx2], labels_arr))
+        if not segments:
             QMessageBox.warning(self, "Warning", "Invalid cursor positions (ordered indices).")
             return
         metric = self.analysis_combo.currentText()
         output_lines = []
-        segment = self.data[idx1:idx2]
+
+        # metric -> (name in the output, values of each column of a segment)
+        reductions = {
+            "RMS": ("RMS", lambda t, s: np.sqrt(np.mean(s**2, axis=0))),
+            "Peak-to-Peak": ("P2P", lambda t, s: np.ptp(s, axis=0)),
+            "Max": ("Max", lambda t, s: np.max(s, axis=0)),
+            "Min": ("Min", lambda t, s: np.min(s, axis=0)),
+            "Mean": ("Mean", lambda t, s: np.mean(s, axis=0)),
+            "Integral": ("Integral", lambda t, s: trapezoid(s, t, axis=0)),
+        }
 
         if metric == "Frequency":
             delta_t = x2 - x1
             freq = 1.0 / delta_t if delta_t != 0 else 0
             output_lines.append(f"Frequency: {freq:.6f} Hz")
-        elif metric == "RMS":
-            rms_values = np.sqrt(np.mean(segment**2, axis=0))
-            output_lines.extend([f"{self.labels[i]} RMS: {rms_values[i]:.6f}" for i in range(len(rms_values))])
-        elif metric == "Peak-to-Peak":
-            ptp_values = np.ptp(segment, axis=0)
-            output_lines.extend([f"{self.labels[i]} P2P: {ptp_values[i]:.6f}" for i in range(len(ptp_values))])
-        elif metric == "Max":
-            max_values = np.max(segment, axis=0)
-            output_lines.extend([f"{self.labels[i]} Max: {max_values[i]:.6f}" for i in range(len(max_values))])
-        elif metric == "Min":
-            min_values = np.min(segment, axis=0)
-            output_lines.extend([f"{self.labels[i]} Min: {min_values[i]:.6f}" for i in range(len(min_values))])
-        elif metric == "Mean":
-            mean_values = np.mean(segment, axis=0)
-            output_lines.extend([f"{self.labels[i]} Mean: {mean_values[i]:.6f}" for i in range(len(mean_values))])
-        elif metric == "Integral":
-            integral_values = np.trapz(segment, self.time[idx1:idx2], axis=0)
-            output_lines.extend([f"{self.labels[i]} Integral: {integral_values[i]:.6f}" for i in range(len(integral_values))])
+        elif metric in reductions:
+            name, reduce = reductions[metric]
+            for seg_time, segment, labels_arr in segments:
+                values = reduce(seg_time, segment)
+                output_lines.extend([f"{labels_arr[i]} {name}: {values[i]:.6f}" for i in range(len(values))])
         elif metric == "Delta X/Y":
             if len(self.v_cursors) >= 2 and len(self.h_cursors) >= 2:
                 dx = abs(self.v_cursors[0].line.get_xdata()[0] - self.v_cursors[1].line.get_xdata()[0])
@@ -454,7 +444,7 @@ class WaveformViewer(QMainWindow):
 
     # ---------- Save ----------
     def save_waveform(self):
-        if self.data is None:
+        if not self.waveform_sets:
             QMessageBox.warning(self, "Warning", "No waveform data to save")
             return
         path, _ = QFileDialog.getSaveFileName(self, "Save Waveform CSV", "", "CSV Files (*.csv)")
@@ -462,10 +452,12 @@ class WaveformViewer(QMainWindow):
             return
         with open(path, 'w', newline='') as f:
             writer = csv.writer(f)
-            writer.writerow(["Time"] + self.labels)
-            for i in range(len(self.time)):
-                row = [self.time[i]] + [float(self.data[i, j]) for j in range(self.data.shape[1])]
-                writer.writerow(row)
+            # each set has its own header row, as the sets need not share x values
+            for time_arr, data_arr, labels_arr in self.waveform_sets:
+                writer.writerow(["Time"] + list(labels_arr))
+                for i in range(len(time_arr)):
+                    row = [time_arr[i]] + [float(data_arr[i, j]) for j in range(data_arr.shape[1])]
+                    writer.writerow(row)
         QMessageBox.information(self, "Saved", f"Waveform saved to {path}")
 
     def save_analysis(self):
@@ -13,6 +13,8 @@ from PyQt6.QtWidgets import (
 )
 from PyQt6.QtCore import Qt
 from PyQt6.QtGui import QFont, QColor
+from waveform_store import Axis, Trace, load_waveforms, values_at
+from waveform_expr import Evaluator
 # ...existing code...
 
 # SI-prefix AxisItem and formatter
@@ -96,6 +98,10 @@ class WaveformViewer(QMainWindow):
         # default waveform color -> black for visibility on white background
         self.selected_color = '#000000'
         self.subplots = {}  # label -> (dock, plotwidget, time, data, pen)
+        self.traces = {}    # label -> Trace (decimated view of the data)
+        self.axes = {}      # id(time) -> (time, Axis) shared by the traces of a file
+        self.units = {}     # label -> unit symbol (e.g. V, A), if known
+        self.evaluator = Evaluator()    # expressions over the loaded waveforms
 
         # cursor defaults
         self.cursor_default_thickness = 2
@@ -113,6 +119,9 @@ class WaveformViewer(QMainWindow):
         self.plot_widget = pg.PlotWidget(axisItems={'bottom': xaxis, 'left': yaxis}, background='w')
         self.plot_widget.showGrid(x=True, y=True)
         self.main_layout.addWidget(self.plot_widget)
+        # Only the points that can be seen are drawn, so redraw on pan/zoom
+        self.plot_widget.getViewBox().sigXRangeChanged.connect(
+            lambda *args: self.refresh_curves(self.plot_widget))
 
         # Top toolbar
         toolbar_layout = QHBoxLayout()
@@ -340,6 +349,10 @@ class WaveformViewer(QMainWindow):
                 except Exception:
                     pass
         self.subplots = {}
+        self.traces = {}
+        self.axes = {}
+        self.units = {}
+        self.evaluator = Evaluator()
         self.split_list.clear()
         self.loaded_file_combo.clear()
 
@@ -353,50 +366,66 @@ class WaveformViewer(QMainWindow):
             self.clear_loaded_waveforms()
 
         file_base = os.path.splitext(os.path.basename(file_path))[0]
-        if file_path.lower().endswith('.csv'):
-            df = pd.read_csv(file_path)
-            time = df.iloc[:, 0].values
-            data = df.iloc[:, 1:].values
-            labels = list(df.columns[1:])
-        elif file_path.lower().endswith('.raw'):
-            time, data, labels = self.parse_raw(file_path)
-        else:
+        if not file_path.lower().endswith(('.csv', '.raw')):
             QMessageBox.information(self, "Load", "Unsupported file type")
             return
+        # Columns are memory-mapped, so nothing is read until it is plotted
+        try:
+            waveforms = load_waveforms(file_path)
+        except Exception as e:
+            QMessageBox.critical(self, "Load", f"Cannot read {file_path}: {e}")
+            return
 
-        # if append, prefix labels with filename to avoid collisions
-        if getattr(self, 'append_checkbox', None) and self.append_checkbox.isChecked():
-            labels = [f"{file_base}_{lab}" for lab in labels]
-
-        self.loaded_waveforms.append((time, data, labels))
+        all_labels = []
+        for wave in waveforms:
+            time, data, labels = wave.x, wave.data, wave.labels
+            # if append, prefix labels with filename to avoid collisions
+            if getattr(self, 'append_checkbox', None) and self.append_checkbox.isChecked():
+                labels = [f"{file_base}_{lab}" for lab in labels]
+            self.loaded_waveforms.append((time, data, labels))
+            self.evaluator.add(time, data, labels)
+            for label, unit in zip(labels, wave.units):
+                self.loaded_waveform_combo.addItem(label)
+                self.units[label] = unit
+            all_labels.extend(labels)
+        # Name the x axis after the sweep variable, unless a label was given
+        if waveforms and not self.xaxis_input.text():
+            xunit = waveforms[0].xunit
+            self.plot_widget.setLabel('bottom', waveforms[0].xlabel + (f" ({xunit})" if xunit else ""))
         self.loaded_file_combo.addItem(os.path.basename(file_path))
-        for label in labels:
-            self.loaded_waveform_combo.addItem(label)
-        QMessageBox.information(self, "Loaded", f"File loaded: {file_path}\nWaveforms: {', '.join(labels)}")
-
-    def parse_raw(self, filepath):
-        time = []
-        values = []
-        with open(filepath, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                if line.startswith('*') or line.lower().startswith('title') or line.lower().startswith('variables'):
-                    continue
-                parts = line.split()
-                try:
-                    t = float(parts[0])
-                    nums = [float(x) for x in parts[1:]]
-                except Exception:
-                    continue
-                time.append(t)
-                values.append(nums)
-        if len(values) == 0:
-            return np.array([]), np.array([[]]), []
-        data = np.array(values)
-        labels = [f'V{i+1}' for i in range(data.shape[1])]
-        return np.array(time), data, labels
+        QMessageBox.information(self, "Loaded", f"File loaded: {file_path}\nWaveforms: {', '.join(all_labels)}")
+
+    # ---------- Decimated Curves ----------
+    def add_curve(self, pw, label, t, d, pen):
+        """Plot a waveform in plot widget pw, drawing only the points that can be seen."""
+        trace = self.traces.get(label)
+        if trace is None:
+            entry = self.axes.get(id(t))
+            if entry is None:
+                entry = (t, Axis(t))
+                self.axes[id(t)] = entry
+            trace = Trace(entry[1], d)
+            self.traces[label] = trace
+        item = pw.plot([], [], pen=pen, name=label)
+        item.trace = trace
+        self.refresh_curve(pw, item)
+        return item
+
+    def refresh_curves(self, pw):
+        for item in pw.listDataItems():
+            if hasattr(item, 'trace'):
+                self.refresh_curve(pw, item)
+
+    def refresh_curve(self, pw, item):
+        vb = pw.getViewBox()
+        # While auto-ranging, the whole trace must be given for its bounds
+        if vb.autoRangeEnabled()[0]:
+            x0, x1 = -np.inf, np.inf
+        else:
+            x0, x1 = vb.viewRange()[0]
+        pixels = int(vb.width()) or 1000
+        xs, ys = item.trace.view(x0, x1, pixels)
+        item.setData(xs, ys)
 
     # ---------- Plot Selected ----------
     def plot_selected_waveform(self):
@@ -409,7 +438,7 @@ class WaveformViewer(QMainWindow):
                 y = data[:, idx]
                 color = self.line_colors.get(label, self.selected_color)
                 pen = pg.mkPen(color=color, width=self.thickness_spin.value())
-                item = self.plot_widget.plot(time, y, pen=pen, name=label)
+                item = self.add_curve(self.plot_widget, label, time, y, pen)
                 self.plot_data_items.append((label, item, time, y))
                 self.plotted_list.addItem(label)
                 # keep combos consistent
@@ -458,6 +487,7 @@ class WaveformViewer(QMainWindow):
     # ---------- Reset View ----------
     def reset_view(self):
         self.plot_widget.enableAutoRange()
+        self.refresh_curves(self.plot_widget)
 
     # ---------- Cursor Management ----------
     def add_vertical_cursor(self):
@@ -498,25 +528,16 @@ class WaveformViewer(QMainWindow):
         # hide defaults
         self.dx_text.hide()
         self.dy_text.hide()
-        # helper to compute y for each plotted waveform at x (interpolate)
-        def y_values_at_x(x):
-            vals = []
-            for l, item, t, d in self.plot_data_items:
-                try:
-                    if len(t) > 1:
-                        yv = np.interp(float(x), np.asarray(t).astype(float), np.asarray(d).astype(float))
-                        vals.append((l, yv))
-                except Exception:
-                    # skip any invalid series
-                    continue
-            return vals
+        # values of each plotted waveform at every vertical cursor, found together
+        cursor_x = [float(v.value()) for v in self.v_cursors]
+        cursor_vals = self.values_at_cursors(self.plot_data_items, cursor_x)
 
         # Vertical cursors
         if len(self.v_cursors) >= 1:
-            x0 = float(self.v_cursors[0].value())
-            vals = y_values_at_x(x0)
+            x0 = cursor_x[0]
+            vals = [(l, ys[0]) for l, ys in cursor_vals]
             if vals:
-                text = f"X={format_si(x0)}\n" + "\n".join([f"{l}: {format_si(y)}" for l, y in vals])
+                text = f"X={format_si(x0)}\n" + "\n".join([f"{l}: {format_si(y)}{self.units.get(l, '')}" for l, y in vals])
             else:
                 text = f"X={format_si(x0)}"
             vr = self.plot_widget.viewRange()
@@ -525,12 +546,12 @@ class WaveformViewer(QMainWindow):
             self.cursor_text.setPos(x0, y_top)
             self.cursor_text.show()
         if len(self.v_cursors) >= 2:
-            x1 = float(self.v_cursors[0].value())
-            x2 = float(self.v_cursors[1].value())
+            x1, x2 = cursor_x[0], cursor_x[1]
             dx = abs(x2 - x1)
             vr = self.plot_widget.viewRange()
             y_top = vr[1][1] if vr and len(vr) > 1 else 0
-            self.dx_text.setText(f'ΔX = {format_si(dx)}')
+            dy_lines = [f"{l}: ΔY={format_si(ys[1] - ys[0])}{self.units.get(l, '')}" for l, ys in cursor_vals]
+            self.dx_text.setText("\n".join([f'ΔX = {format_si(dx)}'] + dy_lines))
             self.dx_text.setPos((x1 + x2) / 2, y_top * 0.95)
             self.dx_text.show()
 
@@ -555,17 +576,26 @@ class WaveformViewer(QMainWindow):
 
         # If both vertical and horizontal exist, show intersection comparisons
         if (self.v_cursors and self.h_cursors):
-            x = float(self.v_cursors[0].value())
+            x = cursor_x[0]
             y = float(self.h_cursors[0].value())
-            vals = y_values_at_x(x)
+            vals = [(l, ys[0]) for l, ys in cursor_vals]
             inter_text = f"X={format_si(x)}, Y={format_si(y)}\n"
             if vals:
-                inter_text += "\n".join([f"{l}: Y_at_X={format_si(yval)}, Δ={format_si(yval - y)}" for l, yval in vals])
+                inter_text += "\n".join([f"{l}: Y_at_X={format_si(yval)}{self.units.get(l, '')}, Δ={format_si(yval - y)}" for l, yval in vals])
             self.cursor_text.setText(inter_text)
             vr = self.plot_widget.viewRange()
             self.cursor_text.setPos(x, vr[1][1] if vr and len(vr) > 1 else y)
             self.cursor_text.show()
 
+    def values_at_cursors(self, plot_items, xs):
+        """Return (label, values at xs) for each plotted waveform, in one batched pass."""
+        items = [(l, item) for l, item, t, d in plot_items if len(t) > 1]
+        try:
+            table = values_at([item.trace for _, item in items], xs)
+        except Exception:
+            return []
+        return [(l, row) for (l, _), row in zip(items, table)]
+
     # ---------- Mouse Move ----------
     def mouse_moved(self, pos):
         vb = self.plot_widget.getViewBox()
@@ -576,13 +606,8 @@ class WaveformViewer(QMainWindow):
         y = mouse_point.y()
         # show mouse coordinates and nearest values for a few plotted waveforms
         info = [f"x={format_si(x)}, y={format_si(y)}"]
-        for l, item, t, d in self.plot_data_items[:6]:
-            try:
-                if len(t) > 1:
-                    yv = np.interp(float(x), np.asarray(t).astype(float), np.asarray(d).astype(float))
-                    info.append(f"{l}: {format_si(yv)}")
-            except Exception:
-                continue
+        for l, ys in self.values_at_cursors(self.plot_data_items[:6], [x]):
+            info.append(f"{l}: {format_si(ys[0])}{self.units.get(l, '')}")
         self.cursor_text.setText("\n".join(info))
         # ensure cursor text visible above plot and slightly offset for readability
         self.cursor_text.setPos(x, y)
@@ -632,12 +657,8 @@ class WaveformViewer(QMainWindow):
         if not expr:
             return
         try:
-            local_dict = {}
-            for _, data, labels in self.loaded_waveforms:
-                for i, l in enumerate(labels):
-                    local_dict[l] = data[:, i]
-            result = eval(expr, {}, local_dict)
-            self.expr_output.setPlainText(str(result))
+            result = self.evaluator.evaluate(expr)
+            self.expr_output.setPlainText(str(np.asarray(result.y)))
         except Exception as e:
             QMessageBox.critical(self, "Error", str(e))
 
@@ -646,49 +667,50 @@ class WaveformViewer(QMainWindow):
         if not expr:
             return
         try:
-            local_dict = {}
-            for _, data, labels in self.loaded_waveforms:
-                for i, l in enumerate(labels):
-                    local_dict[l] = data[:, i]
-            result = eval(expr, {}, local_dict)
-            time = self.loaded_waveforms[0][0]
+            result = self.evaluator.evaluate(expr)
+            if result.x is None:
+                raise ValueError(f"{expr} is a single value, not a waveform")
             new_label = f'Expr_{expr}'
-            arr = np.asarray(result).reshape(-1, 1)
-            self.loaded_waveforms.append((time, arr, [new_label]))
+            arr = result.y.reshape(-1, 1)
+            self.loaded_waveforms.append((result.x, arr, [new_label]))
+            self.evaluator.add(result.x, arr, [new_label])
             self.loaded_waveform_combo.addItem(new_label)
         except Exception as e:
             QMessageBox.critical(self, "Error", str(e))
 
     # ---------- Analysis ----------
-    def calculate_frequency(self):
+    def measure_selected(self):
+        """
+        Measure the selected waveform between the first two vertical cursors,
+        or over all of it.  Returns (Measurement, description of the range).
+        """
         label = self.analysis_combo.currentText()
-        for l, _, time, data in self.plot_data_items:
+        for l, item, _, _ in self.plot_data_items:
             if l == label:
-                zero_crossings = np.where(np.diff(np.sign(data)))[0]
-                if len(zero_crossings) > 1:
-                    periods = np.diff(time[zero_crossings])
-                    if len(periods) > 0 and np.mean(periods) != 0:
-                        freq = 1.0 / np.mean(periods)
-                        QMessageBox.information(self, "Frequency", f"{freq:.3f} Hz")
-                        return
-                QMessageBox.information(self, "Frequency", "Cannot calculate frequency (no zero crossings).")
-                return
+                if len(self.v_cursors) >= 2:
+                    x0, x1 = sorted(float(v.value()) for v in self.v_cursors[:2])
+                    return item.trace.measure(x0, x1), " (between cursors)"
+                return item.trace.measure(), ""
+        return None, ""
+
+    def calculate_frequency(self):
+        result, where = self.measure_selected()
+        if result is None:
+            return
+        if np.isfinite(result.frequency):
+            QMessageBox.information(self, "Frequency", f"{result.frequency:.3f} Hz{where}")
+        else:
+            QMessageBox.information(self, "Frequency", "Cannot calculate frequency (no zero crossings).")
 
     def calculate_rms(self):
-        label = self.analysis_combo.currentText()
-        for l, _, _, data in self.plot_data_items:
-            if l == label:
-                rms = np.sqrt(np.mean(data**2))
-                QMessageBox.information(self, "RMS", f"RMS = {rms:.6f}")
-                return
+        result, where = self.measure_selected()
+        if result is not None:
+            QMessageBox.information(self, "RMS", f"RMS = {result.rms:.6f}{where}")
 
     def calculate_peak_to_peak(self):
-        label = self.analysis_combo.currentText()
-        for l, _, _, data in self.plot_data_items:
-            if l == label:
-                ptp = np.ptp(data)
-                QMessageBox.information(self, "Peak-to-Peak", f"Peak-to-Peak = {ptp:.6f}")
-                return
+        result, where = self.measure_selected()
+        if result is not None:
+            QMessageBox.information(self, "Peak-to-Peak", f"Peak-to-Peak = {result.peak_to_peak:.6f}{where}")
 
     # ---------- Split / Restore ----------
     def split_selected_waveforms(self):
@@ -715,7 +737,9 @@ class WaveformViewer(QMainWindow):
                     xaxis = SIPrefixAxis(orientation='bottom')
                     yaxis = SIPrefixAxis(orientation='left')
                     pw = pg.PlotWidget(axisItems={'bottom': xaxis, 'left': yaxis}, background='w')
-                    pw.plot(t, d, pen=pen, name=label)
+                    pw.getViewBox().sigXRangeChanged.connect(
+                        lambda *args, pw=pw: self.refresh_curves(pw))
+                    self.add_curve(pw, label, t, d, pen)
                     dock.setWidget(pw)
                     self.addDockWidget(Qt.DockWidgetArea.RightDockWidgetArea, dock)
                     self.subplots[label] = (dock, pw, t, d, pen)
@@ -759,7 +783,7 @@ class WaveformViewer(QMainWindow):
                     dock.setParent(None)
                 except Exception:
                     pass
-            item = self.plot_widget.plot(t, d, pen=pen, name=label)
+            item = self.add_curve(self.plot_widget, label, t, d, pen)
             self.plot_data_items.append((label, item, t, d))
             self.plotted_list.addItem(label)
             try:
@@ -787,7 +811,7 @@ class WaveformViewer(QMainWindow):
                     dock.setParent(None)
                 except Exception:
                     pass
-            item = self.plot_widget.plot(t, d, pen=pen, name=label)
+            item = self.add_curve(self.plot_widget, label, t, d, pen)
             self.plot_data_items.append((label, item, t, d))
             self.plotted_list.addItem(label)
             try:
@@ -0,0 +1,229 @@
+# MIT license
+# Reader for ngspice .raw files used by the eda-scripts tools: binary and
+# ASCII, real and complex, files with several plots, and stepped sweeps
+# Compatible with NumPy 2.x
+
+import re
+import tempfile
+from collections import namedtuple
+import numpy as np
+
+HEADER_KEYS = ['title', 'date', 'plotname', 'flags', 'no. variables',
+               'no. points', 'dimensions', 'command', 'option']
+
+# ASCII values are parsed this many bytes at a time
+ASCII_CHUNK = 1 << 24
+
+# Points of the sweep variable read at a time when looking for steps
+STEP_CHUNK = 1 << 22
+
+# Symbols for the variable types ngspice writes as units
+UNIT_SYMBOLS = {'voltage': 'V', 'current': 'A', 'time': 's', 'frequency': 'Hz',
+                'notype': '', 'decibel': 'dB', 'impedance': 'Ohm',
+                'admittance': 'S', 'power': 'W', 'temperature': 'C'}
+
+# One set of waveforms sharing the same x values: a plot of a raw file, or
+# one step of a stepped plot.  "units" are the unit symbols of "labels".
+WaveformSet = namedtuple('WaveformSet', ['x', 'data', 'labels', 'units', 'xlabel', 'xunit'])
+
+class RawPlot:
+    """
+    One plot of a raw file.  "data" has one row per point and one column per
+    variable, and is memory-mapped, so that only the parts of it that are used
+    are ever read.  Columns are views into it (see column()).
+    """
+    def __init__(self, header, names, units):
+        self.header = header
+        self.names = names
+        self.units = units
+        self.title = header.get('title', '')
+        self.plotname = header.get('plotname', '')
+        self.flags = header.get('flags', '').lower().split()
+        self.is_complex = 'complex' in self.flags
+        self.data = None
+        self._steps = None
+
+    @property
+    def npoints(self):
+        return 0 if self.data is None else self.data.shape[0]
+
+    def column(self, key):
+        """Return the column of a variable, given by name or index, as a view."""
+        if not isinstance(key, (int, np.integer)):
+            key = self.names.index(key)
+        return self.data[:, key]
+
+    def unit_symbols(self):
+        return [UNIT_SYMBOLS.get(unit.lower(), unit) for unit in self.units]
+
+    def steps(self):
+        """
+        Return (start, end) of the points of each step of a stepped sweep, or
+        a single range of all points.  The steps are given by a "Dimensions"
+        header (the first dimension varying fastest), or else are found
+        where the first variable turns back against the direction of the
+        sweep.
+        """
+        if self._steps is not None:
+            return self._steps
+        npoints = self.npoints
+        dims = [int(d) for d in re.findall(r'\d+', self.header.get('dimensions', ''))]
+        if len(dims) > 1 and int(np.prod(dims)) == npoints and dims[0] > 0:
+            self._steps = [(start, start + dims[0]) for start in range(0, npoints, dims[0])]
+            return self._steps
+
+        starts = [0]
+        direction = 0
+        last = None
+        x = self.data[:, 0].real if self.is_complex else self.data[:, 0]
+        for start in range(0, npoints, STEP_CHUNK):
+            values = np.asarray(x[start:start + STEP_CHUNK], dtype=np.float64)
+            if last is not None:
+                values = np.concatenate(([last], values))
+                offset = start - 1
+            else:
+                offset = start
+            last = values[-1]
+            diffs = np.diff(values)
+            if direction == 0:
+                moving = np.flatnonzero(diffs)
+                if len(moving) == 0:
+                    continue
+                direction = np.sign(diffs[moving[0]])
+            turns = np.flatnonzero(diffs * direction < 0)
+            starts.extend((offset + turns + 1).tolist())
+        ends = starts[1:] + [npoints]
+        self._steps = list(zip(starts, ends))
+        return self._steps
+
+def read_raw(fname):
+    """Read all plots of an ngspice .raw file. Returns a list of RawPlot"""
+    plots = []
+    with open(fname, 'rb') as fp:
+        while True:
+            plot = read_header(fp)
+            if plot is None:
+                break
+            plots.append(plot)
+            nvars = len(plot.names)
+            npoints = int(plot.header.get('no. points', 0))
+            dtype = np.complex128 if plot.is_complex else np.float64
+            if plot.header['format'] == 'binary':
+                offset = fp.tell()
+                rowsize = nvars * np.dtype(dtype).itemsize
+                fp.seek(0, 2)
+                # (A simulation that was stopped may write fewer points)
+                npoints = min(npoints, (fp.tell() - offset) // rowsize)
+                if npoints > 0:
+                    plot.data = np.memmap(fname, dtype=dtype, mode='r', offset=offset,
+                                          shape=(npoints, nvars))
+                else:
+                    plot.data = np.zeros((0, nvars), dtype=dtype)
+                fp.seek(offset + npoints * rowsize)
+            else:
+                plot.data = read_ascii_values(fp, npoints, nvars, plot.is_complex)
+    return plots
+
+def read_waveforms(fname):
+    """
+    Read an ngspice .raw file as a list of WaveformSet, one for every plot
+    (except operating points, which have no waveforms) and every step of a
+    stepped plot.  The first variable is the x axis.  Where the file has
+    more than one plot or step, the labels are the variable names followed
+    by the plot name and step number in brackets.  The arrays are views
+    into the data read by read_raw().
+    """
+    plots = [plot for plot in read_raw(fname) if plot.npoints > 1 and len(plot.names) > 1]
+    plotnames = [plot.plotname for plot in plots]
+    waveforms = []
+    for index, plot in enumerate(plots):
+        qualifier = []
+        if len(plots) > 1:
+            qualifier.append(plot.plotname)
+            if plotnames.count(plot.plotname) > 1:
+                qualifier[-1] += ' ' + str(plotnames[:index + 1].count(plot.plotname))
+        steps = plot.steps()
+        units = plot.unit_symbols()
+        for stepnum, (start, end) in enumerate(steps):
+            parts = qualifier + (['step ' + str(stepnum + 1)] if len(steps) > 1 else [])
+            suffix = ' [' + ', '.join(parts) + ']' if parts else ''
+            labels = [name + suffix for name in plot.names[1:]]
+            waveforms.append(WaveformSet(plot.data[start:end, 0], plot.data[start:end, 1:],
+                                         labels, units[1:], plot.names[0], units[0]))
+    return waveforms
+
+def read_header(fp):
+    """Read the header of the next plot, up to "Binary:" or "Values:"."""
+    header = {}
+    names = []
+    units = []
+    while True:
+        line = fp.readline()
+        if not line:
+            return None
+        text = line.decode('latin-1').strip()
+        if not text:
+            continue
+        key, _, val = text.partition(':')
+        key = key.strip().lower()
+        val = val.strip()
+        if key in HEADER_KEYS:
+            header[key] = val
+        elif key == 'variables':
+            nvars = int(header.get('no. variables', 0))
+            # (The first variable may be on the same line)
+            specs = [val] if val else []
+            while len(specs) < nvars:
+                specs.append(fp.readline().decode('latin-1').strip())
+            for spec in specs:
+                fields = spec.split()
+                names.append(fields[1])
+                units.append(fields[2] if len(fields) > 2 else '')
+        elif key in ('binary', 'values'):
+            header['format'] = key
+            return RawPlot(header, names, units)
+
+def read_ascii_values(fp, npoints, nvars, is_complex):
+    """
+    Parse the "Values:" section of an ASCII plot into a memory-mapped array,
+    a chunk at a time, stopping at the start of the next plot.
+    """
+    dtype = np.complex128 if is_complex else np.float64
+    # Each point is its index followed by every value (re,im if complex)
+    width = nvars * (2 if is_complex else 1)
+    store = tempfile.TemporaryFile()
+    count = 0
+    rest = np.zeros(0)
+    leftover = b''
+    while True:
+        start = fp.tell() - len(leftover)
+        chunk = fp.read(ASCII_CHUNK)
+        done = not chunk
+        text = leftover + chunk
+        # Stop at the header of the next plot (text always starts a line)
+        nextplot = 0 if text.startswith(b'Title:') else text.find(b'\nTitle:') + 1
+        if nextplot > 0 or text.startswith(b'Title:'):
+            fp.seek(start + nextplot)
+            text = text[:nextplot]
+            done = True
+        # Only parse up to the last complete line
+        if not done:
+            cut = text.rfind(b'\n') + 1
+            text, leftover = text[:cut], text[cut:]
+        else:
+            leftover = b''
+        if is_complex:
+            text = text.replace(b',', b' ')
+        values = np.concatenate((rest, np.fromstring(text, dtype=np.float64, sep=' ')))
+        nrows = len(values) // (width + 1)
+        rows = values[:nrows * (width + 1)].reshape(nrows, width + 1)[:, 1:]
+        rest = values[nrows * (width + 1):]
+        store.write(np.ascontiguousarray(rows).tobytes())
+        count += nrows
+        if done:
+            break
+    count = min(count, npoints) if npoints else count
+    store.flush()
+    if count == 0:
+        return np.zeros((0, nvars), dtype=dtype)
+    return np.memmap(store, dtype=dtype, mode='r', shape=(count, nvars))
@@ -1,83 +1,258 @@
 # MIT license
-# Converts all Ngspice binary .raw files in ~/.xschem/simulations to .csv
+# Converts all Ngspice .raw files in ~/.xschem/simulations to .csv
+# (or to Parquet, Feather or HDF5)
 # No Tkinter or GUI required
 # Compatible with NumPy 2.x
+#
+# usage:  rawtocsv.py [-jobs=<number>] [-format=csv|parquet|feather|hdf5]
+#                     [-force] [<directory or .raw file> ...]
+#
+# Every plot of a file is converted:  the first to <name>.csv and any others
+# to <name>.2.csv, <name>.3.csv, and so on (HDF5 puts all plots in <name>.h5).
+# Complex variables are written as two columns, real(...) and imag(...).
+# Files whose output is newer than they are are skipped unless "-force" is
+# given.  Files are converted in parallel, one per processor unless "-jobs"
+# is given.  Parquet and Feather output needs pyarrow, and HDF5 needs h5py.
 
 from __future__ import division
 import os
+import sys
+import concurrent.futures
 import numpy as np
+from rawfile import HEADER_KEYS, read_raw
 
-BSIZE_SP = 512  # Max size of a line of data
-MDATA_LIST = [b'title', b'date', b'plotname', b'flags', b'no. variables',
-              b'no. points', b'dimensions', b'command', b'option']
+# Rows converted and written at a time
+CHUNK_ROWS = 1 << 16
+
+# Output file extension of each format
+EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet', 'feather': '.feather', 'hdf5': '.h5'}
 
 def rawread(fname: str):
-    """Read Ngspice binary .raw file. Returns tuple (arrays, plots)"""
-    with open(fname, 'rb') as fp:
-        arrs = []
-        plots = []
-        plot = {}
-        while True:
-            line = fp.readline(BSIZE_SP)
-            if not line:
-                break
-            mdata = line.split(b':', maxsplit=1)
-            if len(mdata) == 2:
-                key = mdata[0].lower()
-                val = mdata[1].strip()
-                if key in MDATA_LIST:
-                    plot[key] = val
-                if key == b'variables':
-                    nvars = int(plot[b'no. variables'])
-                    npoints = int(plot[b'no. points'])
-                    plot['varnames'] = []
-                    plot['varunits'] = []
-                    for varn in range(nvars):
-                        varspec = fp.readline(BSIZE_SP).strip().decode('ascii').split()
-                        assert(varn == int(varspec[0]))
-                        plot['varnames'].append(varspec[1])
-                        plot['varunits'].append(varspec[2])
-                if key == b'binary':
-                    rowdtype = np.dtype({
-                        'names': plot['varnames'],
-                        'formats': [np.complex128 if b'complex' in plot[b'flags'] else np.float64]*len(plot['varnames'])
-                    })
-                    arrs.append(np.fromfile(fp, dtype=rowdtype, count=int(plot[b'no. points'])))
-                    plots.append(plot)
-                    plot = {}
-                    fp.readline()
+    """Read Ngspice .raw file (binary or ASCII). Returns tuple (arrays, plots)"""
+    arrs = []
+    plots = []
+    for raw in read_raw(fname):
+        plot = {key.encode('ascii'): val.encode('latin-1')
+                for key, val in raw.header.items() if key in HEADER_KEYS}
+        plot['varnames'] = raw.names
+        plot['varunits'] = raw.units
+        rowdtype = np.dtype({
+            'names': raw.names,
+            'formats': [raw.data.dtype]*len(raw.names)
+        })
+        # One record per row, as a view of the (memory-mapped) data
+        arrs.append(raw.data.view(rowdtype).reshape(raw.npoints))
+        plots.append(plot)
     return arrs, plots
 
-def convert_raw_to_csv(sim_dir):
-    """Convert all .raw files in sim_dir to CSV files"""
+# ---------- Plot data as real columns ----------
+
+def plot_columns(plot):
+    """Column names of a plot.  Complex variables are split in two."""
+    if not plot.is_complex:
+        return list(plot.names)
+    # The sweep variable (frequency) is real
+    columns = [plot.names[0]]
+    for name in plot.names[1:]:
+        columns += [f"real({name})", f"imag({name})"]
+    return columns
+
+def plot_chunks(plot):
+    """Yield the data of a plot as float64 blocks of up to CHUNK_ROWS rows."""
+    for start in range(0, plot.npoints, CHUNK_ROWS):
+        block = np.asarray(plot.data[start:start + CHUNK_ROWS])
+        if plot.is_complex:
+            # Each complex value is viewed as its real and imaginary parts
+            block = np.column_stack((block[:, 0].real,
+                                     np.ascontiguousarray(block[:, 1:]).view(np.float64)))
+        yield block
+
+# ---------- Writers ----------
+
+def write_csv(path, plot):
+    columns = plot_columns(plot)
+    # Same format as np.savetxt(), but each chunk is formatted in one go
+    row = ','.join(['%.18e'] * len(columns)) + '\n'
+    with open(path, 'w') as fp:
+        fp.write(','.join(columns) + '\n')
+        for block in plot_chunks(plot):
+            fp.write((row * len(block)) % tuple(block.ravel().tolist()))
+
+def arrow_batches(plot):
+    import pyarrow as pa
+    columns = plot_columns(plot)
+    schema = pa.schema([(name, pa.float64()) for name in columns])
+    batches = (pa.RecordBatch.from_arrays([pa.array(block[:, i]) for i in range(len(columns))],
+                                          schema=schema)
+               for block in plot_chunks(plot))
+    return schema, batches
+
+def write_parquet(path, plot):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema, batches = arrow_batches(plot)
+    with pq.ParquetWriter(path, schema) as writer:
+        for batch in batches:
+            writer.write_table(pa.Table.from_batches([batch]))
+
+def write_feather(path, plot):
+    import pyarrow as pa
+    schema, batches = arrow_batches(plot)
+    with pa.ipc.new_file(path, schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+
+def write_hdf5(path, plots):
+    """Write all plots to one HDF5 file, as groups "plot1", "plot2", ..."""
+    import h5py
+    with h5py.File(path, 'w') as h5:
+        for number, plot in enumerate(plots, 1):
+            columns = plot_columns(plot)
+            group = h5.create_group(f"plot{number}")
+            group.attrs['title'] = plot.title
+            group.attrs['plotname'] = plot.plotname
+            group.attrs['names'] = columns
+            parts = 2 if plot.is_complex else 1
+            group.attrs['units'] = plot.units[:1] + [u for u in plot.units[1:] for _ in range(parts)]
+            data = group.create_dataset('data', shape=(plot.npoints, len(columns)),
+                                        dtype=np.float64,
+                                        chunks=(min(max(plot.npoints, 1), CHUNK_ROWS), len(columns)))
+            start = 0
+            for block in plot_chunks(plot):
+                data[start:start + len(block)] = block
+                start += len(block)
+
+WRITERS = {'csv': write_csv, 'parquet': write_parquet, 'feather': write_feather}
+
+def check_format(fmt):
+    """Return an error message if a format cannot be written, else None."""
+    if fmt not in EXTENSIONS:
+        return f"Unknown format {fmt}: use one of {', '.join(EXTENSIONS)}."
+    module = {'parquet': 'pyarrow', 'feather': 'pyarrow', 'hdf5': 'h5py'}.get(fmt)
+    if module:
+        try:
+            __import__(module)
+        except ImportError:
+            return f"Format {fmt} needs the Python package {module}, which is not installed."
+    return None
+
+# ---------- Conversion ----------
+
+def output_paths(raw_path, fmt, nplots):
+    """Output file of each plot (all plots share one file for HDF5)."""
+    base = os.path.splitext(raw_path)[0]
+    ext = EXTENSIONS[fmt]
+    if fmt == 'hdf5':
+        return [base + ext]
+    return [base + ext] + [f"{base}.{n}{ext}" for n in range(2, nplots + 1)]
+
+def replace_atomically(path, write, *args):
+    """Write a file through a temporary file, so that no partial file is left."""
+    tmp_path = path + '.tmp'
+    try:
+        write(tmp_path, *args)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def convert_file(raw_path, fmt='csv', force=False):
+    """Convert one .raw file.  Returns (message, skipped)."""
+    filename = os.path.basename(raw_path)
+    first = output_paths(raw_path, fmt, 1)[0]
+    if not force and os.path.exists(first) and \
+            os.path.getmtime(first) >= os.path.getmtime(raw_path):
+        return f"Skipped {filename}: {os.path.basename(first)} is up to date", True
+    try:
+        plots = read_raw(raw_path)
+        if not plots:
+            raise ValueError("no plots found")
+        paths = output_paths(raw_path, fmt, len(plots))
+        if fmt == 'hdf5':
+            replace_atomically(paths[0], write_hdf5, plots)
+        else:
+            # The first plot's file is written last, so that an interrupted
+            # conversion is not taken to be up to date
+            for path, plot in reversed(list(zip(paths, plots))):
+                replace_atomically(path, WRITERS[fmt], plot)
+        outputs = ', '.join(os.path.basename(path) for path in paths)
+        return f"Converted {filename} -> {outputs}", False
+    except Exception as e:
+        return f"Error converting {filename}: {e}", False
+
+def convert_files(raw_paths, fmt='csv', jobs=None, force=False):
+    """Convert .raw files in parallel, printing results in order."""
+    skipped = 0
+    if jobs == 1 or len(raw_paths) <= 1:
+        results = (convert_file(path, fmt, force) for path in raw_paths)
+        for message, was_skipped in results:
+            print(message)
+            skipped += was_skipped
+        return skipped
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        count = len(raw_paths)
+        for message, was_skipped in executor.map(convert_file, raw_paths,
+                                                 [fmt] * count, [force] * count):
+            print(message)
+            skipped += was_skipped
+    return skipped
+
+def convert_raw_to_csv(sim_dir, fmt='csv', jobs=None, force=False):
+    """Convert all .raw files in sim_dir to CSV (or another format) files"""
     sim_dir = os.path.expanduser(sim_dir)
     if not os.path.exists(sim_dir):
         print(f"Simulation directory {sim_dir} does not exist.")
         return
 
-    raw_files = [f for f in os.listdir(sim_dir) if f.endswith(".raw")]
+    raw_files = sorted(f for f in os.listdir(sim_dir) if f.endswith(".raw"))
     if not raw_files:
         print(f"No .raw files found in {sim_dir}.")
         return
 
-    for filename in raw_files:
-        raw_path = os.path.join(sim_dir, filename)
-        csv_filename = filename.replace(".raw", ".csv")
-        csv_path = os.path.join(sim_dir, csv_filename)
-        try:
-            arrs, plots = rawread(raw_path)
-            # Use first plot only
-            data_array = arrs[0]
-            headers = data_array.dtype.names
-            # Flatten structured array to 2D float array
-            np.savetxt(csv_path, data_array.view(np.float64).reshape(data_array.shape + (-1,)),
-                       delimiter=",", header=",".join(headers), comments='')
-            print(f"Converted {filename} -> {csv_filename}")
-        except Exception as e:
-            print(f"Error converting {filename}: {e}")
+    raw_paths = [os.path.join(sim_dir, f) for f in raw_files]
+    skipped = convert_files(raw_paths, fmt, jobs, force)
+    if skipped:
+        print(f"{skipped} file(s) already converted (use -force to convert them again).")
 
 if __name__ == '__main__':
-    # Default Xschem simulations folder
-    xschem_sim_dir = "~/.xschem/simulations"
-    convert_raw_to_csv(xschem_sim_dir)
-    print("All .raw files in the simulations folder have been processed.")
+    fmt = 'csv'
+    jobs = None
+    force = False
+    targets = []
+    for item in sys.argv[1:]:
+        if item.startswith('-jobs='):
+            jobs = max(int(item.split('=')[1]), 1)
+        elif item.startswith('-format='):
+            fmt = item.split('=')[1].lower()
+        elif item == '-force':
+            force = True
+        elif item.startswith('-'):
+            print(f"Unknown option {item}")
+            print("usage: rawtocsv.py [-jobs=<number>] [-format=csv|parquet|feather|hdf5] "
+                  "[-force] [<directory or .raw file> ...]")
+            sys.exit(1)
+        else:
+            targets.append(item)
+
+    error = check_format(fmt)
+    if error:
+        print(error)
+        sys.exit(1)
+
+    if not targets:
+        # Default Xschem simulations folder
+        xschem_sim_dir = "~/.xschem/simulations"
+        convert_raw_to_csv(xschem_sim_dir, fmt, jobs, force)
+        print("All .raw files in the simulations folder have been processed.")
+    else:
+        raw_paths = []
+        for target in targets:
+            target = os.path.expanduser(target)
+            if os.path.isdir(target):
+                convert_raw_to_csv(target, fmt, jobs, force)
+            else:
+                raw_paths.append(target)
+        if raw_paths:
+            skipped = convert_files(raw_paths, fmt, jobs, force)
+            if skipped:
+                print(f"{skipped} file(s) already converted (use -force to convert them again).")
@@ -0,0 +1,349 @@
+# MIT license
+# Waveform expressions for the waveform viewers:  arithmetic on waveforms
+# given by their labels, e.g. "v(out) - v(in)" or "rms(i(vdd)) * 1.8".
+# Expressions are parsed once into a tree of allowed operations only (no
+# eval()), and evaluated a chunk of points at a time
+# Compatible with NumPy 2.x
+
+import ast
+import re
+from collections import namedtuple
+import numpy as np
+from waveform_store import Axis, chunks, new_array
+
+# Element-wise functions allowed in expressions, also as np.<name>
+FUNCTIONS = {name: getattr(np, name) for name in (
+    'sin', 'cos', 'tan', 'arcsin', 'arccos', 'arctan', 'arctan2', 'sinh', 'cosh', 'tanh',
+    'exp', 'log', 'log10', 'log2', 'sqrt', 'abs', 'absolute', 'sign', 'floor', 'ceil',
+    'minimum', 'maximum', 'hypot', 'power', 'real', 'imag', 'conj', 'angle')}
+
+# Functions of whole waveforms, and their number of arguments:
+#   deriv(w)        derivative of w over x
+#   integ(w)        integral of w over x, from the first point
+#   avg(w), rms(w)  average and RMS of w over x (single values)
+#   shift(w, dx)    w delayed by dx
+#   interp(w, ref)  w on the x values of ref, which the result is given on
+WAVEFORM_FUNCTIONS = {'deriv': 1, 'integ': 1, 'avg': 1, 'rms': 1, 'shift': 2, 'interp': 2}
+
+CONSTANTS = {'pi': np.pi, 'e': np.e}
+
+# Points evaluated at a time, few enough for the intermediate values to
+# stay in the processor cache
+CHUNK = 1 << 16
+
+OPERATORS = {
+    ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.true_divide,
+    ast.FloorDiv: np.floor_divide, ast.Mod: np.mod, ast.Pow: np.power,
+    ast.USub: np.negative, ast.UAdd: np.positive,
+    ast.Lt: np.less, ast.LtE: np.less_equal, ast.Gt: np.greater, ast.GtE: np.greater_equal,
+    ast.Eq: np.equal, ast.NotEq: np.not_equal,
+}
+
+# The value of an expression:  a waveform "y" over "x", or a single value
+# "y" if x is None
+Result = namedtuple('Result', ['x', 'y'])
+
+class ExpressionError(ValueError):
+    pass
+
+def function_name(node):
+    """Return the name of a called function, "sin" or "np.sin", or None."""
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) \
+            and node.value.id == 'np' and node.attr in FUNCTIONS:
+        return node.attr
+    return None
+
+def arity(func):
+    """Number of arguments of an element-wise function."""
+    # (Any more arguments to a ufunc would be taken as its output arrays)
+    return func.nin if isinstance(func, np.ufunc) else 1
+
+def read_only(values):
+    """Return a view of stored values that cannot be written through."""
+    view = np.asarray(values).view()
+    view.flags.writeable = False
+    return view
+
+def fill(count, pieces):
+    """Write (start, end, values) pieces into a new array of "count" entries."""
+    column = None
+    for start, end, values in pieces:
+        values = np.asarray(values)
+        if column is None:
+            column = new_array(count, np.complex128 if np.iscomplexobj(values) else np.float64)
+        column[start:end] = values
+    return column if column is not None else new_array(count)
+
+def resample(axis, y, xs):
+    """
+    Interpolate waveform y over an Axis at the (sorted) values xs, reading
+    only the points of y around them.
+    """
+    n = min(axis.n, len(y))
+    if n == 0 or len(xs) == 0:
+        return np.full(len(xs), np.nan)
+    axis.build()
+    start, end = 0, n
+    if axis.is_sorted:
+        low, high = axis.find_all([np.min(xs), np.max(xs)])
+        start, end = max(int(low) - 1, 0), min(int(high) + 1, n)
+    return np.interp(xs, np.asarray(axis.x[start:end], dtype=np.float64),
+                     np.asarray(y[start:end]))
+
+class Evaluator:
+    """
+    Evaluates expressions over a set of waveforms, named by their labels.
+    The result is given on the x values of the first waveform in the
+    expression, and other waveforms are interpolated onto them.  Results
+    are kept by expression, and those of waveform functions by the call,
+    so that they are only worked out once.
+    """
+    def __init__(self):
+        self.sources = []   # list of (label, Axis, values)
+        self.index = {}     # label -> index in sources
+        self.axes = {}      # id(x) -> Axis shared by the waveforms over x
+        self.pattern = None
+        self.results = {}   # expression -> Result
+        self.derived = {}   # (waveform function call, id(Axis)) -> (function, is waveform)
+
+    def add(self, x, data, labels):
+        """Add the columns of "data" over x values "x", by label."""
+        axis = self.axes.get(id(x))
+        if axis is None:
+            axis = Axis(x)
+            self.axes[id(x)] = self.axes[id(axis.x)] = axis
+        if any(label in self.index for label in labels):
+            # A label now names another waveform
+            self.derived.clear()
+        for i, label in enumerate(labels):
+            self.index[label] = len(self.sources)
+            self.sources.append((label, axis, data[:, i]))
+        self.pattern = None
+        self.results.clear()
+
+    # ---------- Parsing ----------
+
+    def parse(self, text):
+        """
+        Parse an expression.  Labels (which need not be Python names, such
+        as "v(out)") are replaced by names _w<index>, longest label first.
+        Labels may also be given as strings, e.g. 'v(out)'.
+        """
+        if self.pattern is None and self.index:
+            labels = sorted(self.index, key=len, reverse=True)
+            # (Quoted strings are matched first, to be left as they are)
+            self.pattern = re.compile(r'(\'[^\']*\'|"[^"]*")|(?<![\w.])(' +
+                                      '|'.join(map(re.escape, labels)) + r')(?!\w)')
+        source = text
+        if self.pattern is not None:
+            source = self.pattern.sub(lambda m: m.group(1) or f"_w{self.index[m.group(2)]}", text)
+        try:
+            return ast.parse(source, mode='eval').body
+        except SyntaxError as e:
+            raise ExpressionError(f"Cannot parse {text}: {e.msg}")
+
+    def describe(self, node):
+        """Return the text of a node, with the labels put back."""
+        return re.sub(r'\b_w(\d+)\b', lambda m: self.sources[int(m.group(1))][0], ast.unparse(node))
+
+    def source(self, node):
+        """Return the (label, Axis, values) a node names, or None."""
+        if isinstance(node, ast.Name):
+            match = re.fullmatch(r'_w(\d+)', node.id)
+            if match and int(match.group(1)) < len(self.sources):
+                return self.sources[int(match.group(1))]
+        elif isinstance(node, ast.Constant) and isinstance(node.value, str) \
+                and node.value in self.index:
+            return self.sources[self.index[node.value]]
+        return None
+
+    def base_axis(self, node):
+        """
+        Return the Axis of the first waveform in an expression, taking that
+        of the second argument of interp() before the first, or None.
+        """
+        source = self.source(node)
+        if source is not None:
+            return source[1]
+        children = list(ast.iter_child_nodes(node))
+        if isinstance(node, ast.Call) and function_name(node.func) == 'interp' and len(node.args) == 2:
+            children = [node.args[1], node.args[0]]
+        for child in children:
+            axis = self.base_axis(child)
+            if axis is not None:
+                return axis
+        return None
+
+    # ---------- Compiling ----------
+
+    def compile(self, node, base):
+        """
+        Return (function, is waveform) for a node.  function(start, end)
+        gives the values of the node at points start to end of the base
+        Axis, or its single value if it is not a waveform.
+        """
+        source = self.source(node)
+        if source is not None:
+            _, axis, values = source
+            if axis is base:
+                return (lambda start, end: read_only(values[start:end])), True
+            return (lambda start, end: resample(axis, values, base.x[start:end])), True
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float, complex)) \
+                and not isinstance(node.value, bool):
+            # (As NumPy numbers, so that e.g. 10**10**10 overflows instead of hanging)
+            value = np.complex128(node.value) if isinstance(node.value, complex) else np.float64(node.value)
+            return (lambda start, end: value), False
+        if isinstance(node, ast.Name) and node.id in CONSTANTS:
+            value = CONSTANTS[node.id]
+            return (lambda start, end: value), False
+        if isinstance(node, ast.BinOp) and type(node.op) in OPERATORS:
+            return self.combine(OPERATORS[type(node.op)], [node.left, node.right], base)
+        if isinstance(node, ast.UnaryOp) and type(node.op) in OPERATORS:
+            return self.combine(OPERATORS[type(node.op)], [node.operand], base)
+        if isinstance(node, ast.Compare) and len(node.ops) == 1 and type(node.ops[0]) in OPERATORS:
+            return self.combine(OPERATORS[type(node.ops[0])], [node.left] + node.comparators, base)
+        if isinstance(node, ast.Call) and not node.keywords:
+            name = function_name(node.func)
+            if name in FUNCTIONS:
+                func = FUNCTIONS[name]
+                if len(node.args) != arity(func):
+                    raise ExpressionError(f"{name}() takes {arity(func)} argument(s)")
+                return self.combine(func, node.args, base)
+            if name in WAVEFORM_FUNCTIONS:
+                return self.waveform_function(name, node, base)
+        if isinstance(node, ast.Name):
+            raise ExpressionError(f"Unknown name {node.id}")
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            raise ExpressionError(f"No waveform {node.value}")
+        raise ExpressionError(f"Not allowed in an expression: {self.describe(node)}")
+
+    def combine(self, func, args, base):
+        """Compile an element-wise function of the nodes "args"."""
+        compiled = [self.compile(arg, base) for arg in args]
+        functions = [function for function, _ in compiled]
+
+        def evaluate(start, end):
+            return func(*[function(start, end) for function in functions])
+
+        if not any(is_wave for _, is_wave in compiled):
+            # Work out parts without waveforms once
+            value = evaluate(0, 0)
+            return (lambda start, end: value), False
+        return evaluate, True
+
+    def waveform_function(self, name, node, base):
+        """Compile a call of a waveform function, working out its value once."""
+        if len(node.args) != WAVEFORM_FUNCTIONS[name]:
+            raise ExpressionError(f"{name}() takes {WAVEFORM_FUNCTIONS[name]} argument(s)")
+        if base is None:
+            raise ExpressionError(f"{name}() needs a waveform")
+        key = (ast.unparse(node), id(base))
+        if key in self.derived:
+            return self.derived[key]
+
+        if name == 'interp':
+            # The base Axis is already that of the second argument
+            compiled = self.compile(node.args[0], base)
+        else:
+            function, is_wave = self.compile(node.args[0], base)
+            if not is_wave:
+                constant = function(0, 0)
+                function = lambda start, end: np.full(end - start, constant)
+            if name in ('avg', 'rms'):
+                value = self.average(function, base, name == 'rms')
+                compiled = (lambda start, end: value), False
+            else:
+                if name == 'deriv':
+                    column = fill(base.n, self.derivative(function, base))
+                elif name == 'integ':
+                    column = fill(base.n, self.integral(function, base))
+                else:
+                    delay, delay_is_wave = self.compile(node.args[1], base)
+                    if delay_is_wave:
+                        raise ExpressionError("The delay of shift() must be a single value")
+                    column = fill(base.n, ((start, end, function(start, end))
+                                           for start, end in chunks(base.n, CHUNK)))
+                    column = fill(base.n, self.shifted(column, base, float(np.real(delay(0, 0)))))
+                compiled = (lambda start, end: read_only(column[start:end])), True
+        self.derived[key] = compiled
+        return compiled
+
+    # ---------- Waveform functions ----------
+
+    def derivative(self, function, base):
+        """Yield (start, end, values) of the derivative, as np.gradient."""
+        for start, end in chunks(base.n, CHUNK):
+            # One point either side, for the differences at the chunk ends
+            low, high = max(start - 1, 0), min(end + 1, base.n)
+            xs = np.asarray(base.x[low:high], dtype=np.float64)
+            if len(xs) < 2:
+                yield start, end, np.zeros(end - start)
+                continue
+            values = np.gradient(function(low, high), xs)
+            yield start, end, values[start - low:end - low]
+
+    def integral(self, function, base):
+        """Yield (start, end, values) of the integral by the trapezoid rule."""
+        total = 0.0
+        last = None
+        for start, end in chunks(base.n, CHUNK):
+            xs = np.asarray(base.x[start:end], dtype=np.float64)
+            ys = np.asarray(function(start, end))
+            if last is not None:
+                xs = np.concatenate(([last[0]], xs))
+                ys = np.concatenate(([last[1]], ys))
+            sums = total + np.cumsum((ys[1:] + ys[:-1]) * np.diff(xs) / 2)
+            values = sums if last is not None else np.concatenate(([total], sums))
+            total = values[-1]
+            last = (xs[-1], ys[-1])
+            yield start, end, values
+
+    def average(self, function, base, squared=False):
+        """Return the average over x of a waveform, or its RMS if squared."""
+        if squared:
+            values_of = function
+            function = lambda start, end: np.abs(values_of(start, end)) ** 2
+        if base.n == 0:
+            return np.nan
+        span = float(base.x[base.n - 1]) - float(base.x[0])
+        if span != 0:
+            total = 0.0
+            for _, _, values in self.integral(function, base):
+                total = values[-1]
+            value = total / span
+        else:
+            # All points are at one x value:  the plain average
+            value = sum(np.sum(function(start, end)) for start, end in chunks(base.n, CHUNK)) / base.n
+        return np.sqrt(value) if squared else value
+
+    def shifted(self, column, base, delay):
+        """Yield (start, end, values) of a waveform delayed by "delay"."""
+        for start, end in chunks(base.n, CHUNK):
+            xs = np.asarray(base.x[start:end], dtype=np.float64) - delay
+            yield start, end, resample(base, column, xs)
+
+    # ---------- Evaluation ----------
+
+    def evaluate(self, text):
+        """Return the Result of an expression, worked out a chunk at a time."""
+        text = text.strip()
+        if text in self.results:
+            return self.results[text]
+        tree = self.parse(text)
+        base = self.base_axis(tree)
+        try:
+            with np.errstate(all='ignore'):
+                function, is_wave = self.compile(tree, base)
+                if is_wave:
+                    result = Result(base.x, fill(base.n, ((start, end, function(start, end))
+                                                          for start, end in chunks(base.n, CHUNK))))
+                else:
+                    result = Result(None, function(0, 0))
+        except ExpressionError:
+            raise
+        except Exception as e:
+            raise ExpressionError(f"Cannot evaluate {text}: {e}")
+        self.results[text] = result
+        return result
@@ -0,0 +1,402 @@
+# MIT license
+# Waveform storage for the waveform viewers: memory-mapped columns with a
+# min/max decimation pyramid, so that only as many points as can be seen are
+# ever drawn, however long the waveform is
+# Compatible with NumPy 2.x
+
+import tempfile
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from rawfile import WaveformSet, read_waveforms
+
+# Points in each block of the finest decimation level, and the number of
+# blocks of each level that make up one block of the next
+BLOCK = 64
+FACTOR = 4
+
+# Points read at a time when scanning a column
+CHUNK = BLOCK * (1 << 16)
+
+# Arrays with more entries than this are kept in a temporary file
+MAX_IN_MEMORY = 1 << 24
+
+# CSV rows read at a time
+CSV_CHUNK = 1 << 20
+
+# Points in each block of the cached statistics of a trace
+STAT_BLOCK = BLOCK * FACTOR ** 3
+
+# Statistics of a run of points:  their number, the sum of their squares,
+# their extremes, and the number of zero crossings between them, with the
+# first and last (each given by the index of the point before it, or -1)
+Statistics = namedtuple('Statistics', ['count', 'sumsq', 'minimum', 'maximum',
+                                       'crossings', 'first', 'last'])
+
+# Measurements of a trace between two x values
+Measurement = namedtuple('Measurement', ['rms', 'peak_to_peak', 'frequency'])
+
+def new_array(count, dtype=np.float64):
+    """Return an array of "count" entries, in a temporary file if large."""
+    if count > MAX_IN_MEMORY:
+        return np.memmap(tempfile.TemporaryFile(), dtype=dtype, mode='w+', shape=(count,))
+    return np.empty(count, dtype=dtype)
+
+def load_waveforms(filepath):
+    """
+    Load an ngspice raw file or CSV file.  Returns a list of WaveformSet
+    (see rawfile.py) for each plot in the file, where "data" has one column
+    for each label.  The arrays are memory-mapped views and are not read
+    into memory.
+    """
+    if filepath.lower().endswith('.csv'):
+        return [read_csv(filepath)]
+    return read_waveforms(filepath)
+
+def read_csv(filepath):
+    """Read a CSV file a chunk at a time into a memory-mapped array."""
+    store = tempfile.TemporaryFile()
+    count = 0
+    columns = []
+    for frame in pd.read_csv(filepath, chunksize=CSV_CHUNK):
+        columns = [str(column) for column in frame.columns]
+        store.write(np.ascontiguousarray(frame.to_numpy(dtype=np.float64)).tobytes())
+        count += len(frame)
+    store.flush()
+    if count:
+        table = np.memmap(store, dtype=np.float64, mode='r', shape=(count, len(columns)))
+    else:
+        table = np.zeros((0, len(columns)))
+    labels = columns[1:]
+    return WaveformSet(table[:, 0], table[:, 1:], labels, [''] * len(labels),
+                       columns[0] if columns else '', '')
+
+def chunks(count, size=CHUNK):
+    for start in range(0, count, size):
+        yield start, min(count, start + size)
+
+def has_imaginary(values):
+    """Tell whether any of the (complex) values has an imaginary part."""
+    if not np.iscomplexobj(values):
+        return False
+    return any(np.any(np.asarray(values[start:end]).imag) for start, end in chunks(len(values)))
+
+def as_float(values, magnitude=None):
+    """
+    Return values as float64.  Complex values are taken by their magnitude,
+    or by their real part if they have no imaginary part (as the vdb() and
+    vp() vectors of an AC analysis, which may be negative).  "magnitude"
+    gives the choice for a whole vector read in parts.
+    """
+    values = np.asarray(values)
+    if np.iscomplexobj(values):
+        if magnitude is None:
+            magnitude = has_imaginary(values)
+        return np.abs(values) if magnitude else values.real
+    return values.astype(np.float64, copy=False)
+
+class Axis:
+    """
+    The x values shared by the traces of one plot, with an index of every
+    BLOCK'th value for finding positions without reading the whole column.
+    """
+    def __init__(self, x):
+        if not isinstance(x, np.ndarray):
+            x = np.asarray(x)
+        self.x = x.real if np.iscomplexobj(x) else x
+        self.n = len(self.x)
+        self.index = None
+        self.is_sorted = True
+
+    def build(self):
+        if self.index is not None:
+            return
+        self.index = new_array((self.n + BLOCK - 1) // BLOCK)
+        last = -np.inf
+        for start, end in chunks(self.n):
+            values = np.asarray(self.x[start:end], dtype=np.float64)
+            if self.is_sorted and len(values):
+                if values[0] < last or np.any(values[1:] < values[:-1]):
+                    self.is_sorted = False
+                last = values[-1]
+            self.index[start // BLOCK:(end + BLOCK - 1) // BLOCK] = values[::BLOCK]
+
+    def find(self, value, side='left'):
+        """Return the position of "value" in the (sorted) x values, as np.searchsorted."""
+        return int(self.find_all([value], side)[0])
+
+    def find_all(self, values, side='left'):
+        """
+        Return the positions of an array of values, as np.searchsorted.  The
+        index gives the window of BLOCK points holding each value, and all of
+        the windows are read and searched together.
+        """
+        self.build()
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if self.n == 0:
+            return np.zeros(len(values), dtype=np.intp)
+        k = np.searchsorted(self.index, values, side)
+        starts = np.maximum(k - 1, 0) * BLOCK
+        ends = np.minimum(k * BLOCK + 1, self.n)
+        points = starts[:, None] + np.arange(2 * BLOCK + 1)
+        inside = points < ends[:, None]
+        window = np.asarray(self.x[np.minimum(points, self.n - 1)], dtype=np.float64)
+        if side == 'left':
+            before = window < values[:, None]
+        else:
+            before = window <= values[:, None]
+        return starts + np.count_nonzero(before & inside, axis=1)
+
+class Trace:
+    """
+    One waveform: values "y" over an Axis.  Complex values are shown by their
+    magnitude, unless none has an imaginary part.  Level L of the pyramid holds the minimum and maximum of each
+    block of BLOCK * FACTOR**L points, and is only made when first needed.
+    """
+    def __init__(self, axis, y):
+        self.axis = axis if isinstance(axis, Axis) else Axis(axis)
+        self.y = y
+        self.n = min(len(y), self.axis.n)
+        self.magnitude = has_imaginary(y)
+        self.levels = []    # list of (blocksize, minimums, maximums)
+        self.blocks = None  # Statistics of each STAT_BLOCK points, and crossings between them
+
+    def values(self, start, end):
+        """Return the values of points start to end as a float64 array."""
+        return as_float(self.y[start:end], self.magnitude)
+
+    def take(self, indices):
+        """Return the values of the points at an array of indices as float64."""
+        return as_float(self.y[indices], self.magnitude)
+
+    def level(self, number):
+        """Return (blocksize, minimums, maximums) of a level, making it if needed."""
+        while len(self.levels) <= number:
+            if self.levels:
+                prevsize, prevmin, prevmax = self.levels[-1]
+                size, step, count = prevsize * FACTOR, FACTOR, len(prevmin)
+            else:
+                size, step, count = BLOCK, BLOCK, self.n
+            nblocks = (count + step - 1) // step
+            mins = new_array(nblocks)
+            maxs = new_array(nblocks)
+            for start, end in chunks(count):
+                if self.levels:
+                    lows = np.asarray(prevmin[start:end])
+                    highs = np.asarray(prevmax[start:end])
+                else:
+                    lows = highs = self.values(start, end)
+                blocks = slice(start // step, (end + step - 1) // step)
+                mins[blocks] = reduce_blocks(np.fmin, lows, step)
+                maxs[blocks] = reduce_blocks(np.fmax, highs, step)
+            self.levels.append((size, mins, maxs))
+        return self.levels[number]
+
+    def view(self, x0, x1, pixels):
+        """
+        Return the x and y values to draw the part of the trace from x0 to
+        x1 across "pixels" pixels:  all of the points if there are few
+        enough, or else the minimum and maximum of each block of points.
+        """
+        n = self.n
+        if n == 0:
+            return np.zeros(0), np.zeros(0)
+        axis = self.axis
+        axis.build()
+        if axis.is_sorted:
+            i0 = max(axis.find(x0, 'left') - 1, 0)
+            i1 = min(axis.find(x1, 'right') + 1, n)
+        else:
+            i0, i1 = 0, n
+        pixels = max(int(pixels), 1)
+        count = i1 - i0
+        if count <= 4 * pixels:
+            return np.asarray(axis.x[i0:i1], dtype=np.float64), self.values(i0, i1)
+
+        number = 0
+        while count / (BLOCK * FACTOR ** number) > 2 * pixels:
+            number += 1
+        size, mins, maxs = self.level(number)
+        k0 = i0 // size
+        k1 = (i1 + size - 1) // size
+        xs = np.asarray(axis.x[k0 * size:k1 * size:size], dtype=np.float64)
+        # Each block is drawn as its minimum and maximum at the block start,
+        # followed by the last point so that the trace reaches its end
+        last = min(k1 * size, n) - 1
+        xs = np.append(np.repeat(xs, 2), axis.x[last])
+        ys = np.append(np.column_stack((mins[k0:k1], maxs[k0:k1])).ravel(),
+                       self.values(last, last + 1))
+        return xs, ys
+
+    def value_at(self, x):
+        """Return the value of the trace at x, interpolated between points."""
+        return float(values_at([self], [x])[0, 0])
+
+    def statistics(self):
+        """
+        Return the Statistics of each block of STAT_BLOCK points, as arrays,
+        and an array telling whether there is a zero crossing between the
+        last point of the block before and the first of each block.  They
+        are made when first needed, in one pass over the trace.
+        """
+        if self.blocks is not None:
+            return self.blocks
+        n = self.n
+        nblocks = (n + STAT_BLOCK - 1) // STAT_BLOCK
+        blocks = Statistics(np.full(nblocks, STAT_BLOCK), np.empty(nblocks), np.empty(nblocks),
+                            np.empty(nblocks), np.zeros(nblocks, dtype=np.int64),
+                            np.full(nblocks, -1, dtype=np.int64), np.full(nblocks, -1, dtype=np.int64))
+        if nblocks:
+            blocks.count[-1] = n - (nblocks - 1) * STAT_BLOCK
+        enters = np.zeros(nblocks, dtype=bool)
+        last_sign = None
+        for start, end in chunks(n):
+            values = self.values(start, end)
+            first_block = start // STAT_BLOCK
+            span = slice(first_block, (end + STAT_BLOCK - 1) // STAT_BLOCK)
+            blocks.sumsq[span] = reduce_blocks(np.add, values * values, STAT_BLOCK)
+            blocks.minimum[span] = reduce_blocks(np.fmin, values, STAT_BLOCK)
+            blocks.maximum[span] = reduce_blocks(np.fmax, values, STAT_BLOCK)
+            signs = np.sign(values)
+            if last_sign is not None:
+                enters[first_block] = last_sign != signs[0]
+            last_sign = signs[-1]
+            changes = signs[1:] != signs[:-1]
+            # Crossings from one block into the next are kept in "enters"
+            boundaries = np.arange(STAT_BLOCK - 1, len(changes), STAT_BLOCK)
+            enters[first_block + 1:first_block + 1 + len(boundaries)] = changes[boundaries]
+            changes[boundaries] = False
+            where = np.flatnonzero(changes)
+            if len(where):
+                owners = where // STAT_BLOCK
+                found, firsts, counts = np.unique(owners, return_index=True, return_counts=True)
+                blocks.crossings[first_block + found] = counts
+                blocks.first[first_block + found] = start + where[firsts]
+                blocks.last[first_block + found] = start + where[firsts + counts - 1]
+        self.blocks = (blocks, enters)
+        return self.blocks
+
+    def direct_statistics(self, start, end):
+        """Return the Statistics of points start to end, from the points themselves."""
+        if end <= start:
+            return Statistics(0, 0.0, np.nan, np.nan, 0, -1, -1)
+        values = self.values(start, end)
+        signs = np.sign(values)
+        where = np.flatnonzero(signs[1:] != signs[:-1])
+        return Statistics(len(values), float(np.dot(values, values)),
+                          float(np.fmin.reduce(values)), float(np.fmax.reduce(values)),
+                          len(where), start + int(where[0]) if len(where) else -1,
+                          start + int(where[-1]) if len(where) else -1)
+
+    def range_statistics(self, start, end):
+        """
+        Return the Statistics of points start to end:  the whole blocks
+        between them come from the cached block statistics, and only the
+        points at either end are read.
+        """
+        first_block = -(-start // STAT_BLOCK)
+        last_block = end // STAT_BLOCK
+        if first_block >= last_block:
+            return self.direct_statistics(start, end)
+        blocks, enters = self.statistics()
+        span = slice(first_block, last_block)
+        inner = np.flatnonzero(enters[first_block + 1:last_block])
+        marks = np.concatenate((blocks.first[span], blocks.last[span],
+                                (inner + first_block + 1) * STAT_BLOCK - 1))
+        marks = marks[marks >= 0]
+        middle = Statistics(int(np.sum(blocks.count[span])), float(np.sum(blocks.sumsq[span])),
+                            float(np.fmin.reduce(blocks.minimum[span])),
+                            float(np.fmax.reduce(blocks.maximum[span])),
+                            int(np.sum(blocks.crossings[span])) + len(inner),
+                            int(marks.min()) if len(marks) else -1,
+                            int(marks.max()) if len(marks) else -1)
+        head = self.direct_statistics(start, first_block * STAT_BLOCK)
+        tail = self.direct_statistics(last_block * STAT_BLOCK, end)
+        result = merge_statistics(head, middle,
+                                  first_block * STAT_BLOCK - 1 if enters[first_block] else None)
+        return merge_statistics(result, tail,
+                                last_block * STAT_BLOCK - 1 if tail.count and enters[last_block] else None)
+
+    def measure(self, x0=-np.inf, x1=np.inf):
+        """
+        Return the Measurement of the points from x0 to x1.  The frequency is
+        found from the mean time between zero crossings, which is half of
+        the period.
+        """
+        n = self.n
+        axis = self.axis
+        axis.build()
+        if axis.is_sorted:
+            start, end = axis.find(x0, 'left'), min(axis.find(x1, 'right'), n)
+        else:
+            start, end = 0, n
+        stats = self.range_statistics(start, end)
+        if stats.count == 0:
+            return Measurement(np.nan, np.nan, np.nan)
+        frequency = np.nan
+        if stats.crossings > 1:
+            period = 2 * (float(axis.x[stats.last]) - float(axis.x[stats.first])) / (stats.crossings - 1)
+            if period != 0:
+                frequency = 1.0 / period
+        return Measurement(np.sqrt(stats.sumsq / stats.count),
+                           stats.maximum - stats.minimum, frequency)
+
+def values_at(traces, xs):
+    """
+    Return the values of each trace at each of the x values, interpolated
+    between points, as an array of one row for each trace.  The x values
+    are found in one pass for each Axis, however many traces share it.
+    """
+    xs = np.asarray(xs, dtype=np.float64).ravel()
+    result = np.full((len(traces), len(xs)), np.nan)
+    found = {}      # (id(axis), n) -> (left, right, x at left, x at right)
+    for row, trace in enumerate(traces):
+        n = trace.n
+        axis = trace.axis
+        if n == 0:
+            continue
+        axis.build()
+        if not axis.is_sorted:
+            result[row] = np.interp(xs, np.asarray(axis.x[:n], dtype=np.float64),
+                                    trace.values(0, n))
+            continue
+        key = (id(axis), n)
+        if key not in found:
+            right = np.clip(axis.find_all(xs, 'right'), 1, max(n - 1, 0))
+            left = np.maximum(right - 1, 0)
+            found[key] = (left, right, np.asarray(axis.x[left], dtype=np.float64),
+                          np.asarray(axis.x[right], dtype=np.float64))
+        left, right, xleft, xright = found[key]
+        yleft, yright = trace.take(left), trace.take(right)
+        # Points outside the trace take the value of its first or last point
+        x = np.clip(xs, xleft, xright)
+        width = xright - xleft
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result[row] = np.where(width != 0,
+                                   yleft + (yright - yleft) * (x - xleft) / width, yright)
+    return result
+
+def merge_statistics(before, after, crossing=None):
+    """
+    Combine the Statistics of two adjacent runs of points, given the index
+    of the zero crossing between them, if there is one.
+    """
+    if before.count == 0:
+        return after
+    if after.count == 0:
+        return before
+    marks = [i for i in (before.first, before.last, crossing, after.first, after.last)
+             if i is not None and i >= 0]
+    return Statistics(before.count + after.count, before.sumsq + after.sumsq,
+                      float(np.fmin(before.minimum, after.minimum)),
+                      float(np.fmax(before.maximum, after.maximum)),
+                      before.crossings + after.crossings + (crossing is not None),
+                      min(marks, default=-1), max(marks, default=-1))
+
+def reduce_blocks(func, values, step):
+    """Reduce each block of "step" values (the last may be short) with func."""
+    full = len(values) // step * step
+    result = func.reduce(values[:full].reshape(-1, step), axis=1)
+    if full < len(values):
+        result = np.append(result, func.reduce(values[full:]))
+    return result